@@ -1,18 +1,25 @@
 # Aplicación de materiales - versión corregida
-from flask import Flask, render_template_string, request, redirect, url_for, flash, jsonify, abort, send_file, make_response, session
-import sqlite3, os, csv, io, logging, re, threading
+from flask import Flask, render_template, render_template_string, request, redirect, url_for, flash, jsonify, abort, send_file, make_response, session
+from jinja2 import FileSystemBytecodeCache
+import sqlite3, os, csv, io, json, base64, logging, re, threading, time, hashlib, queue, tempfile
+import importlib.util
+from collections import OrderedDict
 from datetime import date, datetime, timedelta
 from contextlib import contextmanager
-from typing import Optional, List
-from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, List, Iterable
+from dataclasses import dataclass, field, asdict
 from werkzeug.utils import secure_filename
-try:
-    import openpyxl
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment
-    EXCEL_DISPONIBLE = True
-except ImportError:
-    EXCEL_DISPONIBLE = False
+from shared import operarios_db, hojas
+from shared.conexiones import PoolConexiones, PRAGMAS_POR_DEFECTO, pragmas_desde_entorno
+from shared.recursos import RecursosEstaticos, CACHE_INMUTABLE, CACHE_REVALIDAR
+from shared.compresion import Compresor
+from shared.trabajos import GestorTrabajos, Trabajo, FalloTrabajo
+from shared.migraciones import (migrar_materiales, fts_disponible, sql_set_estado, sql_cuenta_contador,
+                                sql_claves_contador, ORDEN_ESTADOS, SQL_CAD_VALIDA)
+# openpyxl solo se importa donde se lee o escribe un libro (shared/hojas.py)
+EXCEL_DISPONIBLE = importlib.util.find_spec("openpyxl") is not None
+if not EXCEL_DISPONIBLE:
     print("Advertencia: openpyxl no está instalado. Funcionalidad Excel deshabilitada.")
 
 # ================== Config & logging ==================
@@ -24,9 +31,40 @@ app.secret_key = os.environ.get('SECRET_KEY', 'clave-super-secreta')  # flash &
 
 # Bases de datos separadas (usar rutas absolutas relativas al proyecto)
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-DB_MATERIALES = os.path.join(BASE_DIR, "database", "materiales.db")
-DB_OPERARIOS = os.path.join(BASE_DIR, "database", "operarios.db")
+# DIR_DATOS permite otra carpeta (las pruebas de tests/ usan una temporal)
+DIR_DATOS = os.environ.get("DIR_DATOS") or os.path.join(BASE_DIR, "database")
+DB_MATERIALES = os.path.join(DIR_DATOS, "materiales.db")
+DB_OPERARIOS = os.path.join(DIR_DATOS, "operarios.db")
+# Estado de los trabajos en segundo plano y sus archivos (subidas, resultados)
+DB_TRABAJOS = os.path.join(DIR_DATOS, "trabajos.db")
+DIR_TRABAJOS = os.path.join(DIR_DATOS, "trabajos")
+
+# Plantillas en templates/: Jinja compila cada una una sola vez por proceso (sin auto_reload,
+# como en producción) y guarda el código compilado en disco para que el primer render tras
+# arrancar o reiniciar no vuelva a parsear 1.300 líneas de HTML.
+DIR_CACHE_PLANTILLAS = os.path.join(BASE_DIR, "__pycache__", "plantillas")
+try:
+    os.makedirs(DIR_CACHE_PLANTILLAS, exist_ok=True)
+    app.jinja_options = {**app.jinja_options,
+                         "bytecode_cache": FileSystemBytecodeCache(DIR_CACHE_PLANTILLAS)}
+except OSError as e:
+    logger.warning(f"Sin caché de plantillas en disco: {e}")
+
+# JS, CSS e iconos de static/ con la huella del contenido en la URL (plantillas: recurso('js/home.js'))
+recursos = RecursosEstaticos(os.path.join(BASE_DIR, "static"))
+app.add_template_global(recursos.url, "recurso")
+
+# gzip/brotli negociado para HTML, JSON y flujos (ver shared/compresion.py)
+compresor = Compresor()
+
+@app.after_request
+def comprimir_respuesta(resp):
+    ruta = request.url_rule.rule if request.url_rule else "(sin ruta)"
+    return compresor.procesar(resp, request.accept_encodings, ruta)
 AVISO_DIAS = 7
+# PRAGMA de todas las conexiones (ajustables con SQLITE_PRAGMAS="mmap_size=0,synchronous=FULL")
+PRAGMAS_SQLITE = pragmas_desde_entorno(PRAGMAS_POR_DEFECTO)
+FTS_DISPONIBLE = False  # lo fija init_db() según exista materiales_fts
 
 # Evento para reinicio limpio desde el admin (lo escucha run_app_window.py)
 _restart_event = threading.Event()
@@ -47,35 +85,93 @@ class Material:
     ean: Optional[str] = None
     descripcion: Optional[str] = None
     fecha_asignacion: Optional[str] = None  # timestamp ISO de última asignación
+    # Estado materializado (columnas mantenidas por triggers, ver migración 7)
+    estado_calc: Optional[str] = None
+    vence_prox: Optional[int] = None
+    caducado: Optional[int] = None
+    # "numero - nombre" resuelto con el JOIN a op.operarios (vista materiales_operario)
+    operario_display: Optional[str] = None
+    # Orden por relevancia de una búsqueda (solo en las filas de _list_materiales_relevancia)
+    sin_prefijo: Optional[int] = None
+    rango: Optional[float] = None
 
 # ================== DB helpers ==================
+# Se activa tras cada commit con cambios en materiales.db; lo espera el hilo de eventos (SSE)
+_aviso_cambios = threading.Event()
+
+# Conexiones reutilizadas por hilo (WAL, mmap, caché de sentencias), una pool por base
+POOL_MAX_POR_HILO = 2   # conexiones libres que guarda cada hilo (0 = abrir y cerrar en cada bloque)
+_pools = {}
+_pools_lock = threading.Lock()
+
+# Nombre para mostrar de un operario tal como get_operario_display(), a partir de
+# materiales m LEFT JOIN op.operarios o
+SQL_OPERARIO_DISPLAY = """(CASE WHEN IFNULL(m.operario_numero,'') = '' THEN '-'
+    WHEN IFNULL(o.nombre,'') <> '' THEN m.operario_numero || ' - ' || o.nombre
+    ELSE m.operario_numero END)"""
+
+def _preparar_conexion_materiales(conn, ruta_operarios: str):
+    """operarios.db queda adjunta como 'op': los listados traen el nombre del operario en
+    la misma consulta. Las vistas que cruzan bases solo pueden ser TEMP (por conexión)."""
+    conn.create_function("PY_UPPER", 1, _py_upper, deterministic=True)
+    conn.create_function("NORMALIZAR_FECHA", 1, normalize_date_human, deterministic=True)
+    conn.execute("ATTACH DATABASE ? AS op", (ruta_operarios,))
+    conn.execute(f"""
+        CREATE TEMP VIEW IF NOT EXISTS materiales_operario AS
+        SELECT m.*, o.nombre AS operario_nombre, {SQL_OPERARIO_DISPLAY} AS operario_display
+        FROM main.materiales m LEFT JOIN op.operarios o ON o.numero = m.operario_numero
+    """)
+
+def _pool(clave: tuple) -> PoolConexiones:
+    pool = _pools.get(clave)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(clave)
+            if pool is None:
+                if clave[0] == "materiales":
+                    pool = PoolConexiones(clave[1], PRAGMAS_SQLITE, POOL_MAX_POR_HILO,
+                                          al_abrir=lambda conn: _preparar_conexion_materiales(conn, clave[2]),
+                                          al_confirmar=_aviso_cambios.set)
+                else:
+                    pool = PoolConexiones(clave[1], PRAGMAS_SQLITE, POOL_MAX_POR_HILO)
+                _pools[clave] = pool
+    return pool
+
+def pool_materiales() -> PoolConexiones:
+    return _pool(("materiales", DB_MATERIALES, DB_OPERARIOS))
+
+def pool_operarios() -> PoolConexiones:
+    return _pool(("operarios", DB_OPERARIOS))
+
 @contextmanager
 def get_db_materiales():
-    conn = sqlite3.connect(DB_MATERIALES)
-    conn.row_factory = sqlite3.Row
     try:
-        yield conn
-        conn.commit()
+        with pool_materiales().conexion() as conn:
+            yield conn
     except Exception as e:
-        conn.rollback()
         logger.error(f"DB error: {e}")
         raise
-    finally:
-        conn.close()
 
 @contextmanager
 def get_db_operarios():
-    conn = sqlite3.connect(DB_OPERARIOS)
-    conn.row_factory = sqlite3.Row
     try:
-        yield conn
-        conn.commit()
+        with pool_operarios().conexion() as conn:
+            yield conn
     except Exception as e:
-        conn.rollback()
         logger.error(f"DB error: {e}")
         raise
-    finally:
-        conn.close()
+
+# Conexión propia y persistente para leer PRAGMA data_version: cambia con cada commit de
+# cualquier otra conexión (de este u otro proceso) sobre materiales.db.
+_conn_version = None   # (ruta, conexión): se reabre si cambia DB_MATERIALES
+_conn_version_lock = threading.Lock()
+
+def version_materiales() -> int:
+    global _conn_version
+    with _conn_version_lock:
+        if _conn_version is None or _conn_version[0] != DB_MATERIALES:
+            _conn_version = (DB_MATERIALES, sqlite3.connect(DB_MATERIALES, check_same_thread=False))
+        return _conn_version[1].execute("PRAGMA data_version").fetchone()[0]
 
 # Función de compatibilidad (usa materiales por defecto)
 @contextmanager
@@ -84,29 +180,8 @@ def get_db():
         yield conn
 
 def init_db():
-    """Inicializar ambas bases de datos creando tablas y operarios por defecto si no existen."""
-    # ── materiales.db ──────────────────────────────────────────────
-    with get_db_materiales() as conn:
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS materiales (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                codigo TEXT UNIQUE NOT NULL,
-                caducidad TEXT,
-                estado TEXT DEFAULT 'precintado',
-                operario_numero TEXT,
-                ean TEXT,
-                descripcion TEXT,
-                fecha_asignacion TEXT
-            )
-        """)
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS ean_descriptions (
-                ean TEXT PRIMARY KEY,
-                descripcion TEXT NOT NULL,
-                fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
+    """Inicializar ambas bases de datos: migraciones pendientes de materiales y operarios por defecto."""
+    global FTS_DISPONIBLE
     # ── operarios.db ───────────────────────────────────────────────
     with get_db_operarios() as conn:
         conn.execute("""
@@ -124,25 +199,26 @@ def init_db():
                 INSERT INTO operarios (numero, nombre, rol, activo)
                 VALUES ('999999', 'Administrador', 'admin', 1)
             """)
+    # ── materiales.db (adjunta operarios.db, que ya debe tener su tabla) ──
+    with get_db_materiales() as conn:
+        migrar_materiales(conn)
+        FTS_DISPONIBLE = fts_disponible(conn)
+        # Limpiar materiales ya procesados en Excel que no se borraron (registros huérfanos)
+        conn.execute(
+            "DELETE FROM materiales WHERE procesado_excel = 1 AND estado IN ('gastado', 'retirado')"
+        )
+    asegurar_estados_al_dia()
+    iniciar_rollover_estados()
+
+    operarios_db.configurar(DB_OPERARIOS)
 
 def row_to_material(r)->Material:
     return Material(**dict(r))
 
 # ================== Manejo de Roles y Autenticación ==================
 def get_operario_by_numero(numero: str):
-    """Obtiene un operario por su número"""
-    with get_db_operarios() as conn:
-        c = conn.cursor()
-        c.execute("SELECT numero, nombre, rol, activo FROM operarios WHERE numero = ? AND activo = 1", (numero,))
-        row = c.fetchone()
-        if row:
-            return {
-                'numero': row[0],
-                'nombre': row[1],
-                'rol': row[2],
-                'activo': row[3]
-            }
-        return None
+    """Obtiene un operario activo por su número (desde la plantilla en memoria)"""
+    return operarios_db.get_operario(numero, solo_activos=True)
 
 def authenticate_user(numero: str, pin: str = ""):
     """Autentica un usuario solo por número de operario"""
@@ -157,6 +233,12 @@ def current_role():
     """Obtiene el rol del usuario actual desde la cookie"""
     return request.cookies.get("role", "")
 
+def poner_cookies_sesion(resp, operario: dict):
+    """Cookies de sesión (8 h) con el rol y el usuario identificado."""
+    resp.set_cookie("role", operario['rol'], max_age=60*60*8, httponly=True)
+    resp.set_cookie("user_numero", operario['numero'], max_age=60*60*8, httponly=True)
+    resp.set_cookie("user_name", operario['nombre'], max_age=60*60*8, httponly=True)
+
 def current_user():
     """Obtiene los datos del usuario actual"""
     numero = request.cookies.get("user_numero", "")
@@ -189,6 +271,50 @@ def can_user_perform_action(action: str) -> bool:
     
     return action in permissions.get(user_role, [])
 
+# ================== Caché HTTP (ETag/304) ==================
+# Las consultas de solo lectura que sondean los terminales llevan un ETag derivado de
+# PRAGMA data_version de ambas bases, la URL con sus parámetros, el día, AVISO_DIAS y el
+# rol. Si el navegador ya tiene esa versión se responde 304 sin tocar la base; si no, el
+# cuerpo ya serializado se sirve desde una LRU acotada.
+CACHE_HTTP_MAX = 256
+_cache_http = OrderedDict()   # etag -> cuerpo JSON
+_cache_http_lock = threading.Lock()
+
+def _etag_peticion() -> str:
+    clave = (request.path, sorted(request.args.items(multi=True)), date.today().isoformat(), AVISO_DIAS,
+             current_role(), version_materiales(), operarios_db.version_db())
+    return hashlib.sha1(repr(clave).encode("utf-8")).hexdigest()[:24]
+
+def respuesta_cacheable(f):
+    """Decorador para endpoints GET que devuelven JSON y solo dependen de las bases y de la petición"""
+    def wrapper(*args, **kwargs):
+        etag = _etag_peticion()
+        # Comparación débil: al comprimir, el ETag se envía como W/"..."
+        if request.if_none_match.contains_weak(etag):
+            resp = make_response("", 304)
+        else:
+            with _cache_http_lock:
+                cuerpo = _cache_http.get(etag)
+                if cuerpo is not None:
+                    _cache_http.move_to_end(etag)
+            if cuerpo is None:
+                resp = make_response(f(*args, **kwargs))
+                # Errores y respuestas de permisos no se guardan
+                if resp.status_code != 200 or not resp.is_json:
+                    return resp
+                cuerpo = resp.get_data()
+                with _cache_http_lock:
+                    _cache_http[etag] = cuerpo
+                    if len(_cache_http) > CACHE_HTTP_MAX:
+                        _cache_http.popitem(last=False)
+            else:
+                resp = app.response_class(cuerpo, mimetype="application/json")
+        resp.set_etag(etag)
+        resp.headers["Cache-Control"] = "no-cache"  # el navegador guarda la copia pero revalida siempre
+        return resp
+    wrapper.__name__ = f.__name__
+    return wrapper
+
 # ================== Validaciones & fechas ==================
 def codigo_valido(codigo: str) -> bool:
     return bool(re.fullmatch(r"\d{7}", (codigo or "").strip()))
@@ -201,6 +327,12 @@ def normalize_date_human(s: str) -> Optional[str]:
     """Acepta ddmmaa, ddmmaaaa o con separadores. Devuelve ISO YYYY-MM-DD."""
     if not s: return None
     s = s.strip()
+    # ISO (lo que escribe la exportación y Excel al convertir fechas a texto): con 8 dígitos
+    # se tomaría por ddmmaaaa
+    iso = re.fullmatch(r"(\d{4})-(\d{1,2})-(\d{1,2})(?:[ T]\d{1,2}:\d{2}(?::\d{2})?)?", s)
+    if iso:
+        try: return date(int(iso[1]), int(iso[2]), int(iso[3])).strftime("%Y-%m-%d")
+        except ValueError: return None
     digits = re.sub(r"[^0-9]", "", s)
     if len(digits)==6:
         d=int(digits[0:2]); m=int(digits[2:4]); y=2000+int(digits[4:6])
@@ -215,6 +347,7 @@ def normalize_date_human(s: str) -> Optional[str]:
         return date(y,m,d).strftime("%Y-%m-%d")
     except: return None
 
+@lru_cache(maxsize=4096)
 def parse_date(iso: str) -> Optional[date]:
     try: return datetime.strptime(iso, "%Y-%m-%d").date()
     except: return None
@@ -226,7 +359,7 @@ def get_desc(ean: str)->tuple[Optional[str], bool]:
     with get_db() as conn:
         c=conn.cursor()
         # Primero buscar en catálogo
-        c.execute("SELECT descripcion FROM catalogo WHERE ean=?", (ean,))
+        c.execute("SELECT descripcion FROM ean_descriptions WHERE ean=?", (ean,))
         r=c.fetchone()
         if r: return r[0], True
         # Si no está en catálogo, buscar en materiales
@@ -238,25 +371,16 @@ def upsert_desc(ean: str, descripcion: str)->bool:
     if not (ean and descripcion and ean_valido(ean)): return False
     with get_db() as conn:
         c=conn.cursor()
-        c.execute("""INSERT INTO catalogo(ean,descripcion) VALUES(?,?)
+        c.execute("""INSERT INTO ean_descriptions(ean,descripcion) VALUES(?,?)
                      ON CONFLICT(ean) DO UPDATE SET descripcion=excluded.descripcion""", (ean.strip(), descripcion.strip()))
         return True
 
 def get_operario_nombre(num: str)->Optional[str]:
-    if not num: return None
-    with get_db_operarios() as conn:
-        c=conn.cursor()
-        c.execute("SELECT nombre FROM operarios WHERE numero=?", (num,))
-        r=c.fetchone()
-        return r["nombre"] if r else None
+    return operarios_db.get_operario_nombre(num)
 
 def get_operario_display(num: str)->str:
     """Devuelve 'numero - nombre' o solo el número si no encuentra el nombre"""
-    if not num: return "-"
-    nombre = get_operario_nombre(num)
-    if nombre:
-        return f"{num} - {nombre}"
-    return num
+    return operarios_db.get_operario_display(num)
 
 def upsert_operario(num: str, nombre: str, rol: str = "operario", activo: int = 1)->bool:
     """Función mejorada para importación CSV - soporta rol y estado activo"""
@@ -281,29 +405,17 @@ def upsert_operario(num: str, nombre: str, rol: str = "operario", activo: int =
                      ON CONFLICT(numero) DO UPDATE SET 
                      nombre=excluded.nombre, rol=excluded.rol, activo=excluded.activo""", 
                  (num, nombre, rol.lower(), activo))
-        return True
+    operarios_db.invalidar_cache()
+    return True
 
 # ================== CRUD Operarios ==================
 def get_all_operarios():
     """Obtiene todos los operarios con información completa"""
-    with get_db_operarios() as conn:
-        c = conn.cursor()
-        c.execute("""SELECT numero, nombre, rol, activo 
-                    FROM operarios ORDER BY numero""")
-        columns = [desc[0] for desc in c.description]
-        return [dict(zip(columns, row)) for row in c.fetchall()]
+    return operarios_db.get_all_operarios(solo_activos=False)
 
 def get_operario_completo(numero: str):
     """Obtiene un operario completo por número"""
-    with get_db_operarios() as conn:
-        c = conn.cursor()
-        c.execute("""SELECT numero, nombre, rol, activo 
-                    FROM operarios WHERE numero = ?""", (numero,))
-        row = c.fetchone()
-        if row:
-            columns = [desc[0] for desc in c.description]
-            return dict(zip(columns, row))
-        return None
+    return operarios_db.get_operario(numero)
 
 def crear_operario(numero: str, nombre: str, rol: str = "operario"):
     """Crea un nuevo operario"""
@@ -328,7 +440,8 @@ def crear_operario(numero: str, nombre: str, rol: str = "operario"):
             c = conn.cursor()
             c.execute("""INSERT INTO operarios(numero, nombre, rol, activo) 
                         VALUES(?, ?, ?, 1)""", (numero, nombre, rol))
-            return True, "Operario creado exitosamente"
+        operarios_db.invalidar_cache()
+        return True, "Operario creado exitosamente"
     except Exception as e:
         return False, f"Error al crear operario: {str(e)}"
 
@@ -352,7 +465,8 @@ def actualizar_operario(numero: str, nombre: str, rol: str):
                         WHERE numero = ?""", (nombre, rol, numero))
             if c.rowcount == 0:
                 return False, "Operario no encontrado"
-            return True, "Operario actualizado exitosamente"
+        operarios_db.invalidar_cache()
+        return True, "Operario actualizado exitosamente"
     except Exception as e:
         return False, f"Error al actualizar operario: {str(e)}"
 
@@ -370,29 +484,30 @@ def toggle_operario_activo(numero: str):
             c = conn.cursor()
             c.execute("UPDATE operarios SET activo = ? WHERE numero = ?", 
                      (nuevo_estado, numero))
-            return True, f"Operario {estado_texto} exitosamente"
+        operarios_db.invalidar_cache()
+        return True, f"Operario {estado_texto} exitosamente"
     except Exception as e:
         return False, f"Error al cambiar estado: {str(e)}"
 
 def eliminar_operario(numero: str):
     """Elimina un operario (soft delete - lo desactiva)"""
     try:
-        with get_db_operarios() as conn:
+        # Una sola conexión y transacción: operarios.db está adjunta como 'op'
+        with get_db_materiales() as conn:
             c = conn.cursor()
             # Verificar si tiene materiales asignados
-            with get_db_materiales() as conn_mat:
-                c_mat = conn_mat.cursor()
-                c_mat.execute("SELECT COUNT(*) FROM materiales WHERE operario_numero = ?", (numero,))
-                materiales_asignados = c_mat.fetchone()[0]
+            c.execute("SELECT COUNT(*) FROM materiales WHERE operario_numero = ?", (numero,))
+            materiales_asignados = c.fetchone()[0]
             
             if materiales_asignados > 0:
                 return False, f"No se puede eliminar: tiene {materiales_asignados} materiales asignados"
             
             # Soft delete - desactivar
-            c.execute("UPDATE operarios SET activo = 0 WHERE numero = ?", (numero,))
+            c.execute("UPDATE op.operarios SET activo = 0 WHERE numero = ?", (numero,))
             if c.rowcount == 0:
                 return False, "Operario no encontrado"
-            return True, "Operario eliminado (desactivado) exitosamente"
+        operarios_db.invalidar_cache()
+        return True, "Operario eliminado (desactivado) exitosamente"
     except Exception as e:
         return False, f"Error al eliminar operario: {str(e)}"
 
@@ -418,81 +533,14 @@ def get_estadisticas_operario(numero: str):
         return {'materiales_asignados': 0, 'por_estado': {}}
 
 # ================== Materiales CRUD ==================
-def validar_consistencia_ean_descripcion(ean: str, desc: str) -> tuple[bool, Optional[str]]:
-    """Valida que un EAN y descripción sean consistentes con los datos existentes.
-    
-    Retorna:
-        (True, None) si es válido
-        (False, mensaje_error) si hay inconsistencia
-    """
-    if not ean or not desc:
-        return True, None  # Sin EAN o sin descripción, no hay que validar
-    
-    ean = ean.strip()
-    desc = desc.strip()
-    
-    with get_db() as conn:
-        c = conn.cursor()
-        # Buscar si ya existe este EAN con una descripción diferente
-        c.execute("""
-            SELECT DISTINCT descripcion 
-            FROM materiales 
-            WHERE ean = ? AND descripcion != ? AND descripcion IS NOT NULL
-            LIMIT 1
-        """, (ean, desc))
-        
-        existing_desc = c.fetchone()
-        if existing_desc:
-            return False, f"EAN {ean} ya existe con descripción '{existing_desc[0]}'. No se puede usar '{desc}'"
-    
-    return True, None
-
 def get_material(codigo: str)->Optional[Material]:
+    asegurar_estados_al_dia()
     with get_db() as conn:
         c=conn.cursor()
-        c.execute("SELECT id,codigo,caducidad,estado,operario_numero,ean,descripcion,fecha_asignacion FROM materiales WHERE codigo=? LIMIT 1",(codigo,))
+        c.execute(f"SELECT {_COLS_MATERIAL} FROM materiales_operario WHERE codigo=? LIMIT 1",(codigo,))
         r=c.fetchone()
         return row_to_material(r) if r else None
 
-def insert_material(codigo: str, cad_raw: str, ean: Optional[str], desc: Optional[str])->bool:
-    codigo=(codigo or "").strip()
-    ean=(ean or "").strip()
-    desc=(desc or "").strip()
-    if not codigo_valido(codigo): return False
-    if not ean_valido(ean): return False
-    cad=normalize_date_human(cad_raw)
-    if not cad: return False
-    
-    # Validar que la fecha de caducidad no esté ya vencida
-    fecha_cad = parse_date(cad)
-    if fecha_cad and fecha_cad < date.today():
-        return False  # No permitir registro de productos ya caducados
-    # Chequeo de duplicado
-    with get_db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT id FROM materiales WHERE codigo = ?", (codigo,))
-        if c.fetchone():
-            return False  # duplicado
-    if ean and not desc:
-        d = get_desc(ean)
-        if d: desc = d
-    
-    if not desc:
-        return False  # La descripción es obligatoria
-        
-    # Autocompletar descripción desde catálogo si existe
-    if ean:
-        d = get_desc(ean)[0]  # Solo nos interesa la descripción, no si existe
-        if d:
-            desc = d  # Usar la descripción del catálogo
-        
-    with get_db() as conn:
-        c=conn.cursor()
-        c.execute("""INSERT INTO materiales (codigo,caducidad,estado,operario_numero,ean,descripcion,fecha_asignacion)
-                     VALUES (?,?,'precintado',NULL,?,?,NULL)""",(codigo,cad, ean if ean else None, desc))
-    if ean and desc: upsert_desc(ean, desc)
-    return True
-
 @app.route("/api/get_descripcion_by_ean")
 def api_get_descripcion_by_ean():
     ean = request.args.get('ean', '').strip()
@@ -504,120 +552,147 @@ def api_get_descripcion_by_ean():
         'existe': existe
     })
 
-def update_material(codigo: str, cad_raw: Optional[str], ean: Optional[str], desc: Optional[str])->bool:
-    if not codigo_valido(codigo): return False
-    sets=[]; params=[]
-    if cad_raw is not None and cad_raw!="":
-        cad=normalize_date_human(cad_raw)
-        if not cad: return False
-        sets.append("caducidad=?"); params.append(cad)
-    if ean is not None:
-        if ean!="" and not ean_valido(ean): return False
-        sets.append("ean=?"); params.append(ean.strip() or None)
-    if desc is not None:
-        sets.append("descripcion=?"); params.append(desc.strip() or None)
-    if not sets: return False
-    
-    # Validar consistencia EAN-Descripción si ambos están siendo actualizados o ya existen
-    if ean is not None and desc is not None:
-        ean_final = ean.strip() if ean else None
-        desc_final = desc.strip() if desc else None
-        if ean_final and desc_final:
-            es_valido, error_msg = validar_consistencia_ean_descripcion(ean_final, desc_final)
-            if not es_valido:
-                print(f"Error de consistencia: {error_msg}")
-                return False  # Rechazar actualización por inconsistencia
-    
-    params.append(codigo)
-    with get_db() as conn:
-        c=conn.cursor()
-        c.execute(f"UPDATE materiales SET {', '.join(sets)} WHERE codigo=?", tuple(params))
-        ok = c.rowcount>0
-    if ean and desc: upsert_desc(ean, desc)
-    return ok
-
-def set_estado_disponible_si_precintado(codigo: str):
-    with get_db() as conn:
-        c=conn.cursor()
-        c.execute("UPDATE materiales SET estado='disponible' WHERE codigo=? AND LOWER(IFNULL(estado,''))='precintado'", (codigo,))
-        return c.rowcount>0
-
-def update_operario(codigo: str, operario: str) -> bool:
-    """Asigna operario y graba fecha/hora del servidor en asignado_at."""
-    with get_db() as conn:
-        c=conn.cursor()
-        c.execute("UPDATE materiales SET operario_numero=?, fecha_asignacion=datetime('now','localtime') WHERE codigo=?", (operario, codigo))
-        return c.rowcount > 0
+# Estados derivados expresados en SQL: las columnas estado_calc/estado_orden/vence_prox/
+# caducado/precintado (migración 7) guardan el resultado de estado_base() para el día de
+# referencia de materiales_dia, así que filtrar y ordenar el listado son búsquedas en índice.
+_COLS_MATERIAL = ("id,codigo,caducidad,estado,operario_numero,ean,descripcion,fecha_asignacion,"
+                  "estado_calc,vence_prox,caducado,operario_display")
+_ORDEN_LISTADO = "estado_orden, IFNULL(caducidad,''), codigo"
 
-def devolver_material(codigo: str)->bool:
-    with get_db() as conn:
-        c=conn.cursor()
-        c.execute("UPDATE materiales SET operario_numero=NULL WHERE codigo=?", (codigo,))
-        return c.rowcount>0
+def _py_upper(s):
+    """UPPER de SQLite solo convierte ASCII; esta versión respeta tildes y eñes como str.upper()."""
+    return s.upper() if isinstance(s, str) else s
 
-def gastar_material(codigo: str)->bool:
-    with get_db() as conn:
-        c=conn.cursor()
-        c.execute("UPDATE materiales SET estado='gastado', operario_numero=NULL WHERE codigo=?", (codigo,))
-        return c.rowcount>0
+def _fts_frase(texto: str, columnas: str) -> Optional[str]:
+    """Consulta MATCH de subcadena sobre las columnas dadas de materiales_fts.
 
-def retirar_material(codigo: str)->bool:
+    El tokenizador trigram no encuentra nada con menos de 3 caracteres: en ese caso
+    (o sin FTS) devuelve None y el llamador filtra recorriendo la tabla."""
+    if not FTS_DISPONIBLE or len(texto) < 3:
+        return None
+    return "{%s} : \"%s\"" % (columnas, texto.replace('"', '""'))
+
+def filtro_materiales_sql(estado_filter: Optional[str], q: str, operario_filter: str = "")->tuple[str, dict]:
+    """Construye la cláusula WHERE (y sus parámetros con nombre) equivalente a los filtros
+    del listado: estado derivado, texto libre sobre código/EAN/descripción y operario."""
+    asegurar_estados_al_dia()
+    conds = []
+    params = {}
+    if estado_filter and estado_filter != "todos":
+        if estado_filter == "precintado":
+            conds.append("precintado = 1")
+        elif estado_filter == "vence prox":
+            # Incluye materiales en uso (o en cualquier estado) que vencen pronto
+            conds.append("vence_prox = 1")
+        elif estado_filter == "caducado":
+            conds.append("caducado = 1")
+        else:
+            conds.append("estado_orden = :estado_orden")
+            params["estado_orden"] = sort_key_estado(estado_filter)
+    qn = (q or "").upper().strip()
+    if qn:
+        params["q"] = qn
+        params["q_fts"] = _fts_frase(qn, "codigo ean descripcion")
+        if params["q_fts"]:
+            conds.append("id IN (SELECT rowid FROM materiales_fts WHERE materiales_fts MATCH :q_fts)")
+        else:
+            conds.append("instr(PY_UPPER(codigo || ' ' || IFNULL(ean,'') || ' ' || IFNULL(descripcion,'')), :q) > 0")
+    qop = (operario_filter or "").upper().strip()
+    if qop:
+        params["qop"] = qop
+        params["qop_fts"] = _fts_frase(qop, "operario_numero")
+        if params["qop_fts"]:
+            en_numero = "id IN (SELECT rowid FROM materiales_fts WHERE materiales_fts MATCH :qop_fts)"
+        else:
+            en_numero = "instr(PY_UPPER(operario_numero), :qop) > 0"
+        # get_operario_display(): "-" si no hay operario, "numero - nombre" si existe, si no el número tal cual
+        conds.append(f"""({en_numero}
+             OR operario_numero IN (SELECT numero FROM op.operarios
+                                    WHERE instr(PY_UPPER(numero || ' - ' || nombre), :qop) > 0)
+             OR (IFNULL(operario_numero,'') = '' AND :qop = '-'))""")
+    return (" AND ".join(f"({c})" for c in conds) or "1"), params
+
+def list_materiales_paged(estado_filter: Optional[str], q: str, offset: int, limit: int, operario_filter: str = "",
+                          after: Optional[tuple] = None, relevancia: bool = False)->List[Material]:
+    """Página del listado ordenado por (estado, caducidad, código).
+
+    Con after (clave devuelta por clave_orden_material) se pagina por cursor:
+    se ignora offset y se devuelven las filas posteriores a esa clave.
+    Con relevancia y un texto q resuelto por FTS se ordena primero por coincidencia
+    al principio de código/EAN/descripción y después por bm25; la clave de esas filas
+    lleva también la relevancia. ValueError si after es de la otra ordenación."""
+    where, params = filtro_materiales_sql(estado_filter, q, operario_filter)
+    params.update(offset=max(offset, 0), limit=limit)
+    por_relevancia = relevancia and bool(params.get("q_fts"))
+    if after is not None and len(after) != (5 if por_relevancia else 3):
+        raise ValueError("Cursor de otra ordenación")
+    if por_relevancia:
+        return _list_materiales_relevancia(where, params, after)
+    if after is not None:
+        # El primer término acota el rango del índice; el row value resuelve el empate
+        where += f" AND estado_orden >= :c_key AND ({_ORDEN_LISTADO}) > (:c_key, :c_cad, :c_cod)"
+        params.update(c_key=after[0], c_cad=after[1], c_cod=after[2], offset=0)
     with get_db() as conn:
         c=conn.cursor()
-        c.execute("UPDATE materiales SET estado='retirado', operario_numero=NULL WHERE codigo=?", (codigo,))
-        return c.rowcount>0
-
-def list_materiales_paged(estado_filter: Optional[str], q: str, offset: int, limit: int, operario_filter: str = "")->List[Material]:
+        c.execute(f"""SELECT {_COLS_MATERIAL}
+                      FROM materiales_operario
+                      WHERE {where}
+                      ORDER BY {_ORDEN_LISTADO}
+                      LIMIT :limit OFFSET :offset""", params)
+        return [row_to_material(r) for r in c.fetchall()]
+
+_ORDEN_RELEVANCIA = f"sin_prefijo, rango, {_ORDEN_LISTADO}"
+
+def _list_materiales_relevancia(where: str, params: dict, after: Optional[tuple] = None)->List[Material]:
+    # Las coincidencias solo se ordenan (no hay índice por relevancia); after sigue tras la
+    # clave (sin_prefijo, rango, estado_orden, caducidad, código) de la última fila
+    seguir = "1"
+    if after is not None:
+        seguir = f"({_ORDEN_RELEVANCIA}) > (:c_pre, :c_rango, :c_key, :c_cad, :c_cod)"
+        params.update(c_pre=after[0], c_rango=after[1], c_key=after[2], c_cad=after[3], c_cod=after[4], offset=0)
     with get_db() as conn:
         c=conn.cursor()
-        c.execute("SELECT id,codigo,caducidad,estado,operario_numero,ean,descripcion,fecha_asignacion FROM materiales")
-        rows=[row_to_material(r) for r in c.fetchall()]
-
-    def estado_calc(m: Material)->str:
-        return estado_base(m.caducidad, m.operario_numero, m.estado)
-
-    def vence_prox_calc(m: Material)->bool:
-        cad = parse_date(m.caducidad)
-        if not cad: return False
-        hoy = date.today()
-        return cad <= hoy + timedelta(days=AVISO_DIAS) and cad >= hoy
-
-    def caducado_calc(m: Material)->bool:
-        cad = parse_date(m.caducidad)
-        if not cad: return False
-        hoy = date.today()
-        return cad < hoy
-
-    # Función auxiliar para verificar si un material es precintado
-    def es_precintado(material):
-        eg = (material.estado or "").lower()
-        return eg == "precintado" and not (material.operario_numero and str(material.operario_numero).strip())
-
-    qn=(q or "").upper().strip()
-    qop=(operario_filter or "").upper().strip()
-    filtered=[]
-    for m in rows:
-        est=estado_calc(m)
-        
-        # Permitir que materiales "en uso" aparezcan en "vence prox" o "caducado" si cumplen las condiciones
-        if estado_filter and estado_filter != "todos":
-            if estado_filter == "precintado" and es_precintado(m):
-                pass  # Incluir materiales precintados (con P al final)
-            elif estado_filter == "vence prox" and vence_prox_calc(m):
-                pass  # Incluir si vence pronto, incluso si está en uso
-            elif estado_filter == "caducado" and caducado_calc(m):
-                pass  # Incluir si está caducado, incluso si está en uso
-            elif estado_filter != est:
-                continue
-        texto=(f"{m.codigo} {m.ean or ''} {m.descripcion or ''}").upper()
-        if qn and qn not in texto: continue
-        if qop:
-            op_display = get_operario_display(m.operario_numero).upper()
-            if qop not in op_display: continue
-        filtered.append((m, est))
-    filtered.sort(key=lambda t: (sort_key_estado(t[1]), t[0].caducidad, t[0].codigo))
-    sliced=filtered[offset: offset+limit]
-    return [t[0] for t in sliced]
+        c.execute(f"""SELECT {_COLS_MATERIAL}, sin_prefijo, rango FROM (
+                          SELECT *, NOT (substr(PY_UPPER(codigo), 1, length(:q)) = :q
+                                         OR substr(IFNULL(ean,''), 1, length(:q)) = :q
+                                         OR substr(PY_UPPER(IFNULL(descripcion,'')), 1, length(:q)) = :q)
+                                    AS sin_prefijo
+                          FROM materiales_operario
+                          JOIN (SELECT rowid AS fts_id, bm25(materiales_fts, 10.0, 5.0, 1.0, 0.0) AS rango
+                                FROM materiales_fts WHERE materiales_fts MATCH :q_fts) ON fts_id = id
+                          WHERE {where})
+                      WHERE {seguir}
+                      ORDER BY {_ORDEN_RELEVANCIA}
+                      LIMIT :limit OFFSET :offset""", params)
+        return [row_to_material(r) for r in c.fetchall()]
+
+def clave_orden_material(m: Material)->tuple:
+    """Clave de ordenación del listado (la misma que usa el ORDER BY de list_materiales_paged).
+    Las filas ordenadas por relevancia llevan delante (sin_prefijo, rango)."""
+    clave = (sort_key_estado(estado_de(m)), m.caducidad or "", m.codigo)
+    if m.rango is not None:
+        return (m.sin_prefijo, m.rango) + clave
+    return clave
+
+def encode_cursor(clave: tuple)->str:
+    return base64.urlsafe_b64encode(json.dumps(list(clave)).encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str)->Optional[tuple]:
+    """Devuelve la clave codificada en el cursor, o None si no es válido."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        clave = json.loads(raw.decode("utf-8"))
+        relevancia = ()
+        if len(clave) == 5:
+            relevancia, clave = tuple(clave[:2]), clave[2:]
+            if not (isinstance(relevancia[0], int) and isinstance(relevancia[1], (int, float))):
+                return None
+        key, cad, cod = clave
+        if isinstance(key, int) and isinstance(cad, str) and isinstance(cod, str):
+            return relevancia + (key, cad, cod)
+    except Exception:
+        pass
+    return None
 
 # ================== Estados & visual ==================
 def estado_base(caducidad: str, operario: Optional[str], estado_guardado: Optional[str]) -> str:
@@ -641,8 +716,10 @@ def estado_base(caducidad: str, operario: Optional[str], estado_guardado: Option
     return "disponible"
 
 def estado_label(caducidad: str, operario: Optional[str], estado_guardado: Optional[str]) -> str:
+    return _label_desde_base(estado_base(caducidad, operario, estado_guardado), operario, estado_guardado)
+
+def _label_desde_base(base: str, operario: Optional[str], estado_guardado: Optional[str]) -> str:
     eg = (estado_guardado or "").lower()
-    base = estado_base(caducidad, operario, estado_guardado)
     if eg == "gastado":
         return "gastado"
     if eg == "retirado":
@@ -656,8 +733,71 @@ def estado_label(caducidad: str, operario: Optional[str], estado_guardado: Optio
     return base
 
 def sort_key_estado(estado: str)->int:
-    order={"caducado":0,"en uso":1,"vence prox":2,"disponible":3,"precintado":4,"retirado":5,"gastado":6,"escaneado":7,"error fecha":8}
-    return order.get(estado, 99)
+    return ORDEN_ESTADOS.get(estado, 99)
+
+def estado_de(m: Material) -> str:
+    """estado_base del material, usando la columna materializada si viene en la fila."""
+    return m.estado_calc or estado_base(m.caducidad, m.operario_numero, m.estado)
+
+def etiqueta_de(m: Material) -> str:
+    return _label_desde_base(estado_de(m), m.operario_numero, m.estado)
+
+# ================== Estado materializado: día de referencia ==================
+_estados_dia = None            # (hoy, AVISO_DIAS) con el que están calculadas las columnas
+_estados_lock = threading.Lock()
+
+def recalcular_estados(conn, hoy: date):
+    """Fija el día de referencia y recalcula las columnas de estado de las filas que dependen de la fecha."""
+    limite = hoy + timedelta(days=AVISO_DIAS)
+    params = {"hoy": hoy.isoformat(), "limite": limite.isoformat()}
+    conn.execute("UPDATE materiales_dia SET hoy=:hoy, limite=:limite, aviso_dias=:aviso WHERE id=1",
+                 dict(params, aviso=AVISO_DIAS))
+    # Las filas sin fecha válida no cambian con el día (salvo las aún sin calcular)
+    cur = conn.execute(f"UPDATE materiales SET {sql_set_estado(':hoy', ':limite')} "
+                       f"WHERE {SQL_CAD_VALIDA} OR estado_orden IS NULL", params)
+    logger.info(f"Estados recalculados para {hoy.isoformat()} (aviso {AVISO_DIAS} días): {cur.rowcount} materiales")
+
+def asegurar_estados_al_dia():
+    """Recalcula las columnas de estado si ha cambiado el día o AVISO_DIAS desde el último cálculo.
+
+    Lo normal es que lo haga el hilo de medianoche; esta comprobación (una comparación en
+    memoria) cubre equipos suspendidos, cambios de hora y varios procesos sobre la misma base."""
+    global _estados_dia
+    clave = (date.today(), AVISO_DIAS)
+    if _estados_dia == clave:
+        return
+    with _estados_lock:
+        if _estados_dia == clave:
+            return
+        with get_db_materiales() as conn:
+            pool_materiales().begin_immediate(conn)
+            r = conn.execute("SELECT hoy, aviso_dias FROM materiales_dia WHERE id=1").fetchone()
+            if not r or r["hoy"] != clave[0].isoformat() or r["aviso_dias"] != AVISO_DIAS:
+                recalcular_estados(conn, clave[0])
+        _estados_dia = clave
+
+def _hilo_rollover_estados():
+    while True:
+        ahora = datetime.now()
+        siguiente = datetime.combine(ahora.date() + timedelta(days=1), datetime.min.time())
+        time.sleep(max((siguiente - ahora).total_seconds(), 0) + 1)
+        try:
+            asegurar_estados_al_dia()
+        except Exception as e:
+            logger.error(f"Error recalculando estados: {e}")
+        try:
+            podar_acciones_cliente()
+        except Exception as e:
+            logger.error(f"Error podando acciones de cliente: {e}")
+
+_rollover_iniciado = False
+
+def iniciar_rollover_estados():
+    """Arranca (una vez por proceso) el hilo que recalcula los estados al pasar la medianoche."""
+    global _rollover_iniciado
+    if not _rollover_iniciado:
+        _rollover_iniciado = True
+        threading.Thread(target=_hilo_rollover_estados, daemon=True, name="rollover-estados").start()
 
 def badge_html(label: str)->str:
     base = label.replace("P·", "")
@@ -692,9 +832,29 @@ def badge_html(label: str)->str:
 # ================== Init ==================
 init_db()
 
+# ================== Recursos estáticos ==================
+def responder_recurso(recurso, inmutable: bool):
+    """Respuesta de un recurso: versión gzip si el cliente la acepta, ETag y 304."""
+    gz = recurso.datos_gzip is not None and request.accept_encodings["gzip"] > 0
+    resp = app.response_class(recurso.datos_gzip if gz else recurso.datos, mimetype=recurso.tipo)
+    if gz:
+        resp.headers["Content-Encoding"] = "gzip"
+    if recurso.datos_gzip is not None:
+        resp.vary.add("Accept-Encoding")
+    resp.set_etag(recurso.huella + ("-gz" if gz else ""))
+    resp.headers["Cache-Control"] = CACHE_INMUTABLE if inmutable else CACHE_REVALIDAR
+    return resp.make_conditional(request)
+
+@app.get("/recursos/<path:ruta>")
+def recurso_estatico(ruta):
+    recurso = recursos.buscar_url(request.path)
+    if recurso is None:
+        abort(404)
+    # Huella antigua (página cargada antes de una actualización): contenido actual, sin inmutable
+    return responder_recurso(recurso, inmutable=recurso.url == request.path)
+
 # ================== PWA: Manifest e iconos ==================
-@app.route('/manifest.json')
-def pwa_manifest():
+def _manifest_pwa() -> bytes:
     manifest = {
         "name": "Gestión de Materiales",
         "short_name": "GestMat",
@@ -705,38 +865,68 @@ def pwa_manifest():
         "theme_color": "#1a73e8",
         "icons": [
             {
-                "src": "/static/icons/icon-192.png",
+                "src": recursos.url("icons/icon-192.png"),
                 "sizes": "192x192",
                 "type": "image/png",
                 "purpose": "any maskable"
             },
             {
-                "src": "/static/icons/icon-512.png",
+                "src": recursos.url("icons/icon-512.png"),
                 "sizes": "512x512",
                 "type": "image/png",
                 "purpose": "any maskable"
             }
         ]
     }
-    from flask import json as flask_json
-    response = app.response_class(
-        response=flask_json.dumps(manifest),
-        mimetype='application/manifest+json'
-    )
-    return response
+    return json.dumps(manifest, ensure_ascii=False).encode("utf-8")
+
+# El manifest enlaza los iconos versionados y se versiona él mismo (las páginas lo piden
+# como recurso('manifest.json')); /manifest.json queda para PWA ya instaladas, revalidando
+recursos.registrar("manifest.json", _manifest_pwa(), "application/manifest+json")
+
+@app.route('/manifest.json')
+def pwa_manifest():
+    return responder_recurso(recursos.obtener("manifest.json"), inmutable=False)
+
+def _revision_git() -> Optional[str]:
+    """Commit actual leyendo .git directamente (el PC puede no tener git en el PATH)."""
+    directorio_git = os.path.join(BASE_DIR, ".git")
+    try:
+        with open(os.path.join(directorio_git, "HEAD"), encoding="utf-8") as f:
+            head = f.read().strip()
+        if not head.startswith("ref: "):
+            return head[:12]
+        ref = head[5:]
+        ruta_ref = os.path.join(directorio_git, *ref.split("/"))
+        if os.path.exists(ruta_ref):
+            with open(ruta_ref, encoding="utf-8") as f:
+                return f.read().strip()[:12]
+        with open(os.path.join(directorio_git, "packed-refs"), encoding="utf-8") as f:
+            for linea in f:
+                if linea.rstrip().endswith(" " + ref):
+                    return linea.split()[0][:12]
+    except OSError:
+        pass
+    return None
+
+# Versión de la app vista por los clientes: commit + recursos (cubre también cambios sin commit)
+VERSION_APP = f"{_revision_git() or 'local'}-{recursos.huella_conjunto()}"
+
+def _service_worker() -> bytes:
+    """sw.js con la versión y la lista de precarga (templates/sw.js)."""
+    precache = ["/"] + [recursos.url(n) for n in ("css/home.css", "js/home.js", "manifest.json",
+                                                  "icons/icon-192.png", "icons/icon-512.png")]
+    return app.jinja_env.get_template("sw.js").render(version=VERSION_APP, precache=precache).encode("utf-8")
+
+# El service worker no puede cambiar de URL: se revalida siempre (ETag → 304 si no cambió).
+# Su contenido cambia con VERSION_APP, y con él las cachés del navegador.
+recursos.registrar("sw.js", _service_worker(), "application/javascript")
 
 @app.route('/sw.js')
 def pwa_service_worker():
-    sw = (
-        "self.addEventListener('install',e=>self.skipWaiting());\n"
-        "self.addEventListener('activate',e=>e.waitUntil(clients.claim()));\n"
-        "self.addEventListener('fetch',e=>e.respondWith(fetch(e.request).catch(()=>caches.match(e.request))));\n"
-    )
-    return app.response_class(
-        response=sw,
-        mimetype='application/javascript',
-        headers={'Service-Worker-Allowed': '/'}
-    )
+    resp = responder_recurso(recursos.obtener("sw.js"), inmutable=False)
+    resp.headers['Service-Worker-Allowed'] = '/'
+    return resp
 
 @app.route('/favicon.ico')
 def favicon():
@@ -798,8 +988,53 @@ def api_check_codigo():
     m = get_material(codigo)
     return jsonify({"existe": bool(m), "valido": True})
 
+def material_json(m: Material) -> dict:
+    """Fila de la tabla de materiales tal como la pintan home y estado (también va por SSE)."""
+    base = estado_de(m)
+    label = etiqueta_de(m)
+    asignado_at_formatted = "-"
+    if m.fecha_asignacion and m.operario_numero:
+        # Aceptar varios formatos de fecha existentes en BD
+        dt = None
+        for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f"):
+            try:
+                dt = datetime.strptime(m.fecha_asignacion, fmt)
+                break
+            except ValueError:
+                pass
+        if dt is None:
+            try:
+                dt = datetime.fromisoformat(m.fecha_asignacion.replace("Z", "+00:00"))
+            except ValueError:
+                dt = None
+        asignado_at_formatted = dt.strftime("%d/%m/%Y %H:%M:%S") if dt else str(m.fecha_asignacion)
+
+    # Determinar estado crítico para materiales en uso
+    estado_critico = None
+    if base == "en uso":
+        if m.caducado:
+            estado_critico = "caducado"
+        elif m.vence_prox:
+            estado_critico = "vence prox"
+
+    return {
+        "id": m.id,
+        "codigo": m.codigo,
+        "ean": m.ean or "-",
+        "descripcion": m.descripcion or "-",
+        "caducidad": m.caducidad,
+        "estado": base,
+        "estado_label": label,
+        "estado_html": badge_html(label),
+        "asignado_at": asignado_at_formatted,
+        "operario": m.operario_display if m.operario_display is not None else get_operario_display(m.operario_numero),
+        "operario_numero": m.operario_numero or "",
+        "estado_critico": estado_critico,
+    }
+
 # Scroll infinito: devolver filas en lotes
 @app.get("/api/materiales")
+@respuesta_cacheable
 def api_materiales():
     estado=request.args.get("estado","todos")
     q=request.args.get("q","")
@@ -809,52 +1044,22 @@ def api_materiales():
         limit=int(request.args.get("limit","50"))
     except:
         offset=0; limit=50
-    datos=[]
-    for m in list_materiales_paged(estado,q,offset,limit,operario):
-        base = estado_base(m.caducidad, m.operario_numero, m.estado)
-        label = estado_label(m.caducidad, m.operario_numero, m.estado)
-        asignado_at_formatted = "-"
-        if m.fecha_asignacion and m.operario_numero:
-          # Aceptar varios formatos de fecha existentes en BD
-          dt = None
-          for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f"):
-            try:
-              dt = datetime.strptime(m.fecha_asignacion, fmt)
-              break
-            except ValueError:
-              pass
-          if dt is None:
-            try:
-              dt = datetime.fromisoformat(m.fecha_asignacion.replace("Z", "+00:00"))
-            except ValueError:
-              dt = None
-          asignado_at_formatted = dt.strftime("%d/%m/%Y %H:%M:%S") if dt else str(m.fecha_asignacion)
-        
-        # Determinar estado crítico para materiales en uso
-        estado_critico = None
-        if base == "en uso":
-            cad = parse_date(m.caducidad)
-            if cad:
-                hoy = date.today()
-                if cad < hoy:
-                    estado_critico = "caducado"
-                elif cad <= hoy + timedelta(days=AVISO_DIAS):
-                    estado_critico = "vence prox"
-        
-        datos.append({
-            "id": m.id,
-            "codigo": m.codigo,
-            "ean": m.ean or "-",
-            "descripcion": m.descripcion or "-",
-            "caducidad": m.caducidad,
-            "estado": base,
-            "estado_label": label,
-            "estado_html": badge_html(label),
-            "asignado_at": asignado_at_formatted,
-            "operario": get_operario_display(m.operario_numero),
-            "operario_numero": m.operario_numero or "",
-            "estado_critico": estado_critico,
-        })
+    # Modo cursor: ?cursor= (vacío en la primera página) devuelve {items, next_cursor}
+    modo_cursor = "cursor" in request.args
+    after = None
+    if modo_cursor and request.args["cursor"]:
+        after = decode_cursor(request.args["cursor"])
+        if after is None:
+            return jsonify({"error": "Cursor inválido"}), 400
+    relevancia = request.args.get("orden") == "relevancia"
+    try:
+        materiales = list_materiales_paged(estado, q, offset, limit, operario, after=after, relevancia=relevancia)
+    except ValueError:
+        return jsonify({"error": "Cursor inválido"}), 400
+    datos=[material_json(m) for m in materiales]
+    if modo_cursor:
+        next_cursor = encode_cursor(clave_orden_material(materiales[-1])) if materiales and len(materiales) == limit else None
+        return jsonify({"items": datos, "next_cursor": next_cursor})
     return jsonify(datos)
 
 # ================== API de Autenticación ==================
@@ -872,7 +1077,7 @@ def api_auth():
         if not operario:
             return jsonify({'success': False, 'message': 'Número de operario no válido o usuario inactivo'})
         
-        return jsonify({
+        resp = jsonify({
             'success': True,
             'user': {
                 'numero': operario['numero'],
@@ -880,6 +1085,9 @@ def api_auth():
                 'rol': operario['rol']
             }
         })
+        # Las acciones que siguen (formulario, JSON, cola sin conexión) se autorizan con este rol
+        poner_cookies_sesion(resp, operario)
+        return resp
     
     except Exception as e:
         logger.error(f"Error en autenticación: {e}")
@@ -892,15 +1100,11 @@ def api_info_material():
     if not codigo_valido(codigo): return jsonify({"existe": False})
     m=get_material(codigo)
     if not m: return jsonify({"existe": False})
-    cad=parse_date(m.caducidad); hoy=date.today()
-    caducado=False; vence_prox=False
-    if cad:
-        caducado = cad<hoy
-        vence_prox = (not caducado) and (cad <= hoy+timedelta(days=AVISO_DIAS))
+    caducado=bool(m.caducado); vence_prox=bool(m.vence_prox)
     return jsonify({
         "existe": True,
-        "estado": estado_base(m.caducidad, m.operario_numero, m.estado),
-        "estado_label": estado_label(m.caducidad, m.operario_numero, m.estado),
+        "estado": estado_de(m),
+        "estado_label": etiqueta_de(m),
         "caducidad": m.caducidad,
         "descripcion": m.descripcion or "",
         "ean": m.ean or "",
@@ -937,115 +1141,94 @@ def get_productos_caducados_total():
 
 # Contadores por estado (para los botones) - MEJORADO con más datos
 @app.get("/api/contadores")
+@respuesta_cacheable
 def api_contadores():
-    with get_db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT codigo, caducidad, estado, operario_numero, descripcion FROM materiales WHERE (procesado_excel IS NULL OR procesado_excel = 0)")
-        rows = c.fetchall()
-    from collections import Counter
-    ctr = Counter()
-    
-    # Listas para alertas específicas
-    caducados_criticos = []
-    vencen_hoy = []
-    vencen_manana = []
-    
-    def vence_prox_calc(caducidad: str) -> bool:
-        cad = parse_date(caducidad)
-        if not cad: return False
-        hoy = date.today()
-        return cad <= hoy + timedelta(days=AVISO_DIAS) and cad >= hoy
-
-    def caducado_calc(caducidad: str) -> bool:
-        cad = parse_date(caducidad)
-        if not cad: return False
-        hoy = date.today()
-        return cad < hoy
-
+    return jsonify(resumen_contadores())
+
+# El resumen se recalcula solo cuando cambia la base (data_version), el día o AVISO_DIAS; las
+# peticiones simultáneas esperan a una única consulta en curso en vez de repetirla.
+_contadores_cache = None   # (clave, resumen)
+_contadores_lock = threading.Lock()
+
+def resumen_contadores() -> dict:
+    global _contadores_cache
+    asegurar_estados_al_dia()
+    cache = _contadores_cache
+    if cache and cache[0] == (date.today(), AVISO_DIAS, version_materiales()):
+        return cache[1]
+    with _contadores_lock:
+        clave = (date.today(), AVISO_DIAS, version_materiales())
+        cache = _contadores_cache
+        if cache and cache[0] == clave:
+            return cache[1]
+        resumen = _calcular_contadores()
+        _contadores_cache = (clave, resumen)
+        return resumen
+
+def _calcular_contadores() -> dict:
     hoy = date.today()
     manana = hoy + timedelta(days=1)
-    
-    for codigo, caducidad, estado, operario_numero, descripcion in rows:
-        eg = (estado or "").lower()
-        cad = parse_date(caducidad)
-        
-        # Contar estado base
-        base = estado_base(caducidad, operario_numero, estado)
-        ctr[base] += 1
-        
-        # Detectar alertas críticas (excluir escaneados)
-        if cad and eg not in ["gastado", "retirado", "escaneado"]:
-            if cad < hoy:  # Caducado
-                caducados_criticos.append({
-                    'codigo': codigo,
-                    'descripcion': descripcion or 'Sin descripción',
-                    'caducidad': caducidad,
-                    'dias_caducado': (hoy - cad).days,
-                    'operario': get_operario_display(operario_numero) if operario_numero else None
-                })
-            elif cad == hoy:  # Vence hoy
-                vencen_hoy.append({
-                    'codigo': codigo,
-                    'descripcion': descripcion or 'Sin descripción',
-                    'caducidad': caducidad,
-                    'operario': get_operario_display(operario_numero) if operario_numero else None
-                })
-            elif cad == manana:  # Vence mañana
-                vencen_manana.append({
-                    'codigo': codigo,
-                    'descripcion': descripcion or 'Sin descripción',
-                    'caducidad': caducidad,
-                    'operario': get_operario_display(operario_numero) if operario_numero else None
-                })
-        
-        # Contar "vence prox": incluir materiales que vencen pronto Y no están gastados/retirados/escaneados
-        if eg not in ["gastado", "retirado", "escaneado"] and vence_prox_calc(caducidad):
-            if base != "vence prox":
-                ctr["vence prox"] += 1
-                
-        # Contar "caducado": incluir materiales caducados Y no están gastados/retirados/escaneados
-        if eg not in ["gastado", "retirado", "escaneado"] and caducado_calc(caducidad):
-            if base != "caducado":
-                ctr["caducado"] += 1
-                
-        # Contar precintado específicamente
-        if eg == "precintado" and not operario_numero:
-            ctr["precintado"] += 1
+    pendiente = "(procesado_excel IS NULL OR procesado_excel = 0)"
+    with get_db() as conn:
+        ctr = {r["clave"]: r["n"] for r in conn.execute("SELECT clave, n FROM materiales_contadores")}
+        # Alertas (excluyen gastados/retirados/escaneados): todas caen en los índices parciales/de caducidad
+        caducados = conn.execute(f"""
+            SELECT codigo, caducidad, operario_numero, operario_display, descripcion FROM materiales_operario
+            WHERE caducado = 1 AND estado_calc IN ('caducado','en uso') AND {pendiente}
+            ORDER BY id LIMIT 5""").fetchall()
+        proximos = conn.execute(f"""
+            SELECT codigo, caducidad, operario_numero, operario_display, descripcion FROM materiales_operario
+            WHERE caducidad IN (:hoy, :manana) AND estado_calc NOT IN ('gastado','retirado','escaneado')
+              AND {pendiente}
+            ORDER BY id""", {"hoy": hoy.isoformat(), "manana": manana.isoformat()}).fetchall()
+
+    def alerta(r) -> dict:
+        return {
+            'codigo': r["codigo"],
+            'descripcion': r["descripcion"] or 'Sin descripción',
+            'caducidad': r["caducidad"],
+            'operario': r["operario_display"] if r["operario_numero"] else None
+        }
+
+    caducados_criticos = [dict(alerta(r), dias_caducado=(hoy - parse_date(r["caducidad"])).days) for r in caducados]
+    vencen_hoy = [alerta(r) for r in proximos if r["caducidad"] == hoy.isoformat()]
+    vencen_manana = [alerta(r) for r in proximos if r["caducidad"] == manana.isoformat()]
+    total_caducados = ctr.get("caducado", 0) + ctr.get("en uso caducado", 0)
 
-    # Calcular métricas adicionales
+    # Los materiales en uso que vencen pronto/caducados suman también en su contador
+    vence_prox = ctr.get("vence prox", 0) + ctr.get("en uso vence prox", 0)
     total_materiales = sum(ctr.values())
-    total_activos = ctr.get("disponible", 0) + ctr.get("en uso", 0) + ctr.get("vence prox", 0) + ctr.get("precintado", 0)
-    
-    return jsonify({
+    total_activos = ctr.get("disponible", 0) + ctr.get("en uso", 0) + vence_prox + ctr.get("precintado", 0)
+
+    return {
         # Contadores básicos
-        "caducado":   ctr.get("caducado", 0),
+        "caducado":   total_caducados,
         "en uso":     ctr.get("en uso", 0),
-        "vence prox": ctr.get("vence prox", 0),
+        "vence prox": vence_prox,
         "disponible": ctr.get("disponible", 0),
         "precintado": ctr.get("precintado", 0),
         "retirado":   ctr.get("retirado", 0),
         "gastado":    ctr.get("gastado", 0),
         "escaneado":  ctr.get("escaneado", 0),
-        
+
         # Métricas adicionales
         "total_materiales": total_materiales,
         "total_activos": total_activos,
         "porcentaje_uso": round((ctr.get("en uso", 0) / total_activos * 100) if total_activos > 0 else 0, 1),
-        
+
         # Alertas específicas
         "alertas": {
-            "caducados_criticos": caducados_criticos[:5],  # Solo los primeros 5
+            "caducados_criticos": caducados_criticos,  # Solo los primeros 5
             "vencen_hoy": vencen_hoy,
             "vencen_manana": vencen_manana,
-            "total_caducados": len(caducados_criticos),
+            "total_caducados": total_caducados,
             "total_vencen_hoy": len(vencen_hoy),
             "total_vencen_manana": len(vencen_manana)
         }
-    })
+    }
 
-@app.get("/api/verificar_consistencia_ean")
-def api_verificar_consistencia_ean():
-    """Endpoint para verificar consistencia EAN-Descripción"""
+def consistencia_ean() -> dict:
+    """EAN con más de una descripción entre sus materiales, y estadísticas de EAN."""
     with get_db() as conn:
         c = conn.cursor()
         # Buscar EANs con múltiples descripciones
@@ -1077,7 +1260,7 @@ def api_verificar_consistencia_ean():
             "total_materiales": total
         })
     
-    return jsonify({
+    return {
         "consistente": len(inconsistencias) == 0,
         "inconsistencias_count": len(inconsistencias),
         "inconsistencias": inconsistencias_detalle,
@@ -1085,7 +1268,13 @@ def api_verificar_consistencia_ean():
             "total_materiales_con_ean": total_con_ean,
             "eans_unicos": eans_unicos
         }
-    })
+    }
+
+@app.get("/api/verificar_consistencia_ean")
+def api_verificar_consistencia_ean():
+    """Endpoint para verificar consistencia EAN-Descripción (en segundo plano: trabajo
+    verificar_ean)"""
+    return jsonify(consistencia_ean())
 
 # ================== Autenticación simple ==================
 
@@ -1112,9 +1301,7 @@ def admin():
                 return redirect(url_for("home"))
             # Login admin: set cookie y recargar
             resp = redirect(url_for("admin"))
-            resp.set_cookie("role", "admin", max_age=60*60*8, httponly=True)
-            resp.set_cookie("user_numero", operario['numero'], max_age=60*60*8, httponly=True)
-            resp.set_cookie("user_name", operario['nombre'], max_age=60*60*8, httponly=True)
+            poner_cookies_sesion(resp, operario)
             flash("Bienvenido admin", "success")
             return resp
         # GET: mostrar formulario
@@ -1151,116 +1338,70 @@ def admin():
             
             n=0
             errors=0
-            rows_data = []
-            
-            # Determinar tipo de archivo
-            filename = f.filename.lower()
             
-            if filename.endswith('.xlsx') or filename.endswith('.xls'):
-                # Procesar archivo Excel
-                try:
-                    from openpyxl import load_workbook
-                    import tempfile
-                    import os
-                    
-                    # Guardar archivo temporal
-                    temp_dir = tempfile.gettempdir()
-                    temp_path = os.path.join(temp_dir, f"temp_operarios_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
-                    f.save(temp_path)
-                    
-                    # Leer Excel
-                    wb = load_workbook(temp_path)
-                    ws = wb.active
-                    
-                    for row in ws.iter_rows(values_only=True):
-                        if row and len([cell for cell in row if cell is not None]) >= 2:
-                            # Convertir None a string vacío y limpiar
-                            clean_row = [str(cell).strip() if cell is not None else "" for cell in row]
-                            rows_data.append(clean_row)
-                    
-                    # Limpiar archivo temporal
-                    try:
-                        os.unlink(temp_path)
-                    except:
-                        pass
-                        
-                except Exception as e:
-                    flash(f"Error leyendo archivo Excel: {e}", "error")
-                    return redirect(url_for("admin"))
+            # Excel o CSV (coma o punto y coma, UTF-8 o latin-1), leído fila a fila del archivo subido
+            try:
+                if hojas.extension(f.filename) in hojas.EXTENSIONES_EXCEL:
+                    rows_data = hojas.filas_excel(f.stream)
+                else:
+                    rows_data = hojas.filas_csv(f.stream)
+                rows_data = ([hojas.texto_celda(cell) for cell in row] for row in rows_data
+                             if row and sum(cell not in (None, "") for cell in row) >= 2)
             
-            else:
-                # Procesar archivo CSV
-                try:
-                    # Intentar diferentes codificaciones
+                # Procesar filas (tanto de Excel como CSV)
+                for row in rows_data:
+                    if not row or len(row)<2: continue
+                    # Soportar 2, 3 o 4 columnas: numero,nombre[,rol[,activo]]
                     try:
-                        content = f.read().decode("utf-8")
-                    except UnicodeDecodeError:
-                        try:
-                            f.seek(0)
-                            content = f.read().decode("latin-1")
-                        except:
-                            f.seek(0)
-                            content = f.read().decode("utf-8", errors="ignore")
-                    
-                    # Detectar separador (coma o punto y coma)
-                    delimiter = ';' if ';' in content.split('\n')[0] else ','
-                    reader=csv.reader(io.StringIO(content), delimiter=delimiter)
-                    rows_data = list(reader)
-                    
-                except Exception as e:
-                    flash(f"Error leyendo archivo CSV: {e}", "error")
-                    return redirect(url_for("admin"))
-            
-            # Procesar filas (tanto de Excel como CSV)
-            for row in rows_data:
-                if not row or len(row)<2: continue
-                # Soportar 2, 3 o 4 columnas: numero,nombre[,rol[,activo]]
-                try:
-                    numero_raw = str(row[0]).strip()
-                    nombre_raw = str(row[1]).strip()
-                    rol = str(row[2]).strip() if len(row)>2 else "operario"
-                    activo = str(row[3]).strip() if len(row)>3 else "1"
+                        numero_raw = str(row[0]).strip()
+                        nombre_raw = str(row[1]).strip()
+                        rol = str(row[2]).strip() if len(row)>2 else "operario"
+                        activo = str(row[3]).strip() if len(row)>3 else "1"
                     
-                    # Saltar filas de encabezado
-                    if numero_raw.lower() in ['numero', 'id', 'código', 'codigo']:
-                        continue
+                        # Saltar filas de encabezado
+                        if numero_raw.lower() in ['numero', 'id', 'código', 'codigo']:
+                            continue
                     
-                    # Añadir prefijo "US" si no lo tiene (para tarjetas de fichaje)
-                    if numero_raw and not numero_raw.upper().startswith('US'):
-                        # Solo añadir US si es un número o código válido
-                        if numero_raw.isdigit() or numero_raw.isalnum():
-                            numero = f"US{numero_raw}"
-                            logger.info(f"Añadido prefijo US: '{numero_raw}' -> '{numero}'")
+                        # Añadir prefijo "US" si no lo tiene (para tarjetas de fichaje)
+                        if numero_raw and not numero_raw.upper().startswith('US'):
+                            # Solo añadir US si es un número o código válido
+                            if numero_raw.isdigit() or numero_raw.isalnum():
+                                numero = f"US{numero_raw}"
+                                logger.info(f"Añadido prefijo US: '{numero_raw}' -> '{numero}'")
+                            else:
+                                numero = numero_raw  # Mantener formato original si no es numérico
                         else:
-                            numero = numero_raw  # Mantener formato original si no es numérico
-                    else:
-                        numero = numero_raw
+                            numero = numero_raw
                     
-                    # Procesar formato "APELLIDOS, NOMBRE" -> "NOMBRE APELLIDOS"
-                    if ',' in nombre_raw and len(nombre_raw.split(',')) == 2:
-                        partes = nombre_raw.split(',')
-                        apellidos = partes[0].strip()
-                        nombre_parte = partes[1].strip()
-                        nombre = f"{nombre_parte} {apellidos}".strip()
-                        logger.info(f"Convertido nombre: '{nombre_raw}' -> '{nombre}'")
-                    else:
-                        nombre = nombre_raw
+                        # Procesar formato "APELLIDOS, NOMBRE" -> "NOMBRE APELLIDOS"
+                        if ',' in nombre_raw and len(nombre_raw.split(',')) == 2:
+                            partes = nombre_raw.split(',')
+                            apellidos = partes[0].strip()
+                            nombre_parte = partes[1].strip()
+                            nombre = f"{nombre_parte} {apellidos}".strip()
+                            logger.info(f"Convertido nombre: '{nombre_raw}' -> '{nombre}'")
+                        else:
+                            nombre = nombre_raw
                     
-                    # Convertir activo a entero
-                    if str(activo).lower() in ['1', 'true', 'activo', 'si', 'sí']:
-                        activo = 1
-                    elif str(activo).lower() in ['0', 'false', 'inactivo', 'no']:
-                        activo = 0
-                    else:
-                        activo = 1  # Por defecto activo
+                        # Convertir activo a entero
+                        if str(activo).lower() in ['1', 'true', 'activo', 'si', 'sí']:
+                            activo = 1
+                        elif str(activo).lower() in ['0', 'false', 'inactivo', 'no']:
+                            activo = 0
+                        else:
+                            activo = 1  # Por defecto activo
                     
-                    if numero and nombre and upsert_operario(numero, nombre, rol, activo): 
-                        n+=1
-                    else:
+                        if numero and nombre and upsert_operario(numero, nombre, rol, activo): 
+                            n+=1
+                        else:
+                            errors+=1
+                    except Exception as e:
                         errors+=1
-                except Exception as e:
-                    errors+=1
-                    logger.error(f"Error importando operario {row}: {e}")
+                        logger.error(f"Error importando operario {row}: {e}")
+            except Exception as e:
+                # Archivo ilegible (Excel dañado, .xls antiguo): lo ya importado se queda
+                flash(f"Error leyendo archivo: {e}", "error")
+                return redirect(url_for("admin"))
             
             msg = f"Operarios importados/actualizados: {n}"
             if errors > 0:
@@ -1270,91 +1411,30 @@ def admin():
         if accion=="import_materiales":
             f=request.files.get("archivo")
             if not f or f.filename=="": flash("Sube CSV materiales","error"); return redirect(url_for("admin"))
-            content=f.read().decode("utf-8",errors="ignore")
-            reader=csv.reader(io.StringIO(content))
-            ok=upd=err=0
-            for row in reader:
-                if not row: continue
-                codigo=(row[0] if len(row)>0 else "").strip()
-                fecha=(row[1] if len(row)>1 else "").strip()
-                ean=(row[2] if len(row)>2 else "").strip()
-                desc=(row[3] if len(row)>3 else "").strip()
-                if not codigo_valido(codigo) or not fecha or (ean and not ean_valido(ean)): err+=1; continue
-                if insert_material(codigo, fecha, ean, desc): ok+=1
-                elif update_material(codigo, fecha, ean, desc): upd+=1
-                else: err+=1
-            flash(f"Materiales importados: {ok}, actualizados: {upd}, errores: {err}", "success"); return redirect(url_for("admin"))
+            flash_resultado_importacion(importar_filas_materiales(filas_posicionales(hojas.filas_csv(f.stream))), "CSV")
+            return redirect(url_for("admin"))
         if accion=="export_cleanup":
-            from openpyxl import Workbook
-            from openpyxl.styles import Font, PatternFill
-            import tempfile
-            import os
-            
+            if not EXCEL_DISPONIBLE:
+                flash("❌ Funcionalidad Excel no disponible. Instale openpyxl.", "error")
+                return redirect(url_for("admin"))
+            # Se borran solo los exportados, y solo cuando el archivo ha salido entero: si la
+            # descarga se corta, los materiales siguen en la base
             with get_db() as conn:
-                c = conn.cursor()
-                # Obtener materiales gastados y retirados
-                c.execute("SELECT codigo, descripcion FROM materiales WHERE LOWER(estado) IN ('gastado', 'retirado') ORDER BY codigo")
-                materiales = c.fetchall()
-                
-                if not materiales:
-                    flash("No hay materiales gastados o retirados para exportar", "error")
-                    return redirect(url_for("admin"))
-                
-                # Crear archivo Excel
-                wb = Workbook()
-                ws = wb.active
-                ws.title = "Materiales Gastados y Retirados"
-                
-                # Encabezados
-                ws['A1'] = "Código"
-                ws['B1'] = "Descripción"
-                
-                # Formato de encabezados
-                header_font = Font(bold=True, color="FFFFFF")
-                header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-                
-                ws['A1'].font = header_font
-                ws['A1'].fill = header_fill
-                ws['B1'].font = header_font
-                ws['B1'].fill = header_fill
-                
-                # Datos
-                for idx, (codigo, descripcion) in enumerate(materiales, start=2):
-                    ws[f'A{idx}'] = codigo
-                    ws[f'B{idx}'] = descripcion or "-"
-                
-                # Ajustar ancho de columnas
-                ws.column_dimensions['A'].width = 15
-                ws.column_dimensions['B'].width = 50
-                
-                # Guardar archivo temporal
-                temp_dir = tempfile.gettempdir()
-                filename = f"materiales_gastados_retirados_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-                filepath = os.path.join(temp_dir, filename)
-                wb.save(filepath)
-                
-                # Eliminar los materiales de la base de datos
-                c.execute("DELETE FROM materiales WHERE LOWER(estado) IN ('gastado', 'retirado')")
-                deleted_count = c.rowcount
-                
-                # Enviar archivo como respuesta
-                from flask import send_file
-                try:
-                    response = send_file(filepath, as_attachment=True, download_name=filename)
-                    # Programar eliminación del archivo temporal después de enviarlo
-                    @response.call_on_close
-                    def cleanup_temp_file():
-                        try:
-                            os.unlink(filepath)
-                        except:
-                            pass
-                    
-                    flash(f"Exportados y eliminados {deleted_count} materiales", "success")
-                    return response
-                except Exception as e:
-                    logger.error(f"Error enviando archivo: {e}")
-                    flash(f"Error generando archivo Excel: {e}", "error")
-                    return redirect(url_for("admin"))
+                hay = conn.execute("SELECT 1 FROM materiales WHERE LOWER(estado) IN ('gastado', 'retirado') LIMIT 1").fetchone()
+            if not hay:
+                flash("No hay materiales gastados o retirados para exportar", "error")
+                return redirect(url_for("admin"))
+            exportados = []
+            try:
+                resp = respuesta_exportacion("xlsx", gastados_retirados(exportados), "materiales_gastados_retirados",
+                                             columnas=LIMPIEZA_COLUMNAS, titulo="Materiales Gastados y Retirados",
+                                             al_terminar=lambda: borrar_exportados(exportados))
+            except Exception as e:
+                logger.error(f"Error generando archivo: {e}")
+                flash(f"Error generando archivo Excel: {e}", "error")
+                return redirect(url_for("admin"))
+            flash(f"Exportados {len(exportados)} materiales; se eliminan al completarse la descarga", "success")
+            return resp
         if accion=="delete_material":
             codigo=(request.form.get("codigo") or "").strip()
             if not codigo_valido(codigo): flash("Código inválido","error")
@@ -1382,6 +1462,7 @@ def admin():
                                 (numero, nombre, rol, activo) 
                                 VALUES (?, ?, ?, ?)""", 
                              (numero, nombre, rol, activo))
+                operarios_db.invalidar_cache()
                 flash("Operario guardado exitosamente", "success")
             except Exception as e:
                 logger.error(f"Error guardando operario: {e}")
@@ -1398,6 +1479,7 @@ def admin():
                 c=conn.cursor()
                 c.execute("DELETE FROM operarios WHERE numero=?", (numero,))
                 n=c.rowcount
+            operarios_db.invalidar_cache()
             flash(f"Operarios eliminados: {n}", "success" if n else "error"); return redirect(url_for("admin"))
         
         if accion=="op_toggle":
@@ -1410,6 +1492,7 @@ def admin():
                 c=conn.cursor()
                 c.execute("UPDATE operarios SET activo = 1 - activo WHERE numero=?", (numero,))
                 n=c.rowcount
+            operarios_db.invalidar_cache()
             flash(f"Estado cambiado para {n} operario(s)", "success" if n else "error")
             return redirect(url_for("admin"))
         if accion=="update_ean_description":
@@ -1470,234 +1553,384 @@ def admin():
         eans_data = list(eans_dict.values())
         eans_data.sort(key=lambda x: x['total_materiales'], reverse=True)
 
-    with get_db_operarios() as conn:
-        c=conn.cursor()
-        c.execute("SELECT numero, nombre, rol, activo FROM operarios ORDER BY numero")
-        columns = ['numero', 'nombre', 'rol', 'activo']
-        ops = [dict(zip(columns, row)) for row in c.fetchall()]
-    
-    return render_template_string(tpl_admin(), operarios=ops, eans_data=eans_data)
+    ops = get_all_operarios()
+    
+    return render_template("admin.html", operarios=ops, eans_data=eans_data)
+
+# ================== Exportación de materiales ==================
+# Las exportaciones leen los materiales por páginas de EXPORTACION_LOTE filas con el cursor
+# del listado (la conexión no queda retenida mientras el cliente descarga) y no los cargan
+# todos en memoria:
+#   - CSV sale por trozos según se genera: el primer byte llega con la primera página;
+#   - Excel se escribe en modo write-only a un temporal anónimo (un .xlsx es un zip y no
+#     puede enviarse antes de cerrarlo) y se envía después por trozos.
+EXPORTACION_LOTE = 1000
+EXPORTACION_TROZO_BYTES = 64 * 1024
+MIMETYPE_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# (encabezado, ancho en Excel). Estado, Operario y Caducidad tal como se guardan: el archivo
+# se puede volver a importar; Situación es el estado que muestra la pantalla
+EXPORTACION_COLUMNAS = (("ID", 6), ("Código", 12), ("EAN", 15), ("Descripción", 40), ("Caducidad", 12),
+                        ("Estado", 12), ("Situación", 14), ("Operario", 24), ("Asignado En", 19))
+
+def materiales_filtrados(estado: Optional[str], q: str = "", operario: str = "") -> Iterable[Material]:
+    """Todos los materiales del listado con los filtros de /api/materiales, en su orden."""
+    asegurar_estados_al_dia()
+    after = None
+    while True:
+        pagina = list_materiales_paged(estado, q, 0, EXPORTACION_LOTE, operario, after=after)
+        yield from pagina
+        if len(pagina) < EXPORTACION_LOTE:
+            return
+        after = clave_orden_material(pagina[-1])
+
+def fila_exportacion(m: Material) -> tuple:
+    return (m.id, m.codigo, m.ean or "", m.descripcion or "", m.caducidad or "", m.estado or "",
+            etiqueta_de(m), m.operario_numero or "", m.fecha_asignacion or "")
+
+def csv_en_trozos(filas: Iterable[tuple], encabezados: Iterable[str], al_terminar=None):
+    """CSV (UTF-8 con BOM y ';', como lo abre Excel en español) en trozos de EXPORTACION_LOTE
+    filas. al_terminar se llama solo si el cliente ha recibido el archivo entero."""
+    buf = io.StringIO()
+    w = csv.writer(buf, delimiter=";")
+    def vaciar():
+        trozo = buf.getvalue()
+        buf.seek(0); buf.truncate()
+        return trozo
+    buf.write("\ufeff")
+    w.writerow(encabezados)
+    yield vaciar()
+    for n, fila in enumerate(filas, 1):
+        w.writerow(fila)
+        if n % EXPORTACION_LOTE == 0:
+            yield vaciar()
+    if buf.tell():
+        yield vaciar()
+    if al_terminar:
+        al_terminar()
+
+def xlsx_temporal(filas: Iterable[tuple], columnas, titulo: str):
+    """Escribe las filas en un libro write-only y devuelve el temporal (abierto, al principio)."""
+    f = tempfile.TemporaryFile()
+    try:
+        hojas.escribir_xlsx(filas, f, columnas, titulo)
+    except Exception:
+        f.close()
+        raise
+    f.seek(0)
+    return f
+
+def _trozos_archivo(f, al_terminar=None):
+    try:
+        while True:
+            trozo = f.read(EXPORTACION_TROZO_BYTES)
+            if not trozo:
+                break
+            yield trozo
+        if al_terminar:
+            al_terminar()
+    finally:
+        f.close()
+
+def respuesta_exportacion(formato: str, filas: Iterable[tuple], nombre: str, columnas=EXPORTACION_COLUMNAS,
+                          titulo: str = "Materiales", al_terminar=None):
+    """Descarga en CSV o Excel de las filas. al_terminar se ejecuta cuando se ha enviado el
+    último trozo (si el cliente corta la descarga, no)."""
+    nombre = f"{nombre}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    if formato == "xlsx":
+        f = xlsx_temporal(filas, columnas, titulo)
+        tamaño = os.fstat(f.fileno()).st_size
+        resp = app.response_class(_trozos_archivo(f, al_terminar), mimetype=MIMETYPE_XLSX)
+        resp.headers["Content-Length"] = str(tamaño)
+        extension = "xlsx"
+    else:
+        resp = app.response_class(csv_en_trozos(filas, [c for c, _ in columnas], al_terminar),
+                                  mimetype="text/csv")
+        extension = "csv"
+    resp.headers["Content-Disposition"] = f"attachment; filename={nombre}.{extension}"
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+LIMPIEZA_COLUMNAS = (("Código", 15), ("Descripción", 50))
+
+def gastados_retirados(exportados: List[int]) -> Iterable[tuple]:
+    """(código, descripción) de los gastados y retirados para export_cleanup; va dejando
+    sus ids en `exportados` para borrarlos después."""
+    with get_db() as conn:
+        for r in conn.execute("""SELECT id, codigo, descripcion FROM materiales
+                                 WHERE LOWER(estado) IN ('gastado', 'retirado') ORDER BY codigo"""):
+            exportados.append(r["id"])
+            yield r["codigo"], r["descripcion"] or "-"
+
+def borrar_exportados(ids: List[int], lote: int = 500):
+    """Borra los materiales exportados por export_cleanup que siguen gastados o retirados."""
+    borrados = 0
+    with get_db() as conn:
+        for i in range(0, len(ids), lote):
+            parte = ids[i:i + lote]
+            borrados += conn.execute(f"""DELETE FROM materiales WHERE id IN ({",".join("?" * len(parte))})
+                                         AND LOWER(estado) IN ('gastado', 'retirado')""", parte).rowcount
+    logger.info(f"Exportar y limpiar: {borrados} materiales eliminados de {len(ids)} exportados")
+
+def _formato_exportacion() -> Optional[str]:
+    formato = (request.args.get("formato") or "csv").lower()
+    if formato not in ("csv", "xlsx") or (formato == "xlsx" and not EXCEL_DISPONIBLE):
+        return None
+    return formato
+
+@app.get("/api/materiales/exportar")
+def api_materiales_exportar():
+    """El listado completo con los filtros de /api/materiales (estado, q, operario), en CSV
+    (por defecto) o Excel (?formato=xlsx)."""
+    formato = _formato_exportacion()
+    if formato is None:
+        return jsonify({"error": "Formato no disponible (csv o xlsx)"}), 400
+    estado = request.args.get("estado", "todos")
+    filas = (fila_exportacion(m) for m in materiales_filtrados(estado, request.args.get("q", ""),
+                                                                request.args.get("operario", "")))
+    nombre = "materiales" if estado in ("", "todos") else f"materiales_{re.sub(r'[^a-z]+', '_', estado.lower())}"
+    return respuesta_exportacion(formato, filas, nombre)
 
-# ================== Exportar/Importar Materiales ==================
 @app.route('/admin/exportar_materiales')
 def exportar_materiales():
-    """Exportar base de datos de materiales a Excel"""
+    """Exportar la base de datos de materiales completa a Excel (o CSV con ?formato=csv)"""
     if current_role() != "admin":
         flash("Acceso denegado", "error")
         return redirect(url_for("home"))
-    
-    if not EXCEL_DISPONIBLE:
+    formato = (request.args.get("formato") or "xlsx").lower()
+    if formato == "xlsx" and not EXCEL_DISPONIBLE:
         flash("❌ Funcionalidad Excel no disponible. Instale openpyxl.", "error")
         return redirect('/admin')
-    
     try:
-        conn = sqlite3.connect(DB_MATERIALES)
-        cursor = conn.cursor()
-        
-        # Obtener todos los materiales con información completa
-        cursor.execute("""
-            SELECT 
-                id, codigo, ean, descripcion, caducidad, estado, 
-                operario_numero, fecha_asignacion, fecha_registro, fecha_registro
-            FROM materiales 
-            ORDER BY fecha_registro DESC
-        """)
-        
-        materiales = cursor.fetchall()
-        conn.close()
-        
-        # Crear archivo Excel en memoria
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Materiales"
-        
-        # Definir encabezados con estilo
-        encabezados = [
-            'ID', 'Código', 'EAN', 'Descripción', 'Caducidad', 'Estado',
-            'Operario', 'Asignado En', 'Creado En', 'Actualizado En'
-        ]
-        
-        # Escribir encabezados con formato
-        for col, encabezado in enumerate(encabezados, 1):
-            cell = ws.cell(row=1, column=col, value=encabezado)
-            cell.font = Font(bold=True, color="FFFFFF")
-            cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-            cell.alignment = Alignment(horizontal="center")
-        
-        # Escribir datos
-        for fila, material in enumerate(materiales, 2):
-            for col, valor in enumerate(material, 1):
-                ws.cell(row=fila, column=col, value=valor)
-        
-        # Ajustar ancho de columnas
-        columnas_ancho = [5, 12, 15, 30, 12, 12, 15, 18, 18, 18]
-        for col, ancho in enumerate(columnas_ancho, 1):
-            ws.column_dimensions[ws.cell(row=1, column=col).column_letter].width = ancho
-        
-        # Guardar en memoria
-        output = io.BytesIO()
-        wb.save(output)
-        output.seek(0)
-        
-        # Crear respuesta HTTP
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        response.headers['Content-Disposition'] = f'attachment; filename=materiales_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-        
-        flash(f"✅ Exportación Excel completada: {len(materiales)} materiales descargados", "success")
-        return response
-        
+        return respuesta_exportacion("csv" if formato == "csv" else "xlsx",
+                                     (fila_exportacion(m) for m in materiales_filtrados("todos")), "materiales_export")
     except Exception as e:
+        logger.error(f"Error en exportación: {e}")
         flash(f"❌ Error en exportación Excel: {str(e)}", "error")
         return redirect('/admin')
 
+# ================== Importación de materiales ==================
+# Importación por lotes desde CSV o Excel en tres pasos sobre una sola conexión:
+#   1. las filas se cargan con executemany en una tabla TEMP de preparación;
+#   2. se validan con un UPDATE por regla sobre toda la tabla (IMPORTACION_VALIDACIONES,
+#      en orden: la primera que falla queda como error de la fila);
+#   3. las válidas se fusionan en materiales con un INSERT ... ON CONFLICT.
+# Los pasos 2 y 3 van en la misma transacción BEGIN IMMEDIATE: lo validado contra la base
+# es lo que se escribe. Una celda vacía no cambia el valor que ya tiene el material.
+IMPORTACION_ESTADOS = ("precintado", "disponible", "gastado", "retirado", "escaneado")
+# Encabezados admitidos (en minúsculas) → columna de la tabla de preparación
+IMPORTACION_CAMPOS = {
+    "código": "codigo", "codigo": "codigo", "ean": "ean",
+    "descripción": "descripcion", "descripcion": "descripcion",
+    "caducidad": "caducidad", "estado": "estado", "operario": "operario",
+}
+_IMPORTACION_COLUMNAS = ("codigo", "caducidad", "ean", "descripcion", "estado", "operario")
+
+_SQL_IMPORTACION_TABLA = """
+    CREATE TEMP TABLE importacion_materiales (
+        fila INTEGER PRIMARY KEY,      -- nº de fila del archivo, para el informe
+        codigo TEXT,
+        caducidad_txt TEXT,            -- tal como viene; caducidad es la normalizada
+        ean TEXT,
+        descripcion TEXT,
+        estado TEXT,
+        operario_txt TEXT,             -- tal como viene; operario es "num - nombre"
+        caducidad TEXT,
+        operario TEXT,
+        existe INTEGER NOT NULL DEFAULT 0,
+        error TEXT
+    )"""
+
+# Columnas derivadas: fecha normalizada, operario con su nombre (como lo guarda asignar),
+# si el código ya existe y, sin descripción, la del catálogo para ese EAN
+_SQL_IMPORTACION_PREPARAR = """
+    UPDATE temp.importacion_materiales AS i SET
+        caducidad = NORMALIZAR_FECHA(caducidad_txt),
+        estado = LOWER(estado),
+        operario = (SELECT o.numero || ' - ' || o.nombre FROM op.operarios o
+                    WHERE o.numero = TRIM(CASE WHEN instr(i.operario_txt, ' - ') > 0
+                                               THEN substr(i.operario_txt, 1, instr(i.operario_txt, ' - ') - 1)
+                                               ELSE i.operario_txt END)),
+        existe = EXISTS (SELECT 1 FROM main.materiales m WHERE m.codigo = i.codigo),
+        descripcion = COALESCE(descripcion,
+            (SELECT e.descripcion FROM main.ean_descriptions e WHERE e.ean = i.ean),
+            (SELECT m.descripcion FROM main.materiales m WHERE m.ean = i.ean AND m.descripcion IS NOT NULL LIMIT 1))"""
+
+# (mensaje, condición de error): expresiones SQL sobre la fila i
+IMPORTACION_VALIDACIONES = (
+    ("'Código interno inválido (7 dígitos).'",
+     "i.codigo IS NULL OR i.codigo NOT GLOB '" + "[0-9]" * 7 + "'"),
+    ("'Código repetido en el archivo (fila ' || (SELECT MIN(d.fila) FROM temp.importacion_materiales d WHERE d.codigo = i.codigo) || ').'",
+     "EXISTS (SELECT 1 FROM temp.importacion_materiales d WHERE d.codigo = i.codigo AND d.fila < i.fila)"),
+    ("'Fecha de caducidad inválida: ' || i.caducidad_txt || '.'",
+     "i.caducidad_txt IS NOT NULL AND i.caducidad IS NULL"),
+    ("'Caducidad obligatoria para un material nuevo.'",
+     "NOT i.existe AND i.caducidad IS NULL"),
+    ("'EAN inválido (debe tener exactamente 13 dígitos).'",
+     "i.ean IS NOT NULL AND i.ean NOT GLOB '" + "[0-9]" * 13 + "'"),
+    ("'Descripción obligatoria para un material nuevo.'",
+     "NOT i.existe AND i.descripcion IS NULL"),
+    ("'Estado desconocido: ' || i.estado || '.'",
+     "i.estado IS NOT NULL AND i.estado NOT IN (" + ", ".join(f"'{e}'" for e in IMPORTACION_ESTADOS) + ")"),
+    ("'Operario inexistente: ' || i.operario_txt || '.'",
+     "i.operario_txt IS NOT NULL AND i.operario IS NULL"),
+    ("'EAN ' || i.ean || ' con otra descripción en la fila ' || (SELECT MIN(d.fila) FROM temp.importacion_materiales d WHERE d.ean = i.ean AND d.descripcion <> i.descripcion) || '.'",
+     "i.ean IS NOT NULL AND EXISTS (SELECT 1 FROM temp.importacion_materiales d WHERE d.ean = i.ean AND d.descripcion <> i.descripcion AND d.fila < i.fila)"),
+    ("'EAN ' || i.ean || ' ya existe con descripción ''' || (SELECT m.descripcion FROM main.materiales m WHERE m.ean = i.ean AND m.descripcion <> i.descripcion AND m.codigo <> i.codigo LIMIT 1) || '''. No se puede usar ''' || i.descripcion || '''.'",
+     "i.ean IS NOT NULL AND EXISTS (SELECT 1 FROM main.materiales m WHERE m.ean = i.ean AND m.descripcion <> i.descripcion AND m.codigo <> i.codigo)"),
+)
+
+# En los que ya existen, estado NULL = sin cambios (el INSERT siempre choca y manda el DO UPDATE).
+# Con operario y sin estado, un material nuevo queda disponible, como al asignarlo.
+_SQL_IMPORTACION_FUSIONAR = """
+    INSERT INTO main.materiales (codigo, caducidad, estado, operario_numero, ean, descripcion, fecha_asignacion)
+    SELECT codigo, caducidad,
+           CASE WHEN existe THEN estado
+                ELSE COALESCE(estado, CASE WHEN operario IS NOT NULL THEN 'disponible' ELSE :estado END) END,
+           operario, ean, descripcion,
+           CASE WHEN operario IS NOT NULL THEN datetime('now','localtime') END
+    FROM temp.importacion_materiales WHERE error IS NULL ORDER BY fila
+    ON CONFLICT(codigo) DO UPDATE SET
+        caducidad = COALESCE(excluded.caducidad, caducidad),
+        estado = COALESCE(excluded.estado, estado),
+        fecha_asignacion = CASE WHEN excluded.operario_numero IS NOT operario_numero
+                                     AND excluded.operario_numero IS NOT NULL
+                                THEN excluded.fecha_asignacion ELSE fecha_asignacion END,
+        operario_numero = COALESCE(excluded.operario_numero, operario_numero),
+        ean = COALESCE(excluded.ean, ean),
+        descripcion = COALESCE(excluded.descripcion, descripcion)"""
+
+_SQL_IMPORTACION_CATALOGO = """
+    INSERT INTO main.ean_descriptions (ean, descripcion)
+    SELECT ean, descripcion FROM temp.importacion_materiales
+    WHERE error IS NULL AND ean IS NOT NULL AND descripcion IS NOT NULL GROUP BY ean
+    ON CONFLICT(ean) DO UPDATE SET descripcion = excluded.descripcion, fecha_actualizacion = CURRENT_TIMESTAMP"""
+
+@dataclass
+class ResultadoImportacion:
+    insertados: int = 0
+    actualizados: int = 0
+    errores: List[dict] = field(default_factory=list)   # {"fila", "codigo", "error"} por fila rechazada
+
+def filas_con_encabezado(filas: Iterable, primera: int = 1) -> Iterable[tuple]:
+    """(fila, codigo, caducidad, ean, descripcion, estado, operario) a partir de filas de
+    celdas cuya primera fila son los encabezados (Código, EAN, Descripción...)."""
+    filas = iter(filas)
+    encabezados = next(filas, None) or []
+    columnas = [IMPORTACION_CAMPOS.get(hojas.texto_celda(e).lower()) for e in encabezados]
+    for n, celdas in enumerate(filas, start=primera + 1):
+        valores = dict.fromkeys(_IMPORTACION_COLUMNAS, "")
+        for columna, valor in zip(columnas, celdas):
+            if columna:
+                valores[columna] = hojas.texto_celda(valor)
+        if any(valores.values()):
+            yield (n, *valores.values())
+
+def filas_posicionales(filas: Iterable) -> Iterable[tuple]:
+    """Filas sin encabezado: código, caducidad, EAN, descripción (el CSV del panel de admin)."""
+    for n, celdas in enumerate(filas, start=1):
+        valores = [hojas.texto_celda(v) for v in celdas[:4]]
+        if any(valores):
+            yield (n, *valores, *[""] * (6 - len(valores)))
+
+def importar_filas_materiales(filas: Iterable[tuple], estado_por_defecto: str = "precintado",
+                              progreso=None) -> ResultadoImportacion:
+    """Valida e importa filas (fila, codigo, caducidad, ean, descripcion, estado, operario):
+    da de alta los códigos nuevos y actualiza los existentes. Las filas con error no se
+    importan y quedan en el informe; las demás sí.
+
+    progreso (el de un trabajo) se llama antes de escribir en materiales: es el último punto
+    en que la importación se puede cancelar sin dejar nada hecho."""
+    with get_db() as conn:
+        conn.execute("DROP TABLE IF EXISTS temp.importacion_materiales")
+        conn.execute(_SQL_IMPORTACION_TABLA)
+        try:
+            conn.executemany("""INSERT INTO temp.importacion_materiales
+                                (fila, codigo, caducidad_txt, ean, descripcion, estado, operario_txt)
+                                VALUES (?, NULLIF(TRIM(?),''), NULLIF(TRIM(?),''), NULLIF(TRIM(?),''),
+                                        NULLIF(TRIM(?),''), NULLIF(TRIM(?),''), NULLIF(TRIM(?),''))""", filas)
+            conn.execute("CREATE INDEX temp.idx_importacion_codigo ON importacion_materiales(codigo, fila)")
+            conn.execute("CREATE INDEX temp.idx_importacion_ean ON importacion_materiales(ean, descripcion, fila)")
+            conn.commit()   # la carga solo escribe en TEMP: no toma el bloqueo de materiales.db
+
+            if progreso:
+                progreso(mensaje="Validando y guardando", forzar=True)
+            pool_materiales().begin_immediate(conn)
+            conn.execute(_SQL_IMPORTACION_PREPARAR)
+            for mensaje, condicion in IMPORTACION_VALIDACIONES:
+                conn.execute(f"UPDATE temp.importacion_materiales AS i SET error = {mensaje} "
+                             f"WHERE error IS NULL AND ({condicion})")
+            insertados, actualizados = conn.execute("""
+                SELECT IFNULL(SUM(NOT existe), 0), IFNULL(SUM(existe), 0)
+                FROM temp.importacion_materiales WHERE error IS NULL""").fetchone()
+            conn.execute(_SQL_IMPORTACION_FUSIONAR, {"estado": estado_por_defecto})
+            conn.execute(_SQL_IMPORTACION_CATALOGO)
+            errores = [dict(r) for r in conn.execute("""
+                SELECT fila, codigo, error FROM temp.importacion_materiales
+                WHERE error IS NOT NULL ORDER BY fila""")]
+            conn.commit()
+        finally:
+            conn.rollback()
+            conn.execute("DROP TABLE IF EXISTS temp.importacion_materiales")
+    logger.info(f"Importación de materiales: {insertados} nuevos, {actualizados} actualizados, {len(errores)} errores")
+    return ResultadoImportacion(insertados, actualizados, errores)
+
+def flash_resultado_importacion(res: ResultadoImportacion, origen: str, max_errores: int = 5):
+    total = res.insertados + res.actualizados
+    if total:
+        mensaje = f"✅ Importación {origen} completada: {res.insertados} materiales nuevos, {res.actualizados} actualizados"
+        if res.errores:
+            mensaje += f" ({len(res.errores)} filas con errores)"
+        flash(mensaje, "success")
+    else:
+        flash("❌ No se importaron materiales", "error")
+    for e in res.errores[:max_errores]:
+        flash(f"⚠️ Fila {e['fila']}: {e['error']}", "warning" if total else "error")
+    if len(res.errores) > max_errores:
+        flash(f"... y {len(res.errores) - max_errores} errores más", "warning" if total else "error")
+
 @app.route('/admin/importar_materiales', methods=['POST'])
 def importar_materiales():
-    """Importar materiales desde archivo Excel o CSV"""
+    """Importar materiales desde archivo Excel o CSV.
+
+    Con Accept: application/json devuelve el informe completo (todas las filas con error)
+    en lugar de redirigir al panel con los primeros errores."""
+    quiere_json = request.accept_mimetypes.best_match(["text/html", "application/json"]) == "application/json"
+    def fallo(mensaje, status=400):
+        if quiere_json:
+            return jsonify({"error": mensaje}), status
+        flash(mensaje, 'error')
+        return redirect('/admin')
+
     if current_role() != "admin":
+        if quiere_json:
+            return jsonify({"error": "Acceso denegado"}), 403
         flash("Acceso denegado", "error")
         return redirect(url_for("home"))
     
     if 'archivo' not in request.files:
-        flash('No se seleccionó ningún archivo', 'error')
-        return redirect('/admin')
+        return fallo('No se seleccionó ningún archivo')
     
     archivo = request.files['archivo']
     if archivo.filename == '':
-        flash('No se seleccionó ningún archivo', 'error')
-        return redirect('/admin')
+        return fallo('No se seleccionó ningún archivo')
     
-    extension = archivo.filename.lower().split('.')[-1]
-    if extension not in ['csv', 'xlsx', 'xls']:
-        flash('Solo se permiten archivos CSV, XLS o XLSX', 'error')
-        return redirect('/admin')
+    extension = hojas.extension(archivo.filename)
+    if extension not in hojas.EXTENSIONES_CSV + hojas.EXTENSIONES_EXCEL:
+        return fallo('Solo se permiten archivos CSV o XLSX (guarda los .xls como .xlsx)')
+    if extension in hojas.EXTENSIONES_EXCEL and not EXCEL_DISPONIBLE:
+        return fallo("❌ Funcionalidad Excel no disponible. Instale openpyxl.", 501)
     
     try:
-        materiales_data = []
-        
-        if extension == 'csv':
-            # Leer CSV
-            contenido = archivo.read().decode('utf-8')
-            csv_reader = csv.DictReader(io.StringIO(contenido))
-            materiales_data = list(csv_reader)
-            
-        elif extension in ['xlsx', 'xls']:
-            # Leer Excel
-            if not EXCEL_DISPONIBLE:
-                flash("❌ Funcionalidad Excel no disponible. Instale openpyxl.", "error")
-                return redirect('/admin')
-            
-            # Guardar archivo temporalmente
-            temp_path = os.path.join(os.path.dirname(__file__), f"temp_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}")
-            archivo.save(temp_path)
-            
-            try:
-                wb = openpyxl.load_workbook(temp_path)
-                ws = wb.active
-                
-                # Obtener encabezados (primera fila)
-                encabezados = []
-                for col in range(1, ws.max_column + 1):
-                    valor = ws.cell(row=1, column=col).value
-                    if valor:
-                        encabezados.append(str(valor).strip())
-                    else:
-                        break
-                
-                # Leer datos
-                for fila in range(2, ws.max_row + 1):
-                    fila_data = {}
-                    tiene_datos = False
-                    
-                    for col, encabezado in enumerate(encabezados, 1):
-                        valor = ws.cell(row=fila, column=col).value
-                        if valor is not None:
-                            fila_data[encabezado] = str(valor).strip()
-                            tiene_datos = True
-                        else:
-                            fila_data[encabezado] = ''
-                    
-                    if tiene_datos:
-                        materiales_data.append(fila_data)
-                
-            finally:
-                # Limpiar archivo temporal
-                try:
-                    os.unlink(temp_path)
-                except:
-                    pass
-        
-        # Procesar datos
-        conn = sqlite3.connect(DB_MATERIALES)
-        cursor = conn.cursor()
-        
-        materiales_importados = 0
-        errores = []
-        
-        for fila_num, fila in enumerate(materiales_data, start=2):
-            try:
-                # Validar campos obligatorios
-                codigo = fila.get('Código', '').strip()
-                ean = fila.get('EAN', '').strip() 
-                descripcion = fila.get('Descripción', '').strip()
-                estado = fila.get('Estado', 'disponible').strip()
-                
-                if not codigo or not descripcion:
-                    errores.append(f"Fila {fila_num}: Código y Descripción son obligatorios")
-                    continue
-                
-                # Validar consistencia EAN-Descripción si hay EAN
-                if ean:
-                    valido, error_msg = validar_consistencia_ean_descripcion(ean, descripcion)
-                    if not valido:
-                        errores.append(f"Fila {fila_num}: {error_msg}")
-                        continue
-                
-                # Preparar datos
-                caducidad = fila.get('Caducidad', '').strip()
-                operario = fila.get('Operario', '').strip() or None
-                
-                # Insertar material
-                print(f"DEBUG: Insertando material {codigo} con operario_numero: {operario}")
-                cursor.execute("""
-                    INSERT INTO materiales 
-                    (codigo, ean, descripcion, caducidad, estado, operario_numero, fecha_registro)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    codigo, ean or None, descripcion, caducidad or None, estado, 
-                    operario, datetime.now().isoformat()
-                ))
-                
-                materiales_importados += 1
-                
-            except Exception as e:
-                errores.append(f"Fila {fila_num}: Error procesando - {str(e)}")
-        
-        conn.commit()
-        conn.close()
-        
-        # Mostrar resultados
-        if materiales_importados > 0:
-            tipo_archivo = "Excel" if extension in ['xlsx', 'xls'] else "CSV"
-            mensaje = f'✅ Importación {tipo_archivo} completada: {materiales_importados} materiales importados'
-            if errores:
-                mensaje += f' ({len(errores)} errores encontrados)'
-            flash(mensaje, 'success')
-            
-            # Mostrar errores si los hay (máximo 5)
-            if errores:
-                for error in errores[:5]:
-                    flash(f'⚠️ {error}', 'warning')
-                if len(errores) > 5:
-                    flash(f'... y {len(errores)-5} errores más', 'warning')
-        else:
-            flash('❌ No se importaron materiales', 'error')
-            for error in errores[:3]:
-                flash(f'🔥 {error}', 'error')
-    
+        # Las filas pasan del archivo subido a la tabla de preparación sin cargarlo entero
+        res = importar_filas_materiales(filas_con_encabezado(hojas.filas_archivo(archivo)),
+                                        estado_por_defecto="disponible")
     except Exception as e:
-        flash(f'❌ Error procesando archivo: {str(e)}', 'error')
+        logger.error(f"Error importando materiales: {e}")
+        return fallo(f'❌ Error procesando archivo: {str(e)}', 500)
     
+    if quiere_json:
+        return jsonify(asdict(res))
+    flash_resultado_importacion(res, "Excel" if extension in hojas.EXTENSIONES_EXCEL else "CSV")
     return redirect('/admin')
 
 @app.route('/admin/borrar_materiales', methods=['POST'])
@@ -1746,7 +1979,7 @@ def borrar_todos_materiales():
 def vista_estado(estado):
     if estado not in ["precintado","disponible","vence prox","caducado","en uso","retirado","gastado","escaneado"]:
         abort(404)
-    return render_template_string(tpl_estado(), estado=estado)
+    return render_template("estado.html", estado=estado)
 
 # ================== Navegación entre aplicaciones ==================
 @app.route("/switch/herramientas")
@@ -1755,6 +1988,413 @@ def switch_to_herramientas():
     session['app_origen'] = 'materiales'
     return redirect("http://localhost:5001")
 
+# ================== Comandos de materiales ==================
+# Cada transición del ciclo de vida (registrar, asignar, devolver, gastar, retirar) es un
+# comando: sus comprobaciones y su escritura van en una sola transacción BEGIN IMMEDIATE
+# sobre una conexión. Así dos terminales no pueden validar a la vez contra el mismo estado
+# y escribir los dos (p. ej. dos asignaciones del mismo EAN al mismo operario).
+#
+# Las reglas de cada transición están en TRANSICIONES: la lista de comprobaciones, en
+# orden, y las sentencias que la aplican. Llegan por el formulario de inicio, la cola sin
+# conexión de los terminales (POST /api/acciones), una a una en JSON (POST
+# /api/acciones/<accion>) y el modo lote (POST /api/acciones/lote); todas pasan por
+# aplicar_comando(). La importación de archivos va por su propio camino por lotes
+# (importar_filas_materiales), con sus validaciones expresadas en SQL.
+ACCIONES_ESCANEO = {
+    "asignar_directo": "asignar", "asignar": "asignar",
+    "devolver_rapido": "devolver", "devolver": "devolver",
+    "gastado_rapido": "gastar", "gastar": "gastar",
+    "retirado_rapido": "retirar", "retirar": "retirar",
+}
+MAX_ACCIONES_POR_ENVIO = 200
+DIAS_RETENER_ACCIONES = 30   # más que lo que un terminal puede pasar sin conexión
+
+@dataclass
+class Comando:
+    accion: str                              # registrar o una de ACCIONES_ESCANEO
+    codigo: str
+    operario_num: str = ""
+    confirmado: bool = False                 # asignar aunque venza pronto
+    ts_cliente: Optional[datetime] = None    # hora del escaneo (acciones reenviadas por la cola)
+    caducidad: str = ""                      # registrar
+    ean: str = ""
+    descripcion: str = ""
+    rol: str = ""                            # rol de quien la pide (cookie role); ver Transicion.roles
+
+@dataclass
+class _Ejecucion:
+    conn: sqlite3.Connection
+    cmd: Comando
+    transicion: "Transicion"
+    m: Optional[Material]                    # fila actual (None si el código no existe)
+    params: dict                             # parámetros de las sentencias; las reglas los completan
+
+# Reglas: devuelven (categoría, mensaje) para rechazar el comando o None si se cumple
+def _r_codigo_valido(e: _Ejecucion):
+    if not codigo_valido(e.cmd.codigo):
+        return "error", "Código interno inválido (7 dígitos)."
+
+def _r_existe(e: _Ejecucion):
+    if not e.m:
+        return "error", e.transicion.si_no_existe or e.transicion.fallo
+
+def _r_no_existe(e: _Ejecucion):
+    if e.m:
+        return "error", f"El código {e.cmd.codigo} ya existe. No se puede registrar."
+
+def _fecha_asignacion(m: Material) -> Optional[datetime]:
+    try:
+        return datetime.strptime((m.fecha_asignacion or "")[:19], "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+
+def _r_no_obsoleta(e: _Ejecucion):
+    # Acción reenviada desde la cola de un terminal: si el material se asignó después del
+    # escaneo no se aplica, para no deshacer lo que hizo otro terminal mientras este estaba
+    # sin conexión. Las asignaciones reenviadas quedan con la hora del escaneo.
+    ts = e.cmd.ts_cliente
+    e.params["fecha"] = ts.strftime("%Y-%m-%d %H:%M:%S") if ts else None
+    asignado = _fecha_asignacion(e.m) if (e.m and ts) else None
+    if asignado and asignado > ts:
+        return "error", f"No aplicado: el material {e.cmd.codigo} se asignó después del escaneo ({e.m.fecha_asignacion})."
+
+def _r_operario_obligatorio(e: _Ejecucion):
+    if not e.cmd.operario_num:
+        return "error", "Nº de operario obligatorio."
+
+def _r_no_caducado(e: _Ejecucion):
+    cad = parse_date(e.m.caducidad)
+    if cad and cad < date.today():
+        return "error", "No se puede asignar: material CADUCADO."
+
+def _r_vence_prox_confirmado(e: _Ejecucion):
+    cad = parse_date(e.m.caducidad)
+    if cad and cad <= date.today() + timedelta(days=AVISO_DIAS) and not e.cmd.confirmado:
+        return "warning", f"Atención: vence pronto ({e.m.caducidad}). Confirma para asignar."
+
+def _r_operario_existe(e: _Ejecucion):
+    nombre = get_operario_nombre(e.cmd.operario_num)
+    if not nombre:
+        return "error", "Operario inexistente. Añádelo primero."
+    e.params["operario"] = f"{e.cmd.operario_num} - {nombre}"
+
+def _r_sin_conflicto_ean(e: _Ejecucion):
+    # Mismo operario + mismo EAN (no gastados/retirados/escaneados). Las asignaciones de
+    # inicio guardan "num - nombre" y otras vías solo el número: valen ambas
+    if not e.m.ean:
+        return None
+    otro = e.conn.execute("""SELECT 1 FROM materiales
+                             WHERE ean=? AND (operario_numero=? OR operario_numero LIKE ? || ' - %')
+                               AND LOWER(IFNULL(estado,'')) NOT IN ('gastado', 'retirado', 'escaneado') AND codigo<>?
+                             LIMIT 1""",
+                          (e.m.ean, e.cmd.operario_num, e.cmd.operario_num, e.cmd.codigo)).fetchone()
+    if otro:
+        return "error", "No puedes asignarte este producto: ya tienes otro con el mismo EAN. Devuélvelo primero."
+
+def _r_ean_valido(e: _Ejecucion):
+    if e.cmd.ean and not ean_valido(e.cmd.ean):
+        return "error", "EAN inválido (debe tener exactamente 13 dígitos)."
+    e.params["ean"] = e.cmd.ean or None
+
+def _r_caducidad(e: _Ejecucion):
+    cad = normalize_date_human(e.cmd.caducidad)
+    fecha = parse_date(cad) if cad else None
+    if fecha and fecha < date.today():
+        return "error", "No se puede registrar: la fecha de caducidad ya ha vencido."
+    if not cad:
+        return "error", e.transicion.fallo
+    e.params["caducidad"] = cad
+
+def _r_descripcion(e: _Ejecucion):
+    # Con EAN manda la descripción del catálogo (o la de otro material con ese EAN); sin
+    # ninguna, la escrita es obligatoria
+    desc = e.cmd.descripcion
+    if e.cmd.ean:
+        r = e.conn.execute("""SELECT descripcion FROM ean_descriptions WHERE ean=:ean
+                              UNION ALL
+                              SELECT descripcion FROM materiales WHERE ean=:ean AND descripcion IS NOT NULL
+                              LIMIT 1""", {"ean": e.cmd.ean}).fetchone()
+        if r and r[0]:
+            desc = r[0]
+    if not desc:
+        return "error", e.transicion.fallo
+    e.params["descripcion"] = desc
+
+@dataclass(frozen=True)
+class Transicion:
+    roles: tuple                 # quién puede pedirla (aplicar_comando rechaza el resto)
+    reglas: tuple                # comprobaciones, en orden: la primera que falla decide el mensaje
+    sentencias: tuple            # la primera es la transición; las demás solo si esa cambió la fila
+    exito: str                   # mensajes con {codigo} y {operario}
+    fallo: str
+    si_no_existe: Optional[str] = None   # mensaje si el código no existe (por defecto, `fallo`)
+
+TRANSICIONES = {
+    "registrar": Transicion(
+        roles=("almacenero", "admin"),
+        reglas=(_r_codigo_valido, _r_ean_valido, _r_no_existe, _r_caducidad, _r_descripcion),
+        sentencias=(
+            """INSERT INTO materiales (codigo,caducidad,estado,operario_numero,ean,descripcion,fecha_asignacion)
+               VALUES (:codigo,:caducidad,'precintado',NULL,:ean,:descripcion,NULL)""",
+            """INSERT INTO ean_descriptions (ean, descripcion) SELECT :ean, :descripcion WHERE :ean IS NOT NULL
+               ON CONFLICT(ean) DO UPDATE SET descripcion=excluded.descripcion""",
+        ),
+        exito="Material {codigo} registrado (PRECINTADO).",
+        fallo="No se pudo registrar. Revisa datos (fecha inválida o descripción faltante)."),
+    "asignar": Transicion(
+        roles=("operario", "almacenero", "admin"),
+        reglas=(_r_codigo_valido, _r_operario_obligatorio, _r_existe, _r_no_obsoleta, _r_no_caducado,
+                _r_vence_prox_confirmado, _r_operario_existe, _r_sin_conflicto_ean),
+        sentencias=(
+            """UPDATE materiales SET operario_numero=:operario,
+                      fecha_asignacion=COALESCE(:fecha, datetime('now','localtime')),
+                      estado=CASE WHEN LOWER(IFNULL(estado,''))='precintado' THEN 'disponible' ELSE estado END
+               WHERE codigo=:codigo""",
+        ),
+        exito="Material {codigo} asignado a {operario}",
+        fallo="No se pudo asignar el material.",
+        si_no_existe="El código no existe. Regístralo primero."),
+    "devolver": Transicion(
+        roles=("almacenero", "admin"),
+        reglas=(_r_codigo_valido, _r_existe, _r_no_obsoleta),
+        sentencias=("UPDATE materiales SET operario_numero=NULL WHERE codigo=:codigo",),
+        exito="Material {codigo} devuelto.",
+        fallo="Error al devolver el material."),
+    "gastar": Transicion(
+        roles=("almacenero", "admin"),
+        reglas=(_r_codigo_valido, _r_existe, _r_no_obsoleta),
+        sentencias=("UPDATE materiales SET estado='gastado', operario_numero=NULL WHERE codigo=:codigo",),
+        exito="Material {codigo} marcado como gastado.",
+        fallo="Error al marcar como gastado."),
+    "retirar": Transicion(
+        roles=("almacenero", "admin"),
+        reglas=(_r_codigo_valido, _r_existe, _r_no_obsoleta),
+        sentencias=("UPDATE materiales SET estado='retirado', operario_numero=NULL WHERE codigo=:codigo",),
+        exito="Material {codigo} marcado como retirado.",
+        fallo="Error al marcar como retirado."),
+}
+
+def transicion_de(accion: str) -> Optional[Transicion]:
+    return TRANSICIONES.get("registrar" if accion == "registrar" else ACCIONES_ESCANEO.get(accion, ""))
+
+ACCESO_DENEGADO = "Acceso denegado: identifícate con un usuario que tenga permiso para esta acción."
+
+def permitida(accion: str, rol: str) -> bool:
+    """True si el rol puede pedir la acción (False también si la acción no existe)."""
+    t = transicion_de(accion)
+    return t is not None and rol in t.roles
+
+@contextmanager
+def transaccion_comandos():
+    """Conexión con la transacción de escritura ya abierta (BEGIN IMMEDIATE): las lecturas de
+    las reglas ven el mismo estado que la escritura. Commit al salir, rollback si hay excepción."""
+    with get_db() as conn:
+        pool_materiales().begin_immediate(conn)
+        yield conn
+
+def aplicar_comando(conn, cmd: Comando) -> tuple[str, str]:
+    """Comprueba y aplica un comando dentro de la transacción del llamante.
+
+    Devuelve (categoría, mensaje) como los flash del formulario de inicio: solo con
+    'success' ha cambiado algo."""
+    t = transicion_de(cmd.accion)
+    if t is None:
+        return "error", "Acción desconocida."
+    if not permitida(cmd.accion, cmd.rol):
+        return "error", ACCESO_DENEGADO
+    r = conn.execute(f"SELECT {_COLS_MATERIAL} FROM materiales_operario WHERE codigo=?", (cmd.codigo,)).fetchone()
+    e = _Ejecucion(conn, cmd, t, row_to_material(r) if r else None, {"codigo": cmd.codigo})
+    for regla in t.reglas:
+        rechazo = regla(e)
+        if rechazo:
+            return rechazo
+    if conn.execute(t.sentencias[0], e.params).rowcount <= 0:
+        return "error", t.fallo
+    for sql in t.sentencias[1:]:
+        conn.execute(sql, e.params)
+    return "success", t.exito.format(codigo=cmd.codigo, operario=e.params.get("operario", ""))
+
+# Claves de materiales_contadores que suman en otro contador de resumen_contadores()
+_CONTADOR_DE_CLAVE = {"en uso caducado": "caducado", "en uso vence prox": "vence prox"}
+
+def _claves_contador(conn, codigo: str) -> List[str]:
+    """Claves de materiales_contadores en las que cuenta ahora el material."""
+    return [r[0] for r in conn.execute(f"""
+        SELECT c.clave FROM materiales m JOIN materiales_contadores c ON c.clave IN ({sql_claves_contador('m')})
+        WHERE m.codigo=? AND {sql_cuenta_contador('m')}""", (codigo,))]
+
+def deltas_contadores(antes: List[str], despues: List[str]) -> dict:
+    """Cambio de cada contador de /api/contadores entre dos listas de claves ({} si ninguno)."""
+    deltas = {}
+    for claves, signo in ((antes, -1), (despues, 1)):
+        for clave in claves:
+            k = _CONTADOR_DE_CLAVE.get(clave, clave)
+            deltas[k] = deltas.get(k, 0) + signo
+    return {k: v for k, v in deltas.items() if v}
+
+def _resultado_accion(conn, codigo: str, categoria: str, mensaje: str, antes: Optional[List[str]] = None) -> dict:
+    """Resultado en JSON con la fila actual del material y, si se da `antes`, los deltas."""
+    r = conn.execute(f"SELECT {_COLS_MATERIAL} FROM materiales_operario WHERE codigo=?", (codigo,)).fetchone()
+    ok = categoria == "success"
+    return {"codigo": codigo, "ok": ok, "categoria": categoria, "mensaje": mensaje,
+            "material": material_json(row_to_material(r)) if r else None,
+            "contadores": deltas_contadores(antes, _claves_contador(conn, codigo)) if ok and antes is not None else {}}
+
+def ejecutar_comando(conn, cmd: Comando) -> dict:
+    """aplicar_comando() más lo que la página necesita para repintarse sin recargar: la fila
+    actualizada del material y cuánto ha cambiado cada contador."""
+    antes = _claves_contador(conn, cmd.codigo)
+    categoria, mensaje = aplicar_comando(conn, cmd)
+    return _resultado_accion(conn, cmd.codigo, categoria, mensaje, antes)
+
+def comando_desde(datos: dict, accion: str) -> Comando:
+    """Comando a partir de un JSON o formulario con los campos del formulario de inicio y el
+    rol de la petición en curso."""
+    campo = lambda k: str(datos.get(k) or "").strip()
+    return Comando(accion=accion, codigo=campo("codigo"), operario_num=campo("operario_num"),
+                   confirmado=datos.get("confirmado") in (True, 1, "1", "true"),
+                   ts_cliente=_ts_cliente(datos.get("ts")), caducidad=campo("caducidad"),
+                   ean=campo("ean"), descripcion=campo("descripcion"), rol=current_role())
+
+def _ts_cliente(valor) -> Optional[datetime]:
+    """Hora del escaneo enviada por el terminal (ms desde epoch), nunca posterior a la del servidor."""
+    try:
+        ts = datetime.fromtimestamp(float(valor) / 1000)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+    return min(ts, datetime.now())
+
+def _resultado_denegado(codigo: str) -> dict:
+    """Resultado de una acción que el rol de la petición no puede pedir (no se aplica)."""
+    return {"codigo": codigo, "ok": False, "categoria": "error", "mensaje": ACCESO_DENEGADO,
+            "material": None, "contadores": {}, "denegada": True, "error": ACCESO_DENEGADO}
+
+def _accion_con_clave(a: dict, accion: str) -> dict:
+    """Aplica una acción en su propia transacción, una sola vez por clave si trae "clave".
+
+    Solo se guarda bajo la clave un resultado definitivo (aplicada o rechazada); un aviso
+    que pide confirmación no, porque el terminal la reenvía confirmada con otra clave."""
+    clave = str(a.get("clave") or "").strip()[:64]
+    cmd = comando_desde(a, accion)
+    with transaccion_comandos() as conn:
+        previa = clave and conn.execute("SELECT categoria, mensaje FROM acciones_cliente WHERE clave=?", (clave,)).fetchone()
+        if previa:
+            res = _resultado_accion(conn, cmd.codigo, previa["categoria"], previa["mensaje"])
+        else:
+            res = ejecutar_comando(conn, cmd)
+            if clave and res["categoria"] in ("success", "error"):
+                ts = cmd.ts_cliente
+                conn.execute("""INSERT INTO acciones_cliente (clave, accion, codigo, ts_cliente, categoria, mensaje)
+                                VALUES (?,?,?,?,?,?)""",
+                             (clave, accion, cmd.codigo, ts.isoformat(sep=" ", timespec="seconds") if ts else None,
+                              res["categoria"], res["mensaje"]))
+    res.update(clave=clave or None, duplicada=bool(previa))
+    return res
+
+@app.post("/api/acciones")
+def api_acciones():
+    """Aplica en orden las acciones encoladas por un terminal, cada clave una sola vez.
+
+    Cuerpo: {"acciones": [{"clave", "accion", "codigo", "operario_num", "confirmado", "ts"}]}
+    con la clave generada por el terminal y ts la hora del escaneo. Cada acción va en su
+    propia transacción junto con el registro de su clave: si la respuesta se pierde y el
+    terminal reenvía, las ya aplicadas devuelven el resultado guardado (duplicada) sin
+    repetirse. Una acción rechazada (caducado, operario inexistente...) también queda
+    registrada: su resultado es definitivo. Las que piden confirmación (categoría
+    'warning') no se aplican ni se registran. 403, sin aplicar ninguna, si el rol de la
+    petición no puede pedir alguna: siguen en la cola hasta que alguien se identifique."""
+    datos = request.get_json(silent=True) or {}
+    acciones = datos.get("acciones") if isinstance(datos, dict) else None
+    if not isinstance(acciones, list):
+        return jsonify({"error": "Se esperaba {\"acciones\": [...]}"}), 400
+    if len(acciones) > MAX_ACCIONES_POR_ENVIO:
+        return jsonify({"error": f"Como máximo {MAX_ACCIONES_POR_ENVIO} acciones por envío"}), 413
+    rol = current_role()
+    pedidas = {str(a.get("accion") or "") for a in acciones if isinstance(a, dict)}
+    if any(not permitida(accion, rol) for accion in pedidas if accion in ACCIONES_ESCANEO):
+        return jsonify({"error": ACCESO_DENEGADO}), 403
+    asegurar_estados_al_dia()
+    resultados = []
+    for a in acciones:
+        a = a if isinstance(a, dict) else {}
+        if not str(a.get("clave") or "").strip():
+            resultados.append({"clave": None, "ok": False, "categoria": "error",
+                               "mensaje": "Acción sin clave: no se aplica.", "material": None, "contadores": {}})
+            continue
+        resultados.append(_accion_con_clave(a, str(a.get("accion") or "")))
+    return jsonify({"resultados": resultados})
+
+@app.post("/api/acciones/lote")
+def api_acciones_lote():
+    """Aplica una lista de acciones de escaneo (modo lote de inicio) en una sola transacción.
+
+    Cuerpo: {"acciones": [{"accion", "codigo", "operario_num", "confirmado"}], "atomico": false}.
+    Se validan y aplican en orden con las reglas del formulario, y cada una ve el efecto de
+    las anteriores (dos asignaciones del mismo EAN al mismo operario chocan dentro del lote).
+    Las rechazadas no cambian nada; con atomico=true basta una rechazada para que no se
+    aplique ninguna. Devuelve el resultado de cada acción y si el lote quedó aplicado.
+    403, sin aplicar nada, si el rol de la petición no puede pedir alguna de ellas."""
+    datos = request.get_json(silent=True) or {}
+    acciones = datos.get("acciones") if isinstance(datos, dict) else None
+    if not isinstance(acciones, list) or not acciones:
+        return jsonify({"error": "Se esperaba {\"acciones\": [...]} con al menos una acción"}), 400
+    if len(acciones) > MAX_ACCIONES_POR_ENVIO:
+        return jsonify({"error": f"Como máximo {MAX_ACCIONES_POR_ENVIO} acciones por lote"}), 413
+    rol = current_role()
+    pedidas = {str(a.get("accion") or "") for a in acciones if isinstance(a, dict)}
+    if any(not permitida(accion, rol) for accion in pedidas if accion in ACCIONES_ESCANEO):
+        return jsonify({"error": ACCESO_DENEGADO}), 403
+    atomico = bool(datos.get("atomico"))
+    asegurar_estados_al_dia()
+    resultados = []
+    with transaccion_comandos() as conn:
+        for a in acciones:
+            a = a if isinstance(a, dict) else {}
+            accion = str(a.get("accion") or "")
+            # Solo acciones de escaneo; la hora del escaneo no aplica (el lote se envía en el momento)
+            cmd = comando_desde(dict(a, ts=None), accion if accion in ACCIONES_ESCANEO else "")
+            resultados.append(ejecutar_comando(conn, cmd))
+        aplicado = not (atomico and any(not r["ok"] for r in resultados))
+        if not aplicado:
+            conn.rollback()
+    for r in resultados:
+        r["aplicada"] = aplicado and r["ok"]
+        if not aplicado:
+            r.update(material=None, contadores={})
+    return jsonify({"resultados": resultados, "aplicado": aplicado,
+                    "aplicadas": sum(r["aplicada"] for r in resultados),
+                    "rechazadas": sum(not r["ok"] for r in resultados)})
+
+@app.post("/api/acciones/<accion>")
+def api_accion(accion):
+    """Una acción de inicio en JSON, sin redirección ni repintar la página: devuelve el
+    resultado, la fila actualizada del material y el cambio de cada contador.
+
+    accion: registrar o una de escaneo (asignar, devolver, gastar, retirar). Acepta JSON o
+    formulario con los campos del formulario de inicio; las de escaneo admiten además
+    "clave" y "ts" como en /api/acciones, así un reintento no las aplica dos veces.
+    403 si el rol de la petición no puede pedirla."""
+    if transicion_de(accion) is None:
+        abort(404)
+    datos = request.get_json(silent=True)
+    if not isinstance(datos, dict):
+        datos = request.form.to_dict()
+    if not permitida(accion, current_role()):
+        return jsonify(_resultado_denegado(str(datos.get("codigo") or "").strip())), 403
+    asegurar_estados_al_dia()
+    if accion in ACCIONES_ESCANEO:
+        return jsonify(_accion_con_clave(datos, accion))
+    with transaccion_comandos() as conn:
+        return jsonify(ejecutar_comando(conn, comando_desde(datos, "registrar")))
+
+def podar_acciones_cliente():
+    """Olvida las claves de acciones recibidas hace más de DIAS_RETENER_ACCIONES días."""
+    with get_db() as conn:
+        cur = conn.execute("DELETE FROM acciones_cliente WHERE recibida_en < datetime('now','localtime',?)",
+                           (f"-{DIAS_RETENER_ACCIONES} days",))
+    if cur.rowcount:
+        logger.info(f"Acciones de cliente podadas: {cur.rowcount}")
+
 # ================== Home ==================
 @app.route("/", methods=["GET","POST"])
 def home():
@@ -1763,2955 +2403,37 @@ def home():
 
     if request.method=="POST":
         accion=request.form.get("accion","")
-        codigo=(request.form.get("codigo") or "").strip()
-
-        # Registrar
-        if accion=="registrar":
-            if not require_role(["almacenero","admin"]): return redirect(url_for("home"))
-            cad_raw=(request.form.get("caducidad") or "").strip()
-            ean=(request.form.get("ean") or "").strip()
-            desc=(request.form.get("descripcion") or "").strip()
-            if not codigo_valido(codigo):
-                flash("Código interno inválido (7 dígitos).","error")
-                return redirect(url_for("home"))
-            elif ean and not ean_valido(ean):
-                flash("EAN inválido (debe tener exactamente 13 dígitos).","error")
-                return redirect(url_for("home"))
-            elif get_material(codigo):  # Verificación de duplicado
-                flash(f"El código {codigo} ya existe. No se puede registrar.","error")
-                return redirect(url_for("home"))
-            else:
-                # Validar fecha de caducidad antes de intentar insertar
-                cad_normalizada = normalize_date_human(cad_raw)
-                if cad_normalizada:
-                    fecha_cad = parse_date(cad_normalizada)
-                    if fecha_cad and fecha_cad < date.today():
-                        flash("No se puede registrar: la fecha de caducidad ya ha vencido.","error")
-                        return redirect(url_for("home"))
-                
-                if insert_material(codigo, cad_raw, ean, desc):
-                    flash(f"Material {codigo} registrado (PRECINTADO).","success")
-                    return redirect(url_for("home"))
-                else:
-                    flash("No se pudo registrar. Revisa datos (fecha inválida o descripción faltante).","error")
-                    return redirect(url_for("home"))
-
-        # Asignar directo con restricciones
-        elif accion=="asignar_directo":
-            if not require_role(["operario","almacenero","admin"]): return redirect(url_for("home"))
-            oper_num=(request.form.get("operario_num") or "").strip()
-            confirmado=(request.form.get("confirmado") or "")=="1"
-            if not codigo_valido(codigo):
-                flash("Código interno inválido (7 dígitos).","error")
-            elif not oper_num:
-                flash("Nº de operario obligatorio.","error")
-            else:
-                m=get_material(codigo)
-                if not m:
-                    flash("El código no existe. Regístralo primero.","error")
-                else:
-                    cad=parse_date(m.caducidad); hoy=date.today()
-                    caducado = cad<hoy if cad else False
-                    vence_prox = (not caducado) and (cad and cad<=hoy+timedelta(days=AVISO_DIAS))
-                    if caducado:
-                        flash("No se puede asignar: material CADUCADO.","error"); return redirect(url_for("home"))
-                    if vence_prox and not confirmado:
-                        flash(f"Atención: vence pronto ({m.caducidad}). Confirma para asignar.","warning"); return redirect(url_for("home"))
-
-                    nombre=get_operario_nombre(oper_num)
-                    if not nombre:
-                        flash("Operario inexistente. Añádelo primero.","error"); return redirect(url_for("home"))
-
-                    # Restricción: mismo operario + mismo EAN (no gastados/retirados/escaneados)
-                    if m.ean:
-                        with get_db() as conn:
-                            c=conn.cursor()
-                            c.execute("""SELECT COUNT(1) FROM materiales 
-                                         WHERE ean=? AND operario_numero=? AND LOWER(IFNULL(estado,'')) NOT IN ('gastado', 'retirado', 'escaneado') AND codigo<>?""",
-                                      (m.ean, oper_num, codigo))
-                            cnt=c.fetchone()[0]
-                        if cnt>0:
-                            flash("No puedes asignarte este producto: ya tienes otro con el mismo EAN. Devuélvelo primero.", "error")
-                            return redirect(url_for("home"))
-
-                    if update_operario(codigo, f"{oper_num} - {nombre}"):
-                        set_estado_disponible_si_precintado(codigo)
-                        flash(f"Material {codigo} asignado a {oper_num} - {nombre}", "success")
-                    else:
-                        flash("No se pudo asignar el material.","error")
-            return redirect(url_for("home"))
 
-        # Devolver
-        elif accion in ("devolver_rapido","devolver"):
-            if not require_role(["almacenero","admin"]): return redirect(url_for("home"))
-            if not codigo_valido(codigo):
-                flash("Código interno inválido (7 dígitos).","error")
-            elif devolver_material(codigo):
-                flash(f"Material {codigo} devuelto.","success")
-            else:
-                flash("Error al devolver el material.","error")
+        # Registrar / asignar / devolver / gastar / retirar: un comando en una transacción
+        # (aplicar_comando rechaza el rol que no puede pedirla)
+        if transicion_de(accion) is not None:
+            with transaccion_comandos() as conn:
+                categoria, mensaje = aplicar_comando(conn, comando_desde(request.form, accion))
+            flash(mensaje, categoria)
             return redirect(url_for("home"))
 
-        # Gastado
-        elif accion in ("gastado_rapido","gastar"):
-            if not require_role(["almacenero","admin"]): return redirect(url_for("home"))
-            if not codigo_valido(codigo):
-                flash("Código interno inválido (7 dígitos).","error")
-            elif gastar_material(codigo):
-                flash(f"Material {codigo} marcado como gastado.","success")
-            else:
-                flash("Error al marcar como gastado.","error")
-            return redirect(url_for("home"))
-
-        # Retirado
-        elif accion in ("retirado_rapido","retirar"):
-            if not require_role(["almacenero","admin"]): return redirect(url_for("home"))
-            if not codigo_valido(codigo):
-                flash("Código interno inválido (7 dígitos).","error")
-            elif retirar_material(codigo):
-                flash(f"Material {codigo} marcado como retirado.","success")
-            else:
-                flash("Error al marcar como retirado.","error")
-            return redirect(url_for("home"))
-
-    return render_template_string(tpl_home(), role=role)
+    return render_template("home.html", role=role)
 
 # ================== Templates ==================
-def tpl_login():
-    return """
-<!doctype html><html><head><meta charset="utf-8"><title>Login</title>
-<style>
-body{font-family:Segoe UI,Roboto,Arial,sans-serif;background:#f8f9fa;margin:0;padding:40px}
-.card{max-width:480px;margin:0 auto;background:#fff;border-radius:12px;box-shadow:0 2px 10px rgba(0,0,0,.08);padding:20px}
-h1{text-align:center;margin:0 0 12px}
-label{display:block;margin-top:8px}
-select,input,button{width:100%;padding:12px;border:1px solid #ced4da;border-radius:10px;font-size:16px}
-button{background:#007bff;border-color:#007bff;color:#fff;margin-top:12px;cursor:pointer}
-button:hover{background:#0069d9}
-.alert{padding:10px;border-radius:8px;margin:10px 0}
-.alert-error{background:#f8d7da;border:1px solid #f5c6cb;color:#721c24}
-.small{color:#6c757d;text-align:center}
-</style></head><body>
-<div class="card">
-  <h1>🔒 Acceso</h1>
-  {% with messages = get_flashed_messages(with_categories=true) %}
-    {% if messages %}{% for cat,msg in messages %}
-      {% if cat == 'error' %}
-        <script>
-          document.addEventListener('DOMContentLoaded', function() {
-            mostrarDialogoError('{{ msg|e }}');
-          });
-        </script>
-      {% else %}
-        <div class="alert alert-{{ cat }}">{{ msg }}</div>
-      {% endif %}
-    {% endfor %}{% endif %}
-  {% endwith %}
-  
-  <script>
-    function mostrarDialogoError(mensaje) {
-        const overlay = document.createElement('div');
-        overlay.id = 'error-dialog-overlay';
-        overlay.style.cssText = `
-            position: fixed;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            background: rgba(0,0,0,0.5);
-            z-index: 10000;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-        `;
-        
-        const dialog = document.createElement('div');
-        dialog.style.cssText = `
-            background: white;
-            padding: 20px;
-            border-radius: 10px;
-            box-shadow: 0 4px 8px rgba(0,0,0,0.3);
-            max-width: 400px;
-            text-align: center;
-            font-family: inherit;
-        `;
-        
-        dialog.innerHTML = `
-            <div style="color: #721c24; font-size: 18px; margin-bottom: 15px;">
-                ❌ Error
-            </div>
-            <div style="color: #721c24; margin-bottom: 20px; line-height: 1.4;">
-                ${mensaje}
-            </div>
-            <button id="error-dialog-btn" onclick="cerrarDialogoError()" style="
-                background: #dc3545;
-                color: white;
-                border: none;
-                padding: 10px 20px;
-                border-radius: 5px;
-                cursor: pointer;
-                font-size: 14px;
-            ">Aceptar</button>
-        `;
-        
-        overlay.appendChild(dialog);
-        document.body.appendChild(overlay);
-        
-        // Enfocar el botón y añadir evento de teclado
-        const button = document.getElementById('error-dialog-btn');
-        button.focus();
-        
-        // Cerrar con Enter o Escape
-        const handleKeydown = (e) => {
-            if (e.key === 'Enter' || e.key === 'Escape') {
-                cerrarDialogoError();
-                document.removeEventListener('keydown', handleKeydown);
-            }
-        };
-        
-        document.addEventListener('keydown', handleKeydown);
-    }
-
-    function cerrarDialogoError() {
-        const overlay = document.getElementById('error-dialog-overlay');
-        if (overlay) {
-            overlay.remove();
-        }
-    }
-  </script>
-  
-  <form method="POST">
-    <label>Número de Operario</label>
-    <input type="text" name="numero" placeholder="Ej: 999999, US4281, US272..." required autofocus>
-    <button type="submit">Entrar</button>
-  </form>
-  <div class="small" style="margin-top: 15px; padding: 10px; background: #e7f3ff; border-radius: 8px;">
-    <strong>Acceso:</strong><br>
-    • <strong>999999</strong> o <strong>US4281</strong> (Administrador)<br>
-    • <strong>Almaceneros:</strong> US272, US25013<br>
-    • <strong>Operarios:</strong> Usar número de tarjeta
-</div>
-</div>
-</body></html>
-"""
-
-def tpl_admin():
-    return """<!doctype html><html lang="es"><head>
-<meta charset="utf-8"><title>Admin – Gestión de Materiales</title>
-<meta name="viewport" content="width=device-width,initial-scale=1">
-<style>
-*{box-sizing:border-box}
-body{font-family:'Segoe UI',system-ui,sans-serif;margin:0;background:#f1f5f9;color:#1e293b;min-height:100vh}
-.topbar{background:#0f172a;color:#fff;padding:0 24px;height:54px;display:flex;align-items:center;gap:12px;position:sticky;top:0;z-index:200;box-shadow:0 2px 12px rgba(0,0,0,.3)}
-.topbar-logo{font-size:16px;font-weight:700;flex:1;color:#f8fafc;letter-spacing:-.2px}
-.topbar-logo em{color:#60a5fa;font-style:normal}
-.topbar a{color:#94a3b8;text-decoration:none;padding:6px 14px;border-radius:6px;font-size:13px;font-weight:500;transition:background .15s,color .15s}
-.topbar a:hover{background:rgba(255,255,255,.12);color:#f8fafc}
-.page{padding:20px 24px;max-width:1900px;margin:0 auto}
-.alert{padding:12px 16px;border-radius:10px;margin-bottom:16px;font-size:13px}
-.alert-success{background:#f0fdf4;border:1px solid #bbf7d0;color:#166534}
-.alert-error{background:#fef2f2;border:1px solid #fecaca;color:#991b1b}
-.card{background:#fff;border-radius:14px;box-shadow:0 1px 4px rgba(0,0,0,.07),0 2px 12px rgba(0,0,0,.04);padding:22px;margin-bottom:20px}
-.card-head{display:flex;align-items:center;justify-content:space-between;padding-bottom:14px;margin-bottom:16px;border-bottom:1px solid #f1f5f9;gap:12px}
-.card-title{font-size:15px;font-weight:700;color:#0f172a;display:flex;align-items:center;gap:8px;margin:0;flex-shrink:0}
-.tiles{display:grid;grid-template-columns:repeat(auto-fill,minmax(200px,1fr));gap:16px;margin-bottom:20px}
-.tile{background:#fff;border-radius:14px;padding:18px 16px;box-shadow:0 1px 4px rgba(0,0,0,.07);display:flex;flex-direction:column;gap:10px;border-top:3px solid #e2e8f0}
-.tile.amber{border-top-color:#f59e0b}.tile.cyan{border-top-color:#06b6d4}
-.tile.emerald{border-top-color:#10b981}.tile.rose{border-top-color:#f43f5e}.tile.indigo{border-top-color:#6366f1}.tile.excel{border-top-color:#217346}
-.tile-title{font-size:13px;font-weight:700;color:#1e293b}
-.tile-desc{font-size:11px;color:#94a3b8;line-height:1.5;flex:1}
-.row2{display:grid;grid-template-columns:3fr 2fr;gap:20px;margin-bottom:20px;align-items:start}
-.btn{display:inline-flex;align-items:center;gap:6px;padding:8px 16px;border-radius:8px;font-size:13px;font-weight:600;cursor:pointer;border:none;text-decoration:none;line-height:1.2;transition:filter .12s;white-space:nowrap}
-.btn:hover{filter:brightness(.9)}
-.btn-primary{background:#3b82f6;color:#fff}.btn-success{background:#22c55e;color:#fff}
-.btn-warning{background:#f59e0b;color:#fff}.btn-danger{background:#ef4444;color:#fff}
-.btn-info{background:#06b6d4;color:#fff}.btn-secondary{background:#64748b;color:#fff}
-.btn-ghost{background:#fff;border:1.5px solid #e2e8f0;color:#475569}
-.btn-ghost:hover{background:#f8fafc}
-.btn-sm{padding:6px 12px;font-size:12px}.btn-full{width:100%;justify-content:center}
-.btn-row{display:flex;gap:8px;flex-wrap:wrap;align-items:center}
-.fg{margin-bottom:12px}
-.fg label{display:block;font-size:12px;font-weight:600;color:#374151;margin-bottom:4px}
-.fg input,.fg select{width:100%;padding:9px 12px;border:1.5px solid #e2e8f0;border-radius:8px;font-size:13px;font-family:inherit;background:#fafafa;color:#1e293b;transition:border .15s}
-.fg input:focus,.fg select:focus{outline:none;border-color:#3b82f6;background:#fff}
-input[type=file]{padding:5px 8px;background:#fafafa;border:1.5px solid #e2e8f0;border-radius:8px;font-size:12px;width:100%}
-.info-box{background:#f8fafc;border-left:3px solid #3b82f6;padding:10px 14px;border-radius:0 8px 8px 0;font-size:12px;color:#475569;line-height:1.7;margin-top:8px}
-.info-box.danger{border-left-color:#ef4444;background:#fef2f2;color:#7f1d1d}
-details>summary{cursor:pointer;font-size:12px;color:#3b82f6;font-weight:600;padding:4px 0;user-select:none}
-details[open]>summary{color:#1d4ed8}
-.code-block{background:#f8fafc;border:1px solid #e2e8f0;border-radius:6px;padding:12px;font-family:monospace;font-size:11px;color:#475569;line-height:1.8;margin-top:8px}
-.table-wrap{border:1px solid #f1f5f9;border-radius:10px;overflow:hidden}
-table{width:100%;border-collapse:collapse;font-size:13px}
-th{background:#f8fafc;color:#64748b;font-size:11px;font-weight:600;text-transform:uppercase;letter-spacing:.4px;padding:10px 12px;border-bottom:2px solid #e2e8f0;text-align:left;white-space:nowrap}
-td{padding:10px 12px;border-bottom:1px solid #f8fafc;vertical-align:middle}
-tr:last-child td{border-bottom:none}
-tr:hover td{background:#fafcff}
-code{background:#f1f5f9;color:#475569;padding:2px 6px;border-radius:4px;font-family:monospace;font-size:11px}
-.badge{display:inline-block;padding:3px 10px;border-radius:99px;font-size:11px;font-weight:600}
-.badge-ok{background:#dcfce7;color:#166534}.badge-warn{background:#fee2e2;color:#991b1b}
-.badge-blue{background:#dbeafe;color:#1e40af}
-.badge-red{background:#fee2e2;color:#991b1b}.badge-orange{background:#ffedd5;color:#9a3412}
-.danger-zone{border:1.5px solid #fca5a5;border-radius:10px;background:#fef2f2;padding:18px;margin-top:16px}
-.danger-zone-title{font-size:13px;font-weight:700;color:#991b1b;margin:0 0 8px}
-.gh-card{background:linear-gradient(135deg,#0f172a,#1e3a5f);color:#f8fafc;border-radius:14px;padding:22px;margin-bottom:20px}
-.gh-card p{font-size:12px;color:#94a3b8;margin:6px 0 14px}
-.modal-ov{display:none;position:fixed;inset:0;background:rgba(15,23,42,.55);z-index:500}
-.modal-ov .modal-box{position:absolute;top:50%;left:50%;transform:translate(-50%,-50%);background:#fff;border-radius:16px;padding:28px;max-width:500px;width:92%;box-shadow:0 20px 60px rgba(0,0,0,.2)}
-.modal-ov .modal-box h3{font-size:16px;font-weight:700;margin:0 0 20px;color:#0f172a}
-hr.div{border:none;border-top:1px solid #f1f5f9;margin:16px 0}
-</style></head><body>
-
-<nav class="topbar">
-  <span class="topbar-logo">⚙️ Panel de <em>Administración</em></span>
-  <a href="{{ url_for('home') }}">← Inicio</a>
-  <a href="{{ url_for('logout') }}">Cerrar sesión</a>
-</nav>
-
-<main class="page">
-  {% with messages = get_flashed_messages(with_categories=true) %}
-    {% if messages %}{% for cat,msg in messages %}
-      {% if cat == 'error' %}
-        <script>document.addEventListener('DOMContentLoaded',function(){mostrarDialogoError('{{ msg|e }}');});</script>
-      {% else %}
-        <div class="alert alert-{{ cat }}">{{ msg }}</div>
-      {% endif %}
-    {% endfor %}{% endif %}
-  {% endwith %}
-
-  <script>
-    function mostrarDialogoError(mensaje) {
-        const overlay = document.createElement('div');
-        overlay.id = 'error-dialog-overlay';
-        overlay.style.cssText = `
-            position: fixed;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            background: rgba(0,0,0,0.5);
-            z-index: 10000;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-        `;
-        
-        const dialog = document.createElement('div');
-        dialog.style.cssText = `
-            background: white;
-            padding: 20px;
-            border-radius: 10px;
-            box-shadow: 0 4px 8px rgba(0,0,0,0.3);
-            max-width: 400px;
-            text-align: center;
-            font-family: inherit;
-        `;
-        
-        dialog.innerHTML = `
-            <div style="color: #721c24; font-size: 18px; margin-bottom: 15px;">
-                ❌ Error
-            </div>
-            <div style="color: #721c24; margin-bottom: 20px; line-height: 1.4;">
-                ${mensaje}
-            </div>
-            <button id="error-dialog-btn" onclick="cerrarDialogoError()" style="
-                background: #dc3545;
-                color: white;
-                border: none;
-                padding: 10px 20px;
-                border-radius: 5px;
-                cursor: pointer;
-                font-size: 14px;
-            ">Aceptar</button>
-        `;
-        
-        overlay.appendChild(dialog);
-        document.body.appendChild(overlay);
-        
-        const button = document.getElementById('error-dialog-btn');
-        button.focus();
-        
-        const handleKeydown = (e) => {
-            if (e.key === 'Enter' || e.key === 'Escape') {
-                cerrarDialogoError();
-                document.removeEventListener('keydown', handleKeydown);
-            }
-        };
-        
-        document.addEventListener('keydown', handleKeydown);
-    }
-
-    function cerrarDialogoError() {
-        const overlay = document.getElementById('error-dialog-overlay');
-        if (overlay) { overlay.remove(); }
-    }
-  </script>
-
-  <!-- ════ QUICK TILES ════ -->
-  <div class="tiles">
-    <div class="tile" style="border-top-color:#0ea5e9">
-      <div class="tile-title">📂 Carpeta Caducidades</div>
-      <div class="tile-desc">Gestión de productos perecederos</div>
-      <a href="file:///T:/Compartir/Produccion/GESTI%C3%93N%20CADUCIDADES/"
-         class="btn btn-full btn-sm"
-         style="background:#0ea5e9;color:#fff;justify-content:center"
-         title="T:\\Compartir\\Produccion\\GESTI\u00d3N CADUCIDADES">📁 Abrir carpeta</a>
-      <a href="file:///T:/Compartir/Produccion/GESTI%C3%93N%20CADUCIDADES/Gesti%C3%B3n%20de%20productos%20perecederos%20(19.09.2022).xlsx"
-         class="btn btn-full btn-sm btn-ghost"
-         style="justify-content:center;margin-top:4px;font-size:11px"
-         title="Gesti\u00f3n de productos perecederos (19.09.2022)">📊 Abrir Excel</a>
-      <hr style="border:none;border-top:1px solid #e2e8f0;margin:6px 0">
-      <div style="font-size:10px;color:#64748b;margin-bottom:3px">O copia la ruta:</div>
-      <div style="display:flex;gap:4px;align-items:center">
-        <code style="font-size:10px;background:#f1f5f9;padding:3px 6px;border-radius:4px;flex:1;overflow:hidden;text-overflow:ellipsis;white-space:nowrap">T:\\Compartir\\Produccion\\GESTI\u00d3N CADUCIDADES</code>
-        <button id="btn-cp-carpeta"
-                data-ruta="T:\\Compartir\\Produccion\\GESTIÓN CADUCIDADES"
-                onclick="navigator.clipboard.writeText(this.dataset.ruta).then(()=>{var b=this;b.textContent='\u2705';setTimeout(()=>b.textContent='\U0001F4CB',1500)})"
-                style="padding:3px 7px;border:1.5px solid #e2e8f0;border-radius:5px;background:#fff;cursor:pointer;font-size:12px;flex-shrink:0">📋</button>
-      </div>
-      <div style="display:flex;gap:4px;align-items:center;margin-top:4px">
-        <code style="font-size:10px;background:#f1f5f9;padding:3px 6px;border-radius:4px;flex:1;overflow:hidden;text-overflow:ellipsis;white-space:nowrap">Gestión de productos perecederos (19.09.2022).xlsx</code>
-        <button id="btn-cp-excel"
-                data-ruta="T:\\Compartir\\Produccion\\GESTIÓN CADUCIDADES\\Gestión de productos perecederos (19.09.2022).xlsx"
-                onclick="navigator.clipboard.writeText(this.dataset.ruta).then(()=>{var b=this;b.textContent='\u2705';setTimeout(()=>b.textContent='\U0001F4CB',1500)})"
-                style="padding:3px 7px;border:1.5px solid #e2e8f0;border-radius:5px;background:#fff;cursor:pointer;font-size:12px;flex-shrink:0">📋</button>
-      </div>
-    </div>
-    <div class="tile emerald">
-      <div class="tile-title">📈 Exportar y Limpiar</div>
-      <div class="tile-desc">Exporta gastados/retirados a Excel y los elimina de la BD</div>
-      <form method="POST" onsubmit="return confirm('¿Exportar a Excel y eliminar todos los gastados/retirados?')">
-        <input type="hidden" name="accion" value="export_cleanup">
-        <button type="submit" class="btn btn-success btn-full btn-sm">📥 Exportar + Limpiar</button>
-      </form>
-    </div>
-    <div class="tile rose">
-      <div class="tile-title">🗑️ Eliminar Material</div>
-      <div class="tile-desc">Borra un material concreto por código de 7 dígitos</div>
-      <form method="POST" onsubmit="return confirm('¿Eliminar el material?')" style="display:flex;gap:6px">
-        <input type="hidden" name="accion" value="delete_material">
-        <input type="text" name="codigo" placeholder="0000000" maxlength="7" required
-               style="flex:1;padding:6px 8px;border:1.5px solid #e2e8f0;border-radius:6px;font-size:12px;width:0;min-width:0">
-        <button type="submit" class="btn btn-danger btn-sm">Borrar</button>
-      </form>
-    </div>
-    <div class="tile indigo">
-      <div class="tile-title">✅ Dados de Baja</div>
-      <div class="tile-desc" id="count-bajas">Cargando…</div>
-      <button onclick="mostrarSeccionBajas()" class="btn btn-primary btn-full btn-sm">📋 Ver Historial</button>
-    </div>
-    <div class="tile excel">
-      <div class="tile-title">📊 Procesar Bajas en Excel</div>
-      <div class="tile-desc" id="count-pendientes-excel">Cargando…</div>
-      <button id="btn-ejecutar-excel" onclick="ejecutarBajasExcel()" class="btn btn-success btn-full btn-sm">▶️ En este servidor</button>
-      <pre id="excel-output" style="display:none;margin-top:6px;background:#f1f5f9;border-radius:6px;padding:8px;font-size:11px;max-height:100px;overflow-y:auto;white-space:pre-wrap;word-break:break-all;color:#1e293b"></pre>
-      <hr style="border:none;border-top:1px solid #e2e8f0;margin:2px 0">
-      <div style="display:flex;align-items:center;gap:5px">
-        <span id="agente-badge" style="flex-shrink:0;display:inline-block;width:8px;height:8px;border-radius:50%;background:#94a3b8"></span>
-        <span id="agente-estado-texto" style="font-size:10px;color:#64748b">Agente desconectado</span>
-      </div>
-      <button id="btn-enviar-agente" onclick="enviarAlAgente()" class="btn btn-info btn-full btn-sm">📡 Enviar al PC cliente</button>
-      <button id="btn-cancelar-agente" onclick="cancelarSolicitudAgente()" class="btn btn-ghost btn-full btn-sm" style="display:none;font-size:11px">✖ Cancelar solicitud</button>
-      <pre id="agente-output" style="display:none;margin-top:6px;background:#f1f5f9;border-radius:6px;padding:8px;font-size:11px;max-height:100px;overflow-y:auto;white-space:pre-wrap;word-break:break-all;color:#1e293b"></pre>
-      <hr style="border:none;border-top:1px solid #e2e8f0;margin:4px 0">
-      <div style="display:flex;align-items:center;gap:5px">
-        <span id="agente-local-badge" style="flex-shrink:0;display:inline-block;width:8px;height:8px;border-radius:50%;background:#94a3b8"></span>
-        <span id="agente-local-texto" style="font-size:10px;color:#64748b">Agente local no detectado</span>
-      </div>
-      <button id="btn-agente-local" onclick="procesarEnEstePC()" class="btn btn-success btn-full btn-sm" disabled>💻 Procesar en este PC</button>
-      <pre id="agente-local-output" style="display:none;margin-top:6px;background:#f1f5f9;border-radius:6px;padding:8px;font-size:11px;max-height:120px;overflow-y:auto;white-space:pre-wrap;word-break:break-all;color:#1e293b"></pre>
-    </div>
-    <div class="tile" style="border-top-color:#8b5cf6">
-      <div class="tile-title">🛠️ Configurar Agente</div>
-      <div class="tile-desc">Descarga los archivos e instrucciones para instalar el agente en el PC cliente</div>
-      <button onclick="document.getElementById('seccion-agente-setup').scrollIntoView({behavior:'smooth'})" class="btn btn-full btn-sm" style="background:#8b5cf6;color:#fff">📖 Ver Instrucciones</button>
-      <a href="/admin/descargar_agente_zip" class="btn btn-ghost btn-full btn-sm" style="font-size:11px">⬇️ Descargar ZIP</a>
-    </div>
-  </div>
-
-  <!-- ════ 2-COL ROW ════ -->
-  <div class="row2">
-
-    <!-- ─── COL IZQUIERDA: Operarios ─── -->
-    <div class="card">
-      <div class="card-head">
-        <h2 class="card-title">👷 Gestión de Operarios</h2>
-        <div class="btn-row">
-          <button onclick="mostrarModalCrear()" class="btn btn-success btn-sm">➕ Nuevo</button>
-          <button onclick="cargarOperarios()" class="btn btn-ghost btn-sm">🔄</button>
-          <button onclick="exportarOperarios()" class="btn btn-ghost btn-sm">📤 CSV</button>
-        </div>
-      </div>
-
-      <details style="margin-bottom:16px">
-        <summary>📂 Importación masiva desde CSV / Excel</summary>
-        <div style="padding:14px 0 4px">
-          <form method="POST" enctype="multipart/form-data" style="display:flex;gap:10px;align-items:flex-end;flex-wrap:wrap">
-            <input type="hidden" name="accion" value="import_operarios">
-            <div class="fg" style="flex:1;min-width:200px;margin:0">
-              <label>Archivo CSV / Excel</label>
-              <input type="file" name="archivo" accept=".csv,.xlsx,.xls" required>
-            </div>
-            <button type="submit" class="btn btn-info">📂 Importar</button>
-          </form>
-          <div class="info-box">
-            Columnas: <code>numero</code> <code>nombre</code> <code>rol</code> <code>activo</code> ·
-            Roles: operario, almacenero, admin · Activo: 1 / 0
-          </div>
-        </div>
-      </details>
-
-      <div id="tablaOperarios">
-        <div style="text-align:center;padding:24px;color:#94a3b8;font-size:14px">🔄 Cargando operarios…</div>
-      </div>
-
-      <hr class="div">
-      <div class="info-box" style="font-size:11px">
-        <strong>Permisos:</strong>
-        <strong>Admin</strong> – acceso total ·
-        <strong>Almacenero</strong> – registrar, asignar, devolver, retirar, gastar ·
-        <strong>Operario</strong> – solo asignar materiales
-      </div>
-    </div><!-- /col izquierda -->
-
-    <!-- ─── COL DERECHA ─── -->
-    <div>
-      <!-- Base de datos materiales -->
-      <div class="card">
-        <div class="card-head">
-          <h2 class="card-title">📊 Base de Datos de Materiales</h2>
-        </div>
-        <div style="display:grid;grid-template-columns:1fr 1fr;gap:14px;margin-bottom:16px">
-          <div>
-            <div style="font-size:12px;font-weight:700;color:#166534;margin-bottom:6px">📤 Exportar</div>
-            <p style="font-size:11px;color:#64748b;margin-bottom:8px;line-height:1.4">Descarga todos los materiales en Excel con formato profesional.</p>
-            <a href="/admin/exportar_materiales" class="btn btn-success btn-full btn-sm">⬇️ Descargar Excel (.xlsx)</a>
-          </div>
-          <div>
-            <div style="font-size:12px;font-weight:700;color:#1e40af;margin-bottom:6px">📥 Importar</div>
-            <form method="POST" action="/admin/importar_materiales" enctype="multipart/form-data">
-              <div class="fg" style="margin-bottom:6px">
-                <label>Archivo (.xlsx / .csv)</label>
-                <input type="file" name="archivo" accept=".xlsx,.xls,.csv" required>
-              </div>
-              <button type="submit" class="btn btn-primary btn-full btn-sm">⬆️ Subir e Importar</button>
-            </form>
-          </div>
-        </div>
-
-        <details>
-          <summary>📋 Formato de archivos esperado</summary>
-          <div class="code-block">
-            <strong>Columnas (primera fila):</strong><br>
-            Código · EAN · Descripción · Caducidad · Estado · Operario<br><br>
-            Código y Descripción son obligatorios. Caducidad: YYYY-MM-DD.
-          </div>
-        </details>
-
-        <hr class="div">
-
-        <div class="danger-zone">
-          <div class="danger-zone-title">🗑️ Limpiar toda la base de datos</div>
-          <p style="font-size:12px;color:#7f1d1d;margin:0 0 12px;line-height:1.4">
-            ⚠️ Elimina <strong>TODOS</strong> los materiales permanentemente. No se puede deshacer.
-          </p>
-          <form method="POST" action="/admin/borrar_materiales"
-                onsubmit="return confirm('¿Eliminar TODOS los materiales?\\n\\nEsta acción NO SE PUEDE DESHACER.')">
-            <div class="fg" style="margin-bottom:8px">
-              <label style="color:#991b1b">Escribe <code>BORRAR</code> para confirmar</label>
-              <input type="text" name="confirmacion" placeholder="BORRAR" required
-                     style="font-family:monospace;border-color:#fca5a5">
-            </div>
-            <button type="submit" class="btn btn-danger btn-full btn-sm">🗑️ ELIMINAR TODOS LOS MATERIALES</button>
-          </form>
-        </div>
-      </div><!-- /card db -->
-
-      <!-- GitHub Update -->
-      <div class="gh-card">
-        <div class="card-title" style="color:#f8fafc">🔄 Actualización desde GitHub</div>
-        <p>Descarga los últimos cambios y actualiza las dependencias automáticamente.</p>
-        <div class="btn-row">
-          <button id="btn-update" onclick="actualizarDesdeGitHub()" class="btn btn-success">🔄 Actualizar</button>
-          <button id="btn-restart" onclick="reiniciarApp()" style="display:none" class="btn btn-warning">♻️ Reiniciar app</button>
-        </div>
-        <pre id="update-output"
-             style="display:none;margin-top:14px;background:#020617;color:#a3e635;padding:14px;border-radius:8px;font-size:12px;white-space:pre-wrap;max-height:260px;overflow-y:auto;border:1px solid #1e3a5f"></pre>
-      </div><!-- /gh-card -->
-    </div><!-- /col derecha -->
-
-  </div><!-- /row2 -->
-
-  <!-- ════ EAN CATÁLOGO ════ -->
-  <div class="card">
-    <div class="card-head">
-      <h2 class="card-title">🏷️ Catálogo EAN — Descripciones</h2>
-      <span style="font-size:12px;color:#94a3b8">Consistencia de descripciones por código EAN</span>
-    </div>
-
-    {% if eans_data %}
-    <div class="table-wrap">
-      <table>
-        <thead><tr>
-          <th>EAN</th><th>Descripción principal</th>
-          <th style="text-align:center">Materiales</th>
-          <th>Variantes</th>
-          <th style="text-align:center">Estado</th>
-          <th style="text-align:center">Acción</th>
-        </tr></thead>
-        <tbody>
-        {% for ean_info in eans_data %}
-        <tr>
-          <td><code>{{ ean_info.ean }}</code></td>
-          <td><strong>{{ ean_info.descripcion_principal }}</strong></td>
-          <td style="text-align:center"><span class="badge badge-blue">{{ ean_info.total_materiales }}</span></td>
-          <td>{% for desc in ean_info.descripciones %}
-            <div style="font-size:11px;color:#64748b">• {{ desc.descripcion }} ({{ desc.cantidad }})</div>
-            {% endfor %}</td>
-          <td style="text-align:center">
-            {% if ean_info.descripciones|length > 1 %}
-              <span class="badge badge-warn">⚠️ Inconsistente</span>
-            {% else %}
-              <span class="badge badge-ok">✅ OK</span>
-            {% endif %}
-          </td>
-          <td style="text-align:center">
-            <button onclick="editarEAN('{{ ean_info.ean }}','{{ ean_info.descripcion_principal }}')"
-                    class="btn btn-ghost btn-sm">📝 Editar</button>
-          </td>
-        </tr>
-        {% endfor %}
-        </tbody>
-      </table>
-    </div>
-
-    <!-- Modal EAN -->
-    <div id="modalEAN" class="modal-ov">
-      <div class="modal-box">
-        <h3>📝 Editar Descripción EAN</h3>
-        <form method="POST">
-          <input type="hidden" name="accion" value="update_ean_description">
-          <input type="hidden" name="ean" id="modal_ean">
-          <div class="fg">
-            <label>EAN</label>
-            <code id="modal_ean_display" style="display:block;padding:4px 0;font-size:14px"></code>
-          </div>
-          <div class="fg">
-            <label>Nueva descripción</label>
-            <input type="text" name="nueva_descripcion" id="modal_descripcion" required>
-          </div>
-          <div class="btn-row" style="margin-top:8px">
-            <button type="submit" class="btn btn-primary">💾 Actualizar todos</button>
-            <button type="button" onclick="cerrarModalEAN()" class="btn btn-ghost">Cancelar</button>
-          </div>
-        </form>
-      </div>
-    </div>
-
-    <script>
-    function editarEAN(ean, desc) {
-      document.getElementById('modal_ean').value = ean;
-      document.getElementById('modal_ean_display').textContent = ean;
-      document.getElementById('modal_descripcion').value = desc;
-      document.getElementById('modalEAN').style.display = 'block';
-    }
-    function cerrarModalEAN() { document.getElementById('modalEAN').style.display = 'none'; }
-    document.getElementById('modalEAN').addEventListener('click', function(e) {
-      if (e.target === this) cerrarModalEAN();
-    });
-    </script>
-
-    {% else %}
-    <p style="color:#94a3b8;font-style:italic;font-size:13px">No hay EANs registrados en la base de datos.</p>
-    {% endif %}
-  </div><!-- /ean card -->
-
-</main><!-- /page -->
-
-<!-- ════ MODAL OPERARIO ════ -->
-<div id="modalOperario" class="modal-ov">
-  <div class="modal-box">
-    <h3 id="modalTitulo">➕ Crear Nuevo Operario</h3>
-    <form id="formOperario">
-      <div class="fg">
-        <label>Número de operario</label>
-        <input type="text" id="operarioNumero" required placeholder="Ej: 001, US123…">
-        <small style="color:#94a3b8;font-size:11px">Identificador único del operario</small>
-      </div>
-      <div class="fg">
-        <label>Nombre completo</label>
-        <input type="text" id="operarioNombre" required placeholder="Nombre y apellidos">
-      </div>
-      <div class="fg">
-        <label>Rol</label>
-        <select id="operarioRol" required>
-          <option value="operario">👷 Operario</option>
-          <option value="almacenero">📦 Almacenero</option>
-          <option value="admin">⚙️ Administrador</option>
-        </select>
-      </div>
-      <div id="estadisticasOperario" style="display:none;padding:12px;background:#f8fafc;border-radius:8px;margin-bottom:12px">
-        <div style="font-size:12px;font-weight:600;margin-bottom:6px;color:#475569">📊 Estadísticas</div>
-        <div id="statsContent"></div>
-      </div>
-      <div class="btn-row" style="justify-content:flex-end;margin-top:8px">
-        <button type="button" onclick="cerrarModal()" class="btn btn-ghost">Cancelar</button>
-        <button type="submit" id="btnGuardar" class="btn btn-primary">💾 Guardar</button>
-      </div>
-    </form>
-  </div>
-</div>
-
-<script>
-// ================== CRUD de Operarios ==================
-let modoEdicion = false;
-let operarioOriginal = '';
-
-async function cargarOperarios() {
-  try {
-    const response = await fetch('/api/operarios');
-    const data = await response.json();
-    
-    if (data.operarios) {
-      mostrarTablaOperarios(data.operarios);
-    } else {
-      document.getElementById('tablaOperarios').innerHTML = 
-        '<div style="text-align:center;padding:20px;color:#dc3545">❌ Error al cargar operarios</div>';
-    }
-  } catch (error) {
-    console.error('Error:', error);
-    document.getElementById('tablaOperarios').innerHTML = 
-      '<div style="text-align:center;padding:20px;color:#dc3545">❌ Error de conexión</div>';
-  }
-}
-
-function mostrarTablaOperarios(operarios) {
-  let html = `
-    <table style="width:100%;border-collapse:collapse;margin-top:10px">
-      <tr style="background:#f8f9fa">
-        <th style="padding:12px;border:1px solid #dee2e6">Nº</th>
-        <th style="padding:12px;border:1px solid #dee2e6">Nombre</th>
-        <th style="padding:12px;border:1px solid #dee2e6">Rol</th>
-        <th style="padding:12px;border:1px solid #dee2e6">Estado</th>
-        <th style="padding:12px;border:1px solid #dee2e6">Materiales</th>
-        <th style="padding:12px;border:1px solid #dee2e6">Info</th>
-        <th style="padding:12px;border:1px solid #dee2e6">Acciones</th>
-      </tr>`;
-
-  operarios.forEach(op => {
-    const estadoColor = op.activo ? '#d4edda' : '#ffebee';
-    const estadoTexto = op.activo ? '✅ Activo' : '❌ Inactivo';
-    
-    let rolColor = '#f3e5f5'; // operario
-    if (op.rol === 'admin') rolColor = '#e3f2fd';
-    if (op.rol === 'almacenero') rolColor = '#fff3e0';
-    
-    const materialesInfo = op.materiales_asignados || 0;
-    
-    html += `
-      <tr style="background:${estadoColor}">
-        <td style="padding:10px;border:1px solid #dee2e6"><strong>${op.numero}</strong></td>
-        <td style="padding:10px;border:1px solid #dee2e6">${op.nombre}</td>
-        <td style="padding:10px;border:1px solid #dee2e6">
-          <span style="padding:4px 8px; border-radius:4px; font-size:12px; background:${rolColor}">
-            ${op.rol.charAt(0).toUpperCase() + op.rol.slice(1)}
-          </span>
-        </td>
-        <td style="padding:10px;border:1px solid #dee2e6">${estadoTexto}</td>
-        <td style="padding:10px;border:1px solid #dee2e6;text-align:center">
-          <span style="background:#e7f3ff;padding:2px 6px;border-radius:3px;font-size:11px">
-            📦 ${materialesInfo}
-          </span>
-        </td>
-        <td style="padding:10px;border:1px solid #dee2e6;font-size:11px;color:#666">
-          <span style="background:#e9ecef;padding:2px 6px;border-radius:3px;font-size:10px">
-            👤 ID: ${op.numero}
-          </span>
-        </td>
-        <td style="padding:10px;border:1px solid #dee2e6">
-          <div style="display:flex;gap:4px;flex-wrap:wrap">
-            <button onclick="editarOperario('${op.numero}')" 
-                    style="font-size:10px;padding:4px 8px;background:#ffc107;border:none;border-radius:3px;cursor:pointer"
-                    title="Editar">
-              ✏️
-            </button>
-            <button onclick="toggleOperario('${op.numero}')" 
-                    style="font-size:10px;padding:4px 8px;background:${op.activo ? '#dc3545' : '#28a745'};color:white;border:none;border-radius:3px;cursor:pointer"
-                    title="${op.activo ? 'Desactivar' : 'Activar'}">
-              ${op.activo ? '🔒' : '🔓'}
-            </button>
-            <button onclick="eliminarOperario('${op.numero}', '${op.nombre}')" 
-                    style="font-size:10px;padding:4px 8px;background:#6c757d;color:white;border:none;border-radius:3px;cursor:pointer"
-                    title="Eliminar">
-              🗑️
-            </button>
-          </div>
-        </td>
-      </tr>`;
-  });
-
-  html += '</table>';
-  document.getElementById('tablaOperarios').innerHTML = html;
-}
-
-function mostrarModalCrear() {
-  modoEdicion = false;
-  operarioOriginal = '';
-  document.getElementById('modalTitulo').textContent = '➕ Crear Nuevo Operario';
-  document.getElementById('operarioNumero').value = '';
-  document.getElementById('operarioNombre').value = '';
-  document.getElementById('operarioRol').value = 'operario';
-  document.getElementById('operarioNumero').disabled = false;
-  document.getElementById('btnGuardar').textContent = '💾 Crear';
-  document.getElementById('estadisticasOperario').style.display = 'none';
-  document.getElementById('modalOperario').style.display = 'block';
-}
-
-async function editarOperario(numero) {
-  try {
-    const response = await fetch(`/api/operarios/${numero}`);
-    const operario = await response.json();
-    
-    if (operario.error) {
-      alert('Error: ' + operario.error);
-      return;
-    }
-    
-    modoEdicion = true;
-    operarioOriginal = numero;
-    document.getElementById('modalTitulo').textContent = '✏️ Editar Operario';
-    document.getElementById('operarioNumero').value = operario.numero;
-    document.getElementById('operarioNombre').value = operario.nombre;
-    document.getElementById('operarioRol').value = operario.rol;
-    document.getElementById('operarioNumero').disabled = true;
-    document.getElementById('btnGuardar').textContent = '💾 Guardar Cambios';
-    
-    // Mostrar estadísticas
-    if (operario.materiales_asignados !== undefined) {
-      let statsHtml = `<div>📦 Materiales asignados: <strong>${operario.materiales_asignados}</strong></div>`;
-      if (operario.por_estado) {
-        Object.entries(operario.por_estado).forEach(([estado, cantidad]) => {
-          statsHtml += `<div style="font-size:11px;margin-top:3px">• ${estado}: ${cantidad} materiales</div>`;
-        });
-      }
-      document.getElementById('statsContent').innerHTML = statsHtml;
-      document.getElementById('estadisticasOperario').style.display = 'block';
-    }
-    
-    document.getElementById('modalOperario').style.display = 'block';
-  } catch (error) {
-    alert('Error al cargar datos del operario');
-    console.error(error);
-  }
-}
-
-async function toggleOperario(numero) {
-  if (!confirm(`¿Cambiar el estado de activación del operario ${numero}?`)) return;
-  
-  try {
-    const response = await fetch(`/api/operarios/${numero}/toggle`, {
-      method: 'POST'
-    });
-    const result = await response.json();
-    
-    if (result.success) {
-      alert(result.mensaje);
-      cargarOperarios();
-    } else {
-      alert('Error: ' + result.mensaje);
-    }
-  } catch (error) {
-    alert('Error de conexión');
-    console.error(error);
-  }
-}
-
-async function eliminarOperario(numero, nombre) {
-  if (!confirm(`¿Está seguro de eliminar al operario "${nombre}" (${numero})?\n\nEsta acción lo desactivará permanentemente.`)) return;
-  
-  try {
-    const response = await fetch(`/api/operarios/${numero}`, {
-      method: 'DELETE'
-    });
-    const result = await response.json();
-    
-    if (result.success) {
-      alert(result.mensaje);
-      cargarOperarios();
-    } else {
-      alert('Error: ' + result.mensaje);
-    }
-  } catch (error) {
-    alert('Error de conexión');
-    console.error(error);
-  }
-}
-
-function cerrarModal() {
-  document.getElementById('modalOperario').style.display = 'none';
-}
-
-// Manejar envío del formulario
-document.getElementById('formOperario').addEventListener('submit', async function(e) {
-  e.preventDefault();
-  
-  const numero = document.getElementById('operarioNumero').value.trim();
-  const nombre = document.getElementById('operarioNombre').value.trim();
-  const rol = document.getElementById('operarioRol').value;
-  
-  if (!numero || !nombre) {
-    alert('Número y nombre son obligatorios');
-    return;
-  }
-  
-  try {
-    let url, method, data;
-    
-    if (modoEdicion) {
-      url = `/api/operarios/${operarioOriginal}`;
-      method = 'PUT';
-      data = { nombre, rol };
-    } else {
-      url = '/api/operarios';
-      method = 'POST';
-      data = { numero, nombre, rol };
-    }
-    
-    const response = await fetch(url, {
-      method: method,
-      headers: {
-        'Content-Type': 'application/json'
-      },
-      body: JSON.stringify(data)
-    });
-    
-    const result = await response.json();
-    
-    if (result.success) {
-      alert(result.mensaje);
-      cerrarModal();
-      cargarOperarios();
-    } else {
-      alert('Error: ' + result.mensaje);
-    }
-  } catch (error) {
-    alert('Error de conexión');
-    console.error(error);
-  }
-});
-
-// Cerrar modal al hacer clic fuera
-document.getElementById('modalOperario').addEventListener('click', function(e) {
-  if (e.target === this) {
-    cerrarModal();
-  }
-});
-
-async function exportarOperarios() {
-  try {
-    const response = await fetch('/api/operarios');
-    const data = await response.json();
-    
-    if (data.operarios) {
-      // Crear CSV
-      let csvContent = "Número,Nombre,Rol,Estado,Materiales Asignados\\n";
-      
-      data.operarios.forEach(op => {
-        const estado = op.activo ? 'Activo' : 'Inactivo';
-        const materiales = op.materiales_asignados || 0;
-        csvContent += `"${op.numero}","${op.nombre}","${op.rol}","${estado}","${materiales}"\\n`;
-      });
-      
-      // Descargar archivo
-      const blob = new Blob([csvContent], { type: 'text/csv;charset=utf-8;' });
-      const link = document.createElement('a');
-      const url = URL.createObjectURL(blob);
-      link.setAttribute('href', url);
-      link.setAttribute('download', `operarios_${new Date().toISOString().split('T')[0]}.csv`);
-      link.style.visibility = 'hidden';
-      document.body.appendChild(link);
-      link.click();
-      document.body.removeChild(link);
-      
-      alert('✅ Lista de operarios exportada exitosamente');
-    } else {
-      alert('❌ Error al exportar operarios');
-    }
-  } catch (error) {
-    alert('❌ Error de conexión al exportar');
-    console.error(error);
-  }
-}
-
-// Cargar operarios al cargar la página
-// Rellenar IP del servidor e inicializar badge de la sección setup
-async function inicializarSeccionAgente() {
-  // IP del servidor
-  const ipTexto = document.getElementById('ip-servidor-texto');
-  if (ipTexto) {
-    ipTexto.textContent = window.location.host;
-  }
-}
-
-document.addEventListener('DOMContentLoaded', function() {
-  cargarOperarios();
-  cargarContadorBajas();
-  cargarPendientesExcel();
-  cargarEstadoAgente();
-  inicializarSeccionAgente();
-  verificarAgenteLocal();
-  setInterval(cargarEstadoAgente, 8000);
-  setInterval(verificarAgenteLocal, 5000);
-  setInterval(() => {
-    // Sincronizar badge de la sección setup con el estado real del agente
-    const badgeTile = document.getElementById('agente-badge');
-    const badgeSetup = document.getElementById('agente-setup-badge');
-    const estadoSetup = document.getElementById('agente-setup-estado');
-    if (badgeTile && badgeSetup) {
-      badgeSetup.style.background = badgeTile.style.background;
-      const online = badgeTile.style.background.includes('34c55') || badgeTile.style.background === 'rgb(34, 197, 94)';
-      estadoSetup.textContent = online ? 'Agente conectado y escuchando' : 'Agente desconectado — ejecuta AGENTE_EXCEL.bat en el PC cliente';
-      estadoSetup.style.color = online ? '#166534' : '#475569';
-    }
-  }, 2000);
-});
-
-// ── Actualización desde GitHub ─────────────────────────────────
-async function actualizarDesdeGitHub() {
-  const btn = document.getElementById('btn-update');
-  const output = document.getElementById('update-output');
-  const section = document.getElementById('update-section');
-  
-  btn.disabled = true;
-  btn.textContent = '⏳ Actualizando…';
-  output.style.display = 'block';
-  output.textContent = 'Conectando con GitHub…';
-
-  try {
-    const resp = await fetch('/api/admin/update', { method: 'POST' });
-    const data = await resp.json();
-
-    output.textContent = data.output || data.mensaje || '(sin respuesta)';
-
-    if (data.success) {
-      if (data.hubo_cambios) {
-        btn.textContent = '✅ Actualizado';
-        document.getElementById('btn-restart').style.display = 'inline-block';
-      } else {
-        btn.textContent = '✅ Ya estás al día';
-        btn.disabled = false;
-      }
-    } else {
-      btn.textContent = '❌ Error — Reintentar';
-      btn.disabled = false;
-    }
-  } catch(e) {
-    output.textContent = 'Error de conexión: ' + e.message;
-    btn.textContent = '❌ Error — Reintentar';
-    btn.disabled = false;
-  }
-}
-
-async function reiniciarApp() {
-  const btn = document.getElementById('btn-restart');
-  const output = document.getElementById('update-output');
-  btn.disabled = true;
-  btn.textContent = '⏳ Reiniciando…';
-  
-  try {
-    await fetch('/api/admin/restart', { method: 'POST' });
-  } catch(e) { /* Se espera que la conexión se corte */ }
-
-  output.textContent += '\\n\\nServidor reiniciando… esperando que vuelva.';
-
-  // Sondear hasta que el servidor responda, luego recargar
-  let intentos = 0;
-  const maxIntentos = 30; // hasta ~15 segundos
-  const intervalo = setInterval(async () => {
-    intentos++;
-    try {
-      const r = await fetch('/api/hora_servidor', { cache: 'no-store' });
-      if (r.ok) {
-        clearInterval(intervalo);
-        output.textContent += '\\n✅ Servidor listo — recargando…';
-        setTimeout(() => { window.location.reload(); }, 500);
-      }
-    } catch(e) {
-      output.textContent = output.textContent.replace(/\\.+$/, '') + '.'.repeat(intentos % 4 + 1);
-    }
-    if (intentos >= maxIntentos) {
-      clearInterval(intervalo);
-      output.textContent += '\\n⚠️ Tardando más de lo esperado. Recarga la página manualmente.';
-      btn.textContent = '🔄 Recargar';
-      btn.disabled = false;
-      btn.onclick = () => window.location.reload();
-    }
-  }, 500);
-}
-
-// ── Dados de Baja ──────────────────────────────────────────────
-let _bajasSectionVisible = false;
-
-async function cargarContadorBajas() {
-  try {
-    const r = await fetch('/api/bajas');
-    const d = await r.json();
-    const n = d.total || 0;
-    document.getElementById('count-bajas').textContent =
-      n === 0 ? 'Sin registros de bajas' :
-      n === 1 ? '1 material dado de baja' :
-      `${n} materiales dados de baja`;
-  } catch {
-    document.getElementById('count-bajas').textContent = 'Error al cargar';
-  }
-}
-
-function mostrarSeccionBajas() {
-  const sec = document.getElementById('seccion-bajas');
-  if (!_bajasSectionVisible) {
-    sec.style.display = 'block';
-    _bajasSectionVisible = true;
-    cargarTablaBajas();
-    sec.scrollIntoView({ behavior: 'smooth', block: 'start' });
-  } else {
-    sec.scrollIntoView({ behavior: 'smooth', block: 'start' });
-  }
-}
-
-async function cargarTablaBajas(filtro) {
-  const tbody = document.getElementById('bajas-tbody');
-  tbody.innerHTML = '<tr><td colspan="5" style="text-align:center;padding:18px;color:#64748b">Cargando…</td></tr>';
-  try {
-    const r = await fetch('/api/bajas');
-    const d = await r.json();
-    let rows = d.bajas || [];
-    if (filtro) {
-      const f = filtro.toLowerCase();
-      rows = rows.filter(b =>
-        (b.codigo || '').toLowerCase().includes(f) ||
-        (b.descripcion || '').toLowerCase().includes(f) ||
-        (b.operario_numero || '').toLowerCase().includes(f)
-      );
-    }
-    if (rows.length === 0) {
-      tbody.innerHTML = '<tr><td colspan="5" style="text-align:center;padding:18px;color:#64748b">No hay registros</td></tr>';
-      return;
-    }
-    tbody.innerHTML = rows.map(b => `
-      <tr>
-        <td style="font-family:monospace;font-weight:600">${b.codigo || '—'}</td>
-        <td>${b.descripcion || '—'}</td>
-        <td><span class="badge badge-${b.estado_original === 'gastado' ? 'red' : 'orange'}">${b.estado_original || '—'}</span></td>
-        <td>${b.operario_numero || '—'}</td>
-        <td style="font-size:12px;white-space:nowrap">${b.fecha_baja || '—'}</td>
-      </tr>`).join('');
-  } catch {
-    tbody.innerHTML = '<tr><td colspan="5" style="text-align:center;padding:18px;color:#ef4444">Error al cargar</td></tr>';
-  }
-}
-
-// ── Procesar Bajas en Excel ───────────────────────────────────
-async function cargarPendientesExcel() {
-  try {
-    const r = await fetch('/api/bajas_pendientes_excel');
-    const d = await r.json();
-    const n = (d.pendientes || []).length;
-    document.getElementById('count-pendientes-excel').textContent =
-      n === 0 ? 'Sin pendientes de procesar' :
-      n === 1 ? '1 pendiente de procesar en Excel' :
-      `${n} pendientes de procesar en Excel`;
-  } catch {
-    document.getElementById('count-pendientes-excel').textContent = 'Error al cargar';
-  }
-}
-
-async function ejecutarBajasExcel() {
-  const desc = document.getElementById('count-pendientes-excel').textContent;
-  if (!confirm(`¿Ejecutar el proceso de bajas en Excel?\n\n${desc}\n\nAsegúrate de que el archivo Excel con la macro DAR_DE_BAJA esté abierto EN ESTE SERVIDOR.`)) return;
-  const btn = document.getElementById('btn-ejecutar-excel');
-  const output = document.getElementById('excel-output');
-  btn.disabled = true;
-  btn.textContent = '⏳ Procesando…';
-  output.style.display = 'block';
-  output.textContent = 'Iniciando proceso…';
-  try {
-    const r = await fetch('/api/admin/ejecutar_bajas_excel', { method: 'POST' });
-    const d = await r.json();
-    output.textContent = d.salida || '(sin salida)';
-    if (d.success) {
-      btn.textContent = '✅ Completado';
-      setTimeout(() => { btn.disabled = false; btn.textContent = '▶️ En este servidor'; }, 4000);
-      cargarPendientesExcel();
-      cargarContadorBajas();
-    } else {
-      btn.textContent = '❌ Error — Reintentar';
-      btn.disabled = false;
-    }
-  } catch(e) {
-    output.textContent = 'Error de conexión: ' + e.message;
-    btn.textContent = '❌ Error — Reintentar';
-    btn.disabled = false;
-  }
-}
-
-// ── Modo Local (browser bridge) ──────────────────────────────
-async function verificarAgenteLocal() {
-  let online = false;
-  try {
-    const ctrl = new AbortController();
-    const tid = setTimeout(() => ctrl.abort(), 1200);
-    const r = await fetch('http://127.0.0.1:8765/status', {signal: ctrl.signal});
-    clearTimeout(tid);
-    const d = await r.json();
-    online = d.online === true;
-  } catch { online = false; }
-  const badge = document.getElementById('agente-local-badge');
-  const texto = document.getElementById('agente-local-texto');
-  const btn   = document.getElementById('btn-agente-local');
-  if (badge) badge.style.background = online ? '#22c55e' : '#94a3b8';
-  if (texto) texto.textContent = online ? 'Agente local activo (localhost:8765)' : 'Agente local no detectado';
-  if (btn)   btn.disabled = !online;
-}
-
-async function procesarEnEstePC() {
-  const output = document.getElementById('agente-local-output');
-  const btn    = document.getElementById('btn-agente-local');
-
-  // ── Paso 0: obtener pendientes antes del aviso ──────────────────
-  output.style.display = 'block';
-  output.textContent   = 'Consultando pendientes\u2026';
-  btn.disabled = true;
-  let pendientes = [];
-  try {
-    const r = await fetch('/api/bajas_pendientes_excel');
-    const d = await r.json();
-    pendientes = d.pendientes || [];
-  } catch(e) {
-    output.textContent = '\u274c Error al obtener pendientes: ' + e.message;
-    btn.disabled = false; return;
-  }
-  if (pendientes.length === 0) {
-    output.textContent = 'Sin materiales pendientes.';
-    btn.disabled = false; return;
-  }
-
-  // ── Paso 1: aviso + confirmación ────────────────────────────────
-  const confirmado = confirm(
-    '\u26a0\ufe0f  PROCESO DE BAJAS EN EXCEL\\n\\n' +
-    'Se van a procesar ' + pendientes.length + ' baja(s).\\n\\n' +
-    'ANTES DE CONTINUAR:\\n' +
-    '  1. Aseg\u00farate de que el Excel con la macro DAR_DE_BAJA est\u00e1 abierto.\\n' +
-    '  2. Pon la ventana de Excel en primer plano.\\n' +
-    '  3. NO muevas el rat\u00f3n ni uses el teclado hasta que\\n' +
-    '     aparezca el mensaje de finalizaci\u00f3n.\\n\\n' +
-    '\u00bfContinuar?'
-  );
-  if (!confirmado) { btn.disabled = false; output.style.display = 'none'; return; }
-
-  // ── Paso 2: cuenta atrás ────────────────────────────────────────
-  for (let i = 5; i >= 1; i--) {
-    output.textContent = '\u23f3 Iniciando en ' + i + '\u2026  Pon Excel en primer plano y NO toques nada.';
-    await new Promise(res => setTimeout(res, 1000));
-  }
-
-  // ── Paso 3: procesar ───────────────────────────────────────────
-  output.textContent = 'Procesando ' + pendientes.length + ' baja(s)\u2026\\n';
-  let ok = 0, ko = 0;
-  for (const m of pendientes) {
-    output.textContent += '  ' + m.codigo + ' (' + m.estado + ')\u2026 ';
-    try {
-      const r2 = await fetch('http://127.0.0.1:8765/ejecutar', {
-        method: 'POST',
-        headers: {'Content-Type': 'application/json'},
-        body: JSON.stringify({codigo: m.codigo, estado: m.estado})
-      });
-      const d2 = await r2.json();
-      if (d2.ok) {
-        await fetch('/api/local/marcar_baja/' + m.id, {method: 'POST'});
-        ok++;
-        output.textContent += '\u2713\\n';
-      } else {
-        ko++;
-        output.textContent += '\u2717 ' + (d2.error || 'error Excel') + '\\n';
-      }
-    } catch(e) {
-      ko++;
-      output.textContent += '\u2717 ' + e.message + '\\n';
-    }
-    output.scrollTop = output.scrollHeight;
-    await new Promise(res => setTimeout(res, 1500));
-  }
-
-  // ── Paso 4: finalización ────────────────────────────────────────
-  const resumen = (ok > 0 ? '\u2705 ' + ok + ' procesada(s) correctamente' : '') +
-                  (ko > 0 ? '\\n\u274c ' + ko + ' con error' : '');
-  output.textContent += '\\n' + resumen + '\\n\\n\u2714 Proceso finalizado \u2014 ya puedes usar el rat\u00f3n.';
-  output.scrollTop = output.scrollHeight;
-  btn.disabled = false;
-  if (ok > 0) { cargarPendientesExcel(); cargarContadorBajas(); }
-}
-
-// ── Agente Cliente Excel ─────────────────────────────────
-let _agentePollingInterval = null;
-
-async function cargarEstadoAgente() {
-  try {
-    const r = await fetch('/api/admin/estado_solicitud_cliente');
-    const d = await r.json();
-    const badge   = document.getElementById('agente-badge');
-    const texto   = document.getElementById('agente-estado-texto');
-    const btnEnv  = document.getElementById('btn-enviar-agente');
-    const btnCan  = document.getElementById('btn-cancelar-agente');
-    const output  = document.getElementById('agente-output');
-    if (d.agente_online) {
-      badge.style.background = '#22c55e';
-      texto.textContent = 'Agente conectado';
-    } else {
-      badge.style.background = '#94a3b8';
-      texto.textContent = 'Agente desconectado';
-    }
-    const estado = d.estado || 'idle';
-    if (estado === 'idle') {
-      btnEnv.disabled = false; btnEnv.textContent = '📡 Enviar al PC cliente';
-      btnCan.style.display = 'none'; output.style.display = 'none';
-      _detenerPollingAgente();
-    } else if (estado === 'pendiente') {
-      btnEnv.disabled = true; btnEnv.textContent = '⏳ Esperando agente…';
-      btnCan.style.display = 'inline-flex';
-      output.style.display = 'block';
-      output.textContent = 'Solicitud enviada. Esperando que el agente la recoja…';
-      _iniciarPollingAgente();
-    } else if (estado === 'procesando') {
-      btnEnv.disabled = true; btnEnv.textContent = '⚙️ Procesando…';
-      btnCan.style.display = 'inline-flex'; btnCan.textContent = '✖ Detener proceso';
-      output.style.display = 'block';
-      output.textContent = 'El agente está procesando las bajas en Excel…';
-      _iniciarPollingAgente();
-    } else if (estado === 'completado') {
-      btnEnv.disabled = false; btnEnv.textContent = '✅ Completado — Volver a enviar';
-      btnCan.style.display = 'none';
-      output.style.display = 'block'; output.textContent = d.salida || '(sin salida)';
-      cargarPendientesExcel(); cargarContadorBajas();
-      _detenerPollingAgente();
-    } else if (estado === 'error') {
-      btnEnv.disabled = false; btnEnv.textContent = '❌ Error — Reintentar';
-      btnCan.style.display = 'none';
-      output.style.display = 'block'; output.textContent = d.salida || 'Error desconocido';
-      _detenerPollingAgente();
-    } else if (estado === 'cancelado') {
-      btnEnv.disabled = false; btnEnv.textContent = '📡 Enviar al PC cliente';
-      btnCan.style.display = 'none';
-      output.style.display = 'block'; output.textContent = d.salida || 'Proceso detenido por el admin.';
-      cargarPendientesExcel();
-      _detenerPollingAgente();
-    }
-  } catch(e) { console.error('Estado agente error:', e); }
-}
-
-function _iniciarPollingAgente() {
-  if (!_agentePollingInterval)
-    _agentePollingInterval = setInterval(cargarEstadoAgente, 3000);
-}
-function _detenerPollingAgente() {
-  if (_agentePollingInterval) { clearInterval(_agentePollingInterval); _agentePollingInterval = null; }
-}
-
-async function enviarAlAgente() {
-  const desc = document.getElementById('count-pendientes-excel').textContent;
-  if (!confirm(`¿Enviar solicitud al agente cliente?\n\n${desc}\n\nRequisitos en el PC cliente:\n• Excel abierto con macros habilitadas\n• La macro NO debe estar ejecutada manualmente (el agente la lanza solo)\n• AGENTE_EXCEL.bat corriendo en consola`)) return;
-  try {
-    const r = await fetch('/api/admin/solicitar_bajas_cliente', { method: 'POST' });
-    const d = await r.json();
-    if (!d.success) { alert('❌ ' + (d.mensaje || 'Error al enviar solicitud')); return; }
-    cargarEstadoAgente();
-    _iniciarPollingAgente();
-  } catch(e) { alert('❌ Error de conexión: ' + e.message); }
-}
-
-async function cancelarSolicitudAgente() {
-  if (!confirm('¿Cancelar la solicitud pendiente?')) return;
-  try {
-    await fetch('/api/admin/cancelar_solicitud_cliente', { method: 'POST' });
-    cargarEstadoAgente();
-  } catch(e) { alert('Error: ' + e.message); }
-}
-</script>
-
-<!-- ════ SECCIÓN DADOS DE BAJA ════ -->
-<div id="seccion-bajas" class="card" style="display:none;margin-top:24px">
-  <div class="card-head" style="flex-wrap:wrap;gap:10px">
-    <h2 class="card-title">✅ Historial de Bajas</h2>
-    <div class="btn-row">
-      <input type="text" id="bajas-filtro" placeholder="🔍 Filtrar…"
-             oninput="cargarTablaBajas(this.value)"
-             style="padding:6px 10px;border:1.5px solid #e2e8f0;border-radius:6px;font-size:13px;width:200px">
-      <button onclick="cargarTablaBajas(document.getElementById('bajas-filtro').value)" class="btn btn-ghost btn-sm">🔄</button>
-    </div>
-  </div>
-  <div style="overflow-x:auto">
-    <table style="width:100%;border-collapse:collapse;font-size:13px">
-      <thead>
-        <tr style="background:#f8fafc;border-bottom:2px solid #e2e8f0">
-          <th style="padding:10px 12px;text-align:left;color:#475569">Código</th>
-          <th style="padding:10px 12px;text-align:left;color:#475569">Descripción</th>
-          <th style="padding:10px 12px;text-align:left;color:#475569">Estado original</th>
-          <th style="padding:10px 12px;text-align:left;color:#475569">Operario</th>
-          <th style="padding:10px 12px;text-align:left;color:#475569">Fecha/hora baja</th>
-        </tr>
-      </thead>
-      <tbody id="bajas-tbody">
-        <tr><td colspan="5" style="text-align:center;padding:18px;color:#64748b">Haz clic en "Ver Historial" para cargar</td></tr>
-      </tbody>
-    </table>
-  </div>
-</div>
-
-<!-- ════ SECCIÓN AGENTE BAJAS EXCEL ════ -->
-<div id="seccion-agente-setup" class="card" style="margin-top:24px">
-  <div class="card-head" style="flex-wrap:wrap;gap:10px">
-    <h2 class="card-title">📡 Agente Bajas Excel — Configuración del PC cliente</h2>
-    <a href="/admin/descargar_agente_zip" class="btn btn-success btn-sm">⬇️ Descargar todo (ZIP)</a>
-  </div>
-
-  <p style="color:#475569;font-size:13px;margin:0 0 16px">
-    El agente es un pequeño programa que se ejecuta en el ordenador que tiene acceso al Excel compartido.
-    Escucha órdenes del servidor y procesa las bajas automáticamente cuando el admin lo indica desde este panel.
-  </p>
-
-  <!-- Pasos -->
-  <div style="display:grid;grid-template-columns:repeat(auto-fill,minmax(260px,1fr));gap:14px;margin-bottom:20px">
-
-    <div style="background:#f0fdf4;border:1.5px solid #86efac;border-radius:10px;padding:14px">
-      <div style="font-weight:700;color:#166534;margin-bottom:6px">① Copiar archivos al PC cliente</div>
-      <p style="font-size:12px;color:#15803d;margin:0 0 10px">Descarga el ZIP y extráelo en el escritorio del PC que tiene Excel. Crea una carpeta llamada <code>AgenteExcel</code>.</p>
-      <div style="display:flex;flex-direction:column;gap:5px">
-        <a href="/admin/descargar_agente_zip" class="btn btn-success btn-sm" style="justify-content:center">⬇️ Descargar ZIP completo</a>
-        <div style="font-size:11px;color:#16a34a;text-align:center">— o descarga por separado —</div>
-        <a href="/admin/descargar_agente/INSTALAR_AGENTE.bat" class="btn btn-ghost btn-sm" style="justify-content:center;font-size:11px">📄 INSTALAR_AGENTE.bat</a>
-        <a href="/admin/descargar_agente/AGENTE_EXCEL.bat" class="btn btn-ghost btn-sm" style="justify-content:center;font-size:11px">📄 AGENTE_EXCEL.bat</a>
-        <a href="/admin/descargar_agente/baja_excel_agente.py" class="btn btn-ghost btn-sm" style="justify-content:center;font-size:11px">📄 baja_excel_agente.py</a>
-        <a href="/admin/descargar_agente/baja_excel.py" class="btn btn-ghost btn-sm" style="justify-content:center;font-size:11px">📄 baja_excel.py</a>
-      </div>
-    </div>
-
-    <div style="background:#eff6ff;border:1.5px solid #93c5fd;border-radius:10px;padding:14px">
-      <div style="font-weight:700;color:#1e40af;margin-bottom:6px">② Instalar Python y dependencias</div>
-      <p style="font-size:12px;color:#1d4ed8;margin:0 0 6px">En el PC cliente, si Python no está instalado:</p>
-      <ol style="font-size:12px;color:#1d4ed8;margin:0 0 8px;padding-left:18px;line-height:1.8">
-        <li>Descarga Python desde <strong>python.org/downloads</strong></li>
-        <li>Durante la instalación marca <strong>"Add Python to PATH"</strong></li>
-        <li>Doble clic en <strong>INSTALAR_AGENTE.bat</strong> — instala pywin32 y requests automáticamente</li>
-      </ol>
-      <div style="background:#dbeafe;border-radius:6px;padding:8px;font-size:11px;color:#1e40af">
-        ℹ️ Solo hay que hacer esto una vez por PC
-      </div>
-    </div>
-
-    <div style="background:#fdf4ff;border:1.5px solid #d8b4fe;border-radius:10px;padding:14px">
-      <div style="font-weight:700;color:#6b21a8;margin-bottom:6px">③ Arrancar el agente</div>
-      <ol style="font-size:12px;color:#7e22ce;margin:0 0 8px;padding-left:18px;line-height:1.8">
-        <li>Abre el Excel compartido con las <strong>macros habilitadas</strong></li>
-        <li>⚠️ <strong>NO ejecutes la macro manualmente</strong> — el agente la lanza él solo cuando recibe la orden</li>
-        <li>Doble clic en <strong>AGENTE_EXCEL.bat</strong></li>
-        <li>La primera vez te pide la <strong>IP del servidor</strong> y la <strong>contraseña admin</strong></li>
-        <li>Se queda en espera — ya no hace falta repetir este paso hasta cerrar la ventana</li>
-      </ol>
-      <div style="background:#fce7f3;border-radius:6px;padding:8px;font-size:11px;color:#9d174d;margin-bottom:6px">
-        ❌ Si ejecutas la macro antes de que el agente la llame, el proceso fallará
-      </div>
-      <div style="background:#f3e8ff;border-radius:6px;padding:8px;font-size:11px;color:#6b21a8">
-        💡 IP del servidor: <strong id="ip-servidor-texto">cargando…</strong>
-      </div>
-    </div>
-
-    <div style="background:#fff7ed;border:1.5px solid #fdba74;border-radius:10px;padding:14px">
-      <div style="font-weight:700;color:#9a3412;margin-bottom:6px">④ Usar desde este panel</div>
-      <ol style="font-size:12px;color:#c2410c;margin:0 0 8px;padding-left:18px;line-height:1.8">
-        <li>En el tile <strong>"📊 Procesar Bajas en Excel"</strong> verás el punto verde cuando el agente esté conectado</li>
-        <li>Pulsa <strong>"📡 Enviar al PC cliente"</strong></li>
-        <li>El agente procesa las bajas en Excel automáticamente</li>
-        <li>El historial se actualiza solo en <strong>"✅ Dados de Baja"</strong></li>
-      </ol>
-      <div style="background:#ffedd5;border-radius:6px;padding:8px;font-size:11px;color:#9a3412">
-        ⚠️ El Excel debe estar abierto con macros habilitadas, pero <strong>sin ejecutar ninguna macro manualmente</strong> — el agente se encarga de lanzarlas
-      </div>
-    </div>
-
-  </div>
-
-  <!-- Estado actual del agente -->
-  <div style="background:#f8fafc;border:1.5px solid #e2e8f0;border-radius:10px;padding:14px;display:flex;align-items:center;gap:12px;flex-wrap:wrap">
-    <span id="agente-setup-badge" style="display:inline-block;width:12px;height:12px;border-radius:50%;background:#94a3b8;flex-shrink:0"></span>
-    <span id="agente-setup-estado" style="font-size:13px;font-weight:600;color:#475569">Comprobando estado del agente…</span>
-    <span id="agente-setup-ultimo" style="font-size:11px;color:#94a3b8;margin-left:auto"></span>
-  </div>
-</div>
-"""
-
-def tpl_estado():
-    return """
-<!doctype html><html><head><meta charset="utf-8"><title>Estado: {{estado}}</title>
-<style>
-body{font-family:Segoe UI,Roboto,Arial,sans-serif;margin:0;padding:20px;background:#f8f9fa}
-.container{max-width:1400px;margin:0 auto;background:#fff;border-radius:12px;box-shadow:0 2px 10px rgba(0,0,0,.08);padding:20px}
-h1{text-transform:capitalize}
-table{width:100%;border-collapse:collapse;margin-top:10px}
-th,td{padding:10px;border:1px solid #e9ecef}
-th{background:#f8f9fa}
-th:nth-child(5),td:nth-child(5){width:85px;white-space:nowrap;font-size:12px}
-th:nth-child(1),td:nth-child(1){width:50px;text-align:center}
-th:nth-child(2),td:nth-child(2){width:90px}
-th:nth-child(3),td:nth-child(3){width:110px}
-th:nth-child(8),td:nth-child(8){width:85px;white-space:nowrap;font-size:12px}
-.row-green{background:#f6fff2}
-.row-amber{background:#fffbea}
-.row-red{background:#fff1f0}
-.row-critical-red{background-color:#ffd6d6 !important}
-.row-critical-amber{background-color:#fff3bf !important}
-.small{color:#6c757d}
-.alerta-exportacion{position:fixed;top:80px;right:20px;background:#fff3cd;border:1px solid #ffeaa7;border-left:4px solid #f0ad4e;border-radius:6px;padding:12px;box-shadow:0 2px 10px rgba(0,0,0,0.1);z-index:1000;max-width:350px;font-family:inherit;animation:slideInRight 0.3s ease-out}
-.alerta-contenido{display:flex;align-items:flex-start;gap:10px}
-.alerta-icono{font-size:20px;flex-shrink:0;margin-top:2px}
-.alerta-texto{flex:1;font-size:14px;line-height:1.3;color:#8a6d3b}
-.alerta-texto strong{color:#6b5429}
-.alerta-botones{display:flex;gap:6px;flex-shrink:0;margin-top:8px}
-.btn-alerta-admin,.btn-alerta-cerrar{padding:5px 12px;border:none;border-radius:4px;cursor:pointer;font-size:12px;font-weight:500;transition:all 0.15s ease}
-.btn-alerta-admin{background:#007bff;color:white;box-shadow:0 1px 3px rgba(0,123,255,0.3)}
-.btn-alerta-admin:hover{background:#0056b3;box-shadow:0 2px 5px rgba(0,123,255,0.4)}
-.btn-alerta-cerrar{background:#6c757d;color:white;box-shadow:0 1px 3px rgba(108,117,125,0.3)}
-.btn-alerta-cerrar:hover{background:#545b62;box-shadow:0 2px 5px rgba(108,117,125,0.4)}
-@keyframes slideInRight{from{transform:translateX(100%);opacity:0}to{transform:translateX(0);opacity:1}}
-@media (max-width: 768px){.alerta-exportacion{top:10px;right:10px;left:10px;max-width:none;font-size:13px}.alerta-contenido{flex-direction:column;gap:8px}.alerta-texto{font-size:13px}.btn-alerta-admin,.btn-alerta-cerrar{padding:8px 12px;font-size:13px}}
-.nav-header{display:flex;justify-content:space-between;align-items:center;margin-bottom:20px;border-bottom:2px solid #e9ecef;padding-bottom:15px}
-.btn-home{background:#007bff;color:#fff;text-decoration:none;padding:10px 20px;border-radius:8px;font-weight:bold}
-.btn-home:hover{background:#0056b3;color:#fff}
-.filters{margin:15px 0;display:flex;gap:10px;align-items:center}
-.filters input{padding:8px 12px;border:1px solid #ddd;border-radius:6px}
-.filters button{background:#28a745;color:#fff;border:none;padding:8px 16px;border-radius:6px;cursor:pointer}
-</style></head><body>
-<div class="container">
-  <div class="nav-header">
-    <h1>📋 Estado: {{estado}}</h1>
-    <a href="{{ url_for('home') }}" class="btn-home">🏠 Volver al Inicio</a>
-  </div>
-  
-  <div class="filters">
-    <input type="text" id="f_q" placeholder="Buscar por código, EAN o descripción..." style="min-width:300px">
-    <button id="btnFiltrar">🔍 Filtrar</button>
-    <button onclick="location.reload()" style="background:#6c757d">🔄 Limpiar</button>
-  </div>
-  
-  <p class="small">Atajos: F2 Registrar · F3 Asignar · F4 Devolver · F5 Gastado</p>
-  <table id="tbl">
-    <thead>
-      <tr><th>ID</th><th>Código</th><th>EAN</th><th>Descripción</th><th>Caducidad</th><th>Estado</th><th>Operario</th><th>Asignado</th></tr>
-    </thead>
-    <tbody id="body"></tbody>
-  </table>
-  <div id="sentinel" style="height:24px"></div>
-</div>
-<script>
-const estado = "{{ estado }}";
-let offset=0, loading=false, done=false;
-
-async function loadMore(){
-  if(loading||done) return; loading=true;
-  const q = document.getElementById('f_q')?.value || '';
-  const url = `/api/materiales?estado=${encodeURIComponent(estado)}&q=${encodeURIComponent(q)}&offset=${offset}&limit=50`;
-  const res = await fetch(url);
-  const data = await res.json();
-  if(data.length===0){ done=true; return; }
-  const tb=document.getElementById('body');
-  for(const m of data){
-    const tr=document.createElement('tr');
-    if(m.estado==='disponible') tr.className='row-green';
-    if(m.estado==='vence prox') tr.className='row-amber';
-    if(m.estado==='caducado') tr.className='row-red';
-    
-    // Sombreado especial para materiales en uso con problemas de fecha
-    if(m.estado==='en uso' && m.estado_critico==='caducado') {
-        tr.className='row-critical-red';
-    } else if(m.estado==='en uso' && m.estado_critico==='vence prox') {
-        tr.className='row-critical-amber';
-    }
-    
-    tr.innerHTML=`<td>${m.id}</td><td>${m.codigo}</td><td>${m.ean}</td>
-                  <td>${m.descripcion}</td><td>${m.caducidad}</td>
-                  <td>${m.estado_html}</td><td>${m.operario}</td><td>${m.asignado_at}</td>`;
-    tb.appendChild(tr);
-  }
-  offset+=data.length; loading=false;
-}
-const io=new IntersectionObserver((e)=>{ if(e[0].isIntersecting) loadMore(); });
-io.observe(document.getElementById('sentinel'));
-loadMore();
-
-// Funcionalidad del filtro
-document.getElementById('btnFiltrar').onclick=()=>{ 
-  document.getElementById('body').innerHTML=''; 
-  offset=0; 
-  done=false; 
-  loadMore(); 
-};
-
-// Filtrar con Enter
-document.getElementById('f_q').addEventListener('keypress', function(e){
-  if(e.key === 'Enter') {
-    document.getElementById('btnFiltrar').click();
-  }
-});
-
-// Atajos también aquí
-document.addEventListener('keydown', function(e){
-  const tag = (e.target.tagName || '').toLowerCase();
-  if (['input','textarea','select'].includes(tag)) return;
-  if (e.key === 'F2'){ e.preventDefault(); window.opener && window.opener.document.getElementById('openReg')?.click(); }
-  if (e.key === 'F3'){ e.preventDefault(); window.opener && window.opener.document.getElementById('openAsig')?.click(); }
-  if (e.key === 'F4'){ e.preventDefault(); window.opener && window.opener.document.getElementById('openDev')?.click(); }
-  if (e.key === 'F5'){ e.preventDefault(); window.opener && window.opener.document.getElementById('openGas')?.click(); }
-});
-
-// ---- Auto-logout tras 10 minutos sin actividad ----
-(function(){
-  const IDLE_MS = 10 * 60 * 1000;
-  let t = null;
-  function resetTimer(){
-    if (t) clearTimeout(t);
-    t = setTimeout(()=>{ window.location.href = '/logout'; }, IDLE_MS);
-  }
-  ['click','mousemove','keydown','touchstart','scroll'].forEach(ev=>{
-    window.addEventListener(ev, resetTimer, {passive:true});
-  });
-  resetTimer();
-})();
-</script>
-</body></html>
-"""
-
-def tpl_home():
-    return """
-<!doctype html><html><head><meta charset="utf-8"><title>Gestión de Materiales</title>
-<meta name="viewport" content="width=device-width,initial-scale=1.0">
-<link rel="manifest" href="/manifest.json">
-<meta name="theme-color" content="#1a73e8">
-<link rel="icon" type="image/png" href="/static/icons/icon-192.png">
-<link rel="apple-touch-icon" href="/static/icons/icon-192.png">
-<style>
-:root{
-  --bg:#f8f9fa; --card:#fff; --shadow:0 2px 10px rgba(0,0,0,.08);
-  --btn:#1a73e8; --btnh:#1558b0; --ok:#2e7d32; --warn:#c39200; --err:#c62828;
-}
-*{box-sizing:border-box}
-body{font-family:Segoe UI,Roboto,Arial,sans-serif;margin:0;padding:16px;background:var(--bg)}
-.container{max-width:1200px;margin:0 auto;background:var(--card);border-radius:14px;box-shadow:var(--shadow);padding:16px}
-h1{margin:8px 0 12px;text-align:center}
-.tag{display:inline-block;padding:6px 10px;border-radius:999px;background:#eef3ff;margin:6px 6px 0 0}
-.rolebar{display:flex;justify-content:space-between;align-items:center;margin:6px 0 10px;gap:10px}
-a.btnlink{padding:14px 16px;border-radius:14px;text-decoration:none;background:#eef3ff}
-
-/* ===== WIDGETS DE ESTADO MEJORADOS ===== */
-.statebar{
-  display:grid;
-  grid-template-columns:repeat(auto-fit,minmax(160px,1fr));
-  gap:12px;margin:20px 0 16px;
-  /* Forzar que todos los widgets normales estén en la misma línea */
-}
-
-/* Mejoras responsive para widgets */
-@media (max-width: 768px) {
-  .statebar{
-    grid-template-columns:repeat(auto-fit,minmax(140px,1fr));
-    gap:8px
-  }
-  .widget-count{font-size:24px}
-  .critical-count{font-size:32px;margin:0 8px}
-  .widget-trend{font-size:9px;padding:3px 6px}
-  .critical-trend{font-size:10px;padding:4px 8px}
-}
-
-@media (max-width: 1200px) and (min-width: 769px) {
-  .statebar{
-    grid-template-columns:repeat(auto-fit,minmax(150px,1fr));
-    gap:10px
-  }
-}
-
-/* Para pantallas grandes, mantener widgets en línea */
-@media (min-width: 1201px) {
-  .statebar{
-    grid-template-columns:repeat(6,1fr); /* Forzar 6 columnas máximo */
-    gap:14px
-  }
-}
-
-/* Widget crítico centrado - Estados dinámicos */
-.critical-widget-container{
-  display:flex;justify-content:center;
-  margin:35px 0 25px; /* Mucha más separación para destacar como elemento principal */
-  transition:all 0.5s ease;
-  position:relative
-}
-/* Separador visual sutil antes del widget crítico */
-.critical-widget-container::before{
-  content:'';position:absolute;top:-20px;left:50%;
-  transform:translateX(-50%);width:60px;height:2px;
-  background:linear-gradient(90deg,transparent,#f39c12,transparent);
-  border-radius:1px
-}
-
-/* Estado CALMADO (sin caducados) */
-.widget-critical{
-  position:relative;min-width:280px;max-width:350px;
-  background:linear-gradient(135deg,#fff3cd,#ffeaa7,#f1c40f);
-  border:2px solid #f39c12;box-shadow:0 4px 15px rgba(241,196,15,0.2);
-  transform:scale(1.02);color:#856404;text-align:center;
-  transition:all 0.8s cubic-bezier(0.4,0,0.2,1);
-  padding:16px /* Padding uniforme con trend arriba */
-}
-/* Widget crítico ya no necesita padding especial */
-.widget-critical::before{
-  background:linear-gradient(90deg,rgba(243,156,18,0.5),transparent);
-  height:2px;transition:all 0.5s ease
-}
-.widget-critical:hover{
-  transform:scale(1.04) translateY(-2px);
-  box-shadow:0 6px 20px rgba(241,196,15,0.3)
-}
-
-/* Estado CRÍTICO (con caducados) */
-.widget-critical.has-expired{
-  background:linear-gradient(135deg,#ff6b6b,#ee5a52,#e74c3c) !important;
-  border:3px solid #fff !important;
-  box-shadow:0 8px 32px rgba(231,76,60,0.4) !important;
-  transform:scale(1.05) !important;
-  animation:critical-pulse 2s infinite ease-in-out !important;
-  color:#fff !important
-}
-.widget-critical.has-expired::before{
-  background:linear-gradient(90deg,#fff,rgba(255,255,255,0.5),#fff) !important;
-  height:3px !important
-}
-.widget-critical.has-expired:hover{
-  transform:scale(1.08) translateY(-6px) !important;
-  box-shadow:0 12px 40px rgba(231,76,60,0.6) !important
-}
-
-/* Iconos dinámicos */
-.critical-icon{
-  font-size:36px;width:60px;height:60px;
-  background:rgba(133,100,4,0.1);color:#856404;
-  border:2px solid rgba(133,100,4,0.2);
-  transition:all 0.5s ease
-}
-.widget-critical.has-expired .critical-icon{
-  background:rgba(255,255,255,0.2) !important;
-  color:#fff !important;
-  border:2px solid rgba(255,255,255,0.3) !important;
-  animation:shake 1s infinite ease-in-out !important
-}
-
-/* Contadores dinámicos - Máximo protagonismo */
-.critical-count{
-  font-size:44px;font-weight:900;color:#856404;
-  text-shadow:0 3px 6px rgba(133,100,4,0.25);
-  transition:all 0.5s ease;flex:1;text-align:center;
-  margin:0 12px;line-height:1.1 /* Más compacto verticalmente */
-}
-.widget-critical.has-expired .critical-count{
-  color:#fff !important;
-  text-shadow:0 3px 6px rgba(0,0,0,0.3) !important;
-  animation:bounce-count 1.5s infinite ease-in-out !important
-}
-
-/* Labels dinámicos - Menos prominencia que el contador */
-.critical-label{
-  font-size:14px;font-weight:600; /* Menos peso que antes */
-  color:#856404;opacity:0.9; /* Menos prominencia */
-  text-transform:uppercase;letter-spacing:0.8px;
-  text-shadow:0 1px 2px rgba(133,100,4,0.15);
-  transition:all 0.5s ease;margin-top:8px
-}
-.widget-critical.has-expired .critical-label{
-  color:#fff !important;opacity:0.95 !important;
-  text-shadow:0 2px 4px rgba(0,0,0,0.25) !important;
-  font-weight:700 !important
-}
-
-/* Trends dinámicos críticos - Header superior */
-.critical-trend{
-  position:static; /* Ya no absoluto */
-  background:rgba(133,100,4,0.1);color:#856404;
-  font-size:11px;padding:5px 10px;border-radius:8px;
-  font-weight:500;text-transform:uppercase;letter-spacing:0.5px;
-  transition:all 0.5s ease;text-align:center;line-height:1.1;
-  opacity:0.85;margin-bottom:10px /* Header arriba del contador */
-}
-.widget-critical.has-expired .critical-trend{
-  background:rgba(255,255,255,0.9) !important;
-  color:#c0392b !important;
-  font-weight:600 !important;
-  opacity:0.95 !important;
-  box-shadow:0 1px 3px rgba(0,0,0,0.1) !important
-}
-
-/* Glow dinámico */
-.critical-widget-container.has-expired{
-  animation:pulse-glow 2s infinite ease-in-out
-}
-.widget{
-  position:relative;padding:14px;border-radius:14px;text-decoration:none;
-  background:linear-gradient(135deg,var(--bg-from),var(--bg-to));
-  box-shadow:0 4px 20px var(--shadow-color);
-  border:2px solid var(--border-color);
-  transition:all 0.3s cubic-bezier(0.4,0,0.2,1);
-  overflow:hidden;min-height:90px;display:block /* Más altura para acomodar el trend arriba */
-}
-.widget::before{
-  content:'';position:absolute;top:0;left:0;right:0;height:4px;
-  background:linear-gradient(90deg,var(--accent-1),var(--accent-2));
-  transform:scaleX(0);transition:transform 0.3s ease
-}
-.widget:hover{
-  transform:translateY(-4px) scale(1.02);
-  box-shadow:0 8px 30px var(--shadow-hover);
-}
-.widget:hover::before{transform:scaleX(1)}
-.widget-header{
-  display:flex;align-items:center;justify-content:space-between;
-  margin-bottom:12px;min-height:50px;
-  position:relative /* Ya no necesita padding-right */
-}
-.widget-icon{
-  font-size:28px;width:50px;height:50px;border-radius:12px;
-  display:flex;align-items:center;justify-content:center;
-  background:var(--icon-bg);color:var(--icon-color);
-  animation:pulse 2s infinite;flex-shrink:0 /* No se encoge */
-}
-.widget-count{
-  font-size:32px;font-weight:800;color:var(--text-primary);
-  text-shadow:0 2px 4px var(--text-shadow);
-  animation:countUp 0.8s ease-out;
-  flex:1;text-align:center;margin:0 10px /* Centrado con margen */
-}
-.widget-label{
-  font-size:14px;font-weight:600;color:var(--text-secondary);
-  text-transform:uppercase;letter-spacing:0.5px;margin-top:8px
-}
-.widget-trend{
-  position:static; /* Ya no es absoluto */
-  font-size:10px;padding:4px 8px;border-radius:6px;
-  background:var(--trend-bg);color:var(--trend-color);
-  font-weight:500;text-align:center;line-height:1.2;
-  margin-bottom:8px;text-transform:uppercase;letter-spacing:0.5px;
-  opacity:0.85 /* Comentario sutil arriba */
-}
-
-/* Estados específicos con gradientes y colores */
-.widget-red{
-  --bg-from:#ffe1e6;--bg-to:#ffd6d6;--border-color:#ff9aa2;
-  --text-primary:#8b0000;--text-secondary:#a0000f;
-  --icon-bg:rgba(255,87,87,0.2);--icon-color:#ff5757;
-  --shadow-color:rgba(255,87,87,0.3);--shadow-hover:rgba(255,87,87,0.4);
-  --accent-1:#ff6b6b;--accent-2:#ee5a52;--text-shadow:rgba(255,87,87,0.3);
-  --trend-bg:rgba(255,255,255,0.8);--trend-color:#d63031
-}
-.widget-blue{
-  --bg-from:#e3f2fd;--bg-to:#d7e3ff;--border-color:#90caf9;
-  --text-primary:#0d47a1;--text-secondary:#1565c0;
-  --icon-bg:rgba(33,150,243,0.2);--icon-color:#2196f3;
-  --shadow-color:rgba(33,150,243,0.3);--shadow-hover:rgba(33,150,243,0.4);
-  --accent-1:#42a5f5;--accent-2:#1e88e5;--text-shadow:rgba(33,150,243,0.3);
-  --trend-bg:rgba(255,255,255,0.8);--trend-color:#1565c0
-}
-.widget-amber{
-  --bg-from:#fff8e1;--bg-to:#fff3bf;--border-color:#ffcc02;
-  --text-primary:#e65100;--text-secondary:#f57c00;
-  --icon-bg:rgba(255,193,7,0.2);--icon-color:#ffc107;
-  --shadow-color:rgba(255,193,7,0.3);--shadow-hover:rgba(255,193,7,0.4);
-  --accent-1:#ffca28;--accent-2:#ffa000;--text-shadow:rgba(255,193,7,0.3);
-  --trend-bg:rgba(255,255,255,0.8);--trend-color:#e65100
-}
-.widget-green{
-  --bg-from:#e8f5e8;--bg-to:#d8f5d0;--border-color:#81c784;
-  --text-primary:#1b5e20;--text-secondary:#2e7d32;
-  --icon-bg:rgba(76,175,80,0.2);--icon-color:#4caf50;
-  --shadow-color:rgba(76,175,80,0.3);--shadow-hover:rgba(76,175,80,0.4);
-  --accent-1:#66bb6a;--accent-2:#43a047;--text-shadow:rgba(76,175,80,0.3);
-  --trend-bg:rgba(255,255,255,0.8);--trend-color:#2e7d32
-}
-.widget-cyan{
-  --bg-from:#e0f2f1;--bg-to:#bee9f3;--border-color:#4dd0e1;
-  --text-primary:#00695c;--text-secondary:#00796b;
-  --icon-bg:rgba(0,188,212,0.2);--icon-color:#00bcd4;
-  --shadow-color:rgba(0,188,212,0.3);--shadow-hover:rgba(0,188,212,0.4);
-  --accent-1:#26c6da;--accent-2:#00acc1;--text-shadow:rgba(0,188,212,0.3);
-  --trend-bg:rgba(255,255,255,0.8);--trend-color:#00796b
-}
-.widget-orange{
-  --bg-from:#fff3e0;--bg-to:#ffeaa7;--border-color:#ffb74d;
-  --text-primary:#e65100;--text-secondary:#f57c00;
-  --icon-bg:rgba(255,152,0,0.2);--icon-color:#ff9800;
-  --shadow-color:rgba(255,152,0,0.3);--shadow-hover:rgba(255,152,0,0.4);
-  --accent-1:#ffb74d;--accent-2:#fb8c00;--text-shadow:rgba(255,152,0,0.3);
-  --trend-bg:rgba(255,255,255,0.8);--trend-color:#e65100
-}
-.widget-gray{
-  --bg-from:#f5f5f5;--bg-to:#e9ecef;--border-color:#bdbdbd;
-  --text-primary:#424242;--text-secondary:#616161;
-  --icon-bg:rgba(158,158,158,0.2);--icon-color:#9e9e9e;
-  --shadow-color:rgba(158,158,158,0.3);--shadow-hover:rgba(158,158,158,0.4);
-  --accent-1:#bdbdbd;--accent-2:#757575;--text-shadow:rgba(158,158,158,0.3);
-  --trend-bg:rgba(255,255,255,0.8);--trend-color:#616161
-}
-
-/* ===== ALERTAS FLOTANTES ===== */
-.alert-container{
-  position:fixed;top:20px;right:20px;z-index:2000;
-  max-width:400px;pointer-events:none
-}
-.floating-alert{
-  background:white;border-radius:16px;padding:20px;margin-bottom:16px;
-  box-shadow:0 10px 40px rgba(0,0,0,0.15);
-  border-left:6px solid var(--alert-color);
-  animation:slideInRight 0.5s cubic-bezier(0.4,0,0.2,1);
-  pointer-events:auto;position:relative;overflow:hidden
-}
-.floating-alert::before{
-  content:'';position:absolute;top:0;left:0;right:0;height:2px;
-  background:linear-gradient(90deg,var(--alert-color),transparent);
-  animation:progress 5s linear forwards
-}
-.alert-header{
-  display:flex;align-items:center;gap:12px;margin-bottom:12px
-}
-.alert-icon{
-  font-size:24px;width:40px;height:40px;border-radius:50%;
-  display:flex;align-items:center;justify-content:center;
-  background:var(--alert-bg);color:var(--alert-color);
-  animation:bounce 1s ease-in-out infinite alternate
-}
-.alert-title{font-size:16px;font-weight:700;color:#2c3e50}
-.alert-body{color:#546e7a;font-size:14px;line-height:1.4;margin-bottom:16px}
-.alert-actions{display:flex;gap:8px}
-.alert-btn{
-  padding:8px 16px;border:none;border-radius:8px;font-size:12px;
-  font-weight:600;cursor:pointer;transition:all 0.2s ease
-}
-.alert-btn-primary{background:var(--alert-color);color:white}
-.alert-btn-secondary{background:#ecf0f1;color:#546e7a}
-.alert-btn:hover{transform:translateY(-1px);box-shadow:0 4px 12px rgba(0,0,0,0.15)}
-.alert-close{
-  position:absolute;top:16px;right:16px;background:none;border:none;
-  font-size:20px;color:#bdc3c7;cursor:pointer;
-  width:24px;height:24px;border-radius:50%;
-  display:flex;align-items:center;justify-content:center
-}
-.alert-close:hover{background:#ecf0f1;color:#7f8c8d}
-
-/* Tipos de alerta */
-.alert-critical{--alert-color:#e74c3c;--alert-bg:rgba(231,76,60,0.1)}
-.alert-warning{--alert-color:#f39c12;--alert-bg:rgba(243,156,18,0.1)}
-.alert-info{--alert-color:#3498db;--alert-bg:rgba(52,152,219,0.1)}
-.alert-success{--alert-color:#27ae60;--alert-bg:rgba(39,174,96,0.1)}
-
-/* Animaciones */
-@keyframes slideInRight{from{transform:translateX(100%);opacity:0}to{transform:translateX(0);opacity:1}}
-@keyframes pulse{0%{transform:scale(1)}50%{transform:scale(1.05)}100%{transform:scale(1)}}
-@keyframes bounce{0%{transform:translateY(0)}100%{transform:translateY(-4px)}}
-@keyframes countUp{from{transform:scale(0.8);opacity:0}to{transform:scale(1);opacity:1}}
-@keyframes progress{from{transform:scaleX(1)}to{transform:scaleX(0)}}
-
-/* Animaciones críticas */
-@keyframes critical-pulse{
-  0%{box-shadow:0 8px 32px rgba(231,76,60,0.4)}
-  50%{box-shadow:0 12px 40px rgba(231,76,60,0.7)}
-  100%{box-shadow:0 8px 32px rgba(231,76,60,0.4)}
-}
-@keyframes pulse-glow{
-  0%{filter:drop-shadow(0 0 10px rgba(231,76,60,0.3))}
-  50%{filter:drop-shadow(0 0 20px rgba(231,76,60,0.6))}
-  100%{filter:drop-shadow(0 0 10px rgba(231,76,60,0.3))}
-}
-@keyframes shake{
-  0%,100%{transform:translateX(0)}
-  25%{transform:translateX(-2px)}
-  75%{transform:translateX(2px)}
-}
-@keyframes bounce-count{
-  0%,100%{transform:scale(1)}
-  50%{transform:scale(1.1)}
-}
-@keyframes blink{
-  0%,100%{opacity:1}
-  50%{opacity:0.7}
-}
-
-/* Responsive */
-@media (max-width: 768px){
-  .statebar{grid-template-columns:repeat(auto-fit,minmax(140px,1fr));gap:12px}
-  .widget{padding:16px}
-  .widget-icon{font-size:24px;width:40px;height:40px}
-  .widget-count{font-size:24px}
-  .alert-container{top:10px;right:10px;left:10px;max-width:none}
-}
-.row-critical-red{background-color:#ffd6d6 !important}
-.row-critical-amber{background-color:#fff3bf !important}
-
-/* Botonera principal */
-.toolbar{display:flex;flex-wrap:wrap;gap:16px;justify-content:center;margin:22px 0 6px}
-.btn{padding:16px 20px;border:0;border-radius:14px;font-size:18px;color:#fff;background:var(--btn);cursor:pointer;min-width:220px;position:relative}
-.btn:hover{background:var(--btnh)}
-.btn-ok{background:#2e7d32} .btn-warn{background:#d99500} .btn-err{background:#c62828}
-.shortcut{position:absolute;right:10px;top:8px;font-size:12px;opacity:.7;color:#eaf1ff}
-
-/* Mensajes + tabla */
-.alert{padding:12px;border-radius:10px;margin:10px 0}
-.alert-success{background:#d4edda;border:1px solid #c3e6cb;color:#155724}
-.alert-error{background:#f8d7da;border:1px solid #f5c6cb;color:#721c24}
-.alert-warning{background:#fff3cd;border:1px solid #ffeeba;color:#856404}
-table{width:100%;border-collapse:collapse;margin-top:12px;table-layout:fixed}
-th,td{padding:7px 10px;border:1px solid #e9ecef;overflow:hidden;text-overflow:ellipsis;white-space:nowrap;vertical-align:middle}
-th{background:#f8f9fa}
-/* ID: oculto */
-th:nth-child(1),td:nth-child(1){display:none}
-/* Código */
-th:nth-child(2),td:nth-child(2){width:88px}
-/* EAN */
-th:nth-child(3),td:nth-child(3){width:135px;font-size:13px;color:#546e7a}
-/* Descripción: ancho fijo */
-th:nth-child(4),td:nth-child(4){width:220px}
-/* Caducidad */
-th:nth-child(5),td:nth-child(5){width:88px;font-size:12px;color:#546e7a;text-align:center}
-/* Estado */
-th:nth-child(6),td:nth-child(6){width:108px;text-align:center}
-/* Operario: más ancho para nombres completos */
-th:nth-child(7),td:nth-child(7){width:auto}
-/* Asignado: más ancho para la fecha completa */
-th:nth-child(8),td:nth-child(8){width:155px;font-size:12px;color:#78909c;text-align:center}
-.row-green{background:#f6fff2}
-.row-amber{background:#fffbea}
-.row-red{background:#fff1f0}
-
-/* Operario clickable */
-.op-link{background:none;border:none;color:#1565c0;cursor:pointer;font-size:inherit;padding:2px 4px;border-radius:4px;text-decoration:underline;text-align:left;display:inline-block}
-.op-link:hover{background:#e3f2fd;color:#0d47a1}
-
-/* Descripción clickable */
-.desc-link{background:none;border:none;color:#2e7d32;cursor:pointer;font-size:inherit;padding:2px 4px;border-radius:4px;text-align:left;display:inline-block;max-width:100%;overflow:hidden;text-overflow:ellipsis;white-space:nowrap}
-.desc-link:hover{background:#e8f5e9;color:#1b5e20;text-decoration:underline}
-
-/* Filtro activo pills */
-.filtro-pills{display:flex;flex-wrap:wrap;gap:8px;margin-top:6px}
-#filtro-op-pill,#filtro-desc-pill{display:none;align-items:center;gap:8px;border-radius:20px;padding:6px 14px;font-size:13px;font-weight:600;width:fit-content}
-#filtro-op-pill{background:#e3f2fd;border:1px solid #90caf9;color:#1565c0}
-#filtro-desc-pill{background:#e8f5e9;border:1px solid #a5d6a7;color:#2e7d32}
-#filtro-op-pill button,#filtro-desc-pill button{background:none;border:none;font-size:16px;cursor:pointer;line-height:1;padding:0 2px}
-#filtro-op-pill button:hover,#filtro-desc-pill button:hover{color:#c62828}
-
-
-/* Modales */
-.modal-backdrop{position:fixed;inset:0;background:rgba(0,0,0,.45);display:none;align-items:center;justify-content:center;z-index:1000}
-.modal{background:#fff;border-radius:16px;box-shadow:var(--shadow);width:min(700px,95%);padding:16px}
-.modal header{display:flex;justify-content:space-between;align-items:center;font-size:20px;font-weight:700}
-.modal .close{border:0;background:transparent;font-size:28px;cursor:pointer}
-.modal .row{display:flex;gap:10px;align-items:center;flex-wrap:wrap;margin:10px 0}
-.modal label{min-width:160px;font-size:16px}
-.modal input{flex:1;padding:12px;border:1px solid #ced4da;border-radius:10px;font-size:18px}
-.modal footer{display:flex;gap:10px;justify-content:flex-end;margin-top:12px}
-.warntext{color:#c62828;font-weight:700;margin-top:6px;display:none}
-</style></head><body>
-<div class="container">
-  <div class="rolebar" style="display:flex;align-items:center;gap:10px">
-    <div>
-      <span class="tag">Rol: <b>{{ role or 'operario' }}</b></span>
-      <span class="tag" id="reloj">🕒 <span id="hora-servidor">Cargando...</span></span>
-      <span class="tag" style="background:#4CAF50;color:white">✨ VERSIÓN MEJORADA v2.0 ✨</span>
-      <a class="btnlink" href="{{ url_for('logout') }}">Cerrar sesión</a>
-      <a class="btnlink" href="{{ url_for('admin') }}">⚙️ Admin</a>
-      <span class="btnlink" style="background:#ccc;color:#666;padding:6px 12px;border-radius:8px;cursor:not-allowed;opacity:0.6;" title="Próximamente disponible">🔧 Herramientas</span>
-    </div>
-  </div>
-
-  <!-- Widgets de estado mejorados -->
-  <div class="statebar" id="statebar">
-    <a class="widget widget-blue" href="{{ url_for('vista_estado', estado='en uso') }}">
-      <div class="widget-trend" id="trend-uso">Activo</div>
-      <div class="widget-header">
-        <div class="widget-icon">👷</div>
-        <div class="widget-count" id="cnt-uso">0</div>
-      </div>
-      <div class="widget-label">En Uso</div>
-    </a>
-    
-    <a class="widget widget-amber" href="{{ url_for('vista_estado', estado='vence prox') }}">
-      <div class="widget-trend" id="trend-prox">Atención</div>
-      <div class="widget-header">
-        <div class="widget-icon">⏰</div>
-        <div class="widget-count" id="cnt-prox">0</div>
-      </div>
-      <div class="widget-label">Vence Pronto</div>
-    </a>
-    
-    <a class="widget widget-green" href="{{ url_for('vista_estado', estado='disponible') }}">
-      <div class="widget-trend" id="trend-dispo">OK</div>
-      <div class="widget-header">
-        <div class="widget-icon">✅</div>
-        <div class="widget-count" id="cnt-dispo">0</div>
-      </div>
-      <div class="widget-label">Disponibles</div>
-    </a>
-    
-    <a class="widget widget-cyan" href="{{ url_for('vista_estado', estado='precintado') }}">
-      <div class="widget-trend" id="trend-pre">Nuevo</div>
-      <div class="widget-header">
-        <div class="widget-icon">📦</div>
-        <div class="widget-count" id="cnt-pre">0</div>
-      </div>
-      <div class="widget-label">Precintados</div>
-    </a>
-    
-    <a class="widget widget-orange" href="{{ url_for('vista_estado', estado='retirado') }}">
-      <div class="widget-trend" id="trend-ret">Archivado</div>
-      <div class="widget-header">
-        <div class="widget-icon">📤</div>
-        <div class="widget-count" id="cnt-ret">0</div>
-      </div>
-      <div class="widget-label">Retirados</div>
-    </a>
-    
-    <a class="widget widget-gray" href="{{ url_for('vista_estado', estado='gastado') }}">
-      <div class="widget-trend" id="trend-gas">Finalizado</div>
-      <div class="widget-header">
-        <div class="widget-icon">🗑️</div>
-        <div class="widget-count" id="cnt-gas">0</div>
-      </div>
-      <div class="widget-label">Gastados</div>
-    </a>
-  </div>
-
-  <!-- Widget CRÍTICO de Caducados - Destacado y centrado -->
-  <div class="critical-widget-container" id="critical-container">
-    <a class="widget widget-critical" id="critical-widget" href="{{ url_for('vista_estado', estado='caducado') }}">
-      <div class="widget-trend critical-trend" id="trend-cad">Todo OK</div>
-      <div class="widget-header">
-        <div class="widget-icon critical-icon" id="critical-icon">✅</div>
-        <div class="widget-count critical-count" id="cnt-cad">0</div>
-      </div>
-      <div class="widget-label critical-label" id="critical-label">MATERIALES CADUCADOS</div>
-    </a>
-  </div>
-
-  <!-- Contenedor de alertas flotantes -->
-  <div class="alert-container" id="alertContainer"></div>
-
-  {% with messages = get_flashed_messages(with_categories=true) %}
-    {% if messages %}{% for cat,msg in messages %}
-      {% if cat == 'error' %}
-        <script>
-          document.addEventListener('DOMContentLoaded', function() {
-            mostrarDialogoError('{{ msg|e }}');
-          });
-        </script>
-      {% else %}
-        <div class="alert alert-{{ cat }}">{{ msg }}</div>
-      {% endif %}
-    {% endfor %}{% endif %}
-  {% endwith %}
-
-  <!-- Botones táctiles grandes con atajos -->
-  <div class="toolbar">
-    <button class="btn btn-ok" id="openReg">➕ Registrar <span class="shortcut">(F2)</span></button>
-    <button class="btn" id="openAsig">👷 Asignar <span class="shortcut">(F3)</span></button>
-    <button class="btn btn-ok" id="openDev">↩️ Devolver <span class="shortcut">(F4)</span></button>
-    <button class="btn btn-warn" id="openRet">📤 Retirado <span class="shortcut">(F6)</span></button>
-    <button class="btn btn-err" id="openGas">🗑️ Gastado <span class="shortcut">(F5)</span></button>
-  </div>
-
-  <!-- Filtros -->
-  <form id="filtros" style="display:flex;gap:10px;align-items:center;flex-wrap:wrap;margin-top:8px">
-    <label>Estado:</label>
-    <select name="estado" id="f_estado">
-      {% for opt in ["todos","precintado","disponible","vence prox","caducado","en uso","gastado"] %}
-        <option value="{{opt}}">{{opt}}</option>
-      {% endfor %}
-    </select>
-    <label>Operario:</label>
-    <input type="text" id="f_operario" placeholder="Nº o nombre de operario" style="width:180px">
-    <label>Buscar:</label>
-    <input type="text" id="f_q" placeholder="Código, EAN o descripción" style="width:200px">
-    <button type="button" class="btn" id="btnFiltrar">🔍 Filtrar</button>
-    <button type="button" class="btn" id="btnLimpiar" style="background:#6c757d">✖ Limpiar</button>
-  </form>
-  <div class="filtro-pills">
-    <div id="filtro-op-pill">👷 Operario: <strong id="filtro-op-texto"></strong><button onclick="limpiarFiltroOperario()" title="Quitar filtro">×</button></div>
-    <div id="filtro-desc-pill">📦 Producto: <strong id="filtro-desc-texto"></strong><button onclick="limpiarFiltroDesc()" title="Quitar filtro">×</button></div>
-  </div>
-
-  <!-- Tabla con scroll infinito -->
-  <table>
-    <thead>
-      <tr><th>ID</th><th>Código</th><th>EAN</th><th>Descripción</th><th>Caducidad</th><th>Estado</th><th>Operario</th><th>Asignado</th></tr>
-    </thead>
-    <tbody id="body"></tbody>
-  </table>
-  <div id="sentinel" style="height:26px"></div>
-</div>
-
-<!-- Modales -->
-<div class="modal-backdrop" id="mb-reg">
-  <div class="modal">
-    <header>Registrar material <button class="close" data-close="mb-reg">×</button></header>
-    <form method="POST" id="formReg">
-      <input type="hidden" name="accion" value="registrar">
-      <div class="row"><label for="rg_ean">EAN</label><input id="rg_ean" name="ean" placeholder="13 dígitos (opcional)" autofocus></div>
-      <div class="row"><label for="rg_desc">Descripción</label><input id="rg_desc" name="descripcion" placeholder="se autocompleta por EAN si existe"></div>
-      <div class="row"><label for="rg_cod">Código interno</label><input id="rg_cod" name="codigo" placeholder="7 dígitos" required></div>
-      <div class="row"><label for="rg_cad">Caducidad</label><input id="rg_cad" name="caducidad" placeholder="ddmmaa o ddmmaaaa" required></div>
-      <footer><button type="button" class="btn" data-close="mb-reg">Cancelar</button><button type="submit" class="btn btn-ok">Registrar</button></footer>
-    </form>
-  </div>
-</div>
-
-<div class="modal-backdrop" id="mb-asig">
-  <div class="modal">
-    <header>Asignar material <button class="close" data-close="mb-asig">×</button></header>
-    <form method="POST" id="formAsig">
-      <input type="hidden" name="accion" value="asignar_directo">
-      <input type="hidden" name="confirmado" id="asig_conf" value="0">
-      <div class="row"><label for="as_cod">Código interno</label><input id="as_cod" name="codigo" placeholder="7 dígitos" required></div>
-      <div class="row"><label for="as_num">Nº operario</label><input id="as_num" name="operario_num" required></div>
-      <div class="row"><label for="as_nom">Nombre</label><input id="as_nom" placeholder="(auto)" readonly></div>
-      <div id="conflicto_msg" class="warntext">—</div>
-      <footer><button type="button" class="btn" data-close="mb-asig">Cancelar</button><button type="submit" id="btnAsignarSubmit" class="btn btn-ok">Asignar</button></footer>
-    </form>
-  </div>
-</div>
-
-<div class="modal-backdrop" id="mb-dev">
-  <div class="modal">
-    <header>Devolver material <button class="close" data-close="mb-dev">×</button></header>
-    <form method="POST" id="formDev">
-      <input type="hidden" name="accion" value="devolver_rapido">
-      <div class="row"><label for="dv_cod">Código interno</label><input id="dv_cod" name="codigo" placeholder="7 dígitos" required></div>
-      <footer><button type="button" class="btn" data-close="mb-dev">Cancelar</button><button type="submit" class="btn btn-ok">Devolver</button></footer>
-    </form>
-  </div>
-</div>
-
-<div class="modal-backdrop" id="mb-gas">
-  <div class="modal">
-    <header>Marcar gastado <button class="close" data-close="mb-gas">×</button></header>
-    <form method="POST" id="formGas">
-      <input type="hidden" name="accion" value="gastado_rapido">
-      <div class="row"><label for="gs_cod">Código interno</label><input id="gs_cod" name="codigo" placeholder="7 dígitos" required></div>
-      <footer><button type="button" class="btn" data-close="mb-gas">Cancelar</button><button type="submit" class="btn btn-err">Gastado</button></footer>
-    </form>
-  </div>
-</div>
-
-<div class="modal-backdrop" id="mb-ret">
-  <div class="modal">
-    <header>Marcar retirado <button class="close" data-close="mb-ret">×</button></header>
-    <form method="POST" id="formRet">
-      <input type="hidden" name="accion" value="retirado_rapido">
-      <div class="row"><label for="rt_cod">Código interno</label><input id="rt_cod" name="codigo" placeholder="7 dígitos" required></div>
-      <footer><button type="button" class="btn" data-close="mb-ret">Cancelar</button><button type="submit" class="btn btn-warn">Retirado</button></footer>
-    </form>
-  </div>
-</div>
-
-<!-- Modal de Autenticación -->
-<div class="modal-backdrop" id="mb-auth">
-  <div class="modal">
-    <header id="auth-title">🔐 Identificación requerida <button class="close" data-close="mb-auth">×</button></header>
-    <div style="margin: 15px 0; padding: 12px; background: #e3f2fd; border-radius: 8px; font-size: 14px;">
-      <strong>Operación:</strong> <span id="auth-operation"></span><br>
-      <strong>Permisos necesarios:</strong> <span id="auth-required-role"></span>
-    </div>
-    <form id="formAuth">
-      <div class="row"><label for="auth_numero">Nº Operario</label><input id="auth_numero" placeholder="Escanea o ingresa tu número" required autofocus></div>
-      <footer>
-        <button type="button" class="btn" data-close="mb-auth">Cancelar</button>
-        <button type="submit" class="btn btn-ok">Verificar</button>
-      </footer>
-    </form>
-  </div>
-</div>
-
-
-<script>
-// ====== helpers modal ======
-// ====== Reloj hora del servidor ======
-async function actualizarReloj(){
-  try {
-    const res = await fetch('/api/hora_servidor');
-    const data = await res.json();
-    document.getElementById("hora-servidor").textContent = data.full;
-  } catch (e) {
-    document.getElementById("hora-servidor").textContent = "Error al obtener hora";
-  }
-}
-
-// ====== Widgets y Alertas Mejoradas ======
-async function actualizarWidgets(){
-  try {
-    const res = await fetch('/api/contadores');
-    const data = await res.json();
-    
-    // Actualizar contadores en widgets
-    const caducados = data.caducado || 0;
-    document.getElementById("cnt-cad").textContent = caducados;
-    document.getElementById("cnt-uso").textContent = data["en uso"] || 0;
-    document.getElementById("cnt-prox").textContent = data["vence prox"] || 0;
-    document.getElementById("cnt-dispo").textContent = data.disponible || 0;
-    document.getElementById("cnt-pre").textContent = data.precintado || 0;
-    document.getElementById("cnt-ret").textContent = data.retirado || 0;
-    document.getElementById("cnt-gas").textContent = data.gastado || 0;
-    
-    // Actualizar trends dinámicamente
-    const porcentajeUso = data.porcentaje_uso || 0;
-    document.getElementById("trend-uso").textContent = `${porcentajeUso}%`;
-    
-    // ===== WIDGET CRÍTICO DINÁMICO =====
-    const criticalWidget = document.getElementById("critical-widget");
-    const criticalContainer = document.getElementById("critical-container");
-    const criticalIcon = document.getElementById("critical-icon");
-    const criticalTrend = document.getElementById("trend-cad");
-    
-    if (caducados > 0) {
-      // ESTADO CRÍTICO - Hay caducados
-      criticalWidget.classList.add("has-expired");
-      criticalContainer.classList.add("has-expired");
-      criticalIcon.textContent = "🚨";
-      criticalTrend.textContent = "¡URGENTE!";
-    } else {
-      // ESTADO CALMADO - No hay caducados
-      criticalWidget.classList.remove("has-expired");
-      criticalContainer.classList.remove("has-expired");
-      criticalIcon.textContent = "✅";
-      criticalTrend.textContent = "Todo OK";
-    }
-    
-    // Mostrar alertas flotantes si hay caducidades críticas
-    mostrarAlertas(data.alertas);
-    
-  } catch (e) {
-    console.error("Error actualizando widgets:", e);
-  }
-}
-
-function mostrarAlertas(alertas) {
-  const container = document.getElementById("alertContainer");
-  
-  // Limpiar alertas anteriores (solo las automáticas)
-  const alertasAntiguas = container.querySelectorAll('.auto-alert');
-  alertasAntiguas.forEach(alert => alert.remove());
-  
-  // Alertas de caducados críticos
-  if (alertas.caducados_criticos && alertas.caducados_criticos.length > 0) {
-    const totalCaducados = alertas.total_caducados;
-    const primeros = alertas.caducados_criticos.slice(0, 3);
-    
-    const alertaHtml = `
-      <div class="floating-alert alert-critical auto-alert">
-        <button class="alert-close" onclick="this.parentElement.remove()">×</button>
-        <div class="alert-header">
-          <div class="alert-icon">🚨</div>
-          <div class="alert-title">¡${totalCaducados} Materiales Caducados!</div>
-        </div>
-        <div class="alert-body">
-          ${primeros.map(item => `
-            <div style="margin:4px 0;padding:4px 8px;background:rgba(231,76,60,0.1);border-radius:4px;font-size:12px">
-              <strong>${item.codigo}</strong> - ${item.descripcion.substring(0,30)}${item.descripcion.length > 30 ? '...' : ''}
-              <br><span style="color:#e74c3c;font-weight:600">${item.dias_caducado} días caducado</span>
-              ${item.operario ? ` • Asignado a: ${item.operario}` : ''}
-            </div>
-          `).join('')}
-          ${totalCaducados > 3 ? `<div style="margin-top:8px;color:#7f8c8d;font-size:12px">...y ${totalCaducados - 3} más</div>` : ''}
-        </div>
-        <div class="alert-actions">
-          <button class="alert-btn alert-btn-primary" onclick="window.location.href='/estado/caducado'">
-            Ver Todos
-          </button>
-          <button class="alert-btn alert-btn-secondary" onclick="this.closest('.floating-alert').remove()">
-            Cerrar
-          </button>
-        </div>
-      </div>
-    `;
-    container.insertAdjacentHTML('beforeend', alertaHtml);
-  }
-  
-  // Alertas de vencimientos de hoy
-  if (alertas.vencen_hoy && alertas.vencen_hoy.length > 0) {
-    const vencenHoy = alertas.vencen_hoy.slice(0, 2);
-    
-    const alertaHtml = `
-      <div class="floating-alert alert-warning auto-alert">
-        <button class="alert-close" onclick="this.parentElement.remove()">×</button>
-        <div class="alert-header">
-          <div class="alert-icon">⏰</div>
-          <div class="alert-title">¡${alertas.total_vencen_hoy} Vencen HOY!</div>
-        </div>
-        <div class="alert-body">
-          ${vencenHoy.map(item => `
-            <div style="margin:4px 0;padding:4px 8px;background:rgba(243,156,18,0.1);border-radius:4px;font-size:12px">
-              <strong>${item.codigo}</strong> - ${item.descripcion.substring(0,30)}${item.descripcion.length > 30 ? '...' : ''}
-              ${item.operario ? `<br>Asignado a: ${item.operario}` : ''}
-            </div>
-          `).join('')}
-          ${alertas.total_vencen_hoy > 2 ? `<div style="margin-top:8px;color:#7f8c8d;font-size:12px">...y ${alertas.total_vencen_hoy - 2} más</div>` : ''}
-        </div>
-        <div class="alert-actions">
-          <button class="alert-btn alert-btn-primary" onclick="window.location.href='/estado/vence%20prox'">
-            Revisar
-          </button>
-          <button class="alert-btn alert-btn-secondary" onclick="this.closest('.floating-alert').remove()">
-            OK
-          </button>
-        </div>
-      </div>
-    `;
-    container.insertAdjacentHTML('beforeend', alertaHtml);
-  }
-  
-  // Alertas de vencimientos de mañana
-  if (alertas.vencen_manana && alertas.vencen_manana.length > 0) {
-    const alertaHtml = `
-      <div class="floating-alert alert-info auto-alert">
-        <button class="alert-close" onclick="this.parentElement.remove()">×</button>
-        <div class="alert-header">
-          <div class="alert-icon">📅</div>
-          <div class="alert-title">${alertas.total_vencen_manana} Vencen Mañana</div>
-        </div>
-        <div class="alert-body">
-          Hay materiales programados para vencer mañana. Planifica su uso o devolución.
-        </div>
-        <div class="alert-actions">
-          <button class="alert-btn alert-btn-primary" onclick="window.location.href='/estado/vence%20prox'">
-            Ver Lista
-          </button>
-          <button class="alert-btn alert-btn-secondary" onclick="this.closest('.floating-alert').remove()">
-            Recordar
-          </button>
-        </div>
-      </div>
-    `;
-    container.insertAdjacentHTML('beforeend', alertaHtml);
-  }
-  
-  // Auto-ocultar alertas después de 15 segundos
-  setTimeout(() => {
-    const alertasAuto = container.querySelectorAll('.auto-alert');
-    alertasAuto.forEach(alert => {
-      if (alert.parentElement) {
-        alert.style.animation = 'slideInRight 0.3s reverse';
-        setTimeout(() => alert.remove(), 300);
-      }
-    });
-  }, 15000);
-}
-
-// Inicializar sistema
-actualizarReloj();
-actualizarWidgets();
-setInterval(actualizarReloj, 10000);
-setInterval(actualizarWidgets, 30000); // Actualizar widgets cada 30s
-function openModal(id){ document.getElementById(id).style.display='flex'; }
-function closeModal(id){ document.getElementById(id).style.display='none'; }
-document.querySelectorAll('.close,[data-close]').forEach(el=>{
-  el.addEventListener('click', ()=>{ closeModal(el.getAttribute('data-close') || el.closest('.modal-backdrop').id); });
-});
-// Configuración de permisos por operación
-const operationPermissions = {
-  'registrar': { roles: ['almacenero', 'admin'], modal: 'mb-reg', focus: 'rg_ean' },
-  'asignar': { roles: ['operario', 'almacenero', 'admin'], modal: 'mb-asig', focus: 'as_cod' },
-  'devolver': { roles: ['almacenero', 'admin'], modal: 'mb-dev', focus: 'dv_cod' },
-  'retirado': { roles: ['almacenero', 'admin'], modal: 'mb-ret', focus: 'rt_cod' },
-  'gastado': { roles: ['almacenero', 'admin'], modal: 'mb-gas', focus: 'gs_cod' }
-};
-
-// Variable global para la operación pendiente
-let pendingOperation = null;
-let currentUser = null;
-
-// Función para verificar autenticación
-function requireAuth(operation) {
-  const config = operationPermissions[operation];
-  if (!config) return false;
-  
-  // Mostrar modal de autenticación
-  document.getElementById('auth-operation').textContent = operation.charAt(0).toUpperCase() + operation.slice(1);
-  document.getElementById('auth-required-role').textContent = config.roles.join(', ');
-  pendingOperation = operation;
-  openModal('mb-auth');
-  setTimeout(() => document.getElementById('auth_numero').focus(), 20);
-  return false;
-}
-
-// Event listeners para botones principales
-document.getElementById('openReg').onclick = () => requireAuth('registrar');
-document.getElementById('openAsig').onclick = () => requireAuth('asignar');
-document.getElementById('openDev').onclick = () => requireAuth('devolver');
-document.getElementById('openRet').onclick = () => requireAuth('retirado');
-document.getElementById('openGas').onclick = () => requireAuth('gastado');
-
-// ====== Atajos de teclado globales ======
-document.addEventListener('keydown', function(e){
-  const tag = (e.target.tagName || '').toLowerCase();
-  if (['input','textarea','select'].includes(tag)) return;
-  if (e.key === 'F2'){ e.preventDefault(); document.getElementById('openReg').click(); }
-  if (e.key === 'F3'){ e.preventDefault(); document.getElementById('openAsig').click(); }
-  if (e.key === 'F4'){ e.preventDefault(); document.getElementById('openDev').click(); }
-  if (e.key === 'F5'){ e.preventDefault(); document.getElementById('openGas').click(); }
-  if (e.key === 'F6'){ e.preventDefault(); document.getElementById('openRet').click(); }
-});
-
-// ====== Manejo de autenticación ======
-document.getElementById('formAuth').addEventListener('submit', async function(e) {
-  e.preventDefault();
-  
-  const numero = document.getElementById('auth_numero').value.trim();
-  
-  if (!numero) {
-    alert('Escanea o ingresa tu número de operario');
-    return;
-  }
-  
-  try {
-    const response = await fetch('/api/auth', {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ numero: numero })
-    });
-    
-    const data = await response.json();
-    
-    if (data.success) {
-      currentUser = data.user;
-      const config = operationPermissions[pendingOperation];
-      
-      if (config && config.roles.includes(data.user.rol)) {
-        closeModal('mb-auth');
-        openModal(config.modal);
-        setTimeout(() => {
-          const focusElement = document.getElementById(config.focus);
-          if (focusElement) focusElement.focus();
-        }, 100);
-      } else {
-        alert(`No tienes permisos para esta operación. Se requiere: ${config.roles.join(', ')}`);
-      }
-    } else {
-      alert('Número de operario no válido');
-    }
-  } catch (error) {
-    alert('Error de conexión');
-  }
-  
-  document.getElementById('auth_numero').value = '';
-});
-
-function mostrarAlertaCaducados(totalCaducados) {
-    let alertaDiv = document.getElementById('alerta-caducados');
-    if (!alertaDiv) {
-        alertaDiv = document.createElement('div');
-        alertaDiv.id = 'alerta-caducados';
-        alertaDiv.className = 'alerta-exportacion';
-        alertaDiv.innerHTML = `
-            <div class="alerta-contenido">
-                <span class="alerta-icono">⚠️</span>
-                <div style="flex: 1;">
-                    <div class="alerta-texto">
-                        <strong>Productos Caducados Detectados</strong><br>
-                        Hay <span id="total-caducados">${totalCaducados}</span> productos caducados (incluyendo retirados/gastados).<br>
-                        <small>Se recomienda exportar los datos y actualizar el archivo de red.</small>
-                    </div>
-                    <div class="alerta-botones">
-                        <button onclick="irAAdmin()" class="btn-alerta-admin">📊 Ir a Admin</button>
-                        <button onclick="ocultarAlertaCaducados()" class="btn-alerta-cerrar">×</button>
-                    </div>
-                </div>
-            </div>
-        `;
-        document.body.insertBefore(alertaDiv, document.body.firstChild);
-    } else {
-        document.getElementById('total-caducados').textContent = totalCaducados;
-        alertaDiv.style.display = 'block';
-    }
-}
-
-function ocultarAlertaCaducados() {
-    const alertaDiv = document.getElementById('alerta-caducados');
-    if (alertaDiv) {
-        alertaDiv.style.display = 'none';
-    }
-}
-
-function mostrarDialogoError(mensaje) {
-    const overlay = document.createElement('div');
-    overlay.id = 'error-dialog-overlay';
-    overlay.style.cssText = `
-        position: fixed;
-        top: 0;
-        left: 0;
-        width: 100%;
-        height: 100%;
-        background: rgba(0,0,0,0.5);
-        z-index: 10000;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-    `;
-    
-    const dialog = document.createElement('div');
-    dialog.style.cssText = `
-        background: white;
-        padding: 20px;
-        border-radius: 10px;
-        box-shadow: 0 4px 8px rgba(0,0,0,0.3);
-        max-width: 400px;
-        text-align: center;
-        font-family: inherit;
-    `;
-    
-    dialog.innerHTML = `
-        <div style="color: #721c24; font-size: 18px; margin-bottom: 15px;">
-            ❌ Error
-        </div>
-        <div style="color: #721c24; margin-bottom: 20px; line-height: 1.4;">
-            ${mensaje}
-        </div>
-        <button id="error-dialog-btn" onclick="cerrarDialogoError()" style="
-            background: #dc3545;
-            color: white;
-            border: none;
-            padding: 10px 20px;
-            border-radius: 5px;
-            cursor: pointer;
-            font-size: 14px;
-        ">Aceptar</button>
-    `;
-    
-    overlay.appendChild(dialog);
-    document.body.appendChild(overlay);
-    
-    // Enfocar el botón y añadir evento de teclado
-    const button = document.getElementById('error-dialog-btn');
-    button.focus();
-    
-    // Cerrar con Enter o Escape
-    const handleKeydown = (e) => {
-        if (e.key === 'Enter' || e.key === 'Escape') {
-            cerrarDialogoError();
-            document.removeEventListener('keydown', handleKeydown);
-        }
-    };
-    
-    document.addEventListener('keydown', handleKeydown);
-}
-
-function cerrarDialogoError() {
-    const overlay = document.getElementById('error-dialog-overlay');
-    if (overlay) {
-        overlay.remove();
-    }
-}
-
-function irAAdmin() {
-    window.location.href = '/admin';
-}
-
-async function loadCounters(){
-  try{
-    const r = await fetch('/api/contadores');
-    const j = await r.json();
-    document.getElementById('cnt-cad').textContent  = j["caducado"] ?? 0;
-    document.getElementById('cnt-uso').textContent  = j["en uso"] ?? 0;
-    document.getElementById('cnt-prox').textContent = j["vence prox"] ?? 0;
-    document.getElementById('cnt-dispo').textContent= j["disponible"] ?? 0;
-    document.getElementById('cnt-pre').textContent  = j["precintado"] ?? 0;
-    document.getElementById('cnt-ret').textContent  = j["retirado"] ?? 0;
-    document.getElementById('cnt-gas').textContent  = j["gastado"] ?? 0;
-    
-    // Mostrar alerta de productos caducados para exportación
-    if (j.alerta_caducados && j.total_caducados > 0) {
-        mostrarAlertaCaducados(j.total_caducados);
-    } else {
-        ocultarAlertaCaducados();
-    }
-  }catch(e){}
-}
-loadCounters();
-
-// ====== Registro (con chequeo de duplicados) ======
-function nextOnEnter(id,nextId,before){ const el=document.getElementById(id); if(!el) return;
-  el.addEventListener('keydown', ev=>{ if(ev.key==='Enter'){ ev.preventDefault(); if(typeof before==='function') before(); const nx=document.getElementById(nextId); if(nx) nx.focus(); }});
-}
-async function checkEAN(){
-  const ean=document.getElementById('rg_ean').value.trim();
-  const desc=document.getElementById('rg_desc');
-  if(!ean) return;
-  if(!/^\\d{13}$/.test(ean)){ alert('EAN debe tener 13 dígitos'); return; }
-  try{ 
-    const r=await fetch('/api/get_descripcion_by_ean?ean='+encodeURIComponent(ean)); 
-    const j=await r.json(); 
-    if(j.descripcion){ 
-      desc.value=j.descripcion;
-      desc.setAttribute('readonly', 'true');
-      document.getElementById('rg_cod').focus();
-    } else {
-      desc.removeAttribute('readonly');
-      desc.focus();
-    }
-  }catch(e){}
-}
-async function checkCodigoDuplicado(){
-  const cod = document.getElementById('rg_cod').value.trim();
-  if(!/^\\d{7}$/.test(cod)) return;
-  try{
-    const r = await fetch('/api/check_codigo?codigo=' + encodeURIComponent(cod));
-    const j = await r.json();
-    if(j.existe){
-      alert(`El código ${cod} ya existe. No se puede registrar.`);
-      closeModal('mb-reg');
-      window.location.href = '/';
-    }
-  }catch(e){}
-}
-document.getElementById('rg_ean').addEventListener('blur', checkEAN);
-nextOnEnter('rg_ean','rg_desc', checkEAN);
-nextOnEnter('rg_desc','rg_cod');
-nextOnEnter('rg_cod','rg_cad', checkCodigoDuplicado);
-nextOnEnter('rg_cad','', function() {
-  document.getElementById('formReg').requestSubmit();
-});
-document.getElementById('rg_desc').addEventListener('keydown', e=>{ if(e.key==='Enter'){ e.preventDefault(); document.getElementById('formReg').requestSubmit(); }});
-document.getElementById('rg_cod').addEventListener('blur', checkCodigoDuplicado);
-document.getElementById('formReg').addEventListener('submit', async function(e){
-  const cod=document.getElementById('rg_cod').value.trim();
-  const ean=document.getElementById('rg_ean').value.trim();
-  if(!/^\\d{7}$/.test(cod)){ e.preventDefault(); alert('Código interno = 7 dígitos'); return; }
-  if(ean && !/^\\d{13}$/.test(ean)){ e.preventDefault(); alert('EAN debe tener 13 dígitos'); return; }
-  try{
-    const r = await fetch('/api/check_codigo?codigo=' + encodeURIComponent(cod));
-    const j = await r.json();
-    if(j.existe){
-      e.preventDefault();
-      alert(`El código ${cod} ya existe. No se puede registrar.`);
-      closeModal('mb-reg');
-      window.location.href = '/';
-      return;
-    }
-  }catch(e){
-    e.preventDefault();
-    alert('Error al verificar el código.');
-    return;
-  }
-  setTimeout(loadCounters, 500);
-});
-
-// ====== Asignación (conflicto inmediato) ======
-const asNum = document.getElementById('as_num');
-const asCod = document.getElementById('as_cod');
-const asNom = document.getElementById('as_nom');
-const asBtn = document.getElementById('btnAsignarSubmit');
-const conflictoMsg = document.getElementById('conflicto_msg');
-
-async function fillOperarioName(){
-  const num=asNum.value.trim();
-  asNom.value='';
-  if(num){
-    try{
-      const r=await fetch('/api/operario_nombre?numero='+encodeURIComponent(num));
-      const j=await r.json();
-      if(j.nombre){ asNom.value=j.nombre; }
-      else{
-        if(confirm('Operario no existe. ¿Darlo de alta ahora?')){
-          const nombre = prompt('Nombre del operario:','');
-          if(nombre && nombre.trim()){
-            const fd=new FormData(); fd.append('numero',num); fd.append('nombre',nombre.trim());
-            const rr=await fetch('/api/operario_add',{method:'POST', body:fd});
-            const jj=await rr.json();
-            if(jj.ok){ asNom.value=nombre.trim(); alert('Operario guardado.'); }
-            else alert('No se pudo guardar operario.');
-          }
-        }
-      }
-    }catch(e){}
-  }
-  await checkConflict();
-}
-async function checkConflict(){
-  conflictoMsg.style.display='none';
-  asBtn.disabled=false;
-  const num=asNum.value.trim();
-  const cod=asCod.value.trim();
-  if(!/^\\d{7}$/.test(cod) || !num) return;
-  try{
-    const r=await fetch(`/api/operario_conflicto_ean?codigo=${encodeURIComponent(cod)}&operario_num=${encodeURIComponent(num)}`);
-    const j=await r.json();
-    if(j.ok && j.conflicto){
-      conflictoMsg.textContent = `No puedes asignarte este producto: ya tienes otro con el mismo EAN (${j.ean}). Devuélvelo primero (código ${j.otro_codigo}${j.otra_desc? ' - '+j.otra_desc : ''}).`;
-      conflictoMsg.style.display='block';
-      asBtn.disabled = true;
-    }
-  }catch(e){}
-}
-asCod.addEventListener('keydown', ev=>{ if(ev.key==='Enter'){ ev.preventDefault(); asNum.focus(); } });
-asNum.addEventListener('keydown', ev=>{ if(ev.key==='Enter'){ ev.preventDefault(); asNom.focus(); } });
-asNum.addEventListener('blur', fillOperarioName);
-asNum.addEventListener('input', ()=>{ conflictoMsg.style.display='none'; asBtn.disabled=false; });
-asCod.addEventListener('blur', checkConflict);
-asCod.addEventListener('input', ()=>{ conflictoMsg.style.display='none'; asBtn.disabled=false; });
-
-document.getElementById('formAsig').addEventListener('submit', async function(e){
-  const codigo=asCod.value.trim();
-  const num=asNum.value.trim();
-  if(!/^\\d{7}$/.test(codigo)){ e.preventDefault(); alert('Código interno = 7 dígitos'); return; }
-  if(!num){ e.preventDefault(); alert('Nº de operario obligatorio'); return; }
-  if(asBtn.disabled){ e.preventDefault(); alert('No puedes asignarte este producto hasta devolver el otro con el mismo EAN.'); return; }
-  e.preventDefault();
-  try{
-    const r=await fetch('/api/info_material?codigo='+encodeURIComponent(codigo)); const j=await r.json();
-    if(!j.existe){ alert('El código no existe. Regístralo primero.'); return; }
-    if(j.estado==='gastado'){ alert('No se puede asignar: material gastado.'); return; }
-    if(j.caducado){ alert('No se puede asignar: material CADUCADO.'); return; }
-    if(j.vence_prox){
-      if(!confirm('Atención: vence pronto ('+j.caducidad+'). ¿Asignar igualmente?')) return;
-      document.getElementById('asig_conf').value='1';
-    }
-  }catch(e){ alert('No se pudo comprobar el estado.'); return; }
-  this.submit();
-  setTimeout(loadCounters, 500);
-});
-
-// ====== Scroll infinito ======
-let offset=0, loading=false, done=false;
-const bodyT=document.getElementById('body');
-const estadoSel=document.getElementById('f_estado');
-const qInp=document.getElementById('f_q');
-const opInp=document.getElementById('f_operario');
-
-async function loadMore(){
-  if(loading||done) return; loading=true;
-  const res=await fetch(`/api/materiales?estado=${encodeURIComponent(estadoSel.value)}&q=${encodeURIComponent(qInp.value)}&operario=${encodeURIComponent(opInp.value)}&offset=${offset}&limit=50`);
-  const data=await res.json();
-  if(data.length===0){ done=true; loading=false; return; }
-  for(const m of data){
-    const tr=document.createElement('tr');
-    if(m.estado==='disponible') tr.className='row-green';
-    if(m.estado==='vence prox') tr.className='row-amber';
-    if(m.estado==='caducado') tr.className='row-red';
-    
-    // Sombreado especial para materiales en uso con problemas de fecha
-    if(m.estado==='en uso' && m.estado_critico==='caducado') {
-        tr.className='row-critical-red';
-    } else if(m.estado==='en uso' && m.estado_critico==='vence prox') {
-        tr.className='row-critical-amber';
-    }
-    
-    // Celda de operario: clickable si tiene operario asignado
-    let opCell;
-    if(m.operario_numero){
-      opCell=`<button class="op-link" data-num="${m.operario_numero}" data-display="${m.operario.replace(/"/g,'&quot;')}">${m.operario}</button>`;
-    } else {
-      opCell=m.operario;
-    }
-    // Celda de descripción: siempre clickable
-    const descEsc=m.descripcion.replace(/"/g,'&quot;');
-    const descCell=`<button class="desc-link" data-q="${descEsc}" title="Ver todos con este producto">${m.descripcion}</button>`;
-    
-    tr.innerHTML=`<td>${m.id}</td><td>${m.codigo}</td><td>${m.ean}</td><td>${descCell}</td><td>${m.caducidad}</td><td>${m.estado_html}</td><td>${opCell}</td><td>${m.asignado_at}</td>`;
-    bodyT.appendChild(tr);
-  }
-  offset+=data.length; loading=false;
-}
-
-// Click en operario → filtrar tabla directamente
-bodyT.addEventListener('click', function(e){
-  const btnOp=e.target.closest('.op-link');
-  if(btnOp){
-    opInp.value=btnOp.dataset.num;
-    mostrarPillOperario(btnOp.dataset.display);
-    bodyT.innerHTML=''; offset=0; done=false; loadMore();
-    return;
-  }
-  const btnDesc=e.target.closest('.desc-link');
-  if(btnDesc){
-    qInp.value=btnDesc.dataset.q;
-    mostrarPillDesc(btnDesc.dataset.q);
-    bodyT.innerHTML=''; offset=0; done=false; loadMore();
-  }
-});
-
-function mostrarPillOperario(texto){
-  document.getElementById('filtro-op-texto').textContent=texto;
-  document.getElementById('filtro-op-pill').style.display='flex';
-}
-function limpiarFiltroOperario(){
-  opInp.value='';
-  document.getElementById('filtro-op-pill').style.display='none';
-  bodyT.innerHTML=''; offset=0; done=false; loadMore();
-}
-function mostrarPillDesc(texto){
-  document.getElementById('filtro-desc-texto').textContent=texto;
-  document.getElementById('filtro-desc-pill').style.display='flex';
-}
-function limpiarFiltroDesc(){
-  qInp.value='';
-  document.getElementById('filtro-desc-pill').style.display='none';
-  bodyT.innerHTML=''; offset=0; done=false; loadMore();
-}
-
-const io=new IntersectionObserver((e)=>{ if(e[0].isIntersecting) loadMore(); });
-io.observe(document.getElementById('sentinel'));
-loadMore();
-document.getElementById('btnFiltrar').onclick=()=>{ if(!opInp.value) document.getElementById('filtro-op-pill').style.display='none'; if(!qInp.value) document.getElementById('filtro-desc-pill').style.display='none'; bodyT.innerHTML=''; offset=0; done=false; loadMore(); };
-document.getElementById('btnLimpiar').onclick=()=>{ estadoSel.value='todos'; qInp.value=''; opInp.value=''; document.getElementById('filtro-op-pill').style.display='none'; document.getElementById('filtro-desc-pill').style.display='none'; bodyT.innerHTML=''; offset=0; done=false; loadMore(); };
-
-document.addEventListener('click', e=>{
-  if(e.target.classList.contains('modal-backdrop')) e.target.style.display='none';
-});
-
-// ---- Auto-logout tras 10 minutos sin actividad ----
-(function(){
-  const IDLE_MS = 10 * 60 * 1000;
-  let t = null;
-  function resetTimer(){
-    if (t) clearTimeout(t);
-    t = setTimeout(()=>{ window.location.href = '/logout'; }, IDLE_MS);
-  }
-  ['click','mousemove','keydown','touchstart','scroll'].forEach(ev=>{
-    window.addEventListener(ev, resetTimer, {passive:true});
-  });
-  resetTimer();
-})();
-
-// ---- Service Worker (PWA install prompt) ----
-if ('serviceWorker' in navigator) {
-  window.addEventListener('load', () => {
-    navigator.serviceWorker.register('/sw.js').catch(() => {});
-  });
-}
-</script>
-</body></html>
-"""
+# Las páginas están en templates/ (home.html, admin.html, estado.html, login.html); ver
+# la configuración de Jinja junto a la creación de la app.
 
 @app.get("/api/operario/<numero>/materiales")
+@respuesta_cacheable
 def api_operario_materiales(numero):
     """Retorna todos los materiales actualmente asignados a un operario."""
+    asegurar_estados_al_dia()
     with get_db() as conn:
         c = conn.cursor()
         c.execute(
-            "SELECT id,codigo,caducidad,estado,operario_numero,ean,descripcion,fecha_asignacion "
-            "FROM materiales WHERE operario_numero=?", (numero,)
+            f"SELECT {_COLS_MATERIAL} FROM materiales_operario "
+            "WHERE operario_numero=? AND estado_calc NOT IN ('gastado','retirado','escaneado')", (numero,)
         )
         rows = [row_to_material(r) for r in c.fetchall()]
     datos = []
     for m in rows:
-        base = estado_base(m.caducidad, m.operario_numero, m.estado)
-        if base in ("gastado", "retirado", "escaneado"):
-            continue
-        label = estado_label(m.caducidad, m.operario_numero, m.estado)
+        base = estado_de(m)
+        label = etiqueta_de(m)
         datos.append({
             "id": m.id,
             "codigo": m.codigo,
@@ -4726,48 +2448,194 @@ def api_operario_materiales(numero):
 
 @app.get("/api/hora_servidor")
 def api_hora_servidor():
+    return jsonify(hora_servidor())
+
+def hora_servidor() -> dict:
     ahora = datetime.now()
     dias = ["lunes","martes","miércoles","jueves","viernes","sábado","domingo"]
     meses = ["enero","febrero","marzo","abril","mayo","junio","julio","agosto","septiembre","octubre","noviembre","diciembre"]
     dia = dias[ahora.weekday()]
     mes = meses[ahora.month - 1]
     texto = f"{dia.capitalize()}, {ahora.day} de {mes} de {ahora.year} · {ahora.strftime('%H:%M:%S')}"
-    return jsonify({
+    return {
         "fecha": ahora.strftime("%Y-%m-%d"),
         "hora": ahora.strftime("%H:%M:%S"),
         "full": texto
-    })
-
+    }
 
-# ================== Bajas pendientes Excel ==================
-def _ensure_procesado_excel_col():
-    """Migración: añade la columna procesado_excel, crea la tabla bajas y limpia registros huérfanos."""
-    with get_db_materiales() as conn:
+# ================== Eventos en vivo (SSE) ==================
+# /api/eventos mantiene abierta una respuesta text/event-stream por pantalla. Un único hilo
+# vigila la base (despierta al instante con cada commit de este proceso y cada segundo por
+# los de otros) y reparte a todas las conexiones:
+#   contadores  -> {"cambios": {...}} solo las claves de resumen_contadores() que cambiaron
+#   material    -> material_json() del código modificado, o {"codigo", "eliminado": true}
+#   materiales  -> {"recargar": true} cuando cambian demasiados a la vez (p. ej. a medianoche)
+#   agente      -> estado_agente_cliente() al cambiar (solo conexiones admin)
+#   hora        -> hora_servidor(), también hace de latido
+SSE_LATIDO_SEG = 10
+SSE_REINTENTO_MS = 3000
+SSE_MAX_MATERIALES = 200   # más cambios que esto en una vuelta se envían como 'recargar'
+
+class _SuscriptorSSE:
+    def __init__(self, admin: bool):
+        self.admin = admin
+        self.cola = queue.Queue(maxsize=1000)
+        self.cerrado = False
+
+    def enviar(self, mensaje: str):
         try:
-            conn.execute("ALTER TABLE materiales ADD COLUMN procesado_excel INTEGER DEFAULT 0")
-        except Exception:
-            pass  # Ya existe
-        conn.execute(
-            """CREATE TABLE IF NOT EXISTS bajas (
-                id              INTEGER PRIMARY KEY AUTOINCREMENT,
-                codigo          TEXT,
-                descripcion     TEXT,
-                estado_original TEXT,
-                operario_numero TEXT,
-                fecha_baja      TEXT DEFAULT (datetime('now','localtime'))
-            )"""
-        )
-        # Limpiar materiales ya procesados en Excel que no se borraron (registros huérfanos)
-        conn.execute(
-            "DELETE FROM materiales WHERE procesado_excel = 1 AND estado IN ('gastado', 'retirado')"
-        )
+            self.cola.put_nowait(mensaje)
+        except queue.Full:
+            # Cliente que no lee: se cierra su flujo y al reconectar recibe el estado completo
+            self.cerrado = True
+            _quitar_suscriptor(self)
+
+_suscriptores = set()
+_suscriptores_lock = threading.Lock()
+_hilo_sse_iniciado = False
+
+def _evento_sse(nombre: str, datos, id_evento: Optional[int] = None) -> str:
+    cabecera = f"event: {nombre}\n" + (f"id: {id_evento}\n" if id_evento is not None else "")
+    return cabecera + f"data: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+def _quitar_suscriptor(sus: _SuscriptorSSE):
+    with _suscriptores_lock:
+        _suscriptores.discard(sus)
+
+def _publicar(mensaje: str, solo_admin: bool = False):
+    with _suscriptores_lock:
+        destinos = [s for s in _suscriptores if s.admin or not solo_admin]
+    for sus in destinos:
+        sus.enviar(mensaje)
+
+def _cambios_materiales(desde_seq: int):
+    """Eventos 'material' posteriores a desde_seq y el último seq leído.
+
+    Devuelve None en lugar de la lista si hay demasiados o si el registro ya se podó."""
+    with get_db() as conn:
+        filas = conn.execute("SELECT seq, codigo FROM materiales_cambios WHERE seq > ? ORDER BY seq",
+                             (desde_seq,)).fetchall()
+        if not filas:
+            return [], desde_seq
+        ultimo = filas[-1]["seq"]
+        primero = conn.execute("SELECT MIN(seq) FROM materiales_cambios").fetchone()[0]
+        # Códigos distintos, conservando el seq de su último cambio
+        codigos = {r["codigo"]: r["seq"] for r in filas}
+        if primero > desde_seq + 1 or len(codigos) > SSE_MAX_MATERIALES:
+            return None, ultimo
+        actuales = {r["codigo"]: row_to_material(r) for r in conn.execute(
+            f"SELECT {_COLS_MATERIAL} FROM materiales_operario WHERE codigo IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(codigos)),))}
+    eventos = []
+    for codigo, seq in sorted(codigos.items(), key=lambda x: x[1]):
+        m = actuales.get(codigo)
+        datos = material_json(m) if m else {"codigo": codigo, "eliminado": True}
+        eventos.append(_evento_sse("material", datos, seq))
+    return eventos, ultimo
+
+def _ultimo_seq_cambios() -> int:
+    with get_db() as conn:
+        return conn.execute("SELECT IFNULL(MAX(seq), 0) FROM materiales_cambios").fetchone()[0]
+
+def _hilo_eventos():
+    seq = version = contadores = agente = None
+    while True:
+        _aviso_cambios.wait(1.0)
+        _aviso_cambios.clear()
+        with _suscriptores_lock:
+            hay_admin = any(s.admin for s in _suscriptores)
+            hay_alguno = bool(_suscriptores)
+        if not hay_alguno:
+            # Sin pantallas conectadas no se sigue el registro; quien conecte recibe la foto completa
+            seq = version = contadores = agente = None
+            continue
+        try:
+            if seq is None:
+                seq = _ultimo_seq_cambios()
+            v = version_materiales()
+            if v != version:
+                version = v
+                eventos, nuevo_seq = _cambios_materiales(seq)
+                if eventos is None:
+                    _publicar(_evento_sse("materiales", {"recargar": True}, nuevo_seq))
+                else:
+                    for ev in eventos:
+                        _publicar(ev)
+                # materiales_cambios se poda solo (trigger de la migración 12)
+                seq = nuevo_seq
+            # El resumen está cacheado: compararlo cada vuelta también detecta el cambio de día
+            resumen = resumen_contadores()
+            if resumen is not contadores:
+                cambios = {k: v for k, v in resumen.items() if contadores is None or contadores.get(k) != v}
+                if cambios:
+                    _publicar(_evento_sse("contadores", {"cambios": cambios}))
+                contadores = resumen
+            # agente_online caduca con el tiempo, así que se evalúa en cada vuelta
+            if hay_admin:
+                estado = estado_agente_cliente()
+                if estado != agente:
+                    _publicar(_evento_sse("agente", estado), solo_admin=True)
+                    agente = estado
+        except Exception as e:
+            logger.error(f"Error en el canal de eventos: {e}")
+
+def _flujo_eventos(sus: _SuscriptorSSE, ultimo_id: Optional[int]):
+    try:
+        yield f"retry: {SSE_REINTENTO_MS}\n\n"
+        # Al (re)conectar: estado completo y, si el cliente ya tenía uno, los materiales que se perdió
+        yield _evento_sse("contadores", {"cambios": resumen_contadores()})
+        if sus.admin:
+            yield _evento_sse("agente", estado_agente_cliente())
+        if ultimo_id is not None:
+            eventos, seq = _cambios_materiales(ultimo_id)
+            if eventos is None:
+                yield _evento_sse("materiales", {"recargar": True}, seq)
+            else:
+                yield from eventos
+        yield _evento_sse("hora", hora_servidor())
+        while True:
+            try:
+                mensaje = sus.cola.get(timeout=SSE_LATIDO_SEG)
+            except queue.Empty:
+                mensaje = _evento_sse("hora", hora_servidor())
+            if sus.cerrado:
+                return
+            yield mensaje
+    finally:
+        _quitar_suscriptor(sus)
+
+@app.get("/api/eventos")
+def api_eventos():
+    global _hilo_sse_iniciado
+    sus = _SuscriptorSSE(admin=current_role() == "admin")
+    # Con waitress cada flujo ocupa uno de sus hilos fijos (servidor.py fija el límite): al
+    # llegar a él se rechaza y la pantalla vuelve a sondear en lugar de dejar sin hilos al resto
+    limite = app.config.get("SSE_MAX_CONEXIONES")
+    # Suscribir antes de tomar la foto inicial para no perder cambios entre medias
+    with _suscriptores_lock:
+        if limite is not None and len(_suscriptores) >= limite:
+            return jsonify({"error": "Demasiadas pantallas conectadas al canal de eventos"}), 503
+        _suscriptores.add(sus)
+        if not _hilo_sse_iniciado:
+            _hilo_sse_iniciado = True
+            threading.Thread(target=_hilo_eventos, daemon=True, name="eventos-sse").start()
+    try:
+        ultimo_id = int(request.headers.get("Last-Event-ID", ""))
+    except ValueError:
+        ultimo_id = None
+    resp = app.response_class(_flujo_eventos(sus, ultimo_id), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
 
+# ================== Bajas pendientes Excel ==================
 @app.get("/api/bajas_pendientes_excel")
+@respuesta_cacheable
 def api_bajas_pendientes_excel():
     """Devuelve materiales gastados/retirados no procesados en Excel. Solo admin."""
     if current_role() != "admin":
         return jsonify({"success": False}), 403
-    _ensure_procesado_excel_col()
     with get_db_materiales() as conn:
         conn.row_factory = sqlite3.Row
         rows = conn.execute(
@@ -4784,7 +2652,6 @@ def api_marcar_procesado_excel(mat_id):
     """Marca un material como procesado en Excel. Solo admin."""
     if current_role() != "admin":
         return jsonify({"success": False}), 403
-    _ensure_procesado_excel_col()
     with get_db_materiales() as conn:
         conn.execute("UPDATE materiales SET procesado_excel = 1 WHERE id = ?", (mat_id,))
     return jsonify({"success": True})
@@ -4797,7 +2664,6 @@ def api_marcar_procesado_excel_bulk():
     ids = request.json.get("ids", [])
     if not ids:
         return jsonify({"success": False, "mensaje": "Sin IDs"}), 400
-    _ensure_procesado_excel_col()
     with get_db_materiales() as conn:
         conn.executemany(
             "UPDATE materiales SET procesado_excel = 1 WHERE id = ?",
@@ -4806,11 +2672,11 @@ def api_marcar_procesado_excel_bulk():
     return jsonify({"success": True, "procesados": len(ids)})
 
 @app.get("/api/bajas")
+@respuesta_cacheable
 def api_bajas():
     """Devuelve el historial de materiales dados de baja. Solo admin."""
     if current_role() != "admin":
         return jsonify({"success": False}), 403
-    _ensure_procesado_excel_col()
     with get_db_materiales() as conn:
         conn.row_factory = sqlite3.Row
         rows = conn.execute(
@@ -4820,23 +2686,22 @@ def api_bajas():
         ).fetchall()
     return jsonify({"bajas": [dict(r) for r in rows], "total": len(rows)})
 
-# ================== Agente Cliente Excel ==================
-def _ensure_solicitud_cliente_table():
-    with get_db_materiales() as conn:
-        conn.execute(
-            """CREATE TABLE IF NOT EXISTS solicitud_excel_cliente (
-                id INTEGER PRIMARY KEY,
-                estado TEXT DEFAULT 'idle',
-                solicitada_en TEXT,
-                completada_en TEXT,
-                salida TEXT,
-                ultimo_poll_agente TEXT
-            )"""
-        )
-        conn.execute(
-            "INSERT OR IGNORE INTO solicitud_excel_cliente (id, estado) VALUES (1, 'idle')"
-        )
+@app.get("/api/admin/estadisticas_db")
+def api_estadisticas_db():
+    """Aciertos del pool de conexiones y esperas por el bloqueo de escritura. Solo admin."""
+    if current_role() != "admin":
+        return jsonify({"success": False}), 403
+    return jsonify({"materiales": pool_materiales().estadisticas(),
+                    "operarios": pool_operarios().estadisticas()})
+
+@app.get("/api/admin/estadisticas_compresion")
+def api_estadisticas_compresion():
+    """Bytes originales y enviados por ruta desde que arrancó el proceso. Solo admin."""
+    if current_role() != "admin":
+        return jsonify({"success": False}), 403
+    return jsonify(compresor.estadisticas())
 
+# ================== Agente Cliente Excel ==================
 def _check_agent_token():
     auth = request.headers.get("Authorization", "")
     if not auth.startswith("Bearer "):
@@ -4854,12 +2719,14 @@ def api_estado_solicitud_cliente():
     """Estado actual de la solicitud al agente. Solo admin."""
     if current_role() != "admin":
         return jsonify({"success": False}), 403
-    _ensure_solicitud_cliente_table()
+    return jsonify(estado_agente_cliente())
+
+def estado_agente_cliente() -> dict:
     with get_db_materiales() as conn:
         conn.row_factory = sqlite3.Row
         row = conn.execute("SELECT * FROM solicitud_excel_cliente WHERE id=1").fetchone()
     if not row:
-        return jsonify({"estado": "idle", "agente_online": False})
+        return {"estado": "idle", "agente_online": False}
     row = dict(row)
     agente_online = False
     if row.get("ultimo_poll_agente"):
@@ -4869,20 +2736,19 @@ def api_estado_solicitud_cliente():
             agente_online = (_dt.now() - dt).total_seconds() < 15
         except Exception:
             pass
-    return jsonify({
+    return {
         "estado": row["estado"],
         "salida": row["salida"],
         "solicitada_en": row["solicitada_en"],
         "completada_en": row["completada_en"],
         "agente_online": agente_online,
-    })
+    }
 
 @app.post("/api/admin/solicitar_bajas_cliente")
 def api_solicitar_bajas_cliente():
     """Admin solicita al agente que procese las bajas. Solo admin."""
     if current_role() != "admin":
         return jsonify({"success": False}), 403
-    _ensure_solicitud_cliente_table()
     with get_db_materiales() as conn:
         row = conn.execute("SELECT estado FROM solicitud_excel_cliente WHERE id=1").fetchone()
         if row and row[0] in ("pendiente", "procesando"):
@@ -4900,7 +2766,6 @@ def api_cancelar_solicitud_cliente():
     """Admin cancela la solicitud (pendiente o procesando). Solo admin."""
     if current_role() != "admin":
         return jsonify({"success": False}), 403
-    _ensure_solicitud_cliente_table()
     with get_db_materiales() as conn:
         conn.execute(
             "UPDATE solicitud_excel_cliente SET estado='cancelado', salida='Detenido por el admin' WHERE id=1"
@@ -4912,7 +2777,6 @@ def api_agente_cancelado():
     """El agente comprueba si su trabajo fue cancelado. Auth: Bearer."""
     if not _check_agent_token():
         return jsonify({"error": "Token inválido"}), 401
-    _ensure_solicitud_cliente_table()
     with get_db_materiales() as conn:
         row = conn.execute("SELECT estado FROM solicitud_excel_cliente WHERE id=1").fetchone()
     cancelado = row and row[0] == "cancelado"
@@ -4923,7 +2787,6 @@ def api_agente_poll():
     """El agente consulta si hay solicitud pendiente. Auth: Bearer <admin_password>."""
     if not _check_agent_token():
         return jsonify({"error": "Token inválido"}), 401
-    _ensure_solicitud_cliente_table()
     with get_db_materiales() as conn:
         conn.execute(
             "UPDATE solicitud_excel_cliente SET ultimo_poll_agente=datetime('now','localtime') WHERE id=1"
@@ -4938,7 +2801,6 @@ def api_agente_pendientes():
     """El agente descarga los materiales pendientes. Auth: Bearer."""
     if not _check_agent_token():
         return jsonify({"error": "Token inválido"}), 401
-    _ensure_procesado_excel_col()
     with get_db_materiales() as conn:
         conn.row_factory = sqlite3.Row
         rows = conn.execute(
@@ -4955,7 +2817,6 @@ def api_agente_iniciar():
     """El agente marca la solicitud como 'procesando'. Auth: Bearer."""
     if not _check_agent_token():
         return jsonify({"error": "Token inválido"}), 401
-    _ensure_solicitud_cliente_table()
     with get_db_materiales() as conn:
         conn.execute("UPDATE solicitud_excel_cliente SET estado='procesando' WHERE id=1")
     return jsonify({"success": True})
@@ -4965,7 +2826,6 @@ def api_agente_marcar_uno(mat_id):
     """El agente reporta un material procesado: lo registra en bajas y lo elimina de materiales."""
     if not _check_agent_token():
         return jsonify({"error": "Token inválido"}), 401
-    _ensure_procesado_excel_col()
     with get_db_materiales() as conn:
         row = conn.execute(
             "SELECT codigo, descripcion, estado, operario_numero FROM materiales WHERE id=?",
@@ -4988,7 +2848,6 @@ def api_agente_completar():
         return jsonify({"error": "Token inválido"}), 401
     data = request.json or {}
     salida = data.get("salida", "")
-    _ensure_solicitud_cliente_table()
     with get_db_materiales() as conn:
         conn.execute(
             """UPDATE solicitud_excel_cliente
@@ -5004,7 +2863,6 @@ def api_agente_error():
     if not _check_agent_token():
         return jsonify({"error": "Token inválido"}), 401
     mensaje = (request.json or {}).get("mensaje", "Error desconocido")
-    _ensure_solicitud_cliente_table()
     with get_db_materiales() as conn:
         conn.execute(
             """UPDATE solicitud_excel_cliente
@@ -5019,7 +2877,6 @@ def api_local_marcar_baja(mat_id):
     """Marca una baja procesada desde el modo browser-bridge. Auth: cookie admin."""
     if current_role() != "admin":
         return jsonify({"success": False}), 403
-    _ensure_procesado_excel_col()
     with get_db_materiales() as conn:
         row = conn.execute(
             "SELECT codigo, descripcion, estado, operario_numero FROM materiales WHERE id=?",
@@ -5077,7 +2934,6 @@ def api_limpiar_procesados_excel():
     """Elimina de materiales los registros ya marcados como procesado_excel=1. Solo admin."""
     if current_role() != "admin":
         return jsonify({"success": False}), 403
-    _ensure_procesado_excel_col()
     with get_db_materiales() as conn:
         cur = conn.execute(
             "DELETE FROM materiales WHERE procesado_excel = 1 AND estado IN ('gastado', 'retirado')"
@@ -5087,28 +2943,205 @@ def api_limpiar_procesados_excel():
 
 @app.post("/api/admin/ejecutar_bajas_excel")
 def api_ejecutar_bajas_excel():
-    """Ejecuta baja_excel.py en modo automático. Solo admin."""
+    """Lanza baja_excel.py en modo automático como trabajo en segundo plano (bajas_excel):
+    devuelve el trabajo al momento, la salida llega en su resumen. Solo admin."""
     if current_role() != "admin":
         return jsonify({"success": False, "salida": "Acceso denegado"}), 403
-    import subprocess, sys as _sys
-    script = os.path.join(BASE_DIR, "baja_excel.py")
+    trabajo_id = gestor_trabajos.enviar("bajas_excel", usuario=request.cookies.get("user_numero") or None)
+    return jsonify({"success": True, "trabajo": gestor_trabajos.estado(trabajo_id)}), 202
+
+# ================== Trabajos en segundo plano ==================
+# Las tareas largas del panel de admin se lanzan como trabajos (shared/trabajos.py): la
+# petición devuelve el trabajo al momento y la pantalla sigue su progreso por /api/eventos
+# (evento 'trabajo') o consultando /api/admin/trabajos/<id>, puede cancelarlo y descarga el
+# resultado de /api/admin/trabajos/<id>/resultado. Leer y escribir .xlsx (openpyxl) se hace
+# en un proceso hijo para no retener el GIL de los hilos que atienden los escaneos.
+TRABAJOS_HILOS = 2              # trabajos a la vez en cada proceso del servidor
+TRABAJOS_PROCESOS = 1           # procesos hijos de openpyxl a la vez en cada proceso
+BAJAS_EXCEL_TIMEOUT = 180       # s que se espera a baja_excel.py
+
+gestor_trabajos = GestorTrabajos(DB_TRABAJOS, DIR_TRABAJOS, TRABAJOS_HILOS, TRABAJOS_PROCESOS,
+                                 al_cambiar=lambda datos: _publicar(_evento_sse("trabajo", datos), solo_admin=True))
+
+def _nombre_descarga(nombre: str, extension: str) -> str:
+    return f"{nombre}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+
+def exportar_a_resultado(t: Trabajo, formato: str, filas: Iterable[tuple], nombre: str,
+                         columnas=EXPORTACION_COLUMNAS, titulo: str = "Materiales") -> int:
+    """Escribe las filas como resultado del trabajo y devuelve cuántas. El CSV se escribe
+    aquí; el Excel, en el proceso hijo a partir de un JSON Lines intermedio."""
+    destino = t.ruta(formato)
+    filas = t.contando(filas, mensaje="Leyendo materiales")
+    n = 0
+    if formato == "xlsx":
+        intermedio = t.ruta("jsonl")
+        with open(intermedio, "w", encoding="utf-8") as f:
+            for n, fila in enumerate(filas, 1):
+                f.write(json.dumps(fila, ensure_ascii=False) + "\n")
+        t.en_proceso("shared.hojas:jsonl_a_xlsx", origen=intermedio, destino=destino,
+                     columnas=columnas, titulo=titulo, total=n)
+        t.resultado(destino, _nombre_descarga(nombre, "xlsx"), MIMETYPE_XLSX)
+    else:
+        # Como csv_en_trozos: UTF-8 con BOM y ';'
+        with open(destino, "w", encoding="utf-8-sig", newline="") as f:
+            w = csv.writer(f, delimiter=";")
+            w.writerow([c for c, _ in columnas])
+            for n, fila in enumerate(filas, 1):
+                w.writerow(fila)
+        t.resultado(destino, _nombre_descarga(nombre, "csv"), "text/csv")
+    return n
+
+@gestor_trabajos.tipo("exportar")
+def _trabajo_exportar(t: Trabajo):
+    p = t.parametros
+    estado = p.get("estado") or "todos"
+    filas = (fila_exportacion(m) for m in materiales_filtrados(estado, p.get("q", ""), p.get("operario", "")))
+    nombre = "materiales_export" if estado == "todos" else f"materiales_{re.sub(r'[^a-z]+', '_', estado.lower())}"
+    return {"filas": exportar_a_resultado(t, p.get("formato", "xlsx"), filas, nombre)}
+
+def _borrar_limpieza(t: Trabajo):
+    # Como en export_cleanup: solo se borra cuando el archivo ha salido entero, y una vez
+    ruta = t.ruta("ids.json")
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            ids = json.load(f)
+        os.remove(ruta)
+    except FileNotFoundError:
+        return
+    borrar_exportados(ids)
+
+@gestor_trabajos.tipo("limpieza", unico=True, al_descargar=_borrar_limpieza)
+def _trabajo_limpieza(t: Trabajo):
+    exportados = []
+    n = exportar_a_resultado(t, "xlsx", gastados_retirados(exportados), "materiales_gastados_retirados",
+                             columnas=LIMPIEZA_COLUMNAS, titulo="Materiales Gastados y Retirados")
+    if not n:
+        raise FalloTrabajo("No hay materiales gastados o retirados para exportar")
+    ruta = t.ruta("ids.json")
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(exportados, f)
+    t.conservar.append(ruta)
+    return {"filas": n, "mensaje": f"Exportados {n} materiales; se eliminan al completarse la descarga"}
+
+@gestor_trabajos.tipo("importar")
+def _trabajo_importar(t: Trabajo):
+    """Como /admin/importar_materiales; un Excel se pasa antes a CSV en el proceso hijo."""
+    origen, separador = t.entrada, None
+    if t.parametros.get("extension") in hojas.EXTENSIONES_EXCEL:
+        origen, separador = t.ruta("csv"), ";"
+        t.en_proceso("shared.hojas:xlsx_a_csv", origen=t.entrada, destino=origen)
+    with open(origen, "rb") as f:
+        filas = filas_con_encabezado(t.contando(hojas.filas_csv(f, separador), mensaje="Cargando filas"))
+        res = importar_filas_materiales(filas, estado_por_defecto="disponible", progreso=t.progreso)
+    if res.errores:
+        ruta = t.ruta("errores.csv")
+        with open(ruta, "w", encoding="utf-8-sig", newline="") as f:
+            w = csv.writer(f, delimiter=";")
+            w.writerow(["Fila", "Código", "Error"])
+            w.writerows((e["fila"], e["codigo"] or "", e["error"]) for e in res.errores)
+        t.resultado(ruta, _nombre_descarga("errores_importacion", "csv"), "text/csv")
+    return {"insertados": res.insertados, "actualizados": res.actualizados,
+            "errores": len(res.errores), "primeros_errores": res.errores[:20]}
+
+@gestor_trabajos.tipo("verificar_ean")
+def _trabajo_verificar_ean(t: Trabajo):
+    return consistencia_ean()
+
+@gestor_trabajos.tipo("bajas_excel", unico=True)
+def _trabajo_bajas_excel(t: Trabajo):
+    import sys as _sys
     env = os.environ.copy()
     env["PYTHONIOENCODING"] = "utf-8"
+    t.progreso(mensaje="Ejecutando baja_excel.py", forzar=True)
+    r = t.subproceso([_sys.executable, os.path.join(BASE_DIR, "baja_excel.py")], timeout=BAJAS_EXCEL_TIMEOUT,
+                     cwd=BASE_DIR, text=True, encoding="utf-8", errors="replace", env=env)
+    salida = r.stdout.strip() or "(sin salida)"
+    if r.stderr.strip():
+        salida += "\n[stderr]\n" + r.stderr.strip()
+    resumen = {"success": r.returncode == 0, "salida": salida}
+    if r.returncode != 0:
+        raise FalloTrabajo(f"baja_excel.py terminó con código {r.returncode}", resumen)
+    return resumen
+
+@app.get("/api/admin/trabajos")
+def api_trabajos():
+    """Últimos trabajos en segundo plano con su estado. Solo admin."""
+    if current_role() != "admin":
+        return jsonify({"error": "Acceso denegado"}), 403
+    return jsonify({"trabajos": gestor_trabajos.listar()})
+
+@app.post("/api/admin/trabajos/<tipo>")
+def api_trabajos_enviar(tipo):
+    """Lanza un trabajo y devuelve su estado (202). Parámetros de formulario:
+    exportar: formato (csv|xlsx), estado, q, operario; importar: archivo (CSV o XLSX con
+    encabezados). limpieza, verificar_ean y bajas_excel no llevan. Solo admin."""
+    if current_role() != "admin":
+        return jsonify({"error": "Acceso denegado"}), 403
+    if tipo not in gestor_trabajos.tipos():
+        return jsonify({"error": f"Tipo de trabajo desconocido: {tipo}"}), 404
+    parametros, entrada, extension = {}, None, ""
+    if tipo == "exportar":
+        formato = (request.form.get("formato") or "xlsx").lower()
+        if formato not in ("csv", "xlsx") or (formato == "xlsx" and not EXCEL_DISPONIBLE):
+            return jsonify({"error": "Formato no disponible (csv o xlsx)"}), 400
+        parametros = {"formato": formato, "estado": request.form.get("estado") or "todos",
+                      "q": request.form.get("q", ""), "operario": request.form.get("operario", "")}
+    elif tipo == "importar":
+        entrada = request.files.get("archivo")
+        if entrada is None or entrada.filename == "":
+            return jsonify({"error": "No se seleccionó ningún archivo"}), 400
+        extension = hojas.extension(entrada.filename)
+        if extension not in hojas.EXTENSIONES_CSV + hojas.EXTENSIONES_EXCEL:
+            return jsonify({"error": "Solo se permiten archivos CSV o XLSX (guarda los .xls como .xlsx)"}), 400
+        if extension in hojas.EXTENSIONES_EXCEL and not EXCEL_DISPONIBLE:
+            return jsonify({"error": "Funcionalidad Excel no disponible. Instale openpyxl."}), 501
+        parametros = {"extension": extension, "archivo": entrada.filename}
+    elif tipo == "limpieza" and not EXCEL_DISPONIBLE:
+        return jsonify({"error": "Funcionalidad Excel no disponible. Instale openpyxl."}), 501
+    trabajo_id = gestor_trabajos.enviar(tipo, parametros, request.cookies.get("user_numero") or None,
+                                        entrada, extension)
+    return jsonify(gestor_trabajos.estado(trabajo_id)), 202
+
+@app.get("/api/admin/trabajos/<trabajo_id>")
+def api_trabajo(trabajo_id):
+    """Estado y progreso de un trabajo. Solo admin."""
+    if current_role() != "admin":
+        return jsonify({"error": "Acceso denegado"}), 403
+    estado = gestor_trabajos.estado(trabajo_id)
+    if estado is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    return jsonify(estado)
+
+@app.post("/api/admin/trabajos/<trabajo_id>/cancelar")
+def api_trabajo_cancelar(trabajo_id):
+    """Cancela un trabajo en cola o en marcha. Solo admin."""
+    if current_role() != "admin":
+        return jsonify({"error": "Acceso denegado"}), 403
+    estado = gestor_trabajos.cancelar(trabajo_id)
+    if estado is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    return jsonify(estado)
+
+@app.get("/api/admin/trabajos/<trabajo_id>/resultado")
+def api_trabajo_resultado(trabajo_id):
+    """Descarga el resultado de un trabajo terminado. Solo admin."""
+    if current_role() != "admin":
+        return jsonify({"error": "Acceso denegado"}), 403
+    sin_resultado = {"error": "El trabajo no tiene resultado (o ya se ha borrado)"}
+    resultado = gestor_trabajos.resultado(trabajo_id)
+    if resultado is None:
+        return jsonify(sin_resultado), 404
+    ruta, nombre, mimetype = resultado
     try:
-        r = subprocess.run(
-            [_sys.executable, script],
-            cwd=BASE_DIR,
-            capture_output=True, text=True, encoding="utf-8", errors="replace",
-            timeout=180, env=env
-        )
-        salida = r.stdout.strip() or "(sin salida)"
-        if r.stderr.strip():
-            salida += "\n[stderr]\n" + r.stderr.strip()
-        return jsonify({"success": r.returncode == 0, "salida": salida})
-    except subprocess.TimeoutExpired:
-        return jsonify({"success": False, "salida": "Tiempo de espera agotado (180 s)."}), 500
-    except Exception as e:
-        return jsonify({"success": False, "salida": str(e)}), 500
+        f = open(ruta, "rb")
+    except OSError:   # la limpieza lo ha borrado después de resultado()
+        return jsonify(sin_resultado), 404
+    resp = app.response_class(_trozos_archivo(f, al_terminar=lambda: gestor_trabajos.descargado(trabajo_id)),
+                              mimetype=mimetype)
+    resp.headers["Content-Length"] = str(os.fstat(f.fileno()).st_size)
+    resp.headers["Content-Disposition"] = f'attachment; filename="{nombre}"'
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
 
 # ================== Actualización desde GitHub ==================
 @app.post("/api/admin/update")
@@ -5317,4 +3350,6 @@ if __name__ == "__main__":
     _o2.write(f"{'='*60}\n\n")
     _o2.flush()
 
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    # waitress con hilos fijos y keep-alive (servidor.py; variables SERVIDOR_*)
+    import servidor
+    servidor.servir(app, host='0.0.0.0', puerto=5000, evento_reinicio=_restart_event)
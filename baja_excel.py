@@ -17,6 +17,9 @@ import time
 import sqlite3
 import argparse
 
+from shared.migraciones import migrar_materiales
+from shared.conexiones import aplicar_pragmas, pragmas_desde_entorno, PRAGMAS_POR_DEFECTO
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_MATERIALES = os.path.join(BASE_DIR, "database", "materiales.db")
 
@@ -34,33 +37,18 @@ MAPEO_ESTADO = {
 }
 
 
-def _ensure_bajas_table(conn):
-    """Crea la tabla bajas si no existe (migración automática)."""
-    try:
-        conn.execute(
-            "ALTER TABLE materiales ADD COLUMN procesado_excel INTEGER DEFAULT 0"
-        )
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass  # Columna ya existe
-    conn.execute(
-        """CREATE TABLE IF NOT EXISTS bajas (
-            id              INTEGER PRIMARY KEY AUTOINCREMENT,
-            codigo          TEXT,
-            descripcion     TEXT,
-            estado_original TEXT,
-            operario_numero TEXT,
-            fecha_baja      TEXT DEFAULT (datetime('now','localtime'))
-        )"""
-    )
-    conn.commit()
+def _conectar():
+    """Conexión a materiales.db con el esquema al día (migraciones compartidas con app.py)."""
+    conn = sqlite3.connect(DB_MATERIALES)
+    aplicar_pragmas(conn, pragmas_desde_entorno(PRAGMAS_POR_DEFECTO))
+    migrar_materiales(conn)
+    return conn
 
 
 def get_pendientes():
     """Devuelve materiales con estado baja que no se han procesado en Excel."""
-    conn = sqlite3.connect(DB_MATERIALES)
+    conn = _conectar()
     conn.row_factory = sqlite3.Row
-    _ensure_bajas_table(conn)
 
     cur = conn.execute(
         """
@@ -78,22 +66,20 @@ def get_pendientes():
 
 
 def marcar_procesado(material_id: int):
-    """Marca un material como procesado en Excel y lo registra en la tabla bajas."""
-    conn = sqlite3.connect(DB_MATERIALES)
-    _ensure_bajas_table(conn)
+    """Registra el material en la tabla bajas y lo elimina de materiales."""
+    conn = _conectar()
     row = conn.execute(
         "SELECT codigo, descripcion, estado, operario_numero FROM materiales WHERE id = ?",
         (material_id,)
     ).fetchone()
-    conn.execute(
-        "UPDATE materiales SET procesado_excel = 1 WHERE id = ?", (material_id,)
-    )
     if row:
         conn.execute(
             """INSERT INTO bajas (codigo, descripcion, estado_original, operario_numero, fecha_baja)
                VALUES (?, ?, ?, ?, datetime('now','localtime'))""",
             (row[0], row[1], row[2], row[3])
         )
+        # Igual que /api/agente/marcar_uno: la baja sale de materiales en la misma transacción
+        conn.execute("DELETE FROM materiales WHERE id = ?", (material_id,))
     conn.commit()
     conn.close()
 
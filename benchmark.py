@@ -0,0 +1,584 @@
+#!/usr/bin/env python3
+"""
+Mediciones de rendimiento de la app de materiales.
+
+Trabaja siempre sobre una base temporal sembrada con datos sintéticos; no toca
+database/materiales.db más allá de lo que hace importar app.py.
+
+Uso:
+    python benchmark.py conexiones            → coste por petición con y sin pool de conexiones
+    python benchmark.py conexiones -n 5000    → idem con más repeticiones
+    python benchmark.py plantillas            → tiempo de render de home, admin y estado
+    python benchmark.py servidor              → peticiones/s con varios terminales a la vez,
+                                                servidor de desarrollo frente a waitress
+    python benchmark.py comandos              → latencia de cada comando de materiales
+                                                (registrar, asignar, devolver, gastar, retirar)
+    python benchmark.py importacion -n 100000 → lectura de Excel/CSV: libro completo celda a
+                                                celda frente a streaming, y la importación entera
+    python benchmark.py --materiales 100000 exportacion
+                                              → exportación: primer byte, tiempo total y pico de
+                                                memoria del libro en memoria frente a streaming
+    python benchmark.py --materiales 50000 trabajos
+                                              → latencia del listado mientras se exporta a Excel
+                                                dentro de la petición frente a como trabajo
+"""
+
+import io
+import os
+import sys
+import csv
+import time
+import random
+import logging
+import shutil
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import subprocess
+import http.client
+from datetime import date, timedelta
+
+from flask import render_template, render_template_string
+from jinja2 import FileSystemBytecodeCache
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+import app as app_mod
+import servidor
+from shared import operarios_db, hojas
+
+
+# ── Base temporal ─────────────────────────────────────────────────────────────
+
+def usar_base_temporal(directorio: str, n_materiales: int, n_operarios: int = 40):
+    """Apunta app.py a una base nueva en `directorio` y la siembra."""
+    app_mod.DB_MATERIALES = os.path.join(directorio, "materiales.db")
+    app_mod.DB_OPERARIOS = os.path.join(directorio, "operarios.db")
+    # Cachés de proceso ligadas a la base anterior
+    app_mod._estados_dia = None
+    app_mod._contadores_cache = None
+    app_mod._cache_http.clear()
+    app_mod.init_db()
+
+    rnd = random.Random(1)
+    hoy = date.today()
+    with app_mod.get_db_operarios() as conn:
+        conn.executemany("INSERT OR REPLACE INTO operarios (numero, nombre, rol, activo) VALUES (?, ?, 'operario', 1)",
+                         [(f"{100000 + i}", f"Operario {i}") for i in range(n_operarios)])
+    operarios_db.invalidar_cache()
+    with app_mod.get_db_materiales() as conn:
+        filas = []
+        for i in range(n_materiales):
+            cad = (hoy + timedelta(days=rnd.randint(-30, 365))).isoformat()
+            op = f"{100000 + rnd.randrange(n_operarios)}" if rnd.random() < 0.3 else None
+            estado = rnd.choice(["precintado", "disponible", "disponible", "gastado"])
+            filas.append((f"{i:07d}", cad, estado, op, f"84{rnd.randrange(10**11):011d}", f"Material {i % 500}"))
+        conn.executemany("""INSERT INTO materiales (codigo, caducidad, estado, operario_numero, ean, descripcion)
+                            VALUES (?, ?, ?, ?, ?, ?)""", filas)
+
+
+def _medir(func, repeticiones: int) -> float:
+    """Milisegundos por llamada."""
+    t0 = time.perf_counter()
+    for _ in range(repeticiones):
+        func()
+    return (time.perf_counter() - t0) * 1000 / repeticiones
+
+
+def _fijar_pools(max_por_hilo: int, pragmas):
+    """Descarta las pools de app.py; las siguientes se abren con esta configuración."""
+    app_mod._pools.clear()
+    app_mod.POOL_MAX_POR_HILO = max_por_hilo
+    app_mod.PRAGMAS_SQLITE = pragmas
+
+
+# ── conexiones ───────────────────────────────────────────────────────────────
+
+def bench_conexiones(args):
+    """Coste de abrir conexión por bloque frente a reutilizarla por hilo."""
+    cliente = app_mod.app.test_client()
+    cliente.set_cookie("role", "admin")
+    codigos = [f"{i:07d}" for i in range(0, args.materiales, 7)]
+
+    def bloque():
+        with app_mod.get_db() as conn:
+            conn.execute("SELECT 1").fetchone()
+
+    def asignar_y_devolver():
+        cod = random.choice(codigos)
+        cliente.post("/", data={"accion": "asignar_directo", "codigo": cod, "operario_num": "100001", "confirmado": "1"})
+        cliente.post("/", data={"accion": "devolver", "codigo": cod})
+        # Nadie lee los flash: sin esto la cookie de sesión crece en cada vuelta
+        cliente.delete_cookie("session")
+
+    def en_hilo_nuevo(func):
+        # Como el servidor de desarrollo: un hilo por petición
+        def envoltura():
+            h = threading.Thread(target=func)
+            h.start()
+            h.join()
+        return envoltura
+
+    escenarios = [
+        ("sin pool (conexión por bloque, sin PRAGMA)", 0, {}),
+        ("pool por hilo + WAL/mmap", 2, app_mod.PRAGMAS_SQLITE),
+    ]
+    print(f"{'escenario':46} {'bloque':>9} {'asig+dev':>10} {'asig+dev hilo nuevo':>20} {'aperturas/pet':>14}")
+    for nombre, max_por_hilo, pragmas in escenarios:
+        _fijar_pools(max_por_hilo, pragmas)
+        t_bloque = _medir(bloque, args.n)
+        t_peticion = _medir(asignar_y_devolver, max(args.n // 20, 20))
+        _fijar_pools(max_por_hilo, pragmas)
+        reps = max(args.n // 40, 10)
+        t_hilo = _medir(en_hilo_nuevo(asignar_y_devolver), reps)
+        stats = app_mod.pool_materiales().estadisticas()
+        aperturas = stats["aperturas"] / (reps * 2)
+        print(f"{nombre:46} {t_bloque:7.3f}ms {t_peticion:8.3f}ms {t_hilo:18.3f}ms {aperturas:14.2f}")
+
+
+# ── plantillas ───────────────────────────────────────────────────────────────
+
+def bench_plantillas(args):
+    """Render de las tres páginas: compilando el HTML en cada petición (como con
+    render_template_string) frente a la plantilla ya compilada, y primer render tras
+    arrancar con y sin la caché de bytecode en disco."""
+    app = app_mod.app
+    paginas = [
+        ("home.html", "/", "almacenero", lambda: {"role": "almacenero"}),
+        ("admin.html", "/admin", "admin", lambda: {"operarios": app_mod.get_all_operarios(), "eans_data": []}),
+        ("estado.html", "/estado/caducado", "", lambda: {"estado": "caducado"}),
+    ]
+    dir_cache = tempfile.mkdtemp(prefix="bench_plantillas_")
+    print(f"{'página':14} {'compilar+render':>16} {'render (caché)':>15} {'1º sin bytecode':>16} {'1º con bytecode':>16}")
+    try:
+        for nombre, ruta, rol, contexto in paginas:
+            with app.test_request_context(ruta, headers={"Cookie": f"role={rol}"}):
+                ctx = contexto()
+                fuente = app.jinja_loader.get_source(app.jinja_env, nombre)[0]
+                t_antes = _medir(lambda: render_template_string(fuente, **ctx), args.n)
+                render_template(nombre, **ctx)
+                t_ahora = _medir(lambda: render_template(nombre, **ctx), args.n)
+
+            def primer_render(bytecode):
+                # Entorno nuevo = proceso recién arrancado (la caché en memoria está vacía)
+                env = app.create_jinja_environment()
+                env.bytecode_cache = FileSystemBytecodeCache(dir_cache) if bytecode else None
+                env.get_template(nombre)
+            primer_render(True)   # deja el bytecode en disco
+            t_frio = _medir(lambda: primer_render(False), max(args.n // 10, 3))
+            t_bytecode = _medir(lambda: primer_render(True), max(args.n // 10, 3))
+            print(f"{nombre:14} {t_antes:14.2f}ms {t_ahora:13.2f}ms {t_frio:14.2f}ms {t_bytecode:14.2f}ms")
+    finally:
+        shutil.rmtree(dir_cache, ignore_errors=True)
+
+
+# ── servidor ─────────────────────────────────────────────────────────────────
+
+def app_trabajador():
+    """Fábrica de los procesos servidor: la app sobre la base temporal de BENCH_DIRECTORIO."""
+    directorio = os.environ["BENCH_DIRECTORIO"]
+    app_mod.DB_MATERIALES = os.path.join(directorio, "materiales.db")
+    app_mod.DB_OPERARIOS = os.path.join(directorio, "operarios.db")
+    app_mod.init_db()
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    return app_mod.app
+
+def _servir(args):
+    """Proceso servidor lanzado por bench_servidor (subcomando oculto)."""
+    servidor.servir(app_trabajador(), "127.0.0.1", args.puerto, fabrica="benchmark:app_trabajador")
+
+def _terminal(puerto: int, hasta: float, codigos: list, latencias: list, errores: list, semilla: int):
+    """Un terminal: conexión keep-alive repitiendo la mezcla de peticiones de la pantalla."""
+    rnd = random.Random(semilla)
+    conn = http.client.HTTPConnection("127.0.0.1", puerto, timeout=30)
+    cabeceras = {"Cookie": "role=almacenero"}
+    mezcla = [
+        lambda: ("GET", "/", None),
+        lambda: ("GET", "/api/contadores", None),
+        lambda: ("GET", f"/api/materiales?limit=50&offset={rnd.randrange(0, 2000, 50)}", None),
+        lambda: ("GET", f"/api/materiales?limit=50&q=Material+{rnd.randrange(500)}", None),
+        lambda: ("POST", "/", f"accion=asignar_directo&codigo={rnd.choice(codigos)}&operario_num=100001&confirmado=1"),
+    ]
+    while time.perf_counter() < hasta:
+        metodo, ruta, cuerpo = rnd.choice(mezcla)()
+        h = dict(cabeceras)
+        if cuerpo:
+            h["Content-Type"] = "application/x-www-form-urlencoded"
+        t0 = time.perf_counter()
+        try:
+            conn.request(metodo, ruta, body=cuerpo, headers=h)
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status >= 400:
+                errores.append(resp.status)
+        except (OSError, http.client.HTTPException) as e:
+            errores.append(type(e).__name__)
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", puerto, timeout=30)
+            continue
+        latencias.append((time.perf_counter() - t0) * 1000)
+    conn.close()
+
+def bench_servidor(args):
+    """Peticiones/s y latencia con N terminales concurrentes según el servidor."""
+    escenarios = [
+        ("desarrollo (Werkzeug, hilo por petición)", {"SERVIDOR": "desarrollo"}),
+        (f"waitress 1 proceso x {args.hilos} hilos", {"SERVIDOR": "waitress", "SERVIDOR_HILOS": str(args.hilos)}),
+    ]
+    if hasattr(servidor.socket, "SO_REUSEPORT"):
+        escenarios.append((f"waitress {args.procesos} procesos x {args.hilos} hilos",
+                           {"SERVIDOR": "waitress", "SERVIDOR_HILOS": str(args.hilos),
+                            "SERVIDOR_PROCESOS": str(args.procesos)}))
+    codigos = [f"{i:07d}" for i in range(0, args.materiales, 3)]
+    print(f"{args.terminales} terminales, {args.segundos} s por escenario")
+    print(f"{'escenario':44} {'pet/s':>8} {'p50':>9} {'p95':>9} {'errores':>8}")
+    for i, (nombre, entorno) in enumerate(escenarios):
+        puerto = args.puerto + i
+        env = dict(os.environ, BENCH_DIRECTORIO=args.directorio, **entorno)
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "_servir", "--puerto", str(puerto)],
+                                cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            if not servidor.esperar_puerto(puerto, timeout=30):
+                print(f"{nombre:44} no arrancó")
+                continue
+            time.sleep(1)   # los trabajadores extra abren su socket después que el principal
+            latencias, errores = [], []
+            hasta = time.perf_counter() + args.segundos
+            hilos = [threading.Thread(target=_terminal, args=(puerto, hasta, codigos, latencias, errores, n))
+                     for n in range(args.terminales)]
+            for h in hilos:
+                h.start()
+            for h in hilos:
+                h.join()
+            latencias.sort()
+            p = lambda q: latencias[min(len(latencias) - 1, int(len(latencias) * q))] if latencias else 0.0
+            print(f"{nombre:44} {len(latencias) / args.segundos:8.1f} {p(0.5):7.1f}ms {p(0.95):7.1f}ms {len(errores):8}")
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+# ── comandos ─────────────────────────────────────────────────────────────────
+
+def _percentiles(tiempos: list) -> tuple:
+    tiempos = sorted(tiempos)
+    p = lambda q: tiempos[min(len(tiempos) - 1, int(len(tiempos) * q))] if tiempos else 0.0
+    return (sum(tiempos) / len(tiempos) if tiempos else 0.0), p(0.5), p(0.95)
+
+def bench_comandos(args):
+    """Latencia de cada comando de materiales, dentro del proceso (transaccion_comandos +
+    aplicar_comando) y por HTTP (/api/acciones/<accion>), y una carrera de asignaciones con
+    el mismo EAN desde varios hilos: solo una debe aplicarse."""
+    cliente = app_mod.app.test_client()
+    cliente.set_cookie("role", "almacenero")
+    caducidad = (date.today() + timedelta(days=200)).strftime("%d/%m/%Y")
+    ciclo = [
+        # EAN distinto por material: si no, la regla de mismo EAN por operario rechaza las asignaciones
+        ("registrar", lambda cod: dict(caducidad=caducidad, ean=f"840000{cod}", descripcion="Bench")),
+        ("asignar", lambda cod: dict(operario_num="100002", confirmado=True)),
+        ("devolver", lambda cod: {}),
+        ("gastar", lambda cod: {}),
+        ("retirar", lambda cod: {}),
+    ]
+
+    def en_proceso(accion, cod, datos):
+        with app_mod.transaccion_comandos() as conn:
+            return app_mod.aplicar_comando(conn, app_mod.Comando(accion, cod, rol="almacenero", **datos))[0]
+
+    def por_http(accion, cod, datos):
+        resp = cliente.post(f"/api/acciones/{accion}", json=dict(datos, codigo=cod))
+        return resp.get_json()["categoria"]
+
+    print(f"{args.n} materiales por ciclo registrar → asignar → devolver → gastar → retirar")
+    print(f"{'comando':12} {'vía':9} {'media':>9} {'p50':>9} {'p95':>9} {'rechazos':>9}")
+    for via, ejecutar, prefijo in (("proceso", en_proceso, "91"), ("http", por_http, "92")):
+        for accion, datos in ciclo:
+            tiempos, rechazos = [], 0
+            for i in range(args.n):
+                cod = f"{prefijo}{i:05d}"
+                t0 = time.perf_counter()
+                categoria = ejecutar(accion, cod, datos(cod))
+                tiempos.append((time.perf_counter() - t0) * 1000)
+                rechazos += categoria != "success"
+            media, p50, p95 = _percentiles(tiempos)
+            print(f"{accion:12} {via:9} {media:7.2f}ms {p50:7.2f}ms {p95:7.2f}ms {rechazos:9}")
+
+    # Carrera: varios terminales asignan a la vez materiales distintos del mismo EAN al mismo operario
+    codigos = [f"93{i:05d}" for i in range(args.hilos)]
+    for cod in codigos:
+        en_proceso("registrar", cod, dict(caducidad=caducidad, ean="8400000000024", descripcion="Carrera"))
+    barrera = threading.Barrier(args.hilos)
+    resultados = []
+
+    def asignar(cod):
+        barrera.wait()
+        resultados.append(en_proceso("asignar", cod, dict(operario_num="100003", confirmado=True)))
+    hilos = [threading.Thread(target=asignar, args=(cod,)) for cod in codigos]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    print(f"carrera mismo EAN, {args.hilos} hilos: {resultados.count('success')} asignada(s), "
+          f"{len(resultados) - resultados.count('success')} rechazada(s)")
+
+
+# ── importacion ──────────────────────────────────────────────────────────────
+
+def _escribir_archivos(directorio: str, n: int) -> tuple:
+    """Un .xlsx y un .csv de materiales con n filas (más el encabezado)."""
+    from openpyxl import Workbook
+    encabezado = ["Código", "EAN", "Descripción", "Caducidad"]
+    hoy = date.today()
+    filas = [(f"{8000000 + i:07d}", f"84{i:011d}", f"Material {i % 500}",
+              (hoy + timedelta(days=30 + i % 700)).isoformat()) for i in range(n)]
+    ruta_xlsx = os.path.join(directorio, "materiales.xlsx")
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(encabezado)
+    for f in filas:
+        ws.append(f)
+    wb.save(ruta_xlsx)
+    ruta_csv = os.path.join(directorio, "materiales.csv")
+    with open(ruta_csv, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(encabezado)
+        w.writerows(filas)
+    return ruta_xlsx, ruta_csv
+
+def _leer_excel_completo(ruta: str) -> int:
+    """Como antes: libro entero en memoria y una llamada ws.cell() por celda hasta max_row."""
+    import openpyxl
+    ws = openpyxl.load_workbook(ruta).active
+    columnas = [ws.cell(row=1, column=c).value for c in range(1, ws.max_column + 1)]
+    n = 0
+    for fila in range(2, ws.max_row + 1):
+        {e: ws.cell(row=fila, column=c).value for c, e in enumerate(columnas, 1)}
+        n += 1
+    return n
+
+def _leer_csv_completo(ruta: str) -> int:
+    with open(ruta, "rb") as f:
+        return len(list(csv.DictReader(io.StringIO(f.read().decode("utf-8")))))
+
+def _leer_streaming(ruta: str) -> int:
+    with open(ruta, "rb") as f:
+        filas = hojas.filas_excel(f) if ruta.endswith(".xlsx") else hojas.filas_csv(f)
+        return sum(1 for _ in app_mod.filas_con_encabezado(filas))
+
+def _medir_lectura(func, ruta: str) -> tuple:
+    """(segundos, filas, pico de memoria Python en MB); el pico en una segunda pasada, porque
+    tracemalloc ralentiza la lectura."""
+    t0 = time.perf_counter()
+    n = func(ruta)
+    segundos = time.perf_counter() - t0
+    tracemalloc.start()
+    try:
+        func(ruta)
+        pico = tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+    return segundos, n, pico
+
+def bench_importacion(args):
+    """Lectura de un Excel/CSV de n filas: libro completo con acceso por celda (como antes)
+    frente a lectura en streaming, y la importación completa (lectura + validación + fusión)."""
+    ruta_xlsx, ruta_csv = _escribir_archivos(args.directorio, args.n)
+    print(f"{args.n} filas: xlsx {os.path.getsize(ruta_xlsx) / 2**20:.1f} MB, csv {os.path.getsize(ruta_csv) / 2**20:.1f} MB")
+    print(f"{'lectura':34} {'tiempo':>9} {'filas/s':>10} {'pico memoria':>13}")
+    casos = [("xlsx libro completo + ws.cell()", _leer_excel_completo, ruta_xlsx),
+             ("xlsx streaming (read_only)", _leer_streaming, ruta_xlsx),
+             ("csv completo en memoria", _leer_csv_completo, ruta_csv),
+             ("csv streaming", _leer_streaming, ruta_csv)]
+    for nombre, func, ruta in casos:
+        if func is _leer_excel_completo and args.sin_completo:
+            continue
+        segundos, n, pico = _medir_lectura(func, ruta)
+        print(f"{nombre:34} {segundos:8.2f}s {n / segundos:10.0f} {pico:10.1f} MB")
+    for nombre, ruta in (("xlsx", ruta_xlsx), ("csv", ruta_csv)):
+        with app_mod.get_db() as conn:
+            conn.execute("DELETE FROM materiales WHERE codigo >= '8000000'")
+        with open(ruta, "rb") as f:
+            filas = hojas.filas_excel(f) if nombre == "xlsx" else hojas.filas_csv(f)
+            t0 = time.perf_counter()
+            res = app_mod.importar_filas_materiales(app_mod.filas_con_encabezado(filas))
+            segundos = time.perf_counter() - t0
+        print(f"importación completa {nombre:13} {segundos:8.2f}s {res.insertados / segundos:10.0f}"
+              f"   ({res.insertados} nuevos, {len(res.errores)} errores)")
+
+
+# ── exportacion ──────────────────────────────────────────────────────────────
+
+def _exportar_libro_en_memoria() -> int:
+    """Como antes: todas las filas en una lista, Workbook normal con ws.cell() y BytesIO."""
+    from openpyxl import Workbook
+    with app_mod.get_db() as conn:
+        filas = conn.execute("""SELECT id, codigo, ean, descripcion, caducidad, estado, operario_numero,
+                                       fecha_asignacion FROM materiales ORDER BY codigo""").fetchall()
+    wb = Workbook()
+    ws = wb.active
+    for fila, material in enumerate(filas, 2):
+        for col, valor in enumerate(material, 1):
+            ws.cell(row=fila, column=col, value=valor)
+    salida = io.BytesIO()
+    wb.save(salida)
+    return len(salida.getvalue())
+
+def _descargar(cliente, url: str) -> tuple:
+    """(segundos hasta el primer trozo, segundos totales, bytes) leyendo la respuesta en streaming."""
+    t0 = time.perf_counter()
+    resp = cliente.get(url, buffered=False)
+    primero, total = None, 0
+    for trozo in resp.response:
+        if primero is None:
+            primero = time.perf_counter() - t0
+        total += len(trozo)
+    resp.close()
+    return primero or 0.0, time.perf_counter() - t0, total
+
+def bench_exportacion(args):
+    """Exportación de todos los materiales: libro completo en memoria (como antes) frente a
+    CSV por trozos y Excel write-only, con primer byte, tiempo y pico de memoria Python."""
+    cliente = app_mod.app.test_client()
+    cliente.set_cookie("role", "admin")
+    casos = [("xlsx en memoria (antes)", None),
+             ("xlsx write-only", "/admin/exportar_materiales?formato=xlsx"),
+             ("csv por trozos", "/admin/exportar_materiales?formato=csv"),
+             ("csv filtrado (en uso)", "/api/materiales/exportar?formato=csv&estado=en+uso")]
+    print(f"{args.materiales} materiales")
+    print(f"{'exportación':26} {'1er byte':>9} {'total':>8} {'tamaño':>9} {'pico memoria':>13}")
+    for nombre, url in casos:
+        medir = (lambda: (0.0, 0.0, _exportar_libro_en_memoria())) if url is None else (lambda: _descargar(cliente, url))
+        t0 = time.perf_counter()
+        primero, total, tamaño = medir()
+        total = total or time.perf_counter() - t0
+        primero = primero or total
+        tracemalloc.start()
+        try:
+            medir()
+            pico = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+        print(f"{nombre:26} {primero:8.2f}s {total:7.2f}s {tamaño / 2**20:7.1f}MB {pico:10.1f} MB")
+
+
+# ── trabajos ─────────────────────────────────────────────────────────────────
+
+def _latencias_durante(url: str, tarea, terminales: int, pausa: float) -> tuple:
+    """Latencias (ms) de GET url desde `terminales` hilos, cada uno con `pausa` s entre
+    peticiones, mientras tarea() corre en otro hilo; y los segundos que tardó la tarea."""
+    terminada = threading.Event()
+    tiempos = []
+    def terminal():
+        cliente = app_mod.app.test_client()
+        while not terminada.is_set():
+            t0 = time.perf_counter()
+            cliente.get(url)
+            tiempos.append((time.perf_counter() - t0) * 1000)
+            time.sleep(pausa)
+    hilos = [threading.Thread(target=terminal, daemon=True) for _ in range(terminales)]
+    for h in hilos:
+        h.start()
+    t0 = time.perf_counter()
+    try:
+        tarea()
+    finally:
+        segundos = time.perf_counter() - t0
+        terminada.set()
+        for h in hilos:
+            h.join()
+    return tiempos, segundos
+
+def bench_trabajos(args):
+    """Latencia del listado (lo que piden los terminales al escanear) mientras se exportan
+    todos los materiales a Excel: dentro de la petición (openpyxl en el proceso del
+    servidor) frente a como trabajo (openpyxl en un proceso hijo)."""
+    app_mod.gestor_trabajos.configurar(os.path.join(args.directorio, "trabajos.db"),
+                                       os.path.join(args.directorio, "trabajos"))
+    admin = app_mod.app.test_client()
+    admin.set_cookie("role", "admin")
+    url = "/api/materiales?estado=disponible&limit=50"
+
+    def como_trabajo():
+        trabajo = admin.post("/api/admin/trabajos/exportar", data={"formato": "xlsx"}).get_json()
+        while trabajo["estado"] not in ("terminado", "error", "cancelado"):
+            time.sleep(0.2)
+            trabajo = admin.get(f"/api/admin/trabajos/{trabajo['id']}").get_json()
+        assert trabajo["estado"] == "terminado", trabajo
+
+    casos = [("sin exportación", lambda: time.sleep(3)),
+             ("xlsx en la petición", lambda: _descargar(admin, "/admin/exportar_materiales?formato=xlsx")),
+             ("xlsx como trabajo", como_trabajo)]
+    print(f"{args.materiales} materiales; {args.terminales} terminales con GET {url} "
+          f"cada {args.pausa * 1000:.0f} ms durante cada caso")
+    print(f"{'caso':22} {'duración':>9} {'peticiones':>11} {'media':>9} {'p50':>9} {'p95':>9} {'máx':>9}")
+    for nombre, tarea in casos:
+        tiempos, segundos = _latencias_durante(url, tarea, args.terminales, args.pausa)
+        media, p50, p95 = _percentiles(tiempos)
+        print(f"{nombre:22} {segundos:8.2f}s {len(tiempos):11} {media:7.2f}ms {p50:7.2f}ms {p95:7.2f}ms "
+              f"{max(tiempos, default=0):7.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mediciones de rendimiento de la app de materiales")
+    parser.add_argument("--materiales", type=int, default=5000, help="Materiales sintéticos en la base temporal")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("conexiones", help="Coste de conexión por petición con y sin pool")
+    p.add_argument("-n", type=int, default=2000, help="Repeticiones del bloque vacío")
+    p.set_defaults(func=bench_conexiones)
+
+    p = sub.add_parser("plantillas", help="Tiempo de render de las páginas con y sin plantillas compiladas")
+    p.add_argument("-n", type=int, default=50, help="Renders por página")
+    p.set_defaults(func=bench_plantillas)
+
+    p = sub.add_parser("servidor", help="Peticiones/s con terminales concurrentes: desarrollo frente a waitress")
+    p.add_argument("-t", "--terminales", type=int, default=16, help="Terminales simultáneos")
+    p.add_argument("-s", "--segundos", type=float, default=10, help="Duración de cada escenario")
+    p.add_argument("--hilos", type=int, default=servidor.CONFIG_POR_DEFECTO["hilos"], help="Hilos de waitress")
+    p.add_argument("--procesos", type=int, default=2, help="Procesos del escenario multiproceso")
+    p.add_argument("--puerto", type=int, default=5600, help="Primer puerto a usar")
+    p.set_defaults(func=bench_servidor)
+
+    p = sub.add_parser("comandos", help="Latencia de cada comando de materiales en proceso y por HTTP")
+    p.add_argument("-n", type=int, default=300, help="Materiales por ciclo de comandos")
+    p.add_argument("--hilos", type=int, default=8, help="Hilos de la carrera de asignaciones")
+    p.set_defaults(func=bench_comandos)
+
+    p = sub.add_parser("importacion", help="Lectura de Excel/CSV completa frente a streaming e importación")
+    p.add_argument("-n", type=int, default=100000, help="Filas de los archivos de prueba")
+    p.add_argument("--sin-completo", action="store_true", help="Omitir la lectura del libro completo (lenta)")
+    p.set_defaults(func=bench_importacion)
+
+    p = sub.add_parser("exportacion", help="Primer byte, tiempo y memoria de las exportaciones")
+    p.set_defaults(func=bench_exportacion)
+
+    p = sub.add_parser("trabajos", help="Latencia del listado durante una exportación a Excel en la petición y como trabajo")
+    p.add_argument("-t", "--terminales", type=int, default=4, help="Terminales pidiendo el listado a la vez")
+    p.add_argument("--pausa", type=float, default=0.01, help="Segundos entre peticiones de cada terminal")
+    p.set_defaults(func=bench_trabajos)
+
+    p = sub.add_parser("_servir")
+    p.add_argument("--puerto", type=int)
+
+    args = parser.parse_args()
+    if args.comando == "_servir":
+        logging.basicConfig(level=logging.WARNING)
+        _servir(args)
+        return
+    directorio = tempfile.mkdtemp(prefix="bench_materiales_")
+    try:
+        usar_base_temporal(directorio, args.materiales)
+        args.directorio = directorio
+        args.func(args)
+    finally:
+        app_mod._pools.clear()
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,9 @@ SIN BORDES - Para una apariencia más moderna y limpia
 """
 import webview
 import threading
-import time
 import socket
-from app import app, init_db
+from app import app, init_db, _restart_event
+import servidor
 
 def get_local_ip():
     """Obtiene la IP local del equipo"""
@@ -21,7 +21,7 @@ def start_flask():
     """Inicia el servidor Flask en un thread separado"""
     print("🚀 Iniciando servidor Flask...")
     init_db()
-    app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False)
+    servidor.servir(app, host='0.0.0.0', puerto=5000, evento_reinicio=_restart_event)
 
 def main():
     """Función principal que inicia la aplicación en ventana sin bordes"""
@@ -35,7 +35,7 @@ def main():
     
     # Esperar a que Flask esté listo
     print("⏳ Esperando a que el servidor esté listo...")
-    time.sleep(2)
+    servidor.esperar_puerto(5000)
     
     local_ip = get_local_ip()
     print(f"🌐 Servidor ejecutándose:")
@@ -48,9 +48,9 @@ _check_webview2()
 
 import webview
 import threading
-import time
 import socket
-from app import app, init_db
+from app import app, init_db, _restart_event
+import servidor
 
 
 def get_local_ip():
@@ -63,7 +63,7 @@ def get_local_ip():
 
 def start_flask():
     init_db()
-    app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False)
+    servidor.servir(app, host='0.0.0.0', puerto=5000, evento_reinicio=_restart_event)
 
 
 # API expuesta al JavaScript de la ventana
@@ -149,7 +149,7 @@ def main():
     flask_thread.start()
 
     print("Esperando a que el servidor este listo...")
-    time.sleep(2)
+    servidor.esperar_puerto(5000)
 
     ip = get_local_ip()
     print(f"Servidor en: http://localhost:5000  |  Red: http://{ip}:5000")
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Servidor WSGI de producción para la app de materiales.
+
+Sustituye a app.run() (servidor de desarrollo de Werkzeug) por waitress: un número fijo
+de hilos atiende las peticiones, las conexiones HTTP/1.1 se mantienen abiertas entre
+peticiones (keep-alive) y las que no caben esperan en la cola del socket en lugar de
+crear un hilo nuevo por cada una. Si waitress no está instalado se vuelve al servidor de
+Werkzeug con un hilo por petición, como antes.
+
+Con varios procesos (solo donde el sistema tiene SO_REUSEPORT, no en Windows) cada
+trabajador es un intérprete aparte escuchando en el mismo puerto; el kernel reparte las
+conexiones. El proceso principal los vigila: si un trabajador sale con código 42
+(reinicio pedido desde el admin) se activa el evento de reinicio del principal, y al
+salir el principal los termina, así start.bat puede relanzar sin conflicto de puerto.
+
+Configuración por variables de entorno (todas opcionales):
+    SERVIDOR=waitress|desarrollo   motor (por defecto waitress si está instalado)
+    SERVIDOR_HILOS=24              hilos por proceso
+    SERVIDOR_PROCESOS=1            procesos trabajadores
+    SERVIDOR_CONEXIONES=200        conexiones abiertas como máximo por proceso
+    SERVIDOR_COLA=128              conexiones pendientes de aceptar (backlog)
+    SERVIDOR_KEEPALIVE=120         segundos que una conexión inactiva sigue abierta
+
+Uso:
+    python servidor.py             → sirve la app en 0.0.0.0:5000 sin ventana
+"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import atexit
+import logging
+import argparse
+import importlib
+import importlib.util
+import threading
+import subprocess
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CONFIG_POR_DEFECTO: Dict[str, Any] = {
+    "motor": "waitress",
+    "hilos": 24,
+    "procesos": 1,
+    "conexiones": 200,
+    "cola": 128,
+    "keepalive": 120,
+}
+
+# Cada /api/eventos ocupa un hilo mientras la pantalla está abierta: estos hilos quedan
+# siempre libres para las peticiones normales (el resto de canales vuelven a sondear)
+HILOS_RESERVADOS = 8
+
+CODIGO_REINICIO = 42   # contrato con start.bat
+
+def config_desde_entorno(base: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Aplica las variables SERVIDOR_* sobre la configuración dada."""
+    config = dict(CONFIG_POR_DEFECTO if base is None else base)
+    if os.environ.get("SERVIDOR", "").strip():
+        config["motor"] = os.environ["SERVIDOR"].strip().lower()
+    for clave in ("hilos", "procesos", "conexiones", "cola", "keepalive"):
+        valor = os.environ.get(f"SERVIDOR_{clave.upper()}", "").strip()
+        if valor:
+            try:
+                config[clave] = max(1, int(valor))
+            except ValueError:
+                logger.warning(f"SERVIDOR_{clave.upper()}={valor!r} no es un número; se usa {config[clave]}")
+    return config
+
+def _waitress_disponible() -> bool:
+    return importlib.util.find_spec("waitress") is not None
+
+def _socket_compartido(host: str, puerto: int, cola: int) -> socket.socket:
+    """Socket en escucha que otros procesos pueden abrir a la vez sobre el mismo puerto."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, puerto))
+    sock.listen(cola)
+    return sock
+
+def _limitar_eventos(app, config: Dict[str, Any]):
+    # Solo con waitress los hilos son fijos; Werkzeug crea uno por conexión
+    if config["motor"] == "waitress" and hasattr(app, "config"):
+        app.config["SSE_MAX_CONEXIONES"] = max(1, config["hilos"] - HILOS_RESERVADOS)
+
+def _servir_un_proceso(app, host: str, puerto: int, config: Dict[str, Any],
+                       sock: Optional[socket.socket] = None):
+    _limitar_eventos(app, config)
+    if config["motor"] == "waitress":
+        from waitress import create_server
+        opciones = dict(threads=config["hilos"], connection_limit=config["conexiones"],
+                        backlog=config["cola"], channel_timeout=config["keepalive"],
+                        ident="materiales", asyncore_use_poll=True)
+        if sock is not None:
+            servidor = create_server(app, sockets=[sock], **opciones)
+        else:
+            servidor = create_server(app, host=host, port=puerto, **opciones)
+        logger.info(f"waitress en {host}:{puerto} (pid {os.getpid()}): {config['hilos']} hilos, "
+                    f"{config['conexiones']} conexiones, cola {config['cola']}, keep-alive {config['keepalive']} s")
+        servidor.run()
+    else:
+        from werkzeug.serving import make_server
+        logger.warning("Servidor de desarrollo de Werkzeug (un hilo por petición, sin keep-alive)")
+        servidor = make_server(host, puerto, app, threaded=True)
+        servidor.serve_forever()
+
+def _lanzar_trabajadores(n: int, host: str, puerto: int, config: Dict[str, Any], fabrica: str,
+                         evento_reinicio: Optional[threading.Event]):
+    """Arranca n procesos trabajadores y un hilo que vigila cómo terminan."""
+    entorno = dict(os.environ)
+    entorno.update({f"SERVIDOR_{k.upper()}": str(v) for k, v in config.items() if k != "motor"})
+    entorno["SERVIDOR"] = config["motor"]
+    hijos = [subprocess.Popen([sys.executable, os.path.join(BASE_DIR, "servidor.py"), "--trabajador",
+                               "--host", host, "--puerto", str(puerto), "--app", fabrica],
+                              cwd=BASE_DIR, env=entorno)
+             for _ in range(n)]
+
+    def terminar():
+        for h in hijos:
+            if h.poll() is None:
+                h.terminate()
+        for h in hijos:
+            try:
+                h.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                h.kill()
+    atexit.register(terminar)
+
+    def vigilar(hijo: subprocess.Popen):
+        codigo = hijo.wait()
+        if codigo == CODIGO_REINICIO and evento_reinicio is not None:
+            logger.info(f"Trabajador {hijo.pid} pidió reinicio")
+            evento_reinicio.set()
+        elif codigo > 0:
+            logger.error(f"Trabajador {hijo.pid} terminó con código {codigo}")
+    for h in hijos:
+        threading.Thread(target=vigilar, args=(h,), daemon=True, name=f"vigila-{h.pid}").start()
+    return hijos
+
+def servir(app, host: str = "0.0.0.0", puerto: int = 5000, config: Optional[Dict[str, Any]] = None,
+           evento_reinicio: Optional[threading.Event] = None, fabrica: str = "servidor:app_por_defecto"):
+    """Sirve la app WSGI hasta que termine el proceso (bloqueante; para la ventana, en un hilo).
+
+    fabrica ("modulo:funcion") es lo que importan los procesos trabajadores para obtener
+    su propia app; este proceso sirve `app` y cuenta como uno de ellos."""
+    config = dict(config_desde_entorno() if config is None else config)
+    if config["motor"] == "waitress" and not _waitress_disponible():
+        logger.warning("waitress no está instalado (pip install -r requirements.txt)")
+        config["motor"] = "desarrollo"
+    if config["procesos"] > 1 and (config["motor"] != "waitress" or not hasattr(socket, "SO_REUSEPORT")):
+        logger.warning("Varios procesos requieren waitress y SO_REUSEPORT; se sirve con uno solo")
+        config["procesos"] = 1
+    if config["procesos"] == 1:
+        _servir_un_proceso(app, host, puerto, config)
+        return
+    # El principal abre su socket antes que los hijos: si el puerto está ocupado falla aquí
+    sock = _socket_compartido(host, puerto, config["cola"])
+    if threading.current_thread() is threading.main_thread():
+        # SIGTERM al principal también debe terminar a los hijos (atexit solo corre con sys.exit)
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    _lanzar_trabajadores(config["procesos"] - 1, host, puerto, config, fabrica, evento_reinicio)
+    _servir_un_proceso(app, host, puerto, config, sock)
+
+def esperar_puerto(puerto: int, host: str = "127.0.0.1", timeout: float = 15.0) -> bool:
+    """Espera a que el servidor acepte conexiones (en lugar de dormir un tiempo fijo)."""
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        try:
+            with socket.create_connection((host, puerto), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+def app_por_defecto():
+    """App de los procesos trabajadores: la de app.py con sus bases inicializadas."""
+    from app import app, init_db
+    init_db()
+    return app
+
+def _cargar_fabrica(fabrica: str):
+    modulo, _, funcion = fabrica.partition(":")
+    return getattr(importlib.import_module(modulo), funcion)()
+
+def _main_trabajador(args):
+    app = _cargar_fabrica(args.app)
+    # Reinicio pedido a este trabajador: se avisa al principal con el código de salida
+    from app import _restart_event
+    def esperar_reinicio():
+        _restart_event.wait()
+        logging.shutdown()
+        os._exit(CODIGO_REINICIO)
+    threading.Thread(target=esperar_reinicio, daemon=True, name="reinicio").start()
+    # Si el principal muere sin poder terminarnos (kill -9, cierre de la consola) no quedamos huérfanos
+    padre = os.getppid()
+    def vigilar_principal():
+        while os.getppid() == padre:
+            time.sleep(1)
+        os._exit(0)
+    threading.Thread(target=vigilar_principal, daemon=True, name="principal").start()
+    config = config_desde_entorno()
+    _servir_un_proceso(app, args.host, args.puerto, config, _socket_compartido(args.host, args.puerto, config["cola"]))
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor de producción de la app de materiales")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--puerto", type=int, default=5000)
+    parser.add_argument("--trabajador", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--app", default="servidor:app_por_defecto", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.trabajador:
+        _main_trabajador(args)
+        return
+    from app import _restart_event
+    servir(_cargar_fabrica(args.app), args.host, args.puerto,
+           evento_reinicio=_restart_event, fabrica=args.app)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Compresión de respuestas HTTP (gzip, y brotli si está instalado).
+
+Se negocia con Accept-Encoding y solo se comprimen tipos de texto (HTML, JSON, JS, CSS,
+CSV, eventos) por encima de un umbral de tamaño: por debajo, las cabeceras y el marco del
+formato se comen lo que se ahorra. Las respuestas en streaming (/api/eventos, exportaciones)
+se comprimen trozo a trozo con un flush tras cada uno, para que cada evento llegue en
+cuanto se genera en lugar de esperar a llenar un bloque.
+
+Las respuestas con ETag (las de respuesta_cacheable) repiten cuerpo mientras no cambie la
+base: su versión comprimida se guarda en una LRU pequeña y no se recomprime. El ETag pasa
+a débil (W/"..."), como hace nginx: la representación comprimida no es idéntica byte a
+byte a la original, pero sí equivalente.
+
+Por cada ruta se acumulan bytes originales y enviados para ver el ahorro real.
+"""
+import gzip
+import zlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Iterable
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+UMBRAL_BYTES = 1024
+NIVEL_GZIP = 6
+NIVEL_BROTLI = 5          # 0-11; a partir de 6 el coste de CPU crece mucho más que el ahorro
+MAX_CACHE_COMPRIMIDOS = 128
+TIPOS_COMPRIMIBLES = ("text/", "application/json", "application/javascript", "application/manifest+json",
+                      "image/svg+xml")
+
+def _gzip_streaming():
+    comp = zlib.compressobj(NIVEL_GZIP, zlib.DEFLATED, 16 + zlib.MAX_WBITS)   # 16+: cabecera gzip
+    return (lambda trozo: comp.compress(trozo) + comp.flush(zlib.Z_SYNC_FLUSH)), comp.flush
+
+def _brotli_streaming():
+    comp = brotli.Compressor(quality=NIVEL_BROTLI)
+    return (lambda trozo: comp.process(trozo) + comp.flush()), comp.finish
+
+class Compresor:
+    """Comprime respuestas de Flask/Werkzeug y lleva las estadísticas por ruta."""
+
+    def __init__(self, umbral: int = UMBRAL_BYTES):
+        self.umbral = umbral
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    # ── Negociación ─────────────────────────────────────────────────────────────
+    def codificacion(self, accept_encodings) -> Optional[str]:
+        """'br', 'gzip' o None según Accept-Encoding (objeto Accept de Werkzeug)."""
+        if brotli is not None and accept_encodings["br"] > 0:
+            return "br"
+        if accept_encodings["gzip"] > 0:
+            return "gzip"
+        return None
+
+    def _comprimible(self, resp) -> bool:
+        if resp.status_code < 200 or resp.status_code in (204, 206, 304):
+            return False
+        # send_file (Excel, que ya es un zip) y recursos ya comprimidos se envían tal cual
+        if resp.direct_passthrough or "Content-Encoding" in resp.headers:
+            return False
+        return (resp.mimetype or "").startswith(TIPOS_COMPRIMIBLES)
+
+    # ── Compresión ──────────────────────────────────────────────────────────────
+    def _comprimir(self, datos: bytes, codificacion: str) -> bytes:
+        if codificacion == "br":
+            return brotli.compress(datos, quality=NIVEL_BROTLI)
+        return gzip.compress(datos, compresslevel=NIVEL_GZIP, mtime=0)
+
+    def _comprimir_con_cache(self, datos: bytes, codificacion: str, etag: Optional[str]) -> bytes:
+        if not etag:
+            return self._comprimir(datos, codificacion)
+        clave = (etag, codificacion, len(datos))
+        with self._lock:
+            comprimido = self._cache.get(clave)
+            if comprimido is not None:
+                self._cache.move_to_end(clave)
+                return comprimido
+        comprimido = self._comprimir(datos, codificacion)
+        with self._lock:
+            self._cache[clave] = comprimido
+            if len(self._cache) > MAX_CACHE_COMPRIMIDOS:
+                self._cache.popitem(last=False)
+        return comprimido
+
+    def _flujo(self, iterable: Iterable[bytes], codificacion: str, ruta: str):
+        comprimir, terminar = _brotli_streaming() if codificacion == "br" else _gzip_streaming()
+        originales = enviados = 0
+        try:
+            for trozo in iterable:
+                if isinstance(trozo, str):
+                    trozo = trozo.encode("utf-8")
+                if not trozo:
+                    continue
+                salida = comprimir(trozo)
+                originales += len(trozo)
+                enviados += len(salida)
+                yield salida
+            salida = terminar()
+            enviados += len(salida)
+            yield salida
+        finally:
+            # El cliente puede cortar (p. ej. al cerrar la pantalla con /api/eventos abierto)
+            if hasattr(iterable, "close"):
+                iterable.close()
+            self._contar(ruta, originales, enviados, codificacion)
+
+    def procesar(self, resp, accept_encodings, ruta: str):
+        """Devuelve la respuesta comprimida si procede (modifica `resp`)."""
+        if not self._comprimible(resp):
+            return resp
+        resp.vary.add("Accept-Encoding")
+        codificacion = self.codificacion(accept_encodings)
+        if resp.is_streamed:
+            if codificacion is None:
+                return resp
+            resp.response = self._flujo(resp.response, codificacion, ruta)
+            resp.headers.pop("Content-Length", None)
+        else:
+            datos = resp.get_data()
+            if codificacion is None or len(datos) < self.umbral:
+                self._contar(ruta, len(datos), len(datos), None)
+                return resp
+            etag, debil = resp.get_etag()
+            comprimido = self._comprimir_con_cache(datos, codificacion, etag)
+            if len(comprimido) >= len(datos):
+                self._contar(ruta, len(datos), len(datos), None)
+                return resp
+            resp.set_data(comprimido)   # también ajusta Content-Length
+            if etag:
+                resp.set_etag(etag, weak=True)
+            self._contar(ruta, len(datos), len(comprimido), codificacion)
+        resp.headers["Content-Encoding"] = codificacion
+        return resp
+
+    # ── Estadísticas ────────────────────────────────────────────────────────────
+    def _contar(self, ruta: str, originales: int, enviados: int, codificacion: Optional[str]):
+        with self._lock:
+            s = self._stats.get(ruta)
+            if s is None:
+                s = self._stats[ruta] = {"respuestas": 0, "comprimidas": 0, "br": 0,
+                                         "bytes_originales": 0, "bytes_enviados": 0}
+            s["respuestas"] += 1
+            s["bytes_originales"] += originales
+            s["bytes_enviados"] += enviados
+            if codificacion:
+                s["comprimidas"] += 1
+                if codificacion == "br":
+                    s["br"] += 1
+
+    def estadisticas(self) -> Dict[str, Any]:
+        """Por ruta: respuestas, cuántas se comprimieron, bytes y ratio enviados/originales."""
+        with self._lock:
+            stats = {ruta: dict(s) for ruta, s in self._stats.items()}
+        total_orig = sum(s["bytes_originales"] for s in stats.values())
+        total_env = sum(s["bytes_enviados"] for s in stats.values())
+        for s in stats.values():
+            s["ratio"] = round(s["bytes_enviados"] / s["bytes_originales"], 3) if s["bytes_originales"] else 1.0
+            s["ahorrado_bytes"] = s["bytes_originales"] - s["bytes_enviados"]
+        return {
+            "brotli_disponible": brotli is not None,
+            "umbral_bytes": self.umbral,
+            "total": {"bytes_originales": total_orig, "bytes_enviados": total_env,
+                      "ratio": round(total_env / total_orig, 3) if total_orig else 1.0},
+            "rutas": stats,
+        }
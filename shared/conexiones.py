@@ -0,0 +1,143 @@
+"""
+Pool de conexiones SQLite por hilo.
+
+Cada hilo reutiliza sus propias conexiones (sqlite3 no permite compartirlas entre hilos
+sin check_same_thread=False): abrir una conexión, leer el esquema y aplicar los PRAGMA
+se hace una vez por hilo y no en cada consulta. Si un hilo anida dos bloques sobre la
+misma base recibe una segunda conexión, para que el commit/rollback del bloque interior
+no afecte al exterior.
+
+Las conexiones se abren en modo WAL (los lectores no bloquean al escritor), con lecturas
+por mmap, caché de páginas y de sentencias, y busy_timeout para esperar al escritor en
+lugar de fallar con "database is locked".
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Callable
+
+PRAGMAS_POR_DEFECTO: Dict[str, Any] = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",      # en WAL es seguro ante caídas de la app; solo un corte de luz pierde el último commit
+    "busy_timeout": 5000,         # ms esperando al escritor antes de "database is locked"
+    "cache_size": -16000,         # KiB (negativo) de caché de páginas por conexión
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+
+SENTENCIAS_EN_CACHE = 256
+
+def pragmas_desde_entorno(base: Dict[str, Any]) -> Dict[str, Any]:
+    """Aplica SQLITE_PRAGMAS="mmap_size=0,synchronous=FULL" sobre los PRAGMA dados."""
+    pragmas = dict(base)
+    for par in os.environ.get("SQLITE_PRAGMAS", "").split(","):
+        nombre, _, valor = par.partition("=")
+        if nombre.strip() and valor.strip():
+            pragmas[nombre.strip()] = valor.strip()
+    return pragmas
+
+def aplicar_pragmas(conn: sqlite3.Connection, pragmas: Dict[str, Any]):
+    for nombre, valor in pragmas.items():
+        conn.execute(f"PRAGMA {nombre}={valor}")
+
+class PoolConexiones:
+    """Conexiones reutilizables por hilo a una base de datos.
+
+    max_por_hilo=0 desactiva la reutilización (una conexión nueva por bloque, como antes);
+    lo usa benchmark.py para comparar."""
+
+    def __init__(self, ruta: str, pragmas: Optional[Dict[str, Any]] = None, max_por_hilo: int = 2,
+                 row_factory=sqlite3.Row, al_abrir: Optional[Callable[[sqlite3.Connection], None]] = None,
+                 al_confirmar: Optional[Callable[[], None]] = None):
+        self.ruta = ruta
+        self.al_abrir = al_abrir            # prepara cada conexión nueva (ATTACH, funciones, vistas TEMP)
+        self.al_confirmar = al_confirmar    # se llama tras un commit que cambió filas
+        self.pragmas = PRAGMAS_POR_DEFECTO if pragmas is None else pragmas
+        self.max_por_hilo = max_por_hilo
+        self.row_factory = row_factory
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {"aciertos": 0, "aperturas": 0, "cierres": 0,
+                       "esperas_bloqueo": 0, "espera_bloqueo_ms": 0.0, "bloqueos_agotados": 0}
+
+    def _contar(self, clave: str, n=1):
+        with self._stats_lock:
+            self._stats[clave] += n
+
+    def _abrir(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.ruta, cached_statements=SENTENCIAS_EN_CACHE)
+        conn.row_factory = self.row_factory
+        aplicar_pragmas(conn, self.pragmas)
+        if self.al_abrir:
+            self.al_abrir(conn)
+        self._contar("aperturas")
+        return conn
+
+    def _libres(self) -> list:
+        libres = getattr(self._local, "libres", None)
+        if libres is None:
+            libres = self._local.libres = []
+        return libres
+
+    def tomar(self) -> sqlite3.Connection:
+        libres = self._libres()
+        if libres:
+            self._contar("aciertos")
+            return libres.pop()
+        return self._abrir()
+
+    def devolver(self, conn: sqlite3.Connection):
+        libres = self._libres()
+        # El bloque pudo cambiar row_factory (algunos endpoints lo fijan a mano)
+        conn.row_factory = self.row_factory
+        if conn.in_transaction or len(libres) >= self.max_por_hilo:
+            conn.close()
+            self._contar("cierres")
+        else:
+            libres.append(conn)
+
+    @contextmanager
+    def conexion(self):
+        """Conexión del hilo: commit al salir del bloque, rollback si hay excepción."""
+        conn = self.tomar()
+        cambios = conn.total_changes
+        try:
+            yield conn
+            conn.commit()
+            if self.al_confirmar and conn.total_changes != cambios:
+                self.al_confirmar()
+        except Exception as e:
+            conn.rollback()
+            if isinstance(e, sqlite3.OperationalError) and "locked" in str(e):
+                self._contar("bloqueos_agotados")
+            raise
+        finally:
+            self.devolver(conn)
+
+    def begin_immediate(self, conn: sqlite3.Connection):
+        """BEGIN IMMEDIATE midiendo cuánto se espera al escritor que tenga el bloqueo."""
+        t0 = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        espera = (time.perf_counter() - t0) * 1000
+        if espera >= 1:
+            with self._stats_lock:
+                self._stats["esperas_bloqueo"] += 1
+                self._stats["espera_bloqueo_ms"] += espera
+
+    def cerrar_hilo(self):
+        """Cierra las conexiones libres del hilo actual."""
+        libres = self._libres()
+        while libres:
+            libres.pop().close()
+            self._contar("cierres")
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        pedidas = stats["aciertos"] + stats["aperturas"]
+        stats["tasa_aciertos"] = round(stats["aciertos"] / pedidas, 3) if pedidas else 0.0
+        stats["espera_bloqueo_ms"] = round(stats["espera_bloqueo_ms"], 1)
+        stats["pragmas"] = dict(self.pragmas)
+        return stats
@@ -0,0 +1,136 @@
+"""
+Lectura en streaming de hojas de cálculo subidas (Excel y CSV).
+
+Las filas se leen de una en una directamente del fichero subido (el stream de Werkzeug,
+que ya está en memoria o en su propio temporal): no se guarda otra copia en disco ni se
+carga el libro entero. Excel se abre en modo solo lectura, que recorre el XML de la hoja
+sin crear un objeto por celda; el CSV se decodifica a medida que se lee. Quien consume las
+filas (las importaciones de app.py) las recibe como generador, así la memoria no crece
+con el tamaño del archivo.
+
+También escribe libros en modo write-only, y convierte de y a Excel en un proceso aparte
+para los trabajos en segundo plano (xlsx_a_csv, jsonl_a_xlsx: ver shared/trabajos.py).
+"""
+import io
+import csv
+import json
+import codecs
+from datetime import date, datetime
+from typing import Iterable, Iterator, Optional, Tuple
+
+EXTENSIONES_EXCEL = ("xlsx", "xlsm")
+EXTENSIONES_CSV = ("csv", "txt")
+MUESTRA_BYTES = 64 * 1024   # lo que se mira para elegir codificación y separador
+
+def extension(nombre: str) -> str:
+    return (nombre or "").lower().rpartition(".")[2]
+
+def texto_celda(valor) -> str:
+    """Valor de una celda de Excel como lo escribiría el usuario en un CSV."""
+    if valor is None:
+        return ""
+    if isinstance(valor, (datetime, date)):
+        return valor.strftime("%Y-%m-%d")
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))   # códigos y EAN guardados como número
+    return str(valor).strip()
+
+def filas_excel(stream) -> Iterator[tuple]:
+    """Valores de cada fila de la hoja activa (None en las celdas vacías). El libro se abre
+    al llamar, así un archivo que no es Excel falla aquí y no a mitad de la importación."""
+    from openpyxl import load_workbook
+    wb = load_workbook(stream, read_only=True, data_only=True)
+    def filas():
+        try:
+            yield from wb.active.iter_rows(values_only=True)
+        finally:
+            wb.close()
+    return filas()
+
+def _codificacion_y_separador(muestra: bytes) -> Tuple[str, str]:
+    """UTF-8 (con o sin BOM) si la muestra lo es, si no latin-1 (CSV de Excel en Windows);
+    ';' si la primera línea lo tiene (Excel en español), si no ','."""
+    try:
+        # final=False: la muestra puede cortar un carácter multibyte al final
+        texto = codecs.getincrementaldecoder("utf-8-sig")().decode(muestra, final=False)
+        codificacion = "utf-8-sig"
+    except UnicodeDecodeError:
+        texto = muestra.decode("latin-1")
+        codificacion = "latin-1"
+    primera = texto.split("\n", 1)[0]
+    return codificacion, (";" if ";" in primera else ",")
+
+def filas_csv(stream, separador: Optional[str] = None) -> Iterator[list]:
+    """Filas de un CSV en bytes, decodificado a medida que se lee."""
+    muestra = stream.read(MUESTRA_BYTES)
+    codificacion, detectado = _codificacion_y_separador(muestra)
+    stream.seek(0)
+    texto = io.TextIOWrapper(stream, encoding=codificacion, errors="replace", newline="")
+    try:
+        yield from csv.reader(texto, delimiter=separador or detectado)
+    finally:
+        # El stream es de quien lo abrió (que puede haberlo cerrado ya si se corta la lectura)
+        if not stream.closed:
+            texto.detach()
+
+def filas_archivo(archivo) -> Iterator[tuple]:
+    """Filas de un FileStorage de Flask según su extensión (ValueError si no se admite)."""
+    ext = extension(archivo.filename)
+    if ext in EXTENSIONES_EXCEL:
+        return filas_excel(archivo.stream)
+    if ext in EXTENSIONES_CSV:
+        return filas_csv(archivo.stream)
+    raise ValueError(f"Formato no admitido: .{ext}")
+
+# ── Escritura ─────────────────────────────────────────────────────────────────
+def escribir_xlsx(filas: Iterable[tuple], destino, columnas, titulo: str):
+    """Libro write-only con una hoja: encabezado con estilo y anchos de `columnas`
+    ((nombre, ancho), ...) y las filas según llegan. destino es una ruta o un archivo."""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill, Alignment
+    from openpyxl.utils import get_column_letter
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(titulo[:31])
+    for n, (_, ancho) in enumerate(columnas, 1):
+        ws.column_dimensions[get_column_letter(n)].width = ancho
+    encabezado = []
+    for nombre, _ in columnas:
+        celda = WriteOnlyCell(ws, value=nombre)
+        celda.font = Font(bold=True, color="FFFFFF")
+        celda.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+        celda.alignment = Alignment(horizontal="center")
+        encabezado.append(celda)
+    ws.append(encabezado)
+    for fila in filas:
+        ws.append(fila)
+    wb.save(destino)
+
+# ── Conversiones para los trabajos en segundo plano ───────────────────────────
+# openpyxl es Python puro: leer o escribir un libro grande retiene el GIL durante segundos.
+# Los trabajos las ejecutan en un proceso hijo; progreso(hecho, total, mensaje) informa y
+# lanza la cancelación.
+def xlsx_a_csv(origen: str, destino: str, progreso=None) -> int:
+    """Hoja activa de un .xlsx a CSV (UTF-8, ';') con las celdas como texto. Devuelve las filas."""
+    n = 0
+    with open(origen, "rb") as f, open(destino, "w", encoding="utf-8", newline="") as salida:
+        w = csv.writer(salida, delimiter=";")
+        for n, fila in enumerate(filas_excel(f), 1):
+            w.writerow([texto_celda(v) for v in fila])
+            if progreso:
+                progreso(n, mensaje="Leyendo Excel")
+    return n
+
+def jsonl_a_xlsx(origen: str, destino: str, columnas, titulo: str, total: Optional[int] = None,
+                 progreso=None) -> int:
+    """Libro de escribir_xlsx con las filas de un archivo JSON Lines (una lista por línea)."""
+    n = 0
+    def filas(f):
+        nonlocal n
+        for n, linea in enumerate(f, 1):
+            yield json.loads(linea)
+            if progreso:
+                progreso(n, total, "Escribiendo Excel")
+    with open(origen, encoding="utf-8") as f:
+        escribir_xlsx(filas(f), destino, columnas, titulo)
+    return n
@@ -0,0 +1,380 @@
+"""
+Migraciones de esquema de materiales.db
+Registro numerado que se aplica una sola vez según PRAGMA user_version.
+Lo usan app.py (init_db) y los scripts de bajas, así los endpoints no ejecutan DDL.
+"""
+import sqlite3
+from typing import Callable, List, Tuple
+
+# Parte del estado de un material que no depende de la fecha de hoy: gastado/retirado/
+# escaneado, 'en uso', 'error fecha' o 'fecha' (caducado/vence prox/disponible según el día).
+# Está indexada (idx_materiales_orden); las consultas deben usar exactamente esta expresión.
+# Fecha válida = la que acepta parse_date() en app.py, guardada como YYYY-MM-DD (así la
+# escribe normalize_date_human). date() devuelve NULL para meses o días imposibles
+# ('2025-13-45'): el IFNULL evita que el NOT de 'error fecha' quede en NULL y la fila caiga
+# en 'fecha'. El año 0000 lo acepta SQLite pero no datetime.
+SQL_CAD_VALIDA = ("(caducidad GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]' "
+                  "AND substr(caducidad, 1, 4) <> '0000' "
+                  "AND IFNULL(date(caducidad, '+0 days') = caducidad, 0))")
+SQL_CON_OPERARIO = "TRIM(IFNULL(operario_numero,''), char(32,9,10,11,12,13)) <> ''"
+SQL_CLASE_ESTADO = f"""(CASE
+    WHEN LOWER(IFNULL(estado,'')) IN ('gastado','retirado','escaneado') THEN LOWER(estado)
+    WHEN {SQL_CON_OPERARIO} THEN 'en uso'
+    WHEN NOT {SQL_CAD_VALIDA} THEN 'error fecha'
+    ELSE 'fecha'
+END)"""
+
+# Orden del listado por estado (mismo que sort_key_estado en app.py)
+ORDEN_ESTADOS = {"caducado": 0, "en uso": 1, "vence prox": 2, "disponible": 3, "precintado": 4,
+                 "retirado": 5, "gastado": 6, "escaneado": 7, "error fecha": 8}
+
+def sql_estado_base(hoy: str, limite: str) -> str:
+    """Expresión SQL equivalente a estado_base() con hoy/limite dados como SQL (parámetro o subconsulta)."""
+    return f"""(CASE {SQL_CLASE_ESTADO}
+    WHEN 'fecha' THEN CASE
+        WHEN caducidad < {hoy} THEN 'caducado'
+        WHEN caducidad <= {limite} THEN 'vence prox'
+        ELSE 'disponible'
+    END
+    ELSE {SQL_CLASE_ESTADO}
+END)"""
+
+def sql_set_estado(hoy: str, limite: str) -> str:
+    """Asignaciones SET de las columnas de estado materializado (migración 7)."""
+    base = sql_estado_base(hoy, limite)
+    orden = " ".join(f"WHEN '{e}' THEN {n}" for e, n in ORDEN_ESTADOS.items())
+    return f"""estado_calc = {base},
+        estado_orden = (CASE {base} {orden} ELSE 99 END),
+        vence_prox = ({SQL_CAD_VALIDA} AND caducidad >= {hoy} AND caducidad <= {limite}),
+        caducado = ({SQL_CAD_VALIDA} AND caducidad < {hoy}),
+        precintado = (LOWER(IFNULL(estado,'')) = 'precintado' AND NOT {SQL_CON_OPERARIO})"""
+
+def _columnas(conn: sqlite3.Connection, tabla: str) -> set:
+    return {r[1] for r in conn.execute(f"PRAGMA table_info({tabla})")}
+
+def _m1_esquema_base(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS materiales (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            codigo TEXT UNIQUE NOT NULL,
+            caducidad TEXT,
+            estado TEXT DEFAULT 'precintado',
+            operario_numero TEXT,
+            ean TEXT,
+            descripcion TEXT,
+            fecha_asignacion TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ean_descriptions (
+            ean TEXT PRIMARY KEY,
+            descripcion TEXT NOT NULL,
+            fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def _m2_procesado_excel(conn: sqlite3.Connection):
+    # Las bases antiguas pueden tenerla ya (la añadía _ensure_procesado_excel_col)
+    if "procesado_excel" not in _columnas(conn, "materiales"):
+        conn.execute("ALTER TABLE materiales ADD COLUMN procesado_excel INTEGER DEFAULT 0")
+
+def _m3_bajas(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS bajas (
+            id              INTEGER PRIMARY KEY AUTOINCREMENT,
+            codigo          TEXT,
+            descripcion     TEXT,
+            estado_original TEXT,
+            operario_numero TEXT,
+            fecha_baja      TEXT DEFAULT (datetime('now','localtime'))
+        )
+    """)
+
+def _m4_solicitud_excel_cliente(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS solicitud_excel_cliente (
+            id INTEGER PRIMARY KEY,
+            estado TEXT DEFAULT 'idle',
+            solicitada_en TEXT,
+            completada_en TEXT,
+            salida TEXT,
+            ultimo_poll_agente TEXT
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO solicitud_excel_cliente (id, estado) VALUES (1, 'idle')")
+
+def _m5_indices(conn: sqlite3.Connection):
+    # Listados/estadísticas por operario (api_operario_materiales, get_estadisticas_operario, eliminar_operario)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_materiales_operario ON materiales(operario_numero, estado)")
+    # Consistencia EAN-descripción, get_desc y el bloqueo mismo EAN + operario al asignar
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_materiales_ean_operario ON materiales(ean, operario_numero)")
+    # Filtros 'vence prox' / 'caducado'
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_materiales_caducidad ON materiales(caducidad)")
+    # Cola de bajas pendientes del agente Excel (parcial: solo las filas que la consulta mira)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_materiales_bajas_pendientes ON materiales(fecha_asignacion)
+        WHERE estado IN ('gastado','retirado') AND (procesado_excel IS NULL OR procesado_excel = 0)
+    """)
+    # Orden del listado dentro de cada estado que no depende del día
+    conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_materiales_orden
+        ON materiales({SQL_CLASE_ESTADO}, IFNULL(caducidad,''), codigo)
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bajas_fecha ON bajas(fecha_baja)")
+    conn.execute("ANALYZE")
+
+def _m6_fts_materiales(conn: sqlite3.Connection):
+    # Índice de texto completo (trigramas: sigue encontrando subcadenas) sincronizado por triggers.
+    # Si esta compilación de SQLite no trae FTS5/trigram se omite y la búsqueda recorre la tabla.
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS materiales_fts USING fts5(
+                codigo, ean, descripcion, operario_numero,
+                content='materiales', content_rowid='id', tokenize='trigram'
+            )
+        """)
+    except sqlite3.OperationalError:
+        return
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS materiales_fts_ai AFTER INSERT ON materiales BEGIN
+            INSERT INTO materiales_fts(rowid, codigo, ean, descripcion, operario_numero)
+            VALUES (new.id, new.codigo, new.ean, new.descripcion, new.operario_numero);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS materiales_fts_ad AFTER DELETE ON materiales BEGIN
+            INSERT INTO materiales_fts(materiales_fts, rowid, codigo, ean, descripcion, operario_numero)
+            VALUES ('delete', old.id, old.codigo, old.ean, old.descripcion, old.operario_numero);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS materiales_fts_au
+        AFTER UPDATE OF codigo, ean, descripcion, operario_numero ON materiales BEGIN
+            INSERT INTO materiales_fts(materiales_fts, rowid, codigo, ean, descripcion, operario_numero)
+            VALUES ('delete', old.id, old.codigo, old.ean, old.descripcion, old.operario_numero);
+            INSERT INTO materiales_fts(rowid, codigo, ean, descripcion, operario_numero)
+            VALUES (new.id, new.codigo, new.ean, new.descripcion, new.operario_numero);
+        END
+    """)
+    conn.execute("INSERT INTO materiales_fts(materiales_fts) VALUES ('rebuild')")
+
+def fts_disponible(conn: sqlite3.Connection) -> bool:
+    """True si existe el índice materiales_fts (la migración 6 pudo crearlo)."""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='materiales_fts'"
+    ).fetchone() is not None
+
+def _sql_set_estado_dia() -> str:
+    """sql_set_estado con el día de referencia guardado en materiales_dia (para los triggers)."""
+    return sql_set_estado("(SELECT hoy FROM materiales_dia WHERE id = 1)",
+                          "(SELECT limite FROM materiales_dia WHERE id = 1)")
+
+def _triggers_estado(conn: sqlite3.Connection):
+    dia = _sql_set_estado_dia()
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS materiales_estado_ai AFTER INSERT ON materiales BEGIN
+            UPDATE materiales SET {dia} WHERE id = new.id;
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS materiales_estado_au
+        AFTER UPDATE OF caducidad, estado, operario_numero ON materiales BEGIN
+            UPDATE materiales SET {dia} WHERE id = new.id;
+        END
+    """)
+
+def _m7_estado_materializado(conn: sqlite3.Connection):
+    # Estado derivado guardado en columnas indexadas. Los triggers lo calculan en cada
+    # escritura con el día de referencia de materiales_dia; la app cambia ese día (y
+    # recalcula todas las filas) al pasar la medianoche o al cambiar AVISO_DIAS.
+    cols = _columnas(conn, "materiales")
+    for col, tipo in (("estado_calc", "TEXT"), ("estado_orden", "INTEGER"), ("vence_prox", "INTEGER DEFAULT 0"),
+                      ("caducado", "INTEGER DEFAULT 0"), ("precintado", "INTEGER DEFAULT 0")):
+        if col not in cols:
+            conn.execute(f"ALTER TABLE materiales ADD COLUMN {col} {tipo}")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS materiales_dia (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            hoy TEXT NOT NULL DEFAULT '',
+            limite TEXT NOT NULL DEFAULT '',
+            aviso_dias INTEGER
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO materiales_dia (id) VALUES (1)")
+    _triggers_estado(conn)
+    # El orden completo del listado queda en un índice normal; sustituye a idx_materiales_orden
+    conn.execute("DROP INDEX IF EXISTS idx_materiales_orden")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_materiales_estado_orden
+                    ON materiales(estado_orden, IFNULL(caducidad,''), codigo)""")
+    for flag in ("vence_prox", "caducado", "precintado"):
+        conn.execute(f"""CREATE INDEX IF NOT EXISTS idx_materiales_{flag}
+                         ON materiales(estado_orden, IFNULL(caducidad,''), codigo) WHERE {flag} = 1""")
+
+# Claves de materiales_contadores: una por estado base ('precintado' cuenta los precintados
+# sin operario) más los materiales en uso que además vencen pronto o están caducados.
+CLAVES_CONTADOR = tuple(ORDEN_ESTADOS) + ("en uso vence prox", "en uso caducado")
+
+def sql_cuenta_contador(r: str) -> str:
+    """Condición SQL de que la fila r (old/new/alias) entra en los contadores."""
+    return f"({r}.estado_calc IS NOT NULL AND IFNULL({r}.procesado_excel, 0) = 0)"
+
+def sql_claves_contador(r: str) -> str:
+    """Lista SQL (para IN) de las claves de materiales_contadores a las que suma la fila r."""
+    return f"""{r}.estado_calc,
+        CASE WHEN {r}.estado_calc = 'en uso' AND {r}.vence_prox = 1 THEN 'en uso vence prox' END,
+        CASE WHEN {r}.estado_calc = 'en uso' AND {r}.caducado = 1 THEN 'en uso caducado' END,
+        CASE WHEN LOWER(IFNULL({r}.estado,'')) = 'precintado' AND IFNULL({r}.operario_numero,'') = ''
+             THEN 'precintado' END"""
+
+def _m8_contadores(conn: sqlite3.Connection):
+    # Resumen de /api/contadores mantenido por triggers. No hace falta trigger de INSERT:
+    # materiales_estado_ai rellena estado_calc con un UPDATE, que ya dispara el de UPDATE.
+    # El cambio de día tampoco: recalcular estados es un UPDATE de esas mismas columnas.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS materiales_contadores (
+            clave TEXT PRIMARY KEY,
+            n INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.executemany("INSERT OR IGNORE INTO materiales_contadores (clave) VALUES (?)",
+                     [(c,) for c in CLAVES_CONTADOR])
+    conn.execute(f"""
+        UPDATE materiales_contadores SET n = (
+            SELECT COUNT(*) FROM materiales m
+            WHERE {sql_cuenta_contador('m')} AND materiales_contadores.clave IN ({sql_claves_contador('m')})
+        )
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS materiales_contadores_au
+        AFTER UPDATE OF estado_calc, vence_prox, caducado, estado, operario_numero, procesado_excel
+        ON materiales BEGIN
+            UPDATE materiales_contadores SET n = n - 1
+            WHERE {sql_cuenta_contador('old')} AND clave IN ({sql_claves_contador('old')});
+            UPDATE materiales_contadores SET n = n + 1
+            WHERE {sql_cuenta_contador('new')} AND clave IN ({sql_claves_contador('new')});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS materiales_contadores_ad AFTER DELETE ON materiales BEGIN
+            UPDATE materiales_contadores SET n = n - 1
+            WHERE {sql_cuenta_contador('old')} AND clave IN ({sql_claves_contador('old')});
+        END
+    """)
+
+def _m9_registro_cambios(conn: sqlite3.Connection):
+    # Registro de materiales modificados para el canal de eventos (SSE): la app lee las filas
+    # nuevas, emite el estado actual de cada código y poda las antiguas. Sirve también para
+    # escrituras de otros procesos (agente de bajas, scripts).
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS materiales_cambios (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            codigo TEXT NOT NULL
+        )
+    """)
+    columnas = ("estado_calc", "estado", "operario_numero", "caducidad", "descripcion", "ean")
+    distinto = " OR ".join(f"old.{c} IS NOT new.{c}" for c in columnas)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS materiales_cambios_au
+        AFTER UPDATE OF {", ".join(columnas)} ON materiales
+        WHEN {distinto} BEGIN
+            INSERT INTO materiales_cambios (codigo) VALUES (new.codigo);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS materiales_cambios_ad AFTER DELETE ON materiales BEGIN
+            INSERT INTO materiales_cambios (codigo) VALUES (old.codigo);
+        END
+    """)
+
+def _m10_acciones_cliente(conn: sqlite3.Connection):
+    # Acciones de escaneo que los terminales encolan sin conexión y reenvían después: la
+    # clave la genera el cliente, así un reenvío (respuesta perdida, reintento) devuelve el
+    # resultado guardado en lugar de aplicar la acción otra vez.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS acciones_cliente (
+            clave TEXT PRIMARY KEY,
+            accion TEXT NOT NULL,
+            codigo TEXT,
+            ts_cliente TEXT,
+            recibida_en TEXT NOT NULL DEFAULT (datetime('now','localtime')),
+            categoria TEXT NOT NULL,
+            mensaje TEXT
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_acciones_cliente_recibida ON acciones_cliente(recibida_en)")
+
+def _m11_fechas_imposibles(conn: sqlite3.Connection):
+    # Hasta ahora SQL_CAD_VALIDA daba NULL con fechas de forma ISO pero imposibles
+    # ('2025-13-45') y esas filas salían caducadas o disponibles en lugar de 'error fecha'.
+    # Los triggers de estado llevan la expresión copiada: se rehacen y se recalculan esas
+    # filas (los triggers de contadores y de cambios ajustan lo suyo con el UPDATE).
+    conn.execute("DROP TRIGGER IF EXISTS materiales_estado_ai")
+    conn.execute("DROP TRIGGER IF EXISTS materiales_estado_au")
+    _triggers_estado(conn)
+    conn.execute(f"""
+        UPDATE materiales SET {_sql_set_estado_dia()}
+        WHERE caducidad GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]' AND NOT {SQL_CAD_VALIDA}
+    """)
+
+# Cambios que se conservan en materiales_cambios para los clientes que reconectan
+CAMBIOS_CONSERVADOS = 1000
+
+def _m12_poda_registro_cambios(conn: sqlite3.Connection):
+    # La app podaba el registro solo mientras había pantallas conectadas al canal de eventos:
+    # sin ninguna, cada importación o acción masiva lo hacía crecer sin límite. Lo poda la
+    # propia base cada CAMBIOS_CONSERVADOS inserciones, escriba quien escriba.
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS materiales_cambios_poda AFTER INSERT ON materiales_cambios
+        WHEN new.seq % {CAMBIOS_CONSERVADOS} = 0 BEGIN
+            DELETE FROM materiales_cambios WHERE seq <= new.seq - {CAMBIOS_CONSERVADOS};
+        END
+    """)
+    conn.execute("DELETE FROM materiales_cambios WHERE seq <= (SELECT MAX(seq) FROM materiales_cambios) - ?",
+                 (CAMBIOS_CONSERVADOS,))
+
+# (versión, descripción, función). Añadir siempre al final con el siguiente número.
+MIGRACIONES_MATERIALES: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "tablas materiales y ean_descriptions", _m1_esquema_base),
+    (2, "columna materiales.procesado_excel", _m2_procesado_excel),
+    (3, "tabla bajas", _m3_bajas),
+    (4, "tabla solicitud_excel_cliente", _m4_solicitud_excel_cliente),
+    (5, "índices de materiales y bajas", _m5_indices),
+    (6, "índice FTS5 trigram de materiales", _m6_fts_materiales),
+    (7, "estado materializado de materiales", _m7_estado_materializado),
+    (8, "contadores de materiales por triggers", _m8_contadores),
+    (9, "registro de cambios de materiales", _m9_registro_cambios),
+    (10, "acciones de escaneo reenviadas por los clientes", _m10_acciones_cliente),
+    (11, "estado 'error fecha' para fechas ISO imposibles", _m11_fechas_imposibles),
+    (12, "poda del registro de cambios por trigger", _m12_poda_registro_cambios),
+]
+
+def version_actual(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def aplicar_migraciones(conn: sqlite3.Connection, migraciones) -> int:
+    """Aplica en orden las migraciones con número mayor que user_version.
+
+    Cada una va en su propia transacción BEGIN IMMEDIATE junto con el cambio de
+    user_version, de modo que dos procesos arrancando a la vez no la repiten.
+    Devuelve la versión final del esquema."""
+    ultima = migraciones[-1][0] if migraciones else 0
+    if version_actual(conn) >= ultima:
+        return ultima
+    conn.commit()  # cerrar cualquier transacción implícita antes del BEGIN explícito
+    for numero, descripcion, aplicar in migraciones:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version_actual(conn) >= numero:
+                conn.rollback()
+                continue
+            aplicar(conn)
+            conn.execute(f"PRAGMA user_version = {int(numero)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return version_actual(conn)
+
+def migrar_materiales(conn: sqlite3.Connection) -> int:
+    """Deja materiales.db en la última versión del esquema."""
+    return aplicar_migraciones(conn, MIGRACIONES_MATERIALES)
@@ -1,75 +1,126 @@
 """
 Módulo compartido para gestión de operarios
 Funciones comunes entre aplicaciones de materiales y herramientas
+
+La plantilla (numero -> nombre/rol/activo) se mantiene en memoria para todo el proceso.
+Se recarga cuando alguien llama a invalidar_cache() tras escribir en operarios.db, o
+cuando PRAGMA data_version indica que otra conexión (u otro proceso) cambió la base.
 """
+import os
 import sqlite3
+import threading
 from typing import Optional, List, Dict, Any
-from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_OPERARIOS = os.path.join(BASE_DIR, "database", "operarios.db")
+
+_lock = threading.Lock()
+_cache: Optional[Dict[str, Dict[str, Any]]] = None
+_data_version: Optional[int] = None
+_conn_version: Optional[sqlite3.Connection] = None
+
+def configurar(ruta_db: str):
+    """Cambia la ruta de operarios.db (la app usa la suya) y vacía la caché."""
+    global DB_OPERARIOS, _conn_version
+    with _lock:
+        DB_OPERARIOS = ruta_db
+        if _conn_version is not None:
+            _conn_version.close()
+            _conn_version = None
+    invalidar_cache()
 
 def get_operarios_db():
     """Obtiene conexión a la base de datos de operarios"""
-    return sqlite3.connect("database/operarios.db")
+    return sqlite3.connect(DB_OPERARIOS)
+
+def invalidar_cache():
+    """Descarta la plantilla en memoria; la siguiente consulta la vuelve a leer."""
+    global _cache
+    with _lock:
+        _cache = None
+
+def _version_db() -> int:
+    # Conexión propia y persistente: data_version solo cambia por commits de otras conexiones
+    global _conn_version
+    if _conn_version is None:
+        _conn_version = sqlite3.connect(DB_OPERARIOS, check_same_thread=False)
+    return _conn_version.execute("PRAGMA data_version").fetchone()[0]
 
-def get_operario(numero: str) -> Optional[Dict[str, Any]]:
+def version_db() -> Optional[int]:
+    """PRAGMA data_version de operarios.db (cambia con cada commit de otra conexión)."""
+    with _lock:
+        try:
+            return _version_db()
+        except sqlite3.Error:
+            return None
+
+def _plantilla() -> Dict[str, Dict[str, Any]]:
+    global _cache, _data_version
+    with _lock:
+        try:
+            version = _version_db()
+        except sqlite3.Error:
+            version = None
+        if _cache is None or version != _data_version:
+            conn = get_operarios_db()
+            try:
+                rows = conn.execute("SELECT numero, nombre, rol, activo FROM operarios").fetchall()
+            finally:
+                conn.close()
+            _cache = {
+                r[0]: {'numero': r[0], 'nombre': r[1], 'rol': r[2], 'activo': r[3]}
+                for r in rows
+            }
+            _data_version = version
+        return _cache
+
+def get_operario(numero: str, solo_activos: bool = False) -> Optional[Dict[str, Any]]:
     """Obtiene un operario por número"""
+    if not numero:
+        return None
     try:
-        with get_operarios_db() as conn:
-            c = conn.cursor()
-            c.execute("SELECT numero, nombre, pin, activo FROM operarios WHERE numero=?", (numero,))
-            row = c.fetchone()
-            if row:
-                return {
-                    'numero': row[0],
-                    'nombre': row[1], 
-                    'pin': row[2],
-                    'activo': bool(row[3])
-                }
-    except:
-        pass
-    return None
+        op = _plantilla().get(numero)
+    except sqlite3.Error:
+        return None
+    if not op or (solo_activos and not op['activo']):
+        return None
+    return dict(op)
 
 def get_all_operarios(solo_activos: bool = True) -> List[Dict[str, Any]]:
     """Obtiene todos los operarios"""
     try:
-        with get_operarios_db() as conn:
-            c = conn.cursor()
-            if solo_activos:
-                c.execute("SELECT numero, nombre, pin, activo FROM operarios WHERE activo=1 ORDER BY numero")
-            else:
-                c.execute("SELECT numero, nombre, pin, activo FROM operarios ORDER BY numero")
-            
-            operarios = []
-            for row in c.fetchall():
-                operarios.append({
-                    'numero': row[0],
-                    'nombre': row[1],
-                    'pin': row[2], 
-                    'activo': bool(row[3])
-                })
-            return operarios
-    except:
-        pass
-    return []
+        ops = _plantilla().values()
+    except sqlite3.Error:
+        return []
+    return [dict(op) for op in sorted(ops, key=lambda o: o['numero'])
+            if op['activo'] or not solo_activos]
+
+def get_operario_nombre(numero: str) -> Optional[str]:
+    op = get_operario(numero)
+    return op['nombre'] if op else None
+
+def get_operario_display(numero: str) -> str:
+    """Devuelve 'numero - nombre' o solo el número si no encuentra el nombre"""
+    if not numero:
+        return "-"
+    nombre = get_operario_nombre(numero)
+    if nombre:
+        return f"{numero} - {nombre}"
+    return numero
 
 def authenticate_operario(numero: str, pin: str = None) -> bool:
-    """Autentica un operario por número y pin (opcional)"""
-    operario = get_operario(numero)
-    if not operario or not operario['activo']:
-        return False
-    
-    # Si el operario tiene pin configurado, debe proporcionarlo
-    if operario['pin']:
-        return operario['pin'] == pin
-    
-    # Si no tiene pin, solo verificar que existe y está activo
-    return True
+    """Autentica un operario por número (debe existir y estar activo; no hay PIN en la tabla)"""
+    return get_operario(numero, solo_activos=True) is not None
 
 def get_operario_role(numero: str) -> str:
     """Obtiene el rol de un operario basado en su número"""
+    op = get_operario(numero)
+    if op and op['rol']:
+        return op['rol']
     if numero == "admin":
         return "admin"
     elif numero == "almacen":
-        return "almacenero" 
+        return "almacenero"
     else:
         return "operario"
 
@@ -77,6 +128,6 @@ def require_role(allowed_roles: List[str], current_numero: str) -> bool:
     """Verifica si el operario actual tiene uno de los roles permitidos"""
     if not current_numero:
         return False
-    
+
     current_role = get_operario_role(current_numero)
-    return current_role in allowed_roles
\ No newline at end of file
+    return current_role in allowed_roles
@@ -0,0 +1,112 @@
+"""
+Recursos estáticos con huella de contenido.
+
+Al arrancar se leen los ficheros de static/ (JS, CSS, iconos) y se les calcula un hash:
+las páginas los enlazan como /recursos/js/home.<hash>.js, una URL que solo cambia si
+cambia el fichero. Así se pueden servir con "Cache-Control: immutable" y el navegador no
+los vuelve a pedir (ni a revalidar) hasta la siguiente actualización de la app. Los de
+texto se comprimen con gzip una sola vez, al cargarlos.
+
+También admite recursos generados (el manifest de la PWA) registrados con su contenido.
+"""
+import os
+import gzip
+import hashlib
+import mimetypes
+import threading
+from typing import Dict, Optional, NamedTuple
+
+CACHE_INMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDAR = "no-cache"
+
+# Por debajo de esto gzip no compensa (cabeceras + marco del formato)
+GZIP_MIN_BYTES = 512
+TIPOS_COMPRIMIBLES = ("text/", "application/javascript", "application/json", "application/manifest+json",
+                      "image/svg+xml")
+
+class Recurso(NamedTuple):
+    nombre: str            # ruta relativa: "js/home.js"
+    huella: str            # hash corto del contenido
+    url: str               # "/recursos/js/home.<huella>.js"
+    tipo: str              # mimetype
+    datos: bytes
+    datos_gzip: Optional[bytes]
+
+def _url_versionada(prefijo: str, nombre: str, huella: str) -> str:
+    base, ext = os.path.splitext(nombre)
+    return f"{prefijo}/{base}.{huella}{ext}"
+
+class RecursosEstaticos:
+    """Índice en memoria de los recursos de un directorio, con su URL versionada."""
+
+    def __init__(self, directorio: str, prefijo: str = "/recursos"):
+        self.directorio = directorio
+        self.prefijo = prefijo
+        self._lock = threading.Lock()
+        self._por_nombre: Dict[str, Recurso] = {}
+        self._por_url: Dict[str, Recurso] = {}
+        self._cargado = False
+
+    def _cargar(self):
+        for raiz, _, ficheros in os.walk(self.directorio):
+            for fichero in sorted(ficheros):
+                ruta = os.path.join(raiz, fichero)
+                nombre = os.path.relpath(ruta, self.directorio).replace(os.sep, "/")
+                with open(ruta, "rb") as f:
+                    self._añadir(nombre, f.read())
+        self._cargado = True
+
+    def _añadir(self, nombre: str, datos: bytes, tipo: Optional[str] = None) -> Recurso:
+        tipo = tipo or mimetypes.guess_type(nombre)[0] or "application/octet-stream"
+        huella = hashlib.sha256(datos).hexdigest()[:12]
+        datos_gzip = None
+        if len(datos) >= GZIP_MIN_BYTES and tipo.startswith(TIPOS_COMPRIMIBLES):
+            comprimido = gzip.compress(datos, compresslevel=9, mtime=0)
+            if len(comprimido) < len(datos):
+                datos_gzip = comprimido
+        recurso = Recurso(nombre, huella, _url_versionada(self.prefijo, nombre, huella), tipo, datos, datos_gzip)
+        anterior = self._por_nombre.get(nombre)
+        if anterior is not None:
+            self._por_url.pop(anterior.url, None)
+        self._por_nombre[nombre] = recurso
+        self._por_url[recurso.url] = recurso
+        return recurso
+
+    def _asegurar_cargado(self):
+        if not self._cargado:
+            with self._lock:
+                if not self._cargado:
+                    self._cargar()
+
+    def registrar(self, nombre: str, datos: bytes, tipo: Optional[str] = None) -> Recurso:
+        """Añade (o sustituye) un recurso generado en memoria."""
+        self._asegurar_cargado()
+        with self._lock:
+            return self._añadir(nombre, datos, tipo)
+
+    def obtener(self, nombre: str) -> Optional[Recurso]:
+        self._asegurar_cargado()
+        return self._por_nombre.get(nombre)
+
+    def url(self, nombre: str) -> str:
+        """URL versionada del recurso; si no existe, la ruta sin versión (y un 404 al pedirla)."""
+        recurso = self.obtener(nombre)
+        return recurso.url if recurso else f"{self.prefijo}/{nombre}"
+
+    def huella_conjunto(self) -> str:
+        """Hash de todas las huellas: cambia si cambia cualquier recurso."""
+        self._asegurar_cargado()
+        with self._lock:
+            pares = sorted((r.nombre, r.huella) for r in self._por_nombre.values())
+        return hashlib.sha256(repr(pares).encode("utf-8")).hexdigest()[:12]
+
+    def buscar_url(self, ruta: str) -> Optional[Recurso]:
+        """Recurso por su URL versionada. Si la huella no coincide (página anterior a una
+        actualización) devuelve el contenido actual, que no debe cachearse como inmutable."""
+        self._asegurar_cargado()
+        recurso = self._por_url.get(ruta)
+        if recurso is not None:
+            return recurso
+        base, ext = os.path.splitext(ruta[len(self.prefijo) + 1:])
+        base, _, _ = base.rpartition(".")
+        return self._por_nombre.get(base + ext) if base else None
@@ -0,0 +1,487 @@
+"""
+Trabajos en segundo plano para las tareas pesadas del panel de admin.
+
+Importar, exportar o lanzar la macro de bajas no se hace dentro de la petición: la
+petición crea el trabajo y devuelve su id, y el trabajo corre en uno de los hilos del
+gestor (pocos y fijos: no compiten con los de waitress). La pantalla consulta su estado,
+puede cancelarlo y, al terminar, descarga el resultado.
+
+El estado se guarda en su propia base (trabajos.db) y no en materiales.db: las escrituras
+de progreso no esperan al bloqueo que toma una importación ni retrasan los escaneos, y
+cualquier proceso del servidor puede responder por un trabajo aunque lo ejecute otro. Si
+el proceso que lo ejecutaba muere, el trabajo deja de recibir latidos y se marca como
+interrumpido.
+
+Lo que es Python puro y largo (leer o escribir un .xlsx con openpyxl) se ejecuta en un
+proceso hijo (`python -m shared.trabajos`), como mucho `procesos` a la vez: dentro del
+servidor retendría el GIL y frenaría al resto de peticiones. El hijo corre con prioridad
+baja (con pocos núcleos, el sistema atiende antes a los hilos del servidor), escribe su
+progreso en la base y cancelar lo termina.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import logging
+import importlib
+import threading
+import subprocess
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Any, Optional, List, Iterable
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ESTADOS_ACTIVOS = ("pendiente", "ejecutando")
+ESTADOS_FINALES = ("terminado", "error", "cancelado")
+INTERVALO_PROGRESO = 0.5   # s mínimos entre dos escrituras de progreso
+INTERVALO_LATIDO = 15      # s entre latidos de los trabajos de este proceso
+SIN_LATIDO = 120           # s sin latido: el proceso que lo tenía ya no existe
+CONSERVAR_HORAS = 24       # trabajos terminados (y sus archivos) que se guardan
+CODIGO_CANCELADO = 3       # salida del proceso hijo que vio la cancelación
+NICE_HIJO = 10             # prioridad menor para los hijos: ceden la CPU a las peticiones
+
+_SQL_TABLA = """
+    CREATE TABLE IF NOT EXISTS trabajos (
+        id TEXT PRIMARY KEY,
+        tipo TEXT NOT NULL,
+        estado TEXT NOT NULL DEFAULT 'pendiente',
+        usuario TEXT,
+        parametros TEXT,            -- JSON
+        entrada TEXT,               -- archivo subido (nombre dentro del directorio)
+        hecho INTEGER NOT NULL DEFAULT 0,
+        total INTEGER,
+        mensaje TEXT,
+        resumen TEXT,               -- JSON con lo que muestra la pantalla al terminar
+        resultado_archivo TEXT,     -- archivo descargable (nombre dentro del directorio)
+        resultado_nombre TEXT,      -- nombre con el que se descarga
+        resultado_tipo TEXT,        -- mimetype
+        cancelar INTEGER NOT NULL DEFAULT 0,
+        creado_en TEXT NOT NULL,
+        iniciado_en TEXT,
+        terminado_en TEXT,
+        latido REAL
+    )"""
+
+def _ahora() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+@contextmanager
+def _conexion(ruta_db: str, timeout: float = 10.0):
+    conn = sqlite3.connect(ruta_db, timeout=timeout)
+    conn.row_factory = sqlite3.Row
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+class Cancelado(Exception):
+    """El trabajo se canceló a petición del usuario."""
+    def __init__(self, mensaje: str = "Trabajo cancelado"):
+        super().__init__(mensaje)
+
+class FalloTrabajo(Exception):
+    """Fallo con informe: el trabajo termina en error y el resumen se guarda igualmente."""
+    def __init__(self, mensaje: str, resumen: Optional[dict] = None):
+        super().__init__(mensaje)
+        self.resumen = resumen
+
+class Progreso:
+    """Avance de un trabajo. Llamarlo escribe el progreso (como mucho cada
+    INTERVALO_PROGRESO) y lanza Cancelado si se ha pedido cancelar. Solo guarda la ruta y
+    el id, así el proceso hijo construye el suyo."""
+
+    def __init__(self, ruta_db: str, trabajo_id: str, al_cambiar: Optional[Callable[[str], None]] = None):
+        self.ruta_db = ruta_db
+        self.trabajo_id = trabajo_id
+        self.al_cambiar = al_cambiar
+        self._ultimo = 0.0
+
+    def __call__(self, hecho: Optional[int] = None, total: Optional[int] = None,
+                 mensaje: Optional[str] = None, forzar: bool = False):
+        ahora = time.monotonic()
+        if not forzar and ahora - self._ultimo < INTERVALO_PROGRESO:
+            return
+        self._ultimo = ahora
+        try:
+            with _conexion(self.ruta_db) as conn:
+                conn.execute("""UPDATE trabajos SET hecho = COALESCE(?, hecho), total = COALESCE(?, total),
+                                mensaje = COALESCE(?, mensaje) WHERE id = ?""",
+                             (hecho, total, mensaje, self.trabajo_id))
+                fila = conn.execute("SELECT cancelar FROM trabajos WHERE id = ?", (self.trabajo_id,)).fetchone()
+        except sqlite3.Error as e:
+            # El progreso es informativo: un fallo al guardarlo no debe tumbar el trabajo
+            logger.warning(f"Trabajo {self.trabajo_id}: no se pudo guardar el progreso ({e})")
+            return
+        if fila is not None and fila["cancelar"]:
+            raise Cancelado()
+        if self.al_cambiar:
+            self.al_cambiar(self.trabajo_id)
+
+    def cancelado(self) -> bool:
+        with _conexion(self.ruta_db) as conn:
+            fila = conn.execute("SELECT cancelar FROM trabajos WHERE id = ?", (self.trabajo_id,)).fetchone()
+        return bool(fila and fila["cancelar"])
+
+class Trabajo:
+    """Lo que recibe la función de un tipo de trabajo: parámetros, archivos y progreso."""
+
+    def __init__(self, gestor: "GestorTrabajos", fila: sqlite3.Row):
+        self.gestor = gestor
+        self.id = fila["id"]
+        self.tipo = fila["tipo"]
+        self.usuario = fila["usuario"]
+        self.parametros: Dict[str, Any] = json.loads(fila["parametros"] or "{}")
+        self.entrada = gestor.ruta(self.id, fila["entrada"]) if fila["entrada"] else None
+        self.progreso = Progreso(gestor.ruta_db, self.id, al_cambiar=gestor._avisar)
+        self.conservar: List[str] = []   # archivos propios que no se borran al terminar
+        self._resultado = None
+
+    def ruta(self, sufijo: str) -> str:
+        """Archivo de trabajo propio (se borra al terminar salvo el resultado)."""
+        return self.gestor.ruta(self.id, sufijo)
+
+    def contando(self, filas: Iterable, total: Optional[int] = None, mensaje: Optional[str] = None):
+        """Las mismas filas, informando del progreso según se consumen."""
+        n = 0
+        for n, fila in enumerate(filas, 1):
+            yield fila
+            self.progreso(n, total, mensaje)
+        self.progreso(n, total, mensaje, forzar=True)
+
+    def resultado(self, ruta: str, nombre: str, tipo: str):
+        """Marca `ruta` (un archivo de self.ruta()) como el resultado descargable."""
+        self._resultado = (os.path.basename(ruta), nombre, tipo)
+
+    def subproceso(self, args: List[str], timeout: Optional[float] = None, entrada: Optional[str] = None,
+                   **kwargs) -> subprocess.CompletedProcess:
+        """Ejecuta un programa sin dejar de atender la cancelación (lo termina) ni el timeout."""
+        limite = None if timeout is None else time.monotonic() + timeout
+        with subprocess.Popen(args, stdin=subprocess.PIPE if entrada is not None else subprocess.DEVNULL,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs) as p:
+            pendiente = entrada
+            while True:
+                try:
+                    salida, errores = p.communicate(pendiente, timeout=INTERVALO_PROGRESO)
+                    break
+                except subprocess.TimeoutExpired:
+                    pendiente = None   # la entrada solo se envía en la primera llamada
+                    if self.progreso.cancelado():
+                        p.terminate()
+                        p.communicate()
+                        raise Cancelado()
+                    if limite is not None and time.monotonic() > limite:
+                        p.kill()
+                        p.communicate()
+                        raise FalloTrabajo(f"Tiempo de espera agotado ({timeout:.0f} s)")
+                    self.gestor._avisar(self.id)
+        return subprocess.CompletedProcess(args, p.returncode, salida, errores)
+
+    def en_proceso(self, funcion: str, **argumentos):
+        """Llama a funcion ("modulo:nombre", con argumentos JSON y progreso=) en un proceso
+        hijo y devuelve lo que devuelva. Espera turno si ya hay `procesos` hijos en marcha."""
+        # En Windows la prioridad se fija al crearlo; en el resto la baja el propio hijo (os.nice)
+        prioridad = {"creationflags": subprocess.BELOW_NORMAL_PRIORITY_CLASS} if os.name == "nt" else {}
+        with self.gestor._procesos:
+            r = self.subproceso([sys.executable, "-m", "shared.trabajos", self.gestor.ruta_db, self.id],
+                                entrada=json.dumps({"funcion": funcion, "argumentos": argumentos}),
+                                cwd=BASE_DIR, text=True, encoding="utf-8", errors="replace", **prioridad)
+        if r.returncode == CODIGO_CANCELADO:
+            raise Cancelado()
+        if r.returncode != 0:
+            ultima = (r.stderr.strip().splitlines() or [f"código {r.returncode}"])[-1]
+            raise RuntimeError(f"{funcion}: {ultima}")
+        return json.loads(r.stdout.strip().splitlines()[-1])
+
+class _TipoTrabajo:
+    def __init__(self, funcion, unico: bool, al_descargar):
+        self.funcion = funcion
+        self.unico = unico
+        self.al_descargar = al_descargar
+
+class GestorTrabajos:
+    """Cola de trabajos de este proceso: `hilos` trabajos a la vez y, entre todos, como
+    mucho `procesos` procesos hijos."""
+
+    def __init__(self, ruta_db: str, directorio: str, hilos: int = 2, procesos: int = 1,
+                 al_cambiar: Optional[Callable[[dict], None]] = None):
+        self.ruta_db = ruta_db
+        self.directorio = directorio
+        self.hilos = hilos
+        self.al_cambiar = al_cambiar
+        self._tipos: Dict[str, _TipoTrabajo] = {}
+        self._procesos = threading.BoundedSemaphore(procesos)
+        self._cola: "queue.Queue[str]" = queue.Queue()
+        self._propios = set()        # ids en cola o en marcha en este proceso
+        self._lock = threading.Lock()
+        self._iniciado = False
+        self._hilos_iniciados = False
+
+    def configurar(self, ruta_db: str, directorio: str):
+        """Cambia la base y el directorio (antes de enviar trabajos; la app usa los suyos)."""
+        with self._lock:
+            self.ruta_db = ruta_db
+            self.directorio = directorio
+            self._iniciado = False
+
+    # ── Tipos ───────────────────────────────────────────────────────────────────
+    def tipo(self, nombre: str, unico: bool = False, al_descargar: Optional[Callable[[Trabajo], None]] = None):
+        """Decorador que registra la función de un tipo de trabajo: recibe el Trabajo y
+        devuelve el resumen (dict) a mostrar. unico: no se encolan dos del mismo tipo a la
+        vez. al_descargar se llama cuando el resultado se ha descargado entero."""
+        def registrar(funcion: Callable[[Trabajo], Optional[dict]]):
+            self._tipos[nombre] = _TipoTrabajo(funcion, unico, al_descargar)
+            return funcion
+        return registrar
+
+    def tipos(self) -> List[str]:
+        return list(self._tipos)
+
+    def ruta(self, trabajo_id: str, sufijo: str) -> str:
+        return os.path.join(self.directorio, f"{trabajo_id}.{sufijo}")
+
+    # ── Arranque ────────────────────────────────────────────────────────────────
+    def _asegurar_iniciado(self):
+        if self._iniciado:
+            return
+        with self._lock:
+            if self._iniciado:
+                return
+            os.makedirs(self.directorio, exist_ok=True)
+            with _conexion(self.ruta_db) as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(_SQL_TABLA)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_trabajos_estado ON trabajos(estado, tipo)")
+            self._iniciado = True
+            if not self._hilos_iniciados:
+                self._hilos_iniciados = True
+                for n in range(self.hilos):
+                    threading.Thread(target=self._hilo_trabajos, daemon=True, name=f"trabajos-{n}").start()
+                threading.Thread(target=self._hilo_latido, daemon=True, name="trabajos-latido").start()
+        self._marcar_interrumpidos()
+        self.limpiar()
+
+    def _marcar_interrumpidos(self):
+        with _conexion(self.ruta_db) as conn:
+            n = conn.execute("""UPDATE trabajos SET estado = 'error', terminado_en = ?,
+                                mensaje = 'Interrumpido: el servidor se detuvo mientras se ejecutaba'
+                                WHERE estado IN ('pendiente', 'ejecutando') AND latido < ?""",
+                             (_ahora(), time.time() - SIN_LATIDO)).rowcount
+        if n:
+            logger.warning(f"{n} trabajos interrumpidos marcados como error")
+
+    def limpiar(self, horas: float = CONSERVAR_HORAS):
+        """Borra los trabajos terminados hace más de `horas` y sus archivos."""
+        limite = (datetime.now() - timedelta(hours=horas)).strftime("%Y-%m-%d %H:%M:%S")
+        with _conexion(self.ruta_db) as conn:
+            viejos = [r["id"] for r in conn.execute(
+                "SELECT id FROM trabajos WHERE estado IN ('terminado', 'error', 'cancelado') AND terminado_en < ?",
+                (limite,))]
+            conn.executemany("DELETE FROM trabajos WHERE id = ?", [(i,) for i in viejos])
+        for trabajo_id in viejos:
+            self._borrar_archivos(trabajo_id)
+
+    def _borrar_archivos(self, trabajo_id: str, excepto: Iterable[str] = ()):
+        excepto = set(excepto)
+        try:
+            nombres = os.listdir(self.directorio)
+        except FileNotFoundError:
+            return
+        for nombre in nombres:
+            if nombre.startswith(trabajo_id + ".") and nombre not in excepto:
+                try:
+                    os.remove(os.path.join(self.directorio, nombre))
+                except OSError as e:
+                    logger.warning(f"No se pudo borrar {nombre}: {e}")
+
+    # ── Envío y ejecución ───────────────────────────────────────────────────────
+    def enviar(self, tipo: str, parametros: Optional[dict] = None, usuario: Optional[str] = None,
+               entrada=None, extension_entrada: str = "") -> str:
+        """Crea un trabajo y lo encola; devuelve su id. entrada es un archivo subido
+        (cualquier objeto con .save(ruta)) que el trabajo recibe en Trabajo.entrada. Si el
+        tipo es único y ya hay uno en marcha, devuelve el de ese."""
+        if tipo not in self._tipos:
+            raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+        self._asegurar_iniciado()
+        if self._tipos[tipo].unico:
+            with _conexion(self.ruta_db) as conn:
+                activo = conn.execute("SELECT id FROM trabajos WHERE tipo = ? AND estado IN ('pendiente', 'ejecutando')",
+                                      (tipo,)).fetchone()
+            if activo:
+                return activo["id"]
+        trabajo_id = uuid.uuid4().hex
+        nombre_entrada = None
+        if entrada is not None:
+            nombre_entrada = f"entrada.{extension_entrada}" if extension_entrada else "entrada"
+            entrada.save(self.ruta(trabajo_id, nombre_entrada))
+        with self._lock:
+            self._propios.add(trabajo_id)
+        with _conexion(self.ruta_db) as conn:
+            conn.execute("""INSERT INTO trabajos (id, tipo, usuario, parametros, entrada, creado_en, latido)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                         (trabajo_id, tipo, usuario, json.dumps(parametros or {}, ensure_ascii=False),
+                          nombre_entrada, _ahora(), time.time()))
+        self._cola.put(trabajo_id)
+        logger.info(f"Trabajo {tipo} {trabajo_id} encolado")
+        self._avisar(trabajo_id)
+        return trabajo_id
+
+    def _hilo_trabajos(self):
+        while True:
+            trabajo_id = self._cola.get()
+            try:
+                self._ejecutar(trabajo_id)
+            except Exception:
+                logger.exception(f"Trabajo {trabajo_id}: fallo del gestor")
+            finally:
+                with self._lock:
+                    self._propios.discard(trabajo_id)
+
+    def _ejecutar(self, trabajo_id: str):
+        with _conexion(self.ruta_db) as conn:
+            # Si se canceló mientras esperaba en la cola ya no está pendiente
+            if not conn.execute("""UPDATE trabajos SET estado = 'ejecutando', iniciado_en = ?, latido = ?
+                                   WHERE id = ? AND estado = 'pendiente'""",
+                                (_ahora(), time.time(), trabajo_id)).rowcount:
+                self._borrar_archivos(trabajo_id)
+                return
+            fila = conn.execute("SELECT * FROM trabajos WHERE id = ?", (trabajo_id,)).fetchone()
+        self._avisar(trabajo_id)
+        trabajo = Trabajo(self, fila)
+        t0 = time.perf_counter()
+        estado, mensaje, resumen = "terminado", None, None
+        try:
+            resumen = self._tipos[trabajo.tipo].funcion(trabajo)
+        except Cancelado:
+            estado, mensaje = "cancelado", "Cancelado"
+        except FalloTrabajo as e:
+            estado, mensaje, resumen = "error", str(e), e.resumen
+        except Exception as e:
+            logger.exception(f"Trabajo {trabajo.tipo} {trabajo_id} falló")
+            estado, mensaje = "error", str(e) or e.__class__.__name__
+        if estado == "terminado":
+            mensaje = "Terminado"   # no el último paso del progreso
+        resultado = trabajo._resultado if estado == "terminado" else None
+        conservar = [os.path.basename(r) for r in trabajo.conservar] if estado == "terminado" else []
+        self._borrar_archivos(trabajo_id, excepto=([resultado[0]] if resultado else []) + conservar)
+        with _conexion(self.ruta_db) as conn:
+            conn.execute("""UPDATE trabajos SET estado = ?, mensaje = COALESCE(?, mensaje), resumen = ?,
+                                resultado_archivo = ?, resultado_nombre = ?, resultado_tipo = ?, terminado_en = ?,
+                                hecho = CASE WHEN ? = 'terminado' AND total IS NOT NULL THEN total ELSE hecho END
+                            WHERE id = ?""",
+                         (estado, mensaje, json.dumps(resumen, ensure_ascii=False) if resumen is not None else None,
+                          *(resultado or (None, None, None)), _ahora(), estado, trabajo_id))
+        logger.info(f"Trabajo {trabajo.tipo} {trabajo_id}: {estado} en {time.perf_counter() - t0:.1f} s"
+                    + (f" ({mensaje})" if mensaje and estado == "error" else ""))
+        self._avisar(trabajo_id)
+
+    def _hilo_latido(self):
+        ultima_limpieza = time.monotonic()
+        while True:
+            time.sleep(INTERVALO_LATIDO)
+            try:
+                with self._lock:
+                    propios = list(self._propios)
+                if propios:
+                    with _conexion(self.ruta_db) as conn:
+                        conn.executemany("UPDATE trabajos SET latido = ? WHERE id = ?",
+                                         [(time.time(), i) for i in propios])
+                self._marcar_interrumpidos()
+                if time.monotonic() - ultima_limpieza > 3600:
+                    ultima_limpieza = time.monotonic()
+                    self.limpiar()
+            except Exception as e:
+                logger.warning(f"Latido de trabajos: {e}")
+
+    # ── Consulta ────────────────────────────────────────────────────────────────
+    @staticmethod
+    def _a_dict(fila: sqlite3.Row) -> dict:
+        total = fila["total"]
+        return {
+            "id": fila["id"], "tipo": fila["tipo"], "estado": fila["estado"],
+            "hecho": fila["hecho"], "total": total,
+            "porcentaje": min(100, round(100 * fila["hecho"] / total)) if total else None,
+            "mensaje": fila["mensaje"],
+            "resumen": json.loads(fila["resumen"]) if fila["resumen"] else None,
+            "resultado": fila["resultado_nombre"],
+            "creado_en": fila["creado_en"], "iniciado_en": fila["iniciado_en"], "terminado_en": fila["terminado_en"],
+        }
+
+    def estado(self, trabajo_id: str) -> Optional[dict]:
+        self._asegurar_iniciado()
+        with _conexion(self.ruta_db) as conn:
+            fila = conn.execute("SELECT * FROM trabajos WHERE id = ?", (trabajo_id,)).fetchone()
+        return self._a_dict(fila) if fila else None
+
+    def listar(self, limite: int = 20) -> List[dict]:
+        """Los últimos trabajos, del más reciente al más antiguo."""
+        self._asegurar_iniciado()
+        with _conexion(self.ruta_db) as conn:
+            filas = conn.execute("SELECT * FROM trabajos ORDER BY creado_en DESC, rowid DESC LIMIT ?",
+                                 (limite,)).fetchall()
+        return [self._a_dict(f) for f in filas]
+
+    def cancelar(self, trabajo_id: str) -> Optional[dict]:
+        """Uno en cola se cancela al momento; uno en marcha lo ve en su siguiente
+        comprobación de progreso (o se termina su proceso hijo)."""
+        self._asegurar_iniciado()
+        with _conexion(self.ruta_db) as conn:
+            if not conn.execute("""UPDATE trabajos SET estado = 'cancelado', mensaje = 'Cancelado', terminado_en = ?
+                                   WHERE id = ? AND estado = 'pendiente'""", (_ahora(), trabajo_id)).rowcount:
+                conn.execute("UPDATE trabajos SET cancelar = 1 WHERE id = ? AND estado = 'ejecutando'", (trabajo_id,))
+        self._avisar(trabajo_id)
+        return self.estado(trabajo_id)
+
+    def resultado(self, trabajo_id: str) -> Optional[tuple]:
+        """(ruta, nombre de descarga, mimetype) del resultado de un trabajo terminado."""
+        self._asegurar_iniciado()
+        with _conexion(self.ruta_db) as conn:
+            fila = conn.execute("""SELECT resultado_archivo, resultado_nombre, resultado_tipo FROM trabajos
+                                   WHERE id = ? AND estado = 'terminado'""", (trabajo_id,)).fetchone()
+        if not fila or not fila["resultado_archivo"]:
+            return None
+        ruta = os.path.join(self.directorio, fila["resultado_archivo"])
+        return (ruta, fila["resultado_nombre"], fila["resultado_tipo"]) if os.path.exists(ruta) else None
+
+    def descargado(self, trabajo_id: str):
+        """Avisa al tipo de que su resultado se ha descargado entero (al_descargar)."""
+        with _conexion(self.ruta_db) as conn:
+            fila = conn.execute("SELECT * FROM trabajos WHERE id = ?", (trabajo_id,)).fetchone()
+        tipo = self._tipos.get(fila["tipo"]) if fila else None
+        if tipo and tipo.al_descargar:
+            tipo.al_descargar(Trabajo(self, fila))
+
+    def _avisar(self, trabajo_id: str):
+        if self.al_cambiar is None:
+            return
+        try:
+            datos = self.estado(trabajo_id)
+            if datos:
+                self.al_cambiar(datos)
+        except Exception as e:
+            logger.warning(f"Aviso del trabajo {trabajo_id}: {e}")
+
+# ── Proceso hijo ──────────────────────────────────────────────────────────────
+def _main():
+    """python -m shared.trabajos <trabajos.db> <id>, con {"funcion", "argumentos"} en la
+    entrada estándar: ejecuta la función y escribe su resultado (JSON) en la salida."""
+    ruta_db, trabajo_id = sys.argv[1:3]
+    if hasattr(os, "nice"):
+        os.nice(NICE_HIJO)
+    pedido = json.load(sys.stdin)
+    modulo, _, nombre = pedido["funcion"].partition(":")
+    funcion = getattr(importlib.import_module(modulo), nombre)
+    try:
+        resultado = funcion(**pedido["argumentos"], progreso=Progreso(ruta_db, trabajo_id))
+    except Cancelado:
+        sys.exit(CODIGO_CANCELADO)
+    print(json.dumps(resultado))
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,942 @@
+// ================== Diálogo de error (mensajes flash) ==================
+function mostrarDialogoError(mensaje) {
+    const overlay = document.createElement('div');
+    overlay.id = 'error-dialog-overlay';
+    overlay.style.cssText = `
+        position: fixed;
+        top: 0;
+        left: 0;
+        width: 100%;
+        height: 100%;
+        background: rgba(0,0,0,0.5);
+        z-index: 10000;
+        display: flex;
+        align-items: center;
+        justify-content: center;
+    `;
+    
+    const dialog = document.createElement('div');
+    dialog.style.cssText = `
+        background: white;
+        padding: 20px;
+        border-radius: 10px;
+        box-shadow: 0 4px 8px rgba(0,0,0,0.3);
+        max-width: 400px;
+        text-align: center;
+        font-family: inherit;
+    `;
+    
+    dialog.innerHTML = `
+        <div style="color: #721c24; font-size: 18px; margin-bottom: 15px;">
+            ❌ Error
+        </div>
+        <div style="color: #721c24; margin-bottom: 20px; line-height: 1.4;">
+            ${mensaje}
+        </div>
+        <button id="error-dialog-btn" onclick="cerrarDialogoError()" style="
+            background: #dc3545;
+            color: white;
+            border: none;
+            padding: 10px 20px;
+            border-radius: 5px;
+            cursor: pointer;
+            font-size: 14px;
+        ">Aceptar</button>
+    `;
+    
+    overlay.appendChild(dialog);
+    document.body.appendChild(overlay);
+    
+    const button = document.getElementById('error-dialog-btn');
+    button.focus();
+    
+    const handleKeydown = (e) => {
+        if (e.key === 'Enter' || e.key === 'Escape') {
+            cerrarDialogoError();
+            document.removeEventListener('keydown', handleKeydown);
+        }
+    };
+    
+    document.addEventListener('keydown', handleKeydown);
+}
+
+function cerrarDialogoError() {
+    const overlay = document.getElementById('error-dialog-overlay');
+    if (overlay) { overlay.remove(); }
+}
+
+// ================== CRUD de Operarios ==================
+let modoEdicion = false;
+let operarioOriginal = '';
+
+async function cargarOperarios() {
+  try {
+    const response = await fetch('/api/operarios');
+    const data = await response.json();
+    
+    if (data.operarios) {
+      mostrarTablaOperarios(data.operarios);
+    } else {
+      document.getElementById('tablaOperarios').innerHTML = 
+        '<div style="text-align:center;padding:20px;color:#dc3545">❌ Error al cargar operarios</div>';
+    }
+  } catch (error) {
+    console.error('Error:', error);
+    document.getElementById('tablaOperarios').innerHTML = 
+      '<div style="text-align:center;padding:20px;color:#dc3545">❌ Error de conexión</div>';
+  }
+}
+
+function mostrarTablaOperarios(operarios) {
+  let html = `
+    <table style="width:100%;border-collapse:collapse;margin-top:10px">
+      <tr style="background:#f8f9fa">
+        <th style="padding:12px;border:1px solid #dee2e6">Nº</th>
+        <th style="padding:12px;border:1px solid #dee2e6">Nombre</th>
+        <th style="padding:12px;border:1px solid #dee2e6">Rol</th>
+        <th style="padding:12px;border:1px solid #dee2e6">Estado</th>
+        <th style="padding:12px;border:1px solid #dee2e6">Materiales</th>
+        <th style="padding:12px;border:1px solid #dee2e6">Info</th>
+        <th style="padding:12px;border:1px solid #dee2e6">Acciones</th>
+      </tr>`;
+
+  operarios.forEach(op => {
+    const estadoColor = op.activo ? '#d4edda' : '#ffebee';
+    const estadoTexto = op.activo ? '✅ Activo' : '❌ Inactivo';
+    
+    let rolColor = '#f3e5f5'; // operario
+    if (op.rol === 'admin') rolColor = '#e3f2fd';
+    if (op.rol === 'almacenero') rolColor = '#fff3e0';
+    
+    const materialesInfo = op.materiales_asignados || 0;
+    
+    html += `
+      <tr style="background:${estadoColor}">
+        <td style="padding:10px;border:1px solid #dee2e6"><strong>${op.numero}</strong></td>
+        <td style="padding:10px;border:1px solid #dee2e6">${op.nombre}</td>
+        <td style="padding:10px;border:1px solid #dee2e6">
+          <span style="padding:4px 8px; border-radius:4px; font-size:12px; background:${rolColor}">
+            ${op.rol.charAt(0).toUpperCase() + op.rol.slice(1)}
+          </span>
+        </td>
+        <td style="padding:10px;border:1px solid #dee2e6">${estadoTexto}</td>
+        <td style="padding:10px;border:1px solid #dee2e6;text-align:center">
+          <span style="background:#e7f3ff;padding:2px 6px;border-radius:3px;font-size:11px">
+            📦 ${materialesInfo}
+          </span>
+        </td>
+        <td style="padding:10px;border:1px solid #dee2e6;font-size:11px;color:#666">
+          <span style="background:#e9ecef;padding:2px 6px;border-radius:3px;font-size:10px">
+            👤 ID: ${op.numero}
+          </span>
+        </td>
+        <td style="padding:10px;border:1px solid #dee2e6">
+          <div style="display:flex;gap:4px;flex-wrap:wrap">
+            <button onclick="editarOperario('${op.numero}')" 
+                    style="font-size:10px;padding:4px 8px;background:#ffc107;border:none;border-radius:3px;cursor:pointer"
+                    title="Editar">
+              ✏️
+            </button>
+            <button onclick="toggleOperario('${op.numero}')" 
+                    style="font-size:10px;padding:4px 8px;background:${op.activo ? '#dc3545' : '#28a745'};color:white;border:none;border-radius:3px;cursor:pointer"
+                    title="${op.activo ? 'Desactivar' : 'Activar'}">
+              ${op.activo ? '🔒' : '🔓'}
+            </button>
+            <button onclick="eliminarOperario('${op.numero}', '${op.nombre}')" 
+                    style="font-size:10px;padding:4px 8px;background:#6c757d;color:white;border:none;border-radius:3px;cursor:pointer"
+                    title="Eliminar">
+              🗑️
+            </button>
+          </div>
+        </td>
+      </tr>`;
+  });
+
+  html += '</table>';
+  document.getElementById('tablaOperarios').innerHTML = html;
+}
+
+function mostrarModalCrear() {
+  modoEdicion = false;
+  operarioOriginal = '';
+  document.getElementById('modalTitulo').textContent = '➕ Crear Nuevo Operario';
+  document.getElementById('operarioNumero').value = '';
+  document.getElementById('operarioNombre').value = '';
+  document.getElementById('operarioRol').value = 'operario';
+  document.getElementById('operarioNumero').disabled = false;
+  document.getElementById('btnGuardar').textContent = '💾 Crear';
+  document.getElementById('estadisticasOperario').style.display = 'none';
+  document.getElementById('modalOperario').style.display = 'block';
+}
+
+async function editarOperario(numero) {
+  try {
+    const response = await fetch(`/api/operarios/${numero}`);
+    const operario = await response.json();
+    
+    if (operario.error) {
+      alert('Error: ' + operario.error);
+      return;
+    }
+    
+    modoEdicion = true;
+    operarioOriginal = numero;
+    document.getElementById('modalTitulo').textContent = '✏️ Editar Operario';
+    document.getElementById('operarioNumero').value = operario.numero;
+    document.getElementById('operarioNombre').value = operario.nombre;
+    document.getElementById('operarioRol').value = operario.rol;
+    document.getElementById('operarioNumero').disabled = true;
+    document.getElementById('btnGuardar').textContent = '💾 Guardar Cambios';
+    
+    // Mostrar estadísticas
+    if (operario.materiales_asignados !== undefined) {
+      let statsHtml = `<div>📦 Materiales asignados: <strong>${operario.materiales_asignados}</strong></div>`;
+      if (operario.por_estado) {
+        Object.entries(operario.por_estado).forEach(([estado, cantidad]) => {
+          statsHtml += `<div style="font-size:11px;margin-top:3px">• ${estado}: ${cantidad} materiales</div>`;
+        });
+      }
+      document.getElementById('statsContent').innerHTML = statsHtml;
+      document.getElementById('estadisticasOperario').style.display = 'block';
+    }
+    
+    document.getElementById('modalOperario').style.display = 'block';
+  } catch (error) {
+    alert('Error al cargar datos del operario');
+    console.error(error);
+  }
+}
+
+async function toggleOperario(numero) {
+  if (!confirm(`¿Cambiar el estado de activación del operario ${numero}?`)) return;
+  
+  try {
+    const response = await fetch(`/api/operarios/${numero}/toggle`, {
+      method: 'POST'
+    });
+    const result = await response.json();
+    
+    if (result.success) {
+      alert(result.mensaje);
+      cargarOperarios();
+    } else {
+      alert('Error: ' + result.mensaje);
+    }
+  } catch (error) {
+    alert('Error de conexión');
+    console.error(error);
+  }
+}
+
+async function eliminarOperario(numero, nombre) {
+  if (!confirm(`¿Está seguro de eliminar al operario "${nombre}" (${numero})?
+
+Esta acción lo desactivará permanentemente.`)) return;
+  
+  try {
+    const response = await fetch(`/api/operarios/${numero}`, {
+      method: 'DELETE'
+    });
+    const result = await response.json();
+    
+    if (result.success) {
+      alert(result.mensaje);
+      cargarOperarios();
+    } else {
+      alert('Error: ' + result.mensaje);
+    }
+  } catch (error) {
+    alert('Error de conexión');
+    console.error(error);
+  }
+}
+
+function cerrarModal() {
+  document.getElementById('modalOperario').style.display = 'none';
+}
+
+// Manejar envío del formulario
+document.getElementById('formOperario').addEventListener('submit', async function(e) {
+  e.preventDefault();
+  
+  const numero = document.getElementById('operarioNumero').value.trim();
+  const nombre = document.getElementById('operarioNombre').value.trim();
+  const rol = document.getElementById('operarioRol').value;
+  
+  if (!numero || !nombre) {
+    alert('Número y nombre son obligatorios');
+    return;
+  }
+  
+  try {
+    let url, method, data;
+    
+    if (modoEdicion) {
+      url = `/api/operarios/${operarioOriginal}`;
+      method = 'PUT';
+      data = { nombre, rol };
+    } else {
+      url = '/api/operarios';
+      method = 'POST';
+      data = { numero, nombre, rol };
+    }
+    
+    const response = await fetch(url, {
+      method: method,
+      headers: {
+        'Content-Type': 'application/json'
+      },
+      body: JSON.stringify(data)
+    });
+    
+    const result = await response.json();
+    
+    if (result.success) {
+      alert(result.mensaje);
+      cerrarModal();
+      cargarOperarios();
+    } else {
+      alert('Error: ' + result.mensaje);
+    }
+  } catch (error) {
+    alert('Error de conexión');
+    console.error(error);
+  }
+});
+
+// Cerrar modal al hacer clic fuera
+document.getElementById('modalOperario').addEventListener('click', function(e) {
+  if (e.target === this) {
+    cerrarModal();
+  }
+});
+
+async function exportarOperarios() {
+  try {
+    const response = await fetch('/api/operarios');
+    const data = await response.json();
+    
+    if (data.operarios) {
+      // Crear CSV
+      let csvContent = "Número,Nombre,Rol,Estado,Materiales Asignados\n";
+      
+      data.operarios.forEach(op => {
+        const estado = op.activo ? 'Activo' : 'Inactivo';
+        const materiales = op.materiales_asignados || 0;
+        csvContent += `"${op.numero}","${op.nombre}","${op.rol}","${estado}","${materiales}"\n`;
+      });
+      
+      // Descargar archivo
+      const blob = new Blob([csvContent], { type: 'text/csv;charset=utf-8;' });
+      const link = document.createElement('a');
+      const url = URL.createObjectURL(blob);
+      link.setAttribute('href', url);
+      link.setAttribute('download', `operarios_${new Date().toISOString().split('T')[0]}.csv`);
+      link.style.visibility = 'hidden';
+      document.body.appendChild(link);
+      link.click();
+      document.body.removeChild(link);
+      
+      alert('✅ Lista de operarios exportada exitosamente');
+    } else {
+      alert('❌ Error al exportar operarios');
+    }
+  } catch (error) {
+    alert('❌ Error de conexión al exportar');
+    console.error(error);
+  }
+}
+
+// Cargar operarios al cargar la página
+// Rellenar IP del servidor e inicializar badge de la sección setup
+async function inicializarSeccionAgente() {
+  // IP del servidor
+  const ipTexto = document.getElementById('ip-servidor-texto');
+  if (ipTexto) {
+    ipTexto.textContent = window.location.host;
+  }
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+  cargarOperarios();
+  cargarContadorBajas();
+  cargarPendientesExcel();
+  inicializarSeccionAgente();
+  inicializarTrabajos();
+  verificarAgenteLocal();
+  // El agente local corre en este PC (localhost:8765): no pasa por el servidor
+  setInterval(verificarAgenteLocal, 5000);
+  // Estado del agente cliente y bajas pendientes: los empuja el servidor por /api/eventos
+  if (window.EventSource) {
+    _eventosAdmin = new EventSource('/api/eventos');
+    _eventosAdmin.addEventListener('agente', ev => pintarEstadoAgente(JSON.parse(ev.data)));
+    _eventosAdmin.addEventListener('material', refrescarBajasPendientes);
+    _eventosAdmin.addEventListener('materiales', refrescarBajasPendientes);
+    _eventosAdmin.addEventListener('trabajo', recibirEventoTrabajo);
+    _eventosAdmin.onerror = () => {
+      // Canal rechazado por el servidor (sin hilos libres): vuelta al sondeo
+      if (_eventosAdmin.readyState !== EventSource.CLOSED) return;
+      _eventosAdmin = null;
+      cargarEstadoAgente();
+      setInterval(cargarEstadoAgente, 8000);
+    };
+  } else {
+    cargarEstadoAgente();
+    setInterval(cargarEstadoAgente, 8000);
+  }
+});
+
+// Sincronizar badge de la sección setup con el estado real del agente
+function sincronizarBadgeSetup(online) {
+  const badgeSetup = document.getElementById('agente-setup-badge');
+  const estadoSetup = document.getElementById('agente-setup-estado');
+  if (badgeSetup) {
+    badgeSetup.style.background = online ? '#22c55e' : '#94a3b8';
+    estadoSetup.textContent = online ? 'Agente conectado y escuchando' : 'Agente desconectado — ejecuta AGENTE_EXCEL.bat en el PC cliente';
+    estadoSetup.style.color = online ? '#166534' : '#475569';
+  }
+}
+
+// Varios cambios seguidos (p. ej. una tanda de gastados) recargan las bajas una sola vez
+let _refrescoBajas = null;
+function refrescarBajasPendientes() {
+  clearTimeout(_refrescoBajas);
+  _refrescoBajas = setTimeout(() => { cargarPendientesExcel(); cargarContadorBajas(); }, 500);
+}
+
+// ── Actualización desde GitHub ─────────────────────────────────
+async function actualizarDesdeGitHub() {
+  const btn = document.getElementById('btn-update');
+  const output = document.getElementById('update-output');
+  const section = document.getElementById('update-section');
+  
+  btn.disabled = true;
+  btn.textContent = '⏳ Actualizando…';
+  output.style.display = 'block';
+  output.textContent = 'Conectando con GitHub…';
+
+  try {
+    const resp = await fetch('/api/admin/update', { method: 'POST' });
+    const data = await resp.json();
+
+    output.textContent = data.output || data.mensaje || '(sin respuesta)';
+
+    if (data.success) {
+      if (data.hubo_cambios) {
+        btn.textContent = '✅ Actualizado';
+        document.getElementById('btn-restart').style.display = 'inline-block';
+      } else {
+        btn.textContent = '✅ Ya estás al día';
+        btn.disabled = false;
+      }
+    } else {
+      btn.textContent = '❌ Error — Reintentar';
+      btn.disabled = false;
+    }
+  } catch(e) {
+    output.textContent = 'Error de conexión: ' + e.message;
+    btn.textContent = '❌ Error — Reintentar';
+    btn.disabled = false;
+  }
+}
+
+async function reiniciarApp() {
+  const btn = document.getElementById('btn-restart');
+  const output = document.getElementById('update-output');
+  btn.disabled = true;
+  btn.textContent = '⏳ Reiniciando…';
+  
+  try {
+    await fetch('/api/admin/restart', { method: 'POST' });
+  } catch(e) { /* Se espera que la conexión se corte */ }
+
+  output.textContent += '\n\nServidor reiniciando… esperando que vuelva.';
+
+  // Sondear hasta que el servidor responda, luego recargar
+  let intentos = 0;
+  const maxIntentos = 30; // hasta ~15 segundos
+  const intervalo = setInterval(async () => {
+    intentos++;
+    try {
+      const r = await fetch('/api/hora_servidor', { cache: 'no-store' });
+      if (r.ok) {
+        clearInterval(intervalo);
+        output.textContent += '\n✅ Servidor listo — recargando…';
+        setTimeout(() => { window.location.reload(); }, 500);
+      }
+    } catch(e) {
+      output.textContent = output.textContent.replace(/\.+$/, '') + '.'.repeat(intentos % 4 + 1);
+    }
+    if (intentos >= maxIntentos) {
+      clearInterval(intervalo);
+      output.textContent += '\n⚠️ Tardando más de lo esperado. Recarga la página manualmente.';
+      btn.textContent = '🔄 Recargar';
+      btn.disabled = false;
+      btn.onclick = () => window.location.reload();
+    }
+  }, 500);
+}
+
+// ── Dados de Baja ──────────────────────────────────────────────
+let _bajasSectionVisible = false;
+
+async function cargarContadorBajas() {
+  try {
+    const r = await fetch('/api/bajas');
+    const d = await r.json();
+    const n = d.total || 0;
+    document.getElementById('count-bajas').textContent =
+      n === 0 ? 'Sin registros de bajas' :
+      n === 1 ? '1 material dado de baja' :
+      `${n} materiales dados de baja`;
+  } catch {
+    document.getElementById('count-bajas').textContent = 'Error al cargar';
+  }
+}
+
+function mostrarSeccionBajas() {
+  const sec = document.getElementById('seccion-bajas');
+  if (!_bajasSectionVisible) {
+    sec.style.display = 'block';
+    _bajasSectionVisible = true;
+    cargarTablaBajas();
+    sec.scrollIntoView({ behavior: 'smooth', block: 'start' });
+  } else {
+    sec.scrollIntoView({ behavior: 'smooth', block: 'start' });
+  }
+}
+
+async function cargarTablaBajas(filtro) {
+  const tbody = document.getElementById('bajas-tbody');
+  tbody.innerHTML = '<tr><td colspan="5" style="text-align:center;padding:18px;color:#64748b">Cargando…</td></tr>';
+  try {
+    const r = await fetch('/api/bajas');
+    const d = await r.json();
+    let rows = d.bajas || [];
+    if (filtro) {
+      const f = filtro.toLowerCase();
+      rows = rows.filter(b =>
+        (b.codigo || '').toLowerCase().includes(f) ||
+        (b.descripcion || '').toLowerCase().includes(f) ||
+        (b.operario_numero || '').toLowerCase().includes(f)
+      );
+    }
+    if (rows.length === 0) {
+      tbody.innerHTML = '<tr><td colspan="5" style="text-align:center;padding:18px;color:#64748b">No hay registros</td></tr>';
+      return;
+    }
+    tbody.innerHTML = rows.map(b => `
+      <tr>
+        <td style="font-family:monospace;font-weight:600">${b.codigo || '—'}</td>
+        <td>${b.descripcion || '—'}</td>
+        <td><span class="badge badge-${b.estado_original === 'gastado' ? 'red' : 'orange'}">${b.estado_original || '—'}</span></td>
+        <td>${b.operario_numero || '—'}</td>
+        <td style="font-size:12px;white-space:nowrap">${b.fecha_baja || '—'}</td>
+      </tr>`).join('');
+  } catch {
+    tbody.innerHTML = '<tr><td colspan="5" style="text-align:center;padding:18px;color:#ef4444">Error al cargar</td></tr>';
+  }
+}
+
+// ── Procesar Bajas en Excel ───────────────────────────────────
+async function cargarPendientesExcel() {
+  try {
+    const r = await fetch('/api/bajas_pendientes_excel');
+    const d = await r.json();
+    const n = (d.pendientes || []).length;
+    document.getElementById('count-pendientes-excel').textContent =
+      n === 0 ? 'Sin pendientes de procesar' :
+      n === 1 ? '1 pendiente de procesar en Excel' :
+      `${n} pendientes de procesar en Excel`;
+  } catch {
+    document.getElementById('count-pendientes-excel').textContent = 'Error al cargar';
+  }
+}
+
+async function ejecutarBajasExcel() {
+  const desc = document.getElementById('count-pendientes-excel').textContent;
+  if (!confirm(`¿Ejecutar el proceso de bajas en Excel?
+
+${desc}
+
+Asegúrate de que el archivo Excel con la macro DAR_DE_BAJA esté abierto EN ESTE SERVIDOR.`)) return;
+  const btn = document.getElementById('btn-ejecutar-excel');
+  const output = document.getElementById('excel-output');
+  btn.disabled = true;
+  btn.textContent = '⏳ Procesando…';
+  output.style.display = 'block';
+  output.textContent = 'Iniciando proceso…';
+  try {
+    // El servidor lo ejecuta como trabajo: la petición vuelve al momento y aquí se sigue el progreso
+    const r = await fetch('/api/admin/ejecutar_bajas_excel', { method: 'POST' });
+    const d = await r.json();
+    if (!r.ok) throw new Error(d.salida || `Error ${r.status}`);
+    const t = await seguirTrabajo(d.trabajo, e => pintarTrabajo(document.getElementById('trabajo-bajas_excel'), e));
+    output.textContent = (t.resumen && t.resumen.salida) || t.mensaje || '(sin salida)';
+    if (t.estado === 'terminado') {
+      btn.textContent = '✅ Completado';
+      setTimeout(() => { btn.disabled = false; btn.textContent = '▶️ En este servidor'; }, 4000);
+      cargarPendientesExcel();
+      cargarContadorBajas();
+    } else {
+      btn.textContent = '❌ Error — Reintentar';
+      btn.disabled = false;
+    }
+  } catch(e) {
+    output.textContent = 'Error de conexión: ' + e.message;
+    btn.textContent = '❌ Error — Reintentar';
+    btn.disabled = false;
+  }
+}
+
+// ================== Trabajos en segundo plano ==================
+// Exportar, importar, exportar + limpiar, verificar EAN y bajas en Excel corren en el
+// servidor como trabajos: la petición vuelve al momento con el trabajo y su progreso llega
+// por /api/eventos (evento 'trabajo'); el sondeo de /api/admin/trabajos/<id> queda de
+// respaldo (sin EventSource, o si el trabajo lo ejecuta otro proceso del servidor).
+const TRABAJO_FINALES = ['terminado', 'error', 'cancelado'];
+const _trabajosSeguidos = new Map();   // id → función que recibe cada estado
+
+async function lanzarTrabajo(tipo, cuerpo) {
+  const r = await fetch(`/api/admin/trabajos/${tipo}`, { method: 'POST', body: cuerpo });
+  const d = await r.json().catch(() => ({}));
+  if (!r.ok) throw new Error(d.error || `Error ${r.status}`);
+  return d;
+}
+
+// Resuelve con el estado final del trabajo; alCambiar recibe cada estado intermedio
+function seguirTrabajo(trabajo, alCambiar) {
+  return new Promise(resolve => {
+    let temporizador = null;
+    const recibir = t => {
+      if (!_trabajosSeguidos.has(trabajo.id)) return;
+      alCambiar(t);
+      if (TRABAJO_FINALES.includes(t.estado)) {
+        _trabajosSeguidos.delete(trabajo.id);
+        clearTimeout(temporizador);
+        resolve(t);
+      }
+    };
+    const sondear = async () => {
+      try {
+        const r = await fetch(`/api/admin/trabajos/${trabajo.id}`);
+        if (r.ok) recibir(await r.json());
+      } catch {}
+      if (_trabajosSeguidos.has(trabajo.id)) temporizador = setTimeout(sondear, _eventosAdmin ? 3000 : 1000);
+    };
+    _trabajosSeguidos.set(trabajo.id, recibir);
+    recibir(trabajo);
+    if (_trabajosSeguidos.has(trabajo.id)) temporizador = setTimeout(sondear, 1000);
+  });
+}
+
+function recibirEventoTrabajo(ev) {
+  const t = JSON.parse(ev.data);
+  const recibir = _trabajosSeguidos.get(t.id);
+  if (recibir) recibir(t);
+}
+
+function urlResultado(t) {
+  return `/api/admin/trabajos/${t.id}/resultado`;
+}
+
+// Progreso (barra y cancelar) o, al terminar, el resumen que da describir(t) y el enlace al resultado
+function pintarTrabajo(caja, t, describir) {
+  const activo = !TRABAJO_FINALES.includes(t.estado);
+  caja.style.display = 'block';
+  caja.textContent = '';
+  const linea = document.createElement('div');
+  if (activo) {
+    const avance = t.porcentaje != null ? ` ${t.porcentaje}%` : t.hecho ? ` (${t.hecho} filas)` : '';
+    linea.textContent = `⏳ ${t.mensaje || (t.estado === 'pendiente' ? 'En cola…' : 'Procesando…')}${avance}`;
+  } else if (t.estado === 'terminado') {
+    linea.textContent = describir ? describir(t) : '✅ Terminado';
+  } else {
+    linea.textContent = t.estado === 'cancelado' ? '✖ Cancelado' : `❌ ${t.mensaje || 'Error'}`;
+  }
+  caja.appendChild(linea);
+  if (activo) {
+    const barra = document.createElement('progress');
+    barra.max = 100;
+    if (t.porcentaje != null) barra.value = t.porcentaje;   // sin valor: barra indeterminada
+    caja.appendChild(barra);
+    const cancelar = document.createElement('button');
+    cancelar.type = 'button';
+    cancelar.className = 'btn btn-ghost btn-sm';
+    cancelar.textContent = '✖ Cancelar';
+    cancelar.onclick = () => { cancelar.disabled = true; fetch(`/api/admin/trabajos/${t.id}/cancelar`, { method: 'POST' }); };
+    caja.appendChild(cancelar);
+  } else if (t.resultado) {
+    const enlace = document.createElement('a');
+    enlace.href = urlResultado(t);
+    enlace.textContent = `⬇️ ${t.resultado}`;
+    caja.appendChild(enlace);
+  }
+}
+
+// Lanza el trabajo y lo pinta en `caja` hasta que termina; devuelve el estado final (null si no se pudo lanzar)
+async function ejecutarTrabajo(tipo, cuerpo, caja, boton, describir) {
+  if (boton) { boton.disabled = true; boton.classList.add('ocupado'); }
+  try {
+    const t = await lanzarTrabajo(tipo, cuerpo);
+    return await seguirTrabajo(t, e => pintarTrabajo(caja, e, describir));
+  } catch (e) {
+    caja.style.display = 'block';
+    caja.textContent = '❌ ' + e.message;
+    return null;
+  } finally {
+    if (boton) { boton.disabled = false; boton.classList.remove('ocupado'); }
+  }
+}
+
+function descargarResultado(t) {
+  if (t && t.estado === 'terminado' && t.resultado) window.location.href = urlResultado(t);
+}
+
+function describirImportacion(t) {
+  const r = t.resumen;
+  let texto = `✅ ${r.insertados} materiales nuevos, ${r.actualizados} actualizados`;
+  if (r.errores) {
+    texto += `, ${r.errores} filas con errores:`;
+    r.primeros_errores.slice(0, 5).forEach(e => { texto += `\nFila ${e.fila}: ${e.error}`; });
+    if (r.errores > 5) texto += `\n… informe completo:`;
+  }
+  return texto;
+}
+
+function describirConsistenciaEAN(t) {
+  const r = t.resumen;
+  if (r.consistente) return `✅ Sin inconsistencias (${r.estadisticas.eans_unicos} EAN distintos)`;
+  let texto = `⚠️ ${r.inconsistencias_count} EAN con varias descripciones:`;
+  r.inconsistencias.slice(0, 10).forEach(i => { texto += `\n${i.ean}: ${i.descripciones.join(' / ')}`; });
+  if (r.inconsistencias_count > 10) texto += `\n… y ${r.inconsistencias_count - 10} más`;
+  return texto;
+}
+
+// Los formularios y enlaces siguen funcionando sin JS (en la petición); con JS van como trabajos
+function inicializarTrabajos() {
+  const exportar = document.getElementById('btn-exportar-materiales');
+  exportar.addEventListener('click', async ev => {
+    ev.preventDefault();
+    const cuerpo = new FormData();
+    cuerpo.append('formato', 'xlsx');
+    descargarResultado(await ejecutarTrabajo('exportar', cuerpo, document.getElementById('trabajo-exportar'),
+      exportar, t => `✅ ${t.resumen.filas} materiales exportados`));
+  });
+
+  const importar = document.getElementById('form-importar-materiales');
+  importar.addEventListener('submit', async ev => {
+    ev.preventDefault();
+    const t = await ejecutarTrabajo('importar', new FormData(importar), document.getElementById('trabajo-importar'),
+      importar.querySelector('button[type=submit]'), describirImportacion);
+    if (t && t.estado === 'terminado') importar.reset();
+  });
+
+  const limpieza = document.getElementById('form-limpieza');
+  limpieza.addEventListener('submit', async ev => {
+    if (ev.defaultPrevented) return;   // confirm() del onsubmit rechazado
+    ev.preventDefault();
+    const t = await ejecutarTrabajo('limpieza', null, document.getElementById('trabajo-limpieza'),
+      limpieza.querySelector('button[type=submit]'), t => `✅ ${t.resumen.mensaje}`);
+    descargarResultado(t);
+  });
+
+  const verificar = document.getElementById('btn-verificar-ean');
+  verificar.addEventListener('click', () => ejecutarTrabajo('verificar_ean', null,
+    document.getElementById('trabajo-verificar_ean'), verificar, describirConsistenciaEAN));
+}
+
+// ── Modo Local (browser bridge) ──────────────────────────────
+async function verificarAgenteLocal() {
+  let online = false;
+  try {
+    const ctrl = new AbortController();
+    const tid = setTimeout(() => ctrl.abort(), 1200);
+    const r = await fetch('http://127.0.0.1:8765/status', {signal: ctrl.signal});
+    clearTimeout(tid);
+    const d = await r.json();
+    online = d.online === true;
+  } catch { online = false; }
+  const badge = document.getElementById('agente-local-badge');
+  const texto = document.getElementById('agente-local-texto');
+  const btn   = document.getElementById('btn-agente-local');
+  if (badge) badge.style.background = online ? '#22c55e' : '#94a3b8';
+  if (texto) texto.textContent = online ? 'Agente local activo (localhost:8765)' : 'Agente local no detectado';
+  if (btn)   btn.disabled = !online;
+}
+
+async function procesarEnEstePC() {
+  const output = document.getElementById('agente-local-output');
+  const btn    = document.getElementById('btn-agente-local');
+
+  // ── Paso 0: obtener pendientes antes del aviso ──────────────────
+  output.style.display = 'block';
+  output.textContent   = 'Consultando pendientes…';
+  btn.disabled = true;
+  let pendientes = [];
+  try {
+    const r = await fetch('/api/bajas_pendientes_excel');
+    const d = await r.json();
+    pendientes = d.pendientes || [];
+  } catch(e) {
+    output.textContent = '❌ Error al obtener pendientes: ' + e.message;
+    btn.disabled = false; return;
+  }
+  if (pendientes.length === 0) {
+    output.textContent = 'Sin materiales pendientes.';
+    btn.disabled = false; return;
+  }
+
+  // ── Paso 1: aviso + confirmación ────────────────────────────────
+  const confirmado = confirm(
+    '⚠️  PROCESO DE BAJAS EN EXCEL\n\n' +
+    'Se van a procesar ' + pendientes.length + ' baja(s).\n\n' +
+    'ANTES DE CONTINUAR:\n' +
+    '  1. Asegúrate de que el Excel con la macro DAR_DE_BAJA está abierto.\n' +
+    '  2. Pon la ventana de Excel en primer plano.\n' +
+    '  3. NO muevas el ratón ni uses el teclado hasta que\n' +
+    '     aparezca el mensaje de finalización.\n\n' +
+    '¿Continuar?'
+  );
+  if (!confirmado) { btn.disabled = false; output.style.display = 'none'; return; }
+
+  // ── Paso 2: cuenta atrás ────────────────────────────────────────
+  for (let i = 5; i >= 1; i--) {
+    output.textContent = '⏳ Iniciando en ' + i + '…  Pon Excel en primer plano y NO toques nada.';
+    await new Promise(res => setTimeout(res, 1000));
+  }
+
+  // ── Paso 3: procesar ───────────────────────────────────────────
+  output.textContent = 'Procesando ' + pendientes.length + ' baja(s)…\n';
+  let ok = 0, ko = 0;
+  for (const m of pendientes) {
+    output.textContent += '  ' + m.codigo + ' (' + m.estado + ')… ';
+    try {
+      const r2 = await fetch('http://127.0.0.1:8765/ejecutar', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({codigo: m.codigo, estado: m.estado})
+      });
+      const d2 = await r2.json();
+      if (d2.ok) {
+        await fetch('/api/local/marcar_baja/' + m.id, {method: 'POST'});
+        ok++;
+        output.textContent += '✓\n';
+      } else {
+        ko++;
+        output.textContent += '✗ ' + (d2.error || 'error Excel') + '\n';
+      }
+    } catch(e) {
+      ko++;
+      output.textContent += '✗ ' + e.message + '\n';
+    }
+    output.scrollTop = output.scrollHeight;
+    await new Promise(res => setTimeout(res, 1500));
+  }
+
+  // ── Paso 4: finalización ────────────────────────────────────────
+  const resumen = (ok > 0 ? '✅ ' + ok + ' procesada(s) correctamente' : '') +
+                  (ko > 0 ? '\n❌ ' + ko + ' con error' : '');
+  output.textContent += '\n' + resumen + '\n\n✔ Proceso finalizado — ya puedes usar el ratón.';
+  output.scrollTop = output.scrollHeight;
+  btn.disabled = false;
+  if (ok > 0) { cargarPendientesExcel(); cargarContadorBajas(); }
+}
+
+// ── Agente Cliente Excel ─────────────────────────────────
+let _agentePollingInterval = null;
+let _eventosAdmin = null;
+
+async function cargarEstadoAgente() {
+  try {
+    const r = await fetch('/api/admin/estado_solicitud_cliente');
+    pintarEstadoAgente(await r.json());
+  } catch(e) { console.error('Estado agente error:', e); }
+}
+
+function pintarEstadoAgente(d) {
+  const badge   = document.getElementById('agente-badge');
+  const texto   = document.getElementById('agente-estado-texto');
+  const btnEnv  = document.getElementById('btn-enviar-agente');
+  const btnCan  = document.getElementById('btn-cancelar-agente');
+  const output  = document.getElementById('agente-output');
+  if (d.agente_online) {
+    badge.style.background = '#22c55e';
+    texto.textContent = 'Agente conectado';
+  } else {
+    badge.style.background = '#94a3b8';
+    texto.textContent = 'Agente desconectado';
+  }
+  sincronizarBadgeSetup(d.agente_online);
+  const estado = d.estado || 'idle';
+  if (estado === 'idle') {
+    btnEnv.disabled = false; btnEnv.textContent = '📡 Enviar al PC cliente';
+    btnCan.style.display = 'none'; output.style.display = 'none';
+    _detenerPollingAgente();
+  } else if (estado === 'pendiente') {
+    btnEnv.disabled = true; btnEnv.textContent = '⏳ Esperando agente…';
+    btnCan.style.display = 'inline-flex';
+    output.style.display = 'block';
+    output.textContent = 'Solicitud enviada. Esperando que el agente la recoja…';
+    _iniciarPollingAgente();
+  } else if (estado === 'procesando') {
+    btnEnv.disabled = true; btnEnv.textContent = '⚙️ Procesando…';
+    btnCan.style.display = 'inline-flex'; btnCan.textContent = '✖ Detener proceso';
+    output.style.display = 'block';
+    output.textContent = 'El agente está procesando las bajas en Excel…';
+    _iniciarPollingAgente();
+  } else if (estado === 'completado') {
+    btnEnv.disabled = false; btnEnv.textContent = '✅ Completado — Volver a enviar';
+    btnCan.style.display = 'none';
+    output.style.display = 'block'; output.textContent = d.salida || '(sin salida)';
+    cargarPendientesExcel(); cargarContadorBajas();
+    _detenerPollingAgente();
+  } else if (estado === 'error') {
+    btnEnv.disabled = false; btnEnv.textContent = '❌ Error — Reintentar';
+    btnCan.style.display = 'none';
+    output.style.display = 'block'; output.textContent = d.salida || 'Error desconocido';
+    _detenerPollingAgente();
+  } else if (estado === 'cancelado') {
+    btnEnv.disabled = false; btnEnv.textContent = '📡 Enviar al PC cliente';
+    btnCan.style.display = 'none';
+    output.style.display = 'block'; output.textContent = d.salida || 'Proceso detenido por el admin.';
+    cargarPendientesExcel();
+    _detenerPollingAgente();
+  }
+}
+
+function _iniciarPollingAgente() {
+  // Con el canal de eventos cada transición llega sola; el sondeo queda para navegadores sin EventSource
+  if (!_eventosAdmin && !_agentePollingInterval)
+    _agentePollingInterval = setInterval(cargarEstadoAgente, 3000);
+}
+function _detenerPollingAgente() {
+  if (_agentePollingInterval) { clearInterval(_agentePollingInterval); _agentePollingInterval = null; }
+}
+
+async function enviarAlAgente() {
+  const desc = document.getElementById('count-pendientes-excel').textContent;
+  if (!confirm(`¿Enviar solicitud al agente cliente?
+
+${desc}
+
+Requisitos en el PC cliente:
+• Excel abierto con macros habilitadas
+• La macro NO debe estar ejecutada manualmente (el agente la lanza solo)
+• AGENTE_EXCEL.bat corriendo en consola`)) return;
+  try {
+    const r = await fetch('/api/admin/solicitar_bajas_cliente', { method: 'POST' });
+    const d = await r.json();
+    if (!d.success) { alert('❌ ' + (d.mensaje || 'Error al enviar solicitud')); return; }
+    cargarEstadoAgente();
+    _iniciarPollingAgente();
+  } catch(e) { alert('❌ Error de conexión: ' + e.message); }
+}
+
+async function cancelarSolicitudAgente() {
+  if (!confirm('¿Cancelar la solicitud pendiente?')) return;
+  try {
+    await fetch('/api/admin/cancelar_solicitud_cliente', { method: 'POST' });
+    cargarEstadoAgente();
+  } catch(e) { alert('Error: ' + e.message); }
+}
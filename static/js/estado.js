@@ -0,0 +1,75 @@
+let cursor='', loading=false, done=false;
+
+async function loadMore(){
+  if(loading||done) return; loading=true;
+  const q = document.getElementById('f_q')?.value || '';
+  const orden = q.trim() ? '&orden=relevancia' : '';   // con búsqueda, primero lo que empieza por el texto
+  const url = `/api/materiales?estado=${encodeURIComponent(estado)}&q=${encodeURIComponent(q)}${orden}&cursor=${encodeURIComponent(cursor)}&limit=50`;
+  const res = await fetch(url);
+  const page = await res.json();
+  const data = page.items || [];
+  if(data.length===0){ done=true; loading=false; return; }
+  const tb=document.getElementById('body');
+  for(const m of data){
+    const tr=document.createElement('tr');
+    if(m.estado==='disponible') tr.className='row-green';
+    if(m.estado==='vence prox') tr.className='row-amber';
+    if(m.estado==='caducado') tr.className='row-red';
+    
+    // Sombreado especial para materiales en uso con problemas de fecha
+    if(m.estado==='en uso' && m.estado_critico==='caducado') {
+        tr.className='row-critical-red';
+    } else if(m.estado==='en uso' && m.estado_critico==='vence prox') {
+        tr.className='row-critical-amber';
+    }
+    
+    tr.innerHTML=`<td>${m.id}</td><td>${m.codigo}</td><td>${m.ean}</td>
+                  <td>${m.descripcion}</td><td>${m.caducidad}</td>
+                  <td>${m.estado_html}</td><td>${m.operario}</td><td>${m.asignado_at}</td>`;
+    tb.appendChild(tr);
+  }
+  cursor=page.next_cursor; if(!cursor) done=true;
+  loading=false;
+}
+const io=new IntersectionObserver((e)=>{ if(e[0].isIntersecting) loadMore(); });
+io.observe(document.getElementById('sentinel'));
+loadMore();
+
+// Funcionalidad del filtro
+document.getElementById('btnFiltrar').onclick=()=>{ 
+  document.getElementById('body').innerHTML=''; 
+  cursor=''; 
+  done=false; 
+  loadMore(); 
+};
+
+// Filtrar con Enter
+document.getElementById('f_q').addEventListener('keypress', function(e){
+  if(e.key === 'Enter') {
+    document.getElementById('btnFiltrar').click();
+  }
+});
+
+// Atajos también aquí
+document.addEventListener('keydown', function(e){
+  const tag = (e.target.tagName || '').toLowerCase();
+  if (['input','textarea','select'].includes(tag)) return;
+  if (e.key === 'F2'){ e.preventDefault(); window.opener && window.opener.document.getElementById('openReg')?.click(); }
+  if (e.key === 'F3'){ e.preventDefault(); window.opener && window.opener.document.getElementById('openAsig')?.click(); }
+  if (e.key === 'F4'){ e.preventDefault(); window.opener && window.opener.document.getElementById('openDev')?.click(); }
+  if (e.key === 'F5'){ e.preventDefault(); window.opener && window.opener.document.getElementById('openGas')?.click(); }
+});
+
+// ---- Auto-logout tras 10 minutos sin actividad ----
+(function(){
+  const IDLE_MS = 10 * 60 * 1000;
+  let t = null;
+  function resetTimer(){
+    if (t) clearTimeout(t);
+    t = setTimeout(()=>{ window.location.href = '/logout'; }, IDLE_MS);
+  }
+  ['click','mousemove','keydown','touchstart','scroll'].forEach(ev=>{
+    window.addEventListener(ev, resetTimer, {passive:true});
+  });
+  resetTimer();
+})();
@@ -0,0 +1,960 @@
+// ====== helpers modal ======
+// ====== Reloj hora del servidor ======
+async function actualizarReloj(){
+  try {
+    const res = await fetch('/api/hora_servidor');
+    pintarReloj(await res.json());
+  } catch (e) {
+    document.getElementById("hora-servidor").textContent = "Error al obtener hora";
+  }
+}
+
+function pintarReloj(data){
+  document.getElementById("hora-servidor").textContent = data.full;
+}
+
+// ====== Widgets y Alertas Mejoradas ======
+async function actualizarWidgets(){
+  try {
+    const res = await fetch('/api/contadores');
+    const data = await res.json();
+    Object.assign(contadoresActuales, data);
+    pintarWidgets(data, true);
+  } catch (e) {
+    console.error("Error actualizando widgets:", e);
+  }
+}
+
+function pintarWidgets(data, conAlertas){
+  // Actualizar contadores en widgets
+  const caducados = data.caducado || 0;
+  document.getElementById("cnt-cad").textContent = caducados;
+  document.getElementById("cnt-uso").textContent = data["en uso"] || 0;
+  document.getElementById("cnt-prox").textContent = data["vence prox"] || 0;
+  document.getElementById("cnt-dispo").textContent = data.disponible || 0;
+  document.getElementById("cnt-pre").textContent = data.precintado || 0;
+  document.getElementById("cnt-ret").textContent = data.retirado || 0;
+  document.getElementById("cnt-gas").textContent = data.gastado || 0;
+  
+  // Actualizar trends dinámicamente
+  const porcentajeUso = data.porcentaje_uso || 0;
+  document.getElementById("trend-uso").textContent = `${porcentajeUso}%`;
+  
+  // ===== WIDGET CRÍTICO DINÁMICO =====
+  const criticalWidget = document.getElementById("critical-widget");
+  const criticalContainer = document.getElementById("critical-container");
+  const criticalIcon = document.getElementById("critical-icon");
+  const criticalTrend = document.getElementById("trend-cad");
+  
+  if (caducados > 0) {
+    // ESTADO CRÍTICO - Hay caducados
+    criticalWidget.classList.add("has-expired");
+    criticalContainer.classList.add("has-expired");
+    criticalIcon.textContent = "🚨";
+    criticalTrend.textContent = "¡URGENTE!";
+  } else {
+    // ESTADO CALMADO - No hay caducados
+    criticalWidget.classList.remove("has-expired");
+    criticalContainer.classList.remove("has-expired");
+    criticalIcon.textContent = "✅";
+    criticalTrend.textContent = "Todo OK";
+  }
+  
+  // Mostrar alertas flotantes si hay caducidades críticas (solo cuando cambian)
+  if (conAlertas) mostrarAlertas(data.alertas);
+}
+
+function mostrarAlertas(alertas) {
+  const container = document.getElementById("alertContainer");
+  
+  // Limpiar alertas anteriores (solo las automáticas)
+  const alertasAntiguas = container.querySelectorAll('.auto-alert');
+  alertasAntiguas.forEach(alert => alert.remove());
+  
+  // Alertas de caducados críticos
+  if (alertas.caducados_criticos && alertas.caducados_criticos.length > 0) {
+    const totalCaducados = alertas.total_caducados;
+    const primeros = alertas.caducados_criticos.slice(0, 3);
+    
+    const alertaHtml = `
+      <div class="floating-alert alert-critical auto-alert">
+        <button class="alert-close" onclick="this.parentElement.remove()">×</button>
+        <div class="alert-header">
+          <div class="alert-icon">🚨</div>
+          <div class="alert-title">¡${totalCaducados} Materiales Caducados!</div>
+        </div>
+        <div class="alert-body">
+          ${primeros.map(item => `
+            <div style="margin:4px 0;padding:4px 8px;background:rgba(231,76,60,0.1);border-radius:4px;font-size:12px">
+              <strong>${item.codigo}</strong> - ${item.descripcion.substring(0,30)}${item.descripcion.length > 30 ? '...' : ''}
+              <br><span style="color:#e74c3c;font-weight:600">${item.dias_caducado} días caducado</span>
+              ${item.operario ? ` • Asignado a: ${item.operario}` : ''}
+            </div>
+          `).join('')}
+          ${totalCaducados > 3 ? `<div style="margin-top:8px;color:#7f8c8d;font-size:12px">...y ${totalCaducados - 3} más</div>` : ''}
+        </div>
+        <div class="alert-actions">
+          <button class="alert-btn alert-btn-primary" onclick="window.location.href='/estado/caducado'">
+            Ver Todos
+          </button>
+          <button class="alert-btn alert-btn-secondary" onclick="this.closest('.floating-alert').remove()">
+            Cerrar
+          </button>
+        </div>
+      </div>
+    `;
+    container.insertAdjacentHTML('beforeend', alertaHtml);
+  }
+  
+  // Alertas de vencimientos de hoy
+  if (alertas.vencen_hoy && alertas.vencen_hoy.length > 0) {
+    const vencenHoy = alertas.vencen_hoy.slice(0, 2);
+    
+    const alertaHtml = `
+      <div class="floating-alert alert-warning auto-alert">
+        <button class="alert-close" onclick="this.parentElement.remove()">×</button>
+        <div class="alert-header">
+          <div class="alert-icon">⏰</div>
+          <div class="alert-title">¡${alertas.total_vencen_hoy} Vencen HOY!</div>
+        </div>
+        <div class="alert-body">
+          ${vencenHoy.map(item => `
+            <div style="margin:4px 0;padding:4px 8px;background:rgba(243,156,18,0.1);border-radius:4px;font-size:12px">
+              <strong>${item.codigo}</strong> - ${item.descripcion.substring(0,30)}${item.descripcion.length > 30 ? '...' : ''}
+              ${item.operario ? `<br>Asignado a: ${item.operario}` : ''}
+            </div>
+          `).join('')}
+          ${alertas.total_vencen_hoy > 2 ? `<div style="margin-top:8px;color:#7f8c8d;font-size:12px">...y ${alertas.total_vencen_hoy - 2} más</div>` : ''}
+        </div>
+        <div class="alert-actions">
+          <button class="alert-btn alert-btn-primary" onclick="window.location.href='/estado/vence%20prox'">
+            Revisar
+          </button>
+          <button class="alert-btn alert-btn-secondary" onclick="this.closest('.floating-alert').remove()">
+            OK
+          </button>
+        </div>
+      </div>
+    `;
+    container.insertAdjacentHTML('beforeend', alertaHtml);
+  }
+  
+  // Alertas de vencimientos de mañana
+  if (alertas.vencen_manana && alertas.vencen_manana.length > 0) {
+    const alertaHtml = `
+      <div class="floating-alert alert-info auto-alert">
+        <button class="alert-close" onclick="this.parentElement.remove()">×</button>
+        <div class="alert-header">
+          <div class="alert-icon">📅</div>
+          <div class="alert-title">${alertas.total_vencen_manana} Vencen Mañana</div>
+        </div>
+        <div class="alert-body">
+          Hay materiales programados para vencer mañana. Planifica su uso o devolución.
+        </div>
+        <div class="alert-actions">
+          <button class="alert-btn alert-btn-primary" onclick="window.location.href='/estado/vence%20prox'">
+            Ver Lista
+          </button>
+          <button class="alert-btn alert-btn-secondary" onclick="this.closest('.floating-alert').remove()">
+            Recordar
+          </button>
+        </div>
+      </div>
+    `;
+    container.insertAdjacentHTML('beforeend', alertaHtml);
+  }
+  
+  // Auto-ocultar alertas después de 15 segundos
+  setTimeout(() => {
+    const alertasAuto = container.querySelectorAll('.auto-alert');
+    alertasAuto.forEach(alert => {
+      if (alert.parentElement) {
+        alert.style.animation = 'slideInRight 0.3s reverse';
+        setTimeout(() => alert.remove(), 300);
+      }
+    });
+  }, 15000);
+}
+
+// Inicializar sistema: el servidor empuja contadores, cambios de materiales y la hora por
+// /api/eventos (EventSource reconecta solo y recibe la foto completa al volver)
+const contadoresActuales = {};
+let canalEventos = null;
+if (window.EventSource) {
+  const eventos = canalEventos = new EventSource('/api/eventos');
+  eventos.addEventListener('contadores', ev => {
+    const cambios = JSON.parse(ev.data).cambios;
+    Object.assign(contadoresActuales, cambios);
+    pintarWidgets(contadoresActuales, 'alertas' in cambios);
+  });
+  eventos.addEventListener('hora', ev => pintarReloj(JSON.parse(ev.data)));
+  eventos.addEventListener('material', ev => actualizarFilaMaterial(JSON.parse(ev.data)));
+  eventos.addEventListener('materiales', () => recargarTabla());
+  // CLOSED tras un error = el servidor rechazó el canal (sin hilos libres): se pasa a sondear
+  eventos.onerror = () => { if (eventos.readyState === EventSource.CLOSED) sondearWidgets(); };
+} else {
+  sondearWidgets();
+}
+function sondearWidgets() {
+  actualizarReloj();
+  actualizarWidgets();
+  setInterval(actualizarReloj, 10000);
+  setInterval(actualizarWidgets, 30000); // Actualizar widgets cada 30s
+}
+function openModal(id){ document.getElementById(id).style.display='flex'; }
+function closeModal(id){ document.getElementById(id).style.display='none'; }
+document.querySelectorAll('.close,[data-close]').forEach(el=>{
+  el.addEventListener('click', ()=>{ closeModal(el.getAttribute('data-close') || el.closest('.modal-backdrop').id); });
+});
+// Configuración de permisos por operación
+const operationPermissions = {
+  'registrar': { roles: ['almacenero', 'admin'], modal: 'mb-reg', focus: 'rg_ean' },
+  'asignar': { roles: ['operario', 'almacenero', 'admin'], modal: 'mb-asig', focus: 'as_cod' },
+  'devolver': { roles: ['almacenero', 'admin'], modal: 'mb-dev', focus: 'dv_cod' },
+  'retirado': { roles: ['almacenero', 'admin'], modal: 'mb-ret', focus: 'rt_cod' },
+  'gastado': { roles: ['almacenero', 'admin'], modal: 'mb-gas', focus: 'gs_cod' },
+  'lote': { roles: ['almacenero', 'admin'], modal: 'mb-lote', focus: 'lt_cod' }
+};
+
+// Variable global para la operación pendiente
+let pendingOperation = null;
+let currentUser = null;
+
+// Función para verificar autenticación
+function requireAuth(operation) {
+  const config = operationPermissions[operation];
+  if (!config) return false;
+  
+  // Mostrar modal de autenticación
+  document.getElementById('auth-operation').textContent = operation.charAt(0).toUpperCase() + operation.slice(1);
+  document.getElementById('auth-required-role').textContent = config.roles.join(', ');
+  pendingOperation = operation;
+  openModal('mb-auth');
+  setTimeout(() => document.getElementById('auth_numero').focus(), 20);
+  return false;
+}
+
+// Event listeners para botones principales
+document.getElementById('openReg').onclick = () => requireAuth('registrar');
+document.getElementById('openAsig').onclick = () => requireAuth('asignar');
+document.getElementById('openDev').onclick = () => requireAuth('devolver');
+document.getElementById('openRet').onclick = () => requireAuth('retirado');
+document.getElementById('openGas').onclick = () => requireAuth('gastado');
+document.getElementById('openLote').onclick = () => requireAuth('lote');
+
+// ====== Atajos de teclado globales ======
+document.addEventListener('keydown', function(e){
+  const tag = (e.target.tagName || '').toLowerCase();
+  if (['input','textarea','select'].includes(tag)) return;
+  if (e.key === 'F2'){ e.preventDefault(); document.getElementById('openReg').click(); }
+  if (e.key === 'F3'){ e.preventDefault(); document.getElementById('openAsig').click(); }
+  if (e.key === 'F4'){ e.preventDefault(); document.getElementById('openDev').click(); }
+  if (e.key === 'F5'){ e.preventDefault(); document.getElementById('openGas').click(); }
+  if (e.key === 'F6'){ e.preventDefault(); document.getElementById('openRet').click(); }
+  if (e.key === 'F7'){ e.preventDefault(); document.getElementById('openLote').click(); }
+});
+
+// ====== Manejo de autenticación ======
+document.getElementById('formAuth').addEventListener('submit', async function(e) {
+  e.preventDefault();
+  
+  const numero = document.getElementById('auth_numero').value.trim();
+  
+  if (!numero) {
+    alert('Escanea o ingresa tu número de operario');
+    return;
+  }
+  
+  try {
+    const response = await fetch('/api/auth', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ numero: numero })
+    });
+    
+    const data = await response.json();
+    
+    if (data.success) {
+      currentUser = data.user;
+      const config = operationPermissions[pendingOperation];
+      
+      if (config && config.roles.includes(data.user.rol)) {
+        closeModal('mb-auth');
+        openModal(config.modal);
+        setTimeout(() => {
+          const focusElement = document.getElementById(config.focus);
+          if (focusElement) focusElement.focus();
+        }, 100);
+      } else {
+        alert(`No tienes permisos para esta operación. Se requiere: ${config.roles.join(', ')}`);
+      }
+    } else {
+      alert('Número de operario no válido');
+    }
+  } catch (error) {
+    alert('Error de conexión');
+  }
+  
+  document.getElementById('auth_numero').value = '';
+});
+
+function mostrarAlertaCaducados(totalCaducados) {
+    let alertaDiv = document.getElementById('alerta-caducados');
+    if (!alertaDiv) {
+        alertaDiv = document.createElement('div');
+        alertaDiv.id = 'alerta-caducados';
+        alertaDiv.className = 'alerta-exportacion';
+        alertaDiv.innerHTML = `
+            <div class="alerta-contenido">
+                <span class="alerta-icono">⚠️</span>
+                <div style="flex: 1;">
+                    <div class="alerta-texto">
+                        <strong>Productos Caducados Detectados</strong><br>
+                        Hay <span id="total-caducados">${totalCaducados}</span> productos caducados (incluyendo retirados/gastados).<br>
+                        <small>Se recomienda exportar los datos y actualizar el archivo de red.</small>
+                    </div>
+                    <div class="alerta-botones">
+                        <button onclick="irAAdmin()" class="btn-alerta-admin">📊 Ir a Admin</button>
+                        <button onclick="ocultarAlertaCaducados()" class="btn-alerta-cerrar">×</button>
+                    </div>
+                </div>
+            </div>
+        `;
+        document.body.insertBefore(alertaDiv, document.body.firstChild);
+    } else {
+        document.getElementById('total-caducados').textContent = totalCaducados;
+        alertaDiv.style.display = 'block';
+    }
+}
+
+function ocultarAlertaCaducados() {
+    const alertaDiv = document.getElementById('alerta-caducados');
+    if (alertaDiv) {
+        alertaDiv.style.display = 'none';
+    }
+}
+
+function mostrarDialogoError(mensaje) {
+    const overlay = document.createElement('div');
+    overlay.id = 'error-dialog-overlay';
+    overlay.style.cssText = `
+        position: fixed;
+        top: 0;
+        left: 0;
+        width: 100%;
+        height: 100%;
+        background: rgba(0,0,0,0.5);
+        z-index: 10000;
+        display: flex;
+        align-items: center;
+        justify-content: center;
+    `;
+    
+    const dialog = document.createElement('div');
+    dialog.style.cssText = `
+        background: white;
+        padding: 20px;
+        border-radius: 10px;
+        box-shadow: 0 4px 8px rgba(0,0,0,0.3);
+        max-width: 400px;
+        text-align: center;
+        font-family: inherit;
+    `;
+    
+    dialog.innerHTML = `
+        <div style="color: #721c24; font-size: 18px; margin-bottom: 15px;">
+            ❌ Error
+        </div>
+        <div style="color: #721c24; margin-bottom: 20px; line-height: 1.4;">
+            ${mensaje}
+        </div>
+        <button id="error-dialog-btn" onclick="cerrarDialogoError()" style="
+            background: #dc3545;
+            color: white;
+            border: none;
+            padding: 10px 20px;
+            border-radius: 5px;
+            cursor: pointer;
+            font-size: 14px;
+        ">Aceptar</button>
+    `;
+    
+    overlay.appendChild(dialog);
+    document.body.appendChild(overlay);
+    
+    // Enfocar el botón y añadir evento de teclado
+    const button = document.getElementById('error-dialog-btn');
+    button.focus();
+    
+    // Cerrar con Enter o Escape
+    const handleKeydown = (e) => {
+        if (e.key === 'Enter' || e.key === 'Escape') {
+            cerrarDialogoError();
+            document.removeEventListener('keydown', handleKeydown);
+        }
+    };
+    
+    document.addEventListener('keydown', handleKeydown);
+}
+
+function cerrarDialogoError() {
+    const overlay = document.getElementById('error-dialog-overlay');
+    if (overlay) {
+        overlay.remove();
+    }
+}
+
+function irAAdmin() {
+    window.location.href = '/admin';
+}
+
+async function loadCounters(){
+  try{
+    const r = await fetch('/api/contadores');
+    const j = await r.json();
+    Object.assign(contadoresActuales, j);
+    document.getElementById('cnt-cad').textContent  = j["caducado"] ?? 0;
+    document.getElementById('cnt-uso').textContent  = j["en uso"] ?? 0;
+    document.getElementById('cnt-prox').textContent = j["vence prox"] ?? 0;
+    document.getElementById('cnt-dispo').textContent= j["disponible"] ?? 0;
+    document.getElementById('cnt-pre').textContent  = j["precintado"] ?? 0;
+    document.getElementById('cnt-ret').textContent  = j["retirado"] ?? 0;
+    document.getElementById('cnt-gas').textContent  = j["gastado"] ?? 0;
+    
+    // Mostrar alerta de productos caducados para exportación
+    if (j.alerta_caducados && j.total_caducados > 0) {
+        mostrarAlertaCaducados(j.total_caducados);
+    } else {
+        ocultarAlertaCaducados();
+    }
+  }catch(e){}
+}
+loadCounters();
+
+// ====== Registro (con chequeo de duplicados) ======
+function nextOnEnter(id,nextId,before){ const el=document.getElementById(id); if(!el) return;
+  el.addEventListener('keydown', ev=>{ if(ev.key==='Enter'){ ev.preventDefault(); if(typeof before==='function') before(); const nx=document.getElementById(nextId); if(nx) nx.focus(); }});
+}
+async function checkEAN(){
+  const ean=document.getElementById('rg_ean').value.trim();
+  const desc=document.getElementById('rg_desc');
+  if(!ean) return;
+  if(!/^\d{13}$/.test(ean)){ alert('EAN debe tener 13 dígitos'); return; }
+  try{ 
+    const r=await fetch('/api/get_descripcion_by_ean?ean='+encodeURIComponent(ean)); 
+    const j=await r.json(); 
+    if(j.descripcion){ 
+      desc.value=j.descripcion;
+      desc.setAttribute('readonly', 'true');
+      document.getElementById('rg_cod').focus();
+    } else {
+      desc.removeAttribute('readonly');
+      desc.focus();
+    }
+  }catch(e){}
+}
+async function checkCodigoDuplicado(){
+  const cod = document.getElementById('rg_cod').value.trim();
+  if(!/^\d{7}$/.test(cod)) return;
+  try{
+    const r = await fetch('/api/check_codigo?codigo=' + encodeURIComponent(cod));
+    const j = await r.json();
+    if(j.existe){
+      alert(`El código ${cod} ya existe. No se puede registrar.`);
+      closeModal('mb-reg');
+      window.location.href = '/';
+    }
+  }catch(e){}
+}
+document.getElementById('rg_ean').addEventListener('blur', checkEAN);
+nextOnEnter('rg_ean','rg_desc', checkEAN);
+nextOnEnter('rg_desc','rg_cod');
+nextOnEnter('rg_cod','rg_cad', checkCodigoDuplicado);
+nextOnEnter('rg_cad','', function() {
+  document.getElementById('formReg').requestSubmit();
+});
+document.getElementById('rg_desc').addEventListener('keydown', e=>{ if(e.key==='Enter'){ e.preventDefault(); document.getElementById('formReg').requestSubmit(); }});
+document.getElementById('rg_cod').addEventListener('blur', checkCodigoDuplicado);
+document.getElementById('formReg').addEventListener('submit', async function(e){
+  e.preventDefault();
+  const cod=document.getElementById('rg_cod').value.trim();
+  const ean=document.getElementById('rg_ean').value.trim();
+  if(!/^\d{7}$/.test(cod)){ alert('Código interno = 7 dígitos'); return; }
+  if(ean && !/^\d{13}$/.test(ean)){ alert('EAN debe tener 13 dígitos'); return; }
+  let res;
+  try{
+    // El servidor comprueba también el duplicado: una sola petición por registro
+    const r = await fetch('/api/acciones/registrar', {method:'POST', body:new FormData(this)});
+    res = await r.json();
+  }catch(err){ alert('Sin conexión: no se pudo registrar.'); return; }
+  if(!res.ok){ mostrarDialogoError(escaparHtml(res.mensaje)); return; }
+  mostrarAviso('success', res.mensaje);
+  insertarFilaMaterial(res.material);
+  aplicarResultadoAccion(res);
+  ['rg_cod','rg_cad'].forEach(id => document.getElementById(id).value='');
+  document.getElementById('rg_cod').focus();   // mismo EAN y descripción, siguiente unidad
+});
+
+// ====== Asignación (conflicto inmediato) ======
+const asNum = document.getElementById('as_num');
+const asCod = document.getElementById('as_cod');
+const asNom = document.getElementById('as_nom');
+const asBtn = document.getElementById('btnAsignarSubmit');
+const conflictoMsg = document.getElementById('conflicto_msg');
+
+async function fillOperarioName(){
+  const num=asNum.value.trim();
+  asNom.value='';
+  if(num){
+    try{
+      const r=await fetch('/api/operario_nombre?numero='+encodeURIComponent(num));
+      const j=await r.json();
+      if(j.nombre){ asNom.value=j.nombre; }
+      else{
+        if(confirm('Operario no existe. ¿Darlo de alta ahora?')){
+          const nombre = prompt('Nombre del operario:','');
+          if(nombre && nombre.trim()){
+            const fd=new FormData(); fd.append('numero',num); fd.append('nombre',nombre.trim());
+            const rr=await fetch('/api/operario_add',{method:'POST', body:fd});
+            const jj=await rr.json();
+            if(jj.ok){ asNom.value=nombre.trim(); alert('Operario guardado.'); }
+            else alert('No se pudo guardar operario.');
+          }
+        }
+      }
+    }catch(e){}
+  }
+  await checkConflict();
+}
+async function checkConflict(){
+  conflictoMsg.style.display='none';
+  asBtn.disabled=false;
+  const num=asNum.value.trim();
+  const cod=asCod.value.trim();
+  if(!/^\d{7}$/.test(cod) || !num) return;
+  try{
+    const r=await fetch(`/api/operario_conflicto_ean?codigo=${encodeURIComponent(cod)}&operario_num=${encodeURIComponent(num)}`);
+    const j=await r.json();
+    if(j.ok && j.conflicto){
+      conflictoMsg.textContent = `No puedes asignarte este producto: ya tienes otro con el mismo EAN (${j.ean}). Devuélvelo primero (código ${j.otro_codigo}${j.otra_desc? ' - '+j.otra_desc : ''}).`;
+      conflictoMsg.style.display='block';
+      asBtn.disabled = true;
+    }
+  }catch(e){}
+}
+asCod.addEventListener('keydown', ev=>{ if(ev.key==='Enter'){ ev.preventDefault(); asNum.focus(); } });
+asNum.addEventListener('keydown', ev=>{ if(ev.key==='Enter'){ ev.preventDefault(); asNom.focus(); } });
+asNum.addEventListener('blur', fillOperarioName);
+asNum.addEventListener('input', ()=>{ conflictoMsg.style.display='none'; asBtn.disabled=false; });
+asCod.addEventListener('blur', checkConflict);
+asCod.addEventListener('input', ()=>{ conflictoMsg.style.display='none'; asBtn.disabled=false; });
+
+document.getElementById('formAsig').addEventListener('submit', async function(e){
+  const codigo=asCod.value.trim();
+  const num=asNum.value.trim();
+  if(!/^\d{7}$/.test(codigo)){ e.preventDefault(); alert('Código interno = 7 dígitos'); return; }
+  if(!num){ e.preventDefault(); alert('Nº de operario obligatorio'); return; }
+  if(asBtn.disabled){ e.preventDefault(); alert('No puedes asignarte este producto hasta devolver el otro con el mismo EAN.'); return; }
+  e.preventDefault();
+  const conf=document.getElementById('asig_conf');
+  let j=null;
+  try{
+    const r=await fetch('/api/info_material?codigo='+encodeURIComponent(codigo)); j=await r.json();
+  }catch(err){ /* sin conexión: el servidor aplicará las mismas reglas al recibirla */ }
+  if(j){
+    if(!j.existe){ alert('El código no existe. Regístralo primero.'); return; }
+    if(j.estado==='gastado'){ alert('No se puede asignar: material gastado.'); return; }
+    if(j.caducado){ alert('No se puede asignar: material CADUCADO.'); return; }
+    if(j.vence_prox){
+      if(!confirm('Atención: vence pronto ('+j.caducidad+'). ¿Asignar igualmente?')) return;
+      conf.value='1';
+    }
+  }
+  if(!(await colaAcciones.encolar({accion:'asignar_directo', codigo, operario_num:num, confirmado:conf.value==='1'}))){
+    this.submit(); return;
+  }
+  // Mismo operario, siguiente material
+  asCod.value=''; conf.value='0'; asCod.focus();
+});
+
+function escaparHtml(t) {
+  return String(t).replace(/[&<>"']/g, c => `&#${c.charCodeAt(0)};`);
+}
+
+// Resultado de una acción (JSON): se repinta su fila y se suman los cambios de contadores,
+// sin recargar la página ni la tabla. Con /api/eventos abierto los contadores ya llegan
+// empujados por el servidor con su valor total y sumar aquí los contaría dos veces.
+function aplicarResultadoAccion(res) {
+  if (res.material) actualizarFilaMaterial(res.material);
+  if (!res.contadores || !Object.keys(res.contadores).length) return;
+  if (canalEventos && canalEventos.readyState === EventSource.OPEN) return;
+  if (contadoresActuales.disponible === undefined) { loadCounters(); return; }
+  for (const [k, d] of Object.entries(res.contadores)) contadoresActuales[k] = (contadoresActuales[k] || 0) + d;
+  const c = contadoresActuales;
+  const activos = (c.disponible || 0) + (c['en uso'] || 0) + (c['vence prox'] || 0) + (c.precintado || 0);
+  c.porcentaje_uso = activos ? Math.round((c['en uso'] || 0) / activos * 1000) / 10 : 0;
+  pintarWidgets(c, false);
+}
+
+// Aviso pasajero sobre la botonera (como los flash de la página, sin recargarla)
+function mostrarAviso(categoria, mensaje) {
+  const div = document.createElement('div');
+  div.className = 'alert alert-' + categoria;
+  div.textContent = mensaje;
+  document.querySelector('.toolbar').before(div);
+  setTimeout(() => div.remove(), 6000);
+}
+
+// ====== Cola de acciones sin conexión ======
+// Asignar/devolver/gastar/retirar no esperan al servidor: cada acción se guarda en IndexedDB
+// con una clave única y la hora del escaneo y se envía en orden a /api/acciones. Sin red se
+// queda en la cola y se reenvía al volver la conexión (o al abrir la página); el servidor
+// aplica cada clave una sola vez, así que reenviar lo ya aplicado no lo duplica.
+const colaAcciones = (() => {
+  const DB = 'gm-acciones', ALMACEN = 'pendientes', LOTE = 50, REINTENTO_MS = 15000;
+  let bd = null, enviando = false, reintento = null, avisadoSinPermiso = false;
+
+  function abrir() {
+    if (!bd) bd = new Promise((ok, ko) => {
+      const req = indexedDB.open(DB, 1);
+      req.onupgradeneeded = () => req.result.createObjectStore(ALMACEN, {keyPath: 'seq', autoIncrement: true});
+      req.onsuccess = () => ok(req.result);
+      req.onerror = () => ko(req.error);
+    });
+    return bd;
+  }
+  // Ejecuta fn(almacén) en una transacción y devuelve el resultado de la petición que retorne
+  async function operar(modo, fn) {
+    const db = await abrir();
+    return new Promise((ok, ko) => {
+      const tx = db.transaction(ALMACEN, modo);
+      const req = fn(tx.objectStore(ALMACEN));
+      tx.oncomplete = () => ok(req ? req.result : undefined);
+      tx.onerror = tx.onabort = () => ko(tx.error);
+    });
+  }
+  function nuevaClave() {
+    const b = crypto.getRandomValues(new Uint8Array(16));   // randomUUID solo existe en https
+    return Array.from(b, x => x.toString(16).padStart(2, '0')).join('');
+  }
+
+  async function pintarPendientes() {
+    const el = document.getElementById('pendientesEnvio');
+    let n = 0;
+    try { n = await operar('readonly', a => a.count()); } catch (e) {}
+    el.hidden = !n;
+    el.textContent = `⏳ ${n} pendiente${n === 1 ? '' : 's'} de enviar`;
+    return n;
+  }
+
+  function mostrarResultados(resultados) {
+    const errores = [];
+    resultados.forEach(res => {
+      if (res.categoria === 'error') errores.push(res.mensaje);
+      else mostrarAviso(res.categoria, res.mensaje);
+    });
+    resultados.forEach(aplicarResultadoAccion);
+    if (errores.length) {
+      cerrarDialogoError();
+      mostrarDialogoError(errores.map(escaparHtml).join('<br>'));
+    }
+  }
+
+  async function enviar() {
+    if (enviando) return;
+    enviando = true;
+    clearTimeout(reintento);
+    try {
+      for (;;) {
+        const lote = await operar('readonly', a => a.getAll(null, LOTE));
+        if (!lote.length) break;
+        // Lo normal (con red) es una sola acción: va a su endpoint; lo acumulado, en bloque
+        const url = lote.length === 1 ? '/api/acciones/' + encodeURIComponent(lote[0].accion) : '/api/acciones';
+        let resp;
+        try {
+          resp = await fetch(url, {method: 'POST', headers: {'Content-Type': 'application/json'},
+                                   body: JSON.stringify(lote.length === 1 ? lote[0] : {acciones: lote})});
+        } catch (e) { break; }           // sin red: siguen en la cola
+        if (resp.status === 403) {       // sesión caducada o sin permiso: esperan a que alguien se identifique
+          if (!avisadoSinPermiso) mostrarAviso('warning', 'Hay acciones pendientes: identifícate para enviarlas.');
+          avisadoSinPermiso = true;
+          break;
+        }
+        if (!resp.ok) break;             // servidor caído o reiniciando: se reintenta luego
+        const j = await resp.json(), resultados = j.resultados || [j];
+        await operar('readwrite', a => { lote.forEach(x => a.delete(x.seq)); });
+        // Un aviso (vence pronto) no se ha aplicado ni guardado en el servidor: si se confirma,
+        // vuelve a la cola confirmada, con otra clave y la hora del escaneo original
+        const avisos = lote.filter((x, i) => resultados[i] && resultados[i].categoria === 'warning');
+        mostrarResultados(resultados.filter(res => res.categoria !== 'warning'));
+        for (const x of avisos) {
+          const res = resultados[lote.indexOf(x)];
+          if (!confirm(`${res.mensaje}\n¿Asignar igualmente?`)) continue;
+          const {seq, clave, ...accion} = x;
+          await encolar({...accion, confirmado: true});
+        }
+      }
+    } finally {
+      enviando = false;
+      if (await pintarPendientes()) reintento = setTimeout(enviar, REINTENTO_MS);
+    }
+  }
+
+  // Devuelve false si el navegador no tiene IndexedDB: el formulario se envía como siempre
+  async function encolar(accion) {
+    if (!window.indexedDB || !window.crypto) return false;
+    try {
+      await operar('readwrite', a => a.add({ts: Date.now(), ...accion, clave: nuevaClave()}));
+    } catch (e) { return false; }
+    pintarPendientes();
+    enviar();
+    return true;
+  }
+
+  window.addEventListener('online', enviar);
+  if (window.indexedDB) enviar();
+  return {encolar, enviar};
+})();
+
+['formDev', 'formGas', 'formRet'].forEach(id => {
+  const form = document.getElementById(id);
+  const inp = form.elements.codigo;
+  form.addEventListener('submit', async e => {
+    e.preventDefault();
+    const codigo = inp.value.trim();
+    if (!/^\d{7}$/.test(codigo)) { alert('Código interno = 7 dígitos'); return; }
+    if (!(await colaAcciones.encolar({accion: form.elements.accion.value, codigo}))) { form.submit(); return; }
+    inp.value = ''; inp.focus();   // listo para el siguiente escaneo
+  });
+});
+
+// ====== Modo lote ======
+// Se escanea todo (p. ej. un carro que vuelve con 40 materiales) y se envía en una sola
+// petición a /api/acciones/lote: una transacción en el servidor y un resultado por línea.
+// Los aplicados salen de la lista; los rechazados se quedan con el motivo para corregirlos.
+(() => {
+  const NOMBRES = {asignar: 'Asignar', devolver: 'Devolver', gastar: 'Gastado', retirar: 'Retirado'};
+  const acc = document.getElementById('lt_accion'), op = document.getElementById('lt_op'),
+        cod = document.getElementById('lt_cod'), conf = document.getElementById('lt_conf'),
+        lista = document.getElementById('lt_lista'), btn = document.getElementById('lt_enviar');
+  let lote = [];   // {accion, codigo, operario_num, mensaje}
+
+  function pintar() {
+    lista.innerHTML = '';
+    lote.forEach((a, i) => {
+      const tr = document.createElement('tr');
+      if (a.mensaje) tr.className = 'lote-error';
+      [NOMBRES[a.accion], a.codigo, a.operario_num, a.mensaje || ''].forEach(t => {
+        const td = document.createElement('td'); td.textContent = t; tr.appendChild(td);
+      });
+      const td = document.createElement('td'), quitar = document.createElement('button');
+      quitar.type = 'button'; quitar.className = 'close'; quitar.title = 'Quitar'; quitar.textContent = '×';
+      quitar.onclick = () => { lote.splice(i, 1); pintar(); cod.focus(); };
+      td.appendChild(quitar); tr.appendChild(td); lista.appendChild(tr);
+    });
+    btn.textContent = `Enviar lote (${lote.length})`;
+    btn.disabled = !lote.length;
+  }
+
+  function añadir() {
+    const codigo = cod.value.trim(), accion = acc.value;
+    const operario_num = accion === 'asignar' ? op.value.trim() : '';
+    cod.value = '';
+    if (!/^\d{7}$/.test(codigo)) { alert('Código interno = 7 dígitos'); return; }
+    if (accion === 'asignar' && !operario_num) { alert('Nº de operario obligatorio'); op.focus(); return; }
+    if (lote.some(a => a.codigo === codigo && a.accion === accion)) return;   // doble lectura del escáner
+    lote.push({accion, codigo, operario_num});
+    pintar();
+  }
+
+  async function enviar() {
+    btn.disabled = true;
+    const acciones = lote.map(a => ({accion: a.accion, codigo: a.codigo, operario_num: a.operario_num, confirmado: conf.checked}));
+    let r, j;
+    try {
+      r = await fetch('/api/acciones/lote', {method: 'POST', headers: {'Content-Type': 'application/json'},
+                                            body: JSON.stringify({acciones})});
+    } catch (e) {
+      // Sin red: se pueden pasar a la cola sin conexión (cada una con su clave)
+      if (confirm('Sin conexión. ¿Guardar el lote en este equipo y enviarlo al volver la red?')) {
+        const quedan = [];
+        for (let i = 0; i < lote.length; i++) {
+          if (!(await colaAcciones.encolar(acciones[i]))) quedan.push(lote[i]);
+        }
+        lote = quedan;
+      }
+      pintar();
+      return;
+    }
+    try { j = await r.json(); } catch (e) { j = {}; }
+    if (!r.ok || !j.resultados) { alert(j.error || 'Error al enviar el lote.'); pintar(); return; }
+    lote = lote.map((a, i) => ({...a, mensaje: j.resultados[i].mensaje})).filter((a, i) => !j.resultados[i].aplicada);
+    pintar();
+    j.resultados.forEach(aplicarResultadoAccion);
+    if (j.aplicadas) mostrarAviso('success', `Lote: ${j.aplicadas} acciones aplicadas.`);
+    if (lote.length) mostrarAviso('warning', `Lote: ${lote.length} acciones rechazadas (ver motivo en la lista).`);
+    else closeModal('mb-lote');
+  }
+
+  acc.addEventListener('change', () => {
+    document.getElementById('lt_fila_op').hidden = acc.value !== 'asignar';
+    (acc.value === 'asignar' && !op.value ? op : cod).focus();
+  });
+  op.addEventListener('keydown', e => { if (e.key === 'Enter') { e.preventDefault(); cod.focus(); } });
+  cod.addEventListener('keydown', e => { if (e.key === 'Enter') { e.preventDefault(); añadir(); } });
+  document.getElementById('formLote').addEventListener('submit', e => e.preventDefault());
+  document.getElementById('lt_vaciar').onclick = () => {
+    if (!lote.length || confirm('¿Vaciar la lista del lote?')) { lote = []; pintar(); }
+    cod.focus();
+  };
+  btn.onclick = enviar;
+})();
+
+// ====== Scroll infinito ======
+let cursor='', loading=false, done=false;
+const bodyT=document.getElementById('body');
+const estadoSel=document.getElementById('f_estado');
+const qInp=document.getElementById('f_q');
+const opInp=document.getElementById('f_operario');
+
+async function loadMore(){
+  if(loading||done) return; loading=true;
+  try{
+    // Con texto de búsqueda (o el filtro de descripción) primero lo que empieza por ese texto
+    const orden=qInp.value.trim() ? '&orden=relevancia' : '';
+    const res=await fetch(`/api/materiales?estado=${encodeURIComponent(estadoSel.value)}&q=${encodeURIComponent(qInp.value)}&operario=${encodeURIComponent(opInp.value)}${orden}&cursor=${encodeURIComponent(cursor)}&limit=50`);
+    const page=await res.json();
+    const data=page.items||[];
+    if(data.length===0){ done=true; return; }
+    for(const m of data) bodyT.appendChild(filaMaterial(m));
+    cursor=page.next_cursor; if(!cursor) done=true;
+  }catch(e){
+    // Sin red y sin copia guardada: se reintenta en el siguiente scroll o recarga
+  }finally{
+    loading=false;
+  }
+}
+
+function filaMaterial(m){
+  const tr=document.createElement('tr');
+  tr.dataset.codigo=m.codigo;
+  if(m.estado==='disponible') tr.className='row-green';
+  if(m.estado==='vence prox') tr.className='row-amber';
+  if(m.estado==='caducado') tr.className='row-red';
+  
+  // Sombreado especial para materiales en uso con problemas de fecha
+  if(m.estado==='en uso' && m.estado_critico==='caducado') {
+      tr.className='row-critical-red';
+  } else if(m.estado==='en uso' && m.estado_critico==='vence prox') {
+      tr.className='row-critical-amber';
+  }
+  
+  // Celda de operario: clickable si tiene operario asignado
+  let opCell;
+  if(m.operario_numero){
+    opCell=`<button class="op-link" data-num="${m.operario_numero}" data-display="${m.operario.replace(/"/g,'&quot;')}">${m.operario}</button>`;
+  } else {
+    opCell=m.operario;
+  }
+  // Celda de descripción: siempre clickable
+  const descEsc=m.descripcion.replace(/"/g,'&quot;');
+  const descCell=`<button class="desc-link" data-q="${descEsc}" title="Ver todos con este producto">${m.descripcion}</button>`;
+  
+  tr.innerHTML=`<td>${m.id}</td><td>${m.codigo}</td><td>${m.ean}</td><td>${descCell}</td><td>${m.caducidad}</td><td>${m.estado_html}</td><td>${opCell}</td><td>${m.asignado_at}</td>`;
+  return tr;
+}
+
+// Cambio empujado por el servidor: se repinta la fila si está cargada
+function actualizarFilaMaterial(m){
+  const tr=bodyT.querySelector(`tr[data-codigo="${m.codigo}"]`);
+  if(!tr) return;
+  if(m.eliminado) tr.remove(); else tr.replaceWith(filaMaterial(m));
+}
+// Material nuevo (registrado desde esta página): arriba de la tabla si no hay filtros que lo excluyan
+function insertarFilaMaterial(m){
+  if(estadoSel.value!=='todos' || qInp.value || opInp.value) return;
+  bodyT.prepend(filaMaterial(m));
+}
+function recargarTabla(){ bodyT.innerHTML=''; cursor=''; done=false; loadMore(); }
+
+// Exportar lo que muestra la tabla: mismos filtros que /api/materiales, todas las filas
+for (const [id, formato] of [['btnExportCsv', 'csv'], ['btnExportXlsx', 'xlsx']]) {
+  document.getElementById(id).addEventListener('click', e => {
+    e.currentTarget.href = `/api/materiales/exportar?formato=${formato}&estado=${encodeURIComponent(estadoSel.value)}&q=${encodeURIComponent(qInp.value)}&operario=${encodeURIComponent(opInp.value)}`;
+  });
+}
+
+// Click en operario → filtrar tabla directamente
+bodyT.addEventListener('click', function(e){
+  const btnOp=e.target.closest('.op-link');
+  if(btnOp){
+    opInp.value=btnOp.dataset.num;
+    mostrarPillOperario(btnOp.dataset.display);
+    bodyT.innerHTML=''; cursor=''; done=false; loadMore();
+    return;
+  }
+  const btnDesc=e.target.closest('.desc-link');
+  if(btnDesc){
+    qInp.value=btnDesc.dataset.q;
+    mostrarPillDesc(btnDesc.dataset.q);
+    bodyT.innerHTML=''; cursor=''; done=false; loadMore();
+  }
+});
+
+function mostrarPillOperario(texto){
+  document.getElementById('filtro-op-texto').textContent=texto;
+  document.getElementById('filtro-op-pill').style.display='flex';
+}
+function limpiarFiltroOperario(){
+  opInp.value='';
+  document.getElementById('filtro-op-pill').style.display='none';
+  bodyT.innerHTML=''; cursor=''; done=false; loadMore();
+}
+function mostrarPillDesc(texto){
+  document.getElementById('filtro-desc-texto').textContent=texto;
+  document.getElementById('filtro-desc-pill').style.display='flex';
+}
+function limpiarFiltroDesc(){
+  qInp.value='';
+  document.getElementById('filtro-desc-pill').style.display='none';
+  bodyT.innerHTML=''; cursor=''; done=false; loadMore();
+}
+
+const io=new IntersectionObserver((e)=>{ if(e[0].isIntersecting) loadMore(); });
+io.observe(document.getElementById('sentinel'));
+loadMore();
+document.getElementById('btnFiltrar').onclick=()=>{ if(!opInp.value) document.getElementById('filtro-op-pill').style.display='none'; if(!qInp.value) document.getElementById('filtro-desc-pill').style.display='none'; bodyT.innerHTML=''; cursor=''; done=false; loadMore(); };
+document.getElementById('btnLimpiar').onclick=()=>{ estadoSel.value='todos'; qInp.value=''; opInp.value=''; document.getElementById('filtro-op-pill').style.display='none'; document.getElementById('filtro-desc-pill').style.display='none'; bodyT.innerHTML=''; cursor=''; done=false; loadMore(); };
+
+document.addEventListener('click', e=>{
+  if(e.target.classList.contains('modal-backdrop')) e.target.style.display='none';
+});
+
+// ---- Auto-logout tras 10 minutos sin actividad ----
+(function(){
+  const IDLE_MS = 10 * 60 * 1000;
+  let t = null;
+  function resetTimer(){
+    if (t) clearTimeout(t);
+    t = setTimeout(()=>{ window.location.href = '/logout'; }, IDLE_MS);
+  }
+  ['click','mousemove','keydown','touchstart','scroll'].forEach(ev=>{
+    window.addEventListener(ev, resetTimer, {passive:true});
+  });
+  resetTimer();
+})();
+
+// ---- Service Worker (PWA, funcionamiento sin conexión) ----
+if ('serviceWorker' in navigator) {
+  window.addEventListener('load', () => {
+    navigator.serviceWorker.register('/sw.js').catch(() => {});
+  });
+  // El worker sirvió datos guardados y al revalidar llegaron otros: se repinta con los nuevos
+  navigator.serviceWorker.addEventListener('message', ev => {
+    if (!ev.data || ev.data.tipo !== 'datos-actualizados') return;
+    const url = new URL(ev.data.url);
+    if (url.pathname === '/api/contadores') actualizarWidgets();
+    // Solo la primera página: recargar por una posterior devolvería al usuario arriba
+    else if (url.pathname === '/api/materiales' && !url.searchParams.get('cursor')) recargarTabla();
+  });
+}
@@ -0,0 +1,89 @@
+// Service worker de Gestión de Materiales, versión {{ version }}
+// (generado por app.py al arrancar: cambia con cada commit o cambio de los recursos)
+const VERSION = {{ version|tojson }};
+const CACHE_SHELL = 'gm-shell-' + VERSION;   // página de inicio, JS, CSS, iconos, manifest
+const CACHE_DATOS = 'gm-datos-' + VERSION;   // respuestas de /api/contadores y /api/materiales
+const PRECACHE = {{ precache|tojson }};
+const RUTAS_DATOS = ['/api/contadores', '/api/materiales'];
+// Cada búsqueda, filtro o página de /api/materiales es una URL distinta: se guardan solo las
+// últimas, así la caché no crece sin límite en terminales que no se actualizan en meses
+const MAX_DATOS = 60;
+
+self.addEventListener('install', e => {
+  e.waitUntil(caches.open(CACHE_SHELL).then(c => c.addAll(PRECACHE)).then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', e => {
+  // Las cachés de versiones anteriores ya no sirven (otros bundles, otro esquema de datos)
+  e.waitUntil(caches.keys()
+    .then(claves => Promise.all(claves.filter(k => k !== CACHE_SHELL && k !== CACHE_DATOS).map(k => caches.delete(k))))
+    .then(() => self.clients.claim()));
+});
+
+// Recursos con huella: no cambian nunca, primero la caché
+async function primeroCache(req) {
+  const cache = await caches.open(CACHE_SHELL);
+  const guardada = await cache.match(req);
+  if (guardada) return guardada;
+  const resp = await fetch(req);
+  if (resp.ok) cache.put(req, resp.clone());
+  return resp;
+}
+
+// Página de inicio: primero la red (cada escaneo la vuelve a pedir) y, sin red, la última guardada
+async function primeroRed(req) {
+  const cache = await caches.open(CACHE_SHELL);
+  try {
+    const resp = await fetch(req);
+    if (resp.ok) cache.put('/', resp.clone());
+    return resp;
+  } catch (err) {
+    const guardada = await cache.match('/');
+    if (guardada) return guardada;
+    throw err;
+  }
+}
+
+// Cache.put sustituye la entrada y la pone al final: las primeras son las menos recientes
+async function recortar(cache, maximo) {
+  const claves = await cache.keys();
+  await Promise.all(claves.slice(0, Math.max(claves.length - maximo, 0)).map(k => cache.delete(k)));
+}
+
+// Datos: se responde al momento con lo guardado y se revalida detrás; si lo nuevo es
+// distinto se avisa a la página para que repinte (o lo pida otra vez y ya le llegue fresco)
+async function obsoletoMientrasRevalida(e) {
+  const cache = await caches.open(CACHE_DATOS);
+  const guardada = await cache.match(e.request);
+  const red = fetch(e.request).then(async resp => {
+    if (resp.ok) {
+      await cache.put(e.request, resp.clone());
+      await recortar(cache, MAX_DATOS);
+      if (guardada && guardada.headers.get('ETag') !== resp.headers.get('ETag') && e.clientId) {
+        const cliente = await self.clients.get(e.clientId);
+        if (cliente) cliente.postMessage({tipo: 'datos-actualizados', url: e.request.url});
+      }
+    }
+    return resp;
+  });
+  if (guardada) {
+    e.waitUntil(red.catch(() => {}));
+    return guardada;
+  }
+  return red;
+}
+
+self.addEventListener('fetch', e => {
+  const req = e.request;
+  if (req.method !== 'GET') return;
+  const url = new URL(req.url);
+  if (url.origin !== self.location.origin) return;
+  if (url.pathname.startsWith('/recursos/')) {
+    e.respondWith(primeroCache(req));
+  } else if (req.mode === 'navigate' && url.pathname === '/') {
+    e.respondWith(primeroRed(req));
+  } else if (RUTAS_DATOS.includes(url.pathname)) {
+    e.respondWith(obsoletoMientrasRevalida(e));
+  }
+  // El resto (incluido /api/eventos, que es un flujo) va directo a la red
+});
@@ -0,0 +1,38 @@
+"""
+Configuración común de las pruebas.
+
+Importar app.py ya crea e inicializa las bases: DIR_DATOS apunta a una carpeta temporal
+para no tocar database/, y el fixture `app` da a cada prueba bases nuevas en tmp_path
+(como usar_base_temporal() de benchmark.py).
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+import pytest
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+_DIR_IMPORTACION = tempfile.mkdtemp(prefix="gm-tests-")
+os.environ["DIR_DATOS"] = _DIR_IMPORTACION
+
+import app as app_mod  # noqa: E402
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_DIR_IMPORTACION, ignore_errors=True)
+
+
+@pytest.fixture
+def app(tmp_path):
+    """app.py sobre materiales.db y operarios.db nuevas (esquema completo, sin materiales)."""
+    app_mod.DB_MATERIALES = str(tmp_path / "materiales.db")
+    app_mod.DB_OPERARIOS = str(tmp_path / "operarios.db")
+    # Cachés de proceso ligadas a la base anterior
+    app_mod._estados_dia = None
+    app_mod._contadores_cache = None
+    app_mod._cache_http.clear()
+    app_mod.init_db()
+    return app_mod
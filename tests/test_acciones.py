@@ -0,0 +1,164 @@
+"""
+Acciones de inicio por la capa de comandos: permisos por rol en /api/acciones/<accion>,
+el modo lote (/api/acciones/lote) y la cola sin conexión (/api/acciones).
+"""
+import time
+from datetime import date, datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def client(app):
+    with app.get_db_materiales() as conn:
+        conn.execute("""INSERT INTO materiales (codigo, caducidad, estado, ean, descripcion)
+                        VALUES ('1000001', '2099-01-01', 'precintado', '8400000000001', 'Guantes')""")
+    with app.get_db_operarios() as conn:
+        conn.execute("INSERT INTO operarios (numero, nombre, rol, activo) VALUES ('100', 'Ana', 'operario', 1)")
+    app.operarios_db.invalidar_cache()
+    return app.app.test_client()
+
+
+def _material(app, codigo):
+    with app.get_db_materiales() as conn:
+        return conn.execute("SELECT estado, operario_numero FROM materiales WHERE codigo = ?", (codigo,)).fetchone()
+
+
+@pytest.mark.parametrize("rol", [None, "operario"])
+def test_accion_sin_permiso_403(app, client, rol):
+    if rol:
+        client.set_cookie("role", rol)
+    r = client.post("/api/acciones/gastar", json={"codigo": "1000001", "clave": "k1"})
+    assert r.status_code == 403
+    assert r.get_json()["ok"] is False
+    r = client.post("/api/acciones/registrar", data={"codigo": "1000002", "caducidad": "2099-01-01",
+                                                      "descripcion": "Mascarillas"})
+    assert r.status_code == 403
+    assert tuple(_material(app, "1000001")) == ("precintado", None)
+    assert _material(app, "1000002") is None
+
+
+def test_accion_con_permiso(app, client):
+    client.set_cookie("role", "operario")
+    r = client.post("/api/acciones/asignar", json={"codigo": "1000001", "operario_num": "100", "clave": "k1"})
+    assert r.status_code == 200 and r.get_json()["ok"]
+    assert _material(app, "1000001")["estado"] == "disponible"
+    client.set_cookie("role", "almacenero")
+    r = client.post("/api/acciones/gastar", json={"codigo": "1000001", "clave": "k2"})
+    assert r.get_json()["ok"]
+    assert tuple(_material(app, "1000001")) == ("gastado", None)
+
+
+def test_accion_desconocida_404(client):
+    client.set_cookie("role", "admin")
+    assert client.post("/api/acciones/borrar", json={"codigo": "1000001"}).status_code == 404
+
+
+def _lote(client, acciones, atomico=False):
+    return client.post("/api/acciones/lote", json={"acciones": acciones, "atomico": atomico})
+
+
+def _asignar(codigo):
+    return {"accion": "asignar", "codigo": codigo, "operario_num": "100"}
+
+
+def test_lote_sin_permiso_403(app, client):
+    client.set_cookie("role", "operario")
+    r = _lote(client, [_asignar("1000001"), {"accion": "gastar", "codigo": "1000001"}])
+    assert r.status_code == 403
+    assert tuple(_material(app, "1000001")) == ("precintado", None)
+
+
+@pytest.mark.parametrize("atomico", [False, True])
+def test_lote_atomico_deshace_todo(app, client, atomico):
+    client.set_cookie("role", "almacenero")
+    r = _lote(client, [_asignar("1000001"), _asignar("9999999")], atomico=atomico)
+    j = r.get_json()
+    assert [x["ok"] for x in j["resultados"]] == [True, False]
+    assert j["aplicado"] is not atomico
+    assert j["aplicadas"] == (0 if atomico else 1) and j["rechazadas"] == 1
+    m = _material(app, "1000001")
+    if atomico:
+        assert tuple(m) == ("precintado", None)
+    else:
+        assert m["estado"] == "disponible" and m["operario_numero"].startswith("100")
+
+
+def test_lote_ve_acciones_anteriores(app, client):
+    # Dos materiales con el mismo EAN al mismo operario: el segundo choca con el primero del lote
+    with app.get_db_materiales() as conn:
+        conn.execute("""INSERT INTO materiales (codigo, caducidad, estado, ean, descripcion)
+                        VALUES ('1000003', '2099-01-01', 'precintado', '8400000000001', 'Guantes')""")
+    client.set_cookie("role", "almacenero")
+    j = _lote(client, [_asignar("1000001"), _asignar("1000003")]).get_json()
+    assert [x["aplicada"] for x in j["resultados"]] == [True, False]
+    assert "mismo EAN" in j["resultados"][1]["mensaje"]
+    assert _material(app, "1000001")["operario_numero"].startswith("100")
+    assert tuple(_material(app, "1000003")) == ("precintado", None)
+    # Devolver y asignar el otro en el mismo lote sí vale
+    j = _lote(client, [{"accion": "devolver", "codigo": "1000001"}, _asignar("1000003")]).get_json()
+    assert j["aplicadas"] == 2
+    assert _material(app, "1000001")["operario_numero"] is None
+    assert _material(app, "1000003")["operario_numero"].startswith("100")
+
+
+def _cola(client, *acciones):
+    return client.post("/api/acciones", json={"acciones": list(acciones)})
+
+
+def test_cola_misma_clave_una_vez(app, client):
+    client.set_cookie("role", "almacenero")
+    r1 = _cola(client, dict(_asignar("1000001"), clave="k1")).get_json()["resultados"][0]
+    assert r1["ok"] and not r1["duplicada"]
+    # El terminal no recibió la respuesta y reenvía: no se repite, devuelve lo guardado
+    client.post("/api/acciones/devolver", json={"codigo": "1000001", "clave": "k2"})
+    r2 = _cola(client, dict(_asignar("1000001"), clave="k1")).get_json()["resultados"][0]
+    assert r2["duplicada"] and r2["ok"] and r2["mensaje"] == r1["mensaje"]
+    assert _material(app, "1000001")["operario_numero"] is None
+    with app.get_db_materiales() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM acciones_cliente WHERE clave = 'k1'").fetchone()[0] == 1
+
+
+def test_cola_sin_clave_no_se_aplica(app, client):
+    client.set_cookie("role", "almacenero")
+    j = _cola(client, _asignar("1000001"), dict(_asignar("1000001"), clave="  ")).get_json()
+    assert [r["ok"] for r in j["resultados"]] == [False, False]
+    assert all(r["clave"] is None for r in j["resultados"])
+    assert tuple(_material(app, "1000001")) == ("precintado", None)
+
+
+def test_cola_ts_no_posterior_al_servidor(app, client):
+    client.set_cookie("role", "almacenero")
+    futuro = (time.time() + 86400) * 1000
+    antes = datetime.now().replace(microsecond=0)
+    assert _cola(client, dict(_asignar("1000001"), clave="k1", ts=futuro)).get_json()["resultados"][0]["ok"]
+    despues = datetime.now()
+    with app.get_db_materiales() as conn:
+        ts = conn.execute("SELECT ts_cliente FROM acciones_cliente WHERE clave = 'k1'").fetchone()[0]
+        asignado = conn.execute("SELECT fecha_asignacion FROM materiales WHERE codigo = '1000001'").fetchone()[0]
+    for valor in (ts, asignado):
+        assert antes <= datetime.fromisoformat(valor) <= despues
+
+
+def test_cola_aviso_no_queda_registrado(app, client):
+    pronto = (date.today() + timedelta(days=1)).isoformat()
+    with app.get_db_materiales() as conn:
+        conn.execute("UPDATE materiales SET caducidad = ? WHERE codigo = '1000001'", (pronto,))
+    client.set_cookie("role", "almacenero")
+    r = _cola(client, dict(_asignar("1000001"), clave="k1")).get_json()["resultados"][0]
+    assert r["categoria"] == "warning" and not r["ok"]
+    with app.get_db_materiales() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM acciones_cliente").fetchone()[0] == 0
+    # El terminal la reenvía confirmada con otra clave y se aplica
+    r = _cola(client, dict(_asignar("1000001"), clave="k2", confirmado=True)).get_json()["resultados"][0]
+    assert r["ok"]
+    assert _material(app, "1000001")["operario_numero"].startswith("100")
+
+
+def test_cola_sin_permiso_403(app, client):
+    client.set_cookie("role", "operario")
+    r = _cola(client, dict(_asignar("1000001"), clave="k1"), {"accion": "gastar", "codigo": "1000001", "clave": "k2"})
+    assert r.status_code == 403
+    assert tuple(_material(app, "1000001")) == ("precintado", None)
+    with app.get_db_materiales() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM acciones_cliente").fetchone()[0] == 0
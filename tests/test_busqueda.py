@@ -0,0 +1,52 @@
+"""
+Búsqueda de /api/materiales con orden=relevancia: el cursor lleva la clave de relevancia,
+así que recorrer todas las páginas da las mismas filas y en el mismo orden que una sola.
+"""
+import random
+from datetime import date, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def cliente(app):
+    if not app.FTS_DISPONIBLE:
+        pytest.skip("SQLite sin FTS5 trigram")
+    rnd = random.Random(2)
+    hoy = date.today()
+    filas = []
+    for i in range(1200):
+        cad = (hoy + timedelta(days=rnd.randint(-30, 365))).isoformat()
+        # Descripciones que empiezan por el texto buscado y otras que solo lo contienen
+        desc = rnd.choice(["Guante nitrilo", "Caja de guantes", "Gafas", "Guantera", "Par de guante"])
+        filas.append((f"{i:07d}", cad, "disponible", f"{desc} {i % 7}"))
+    with app.get_db_materiales() as conn:
+        conn.executemany("INSERT INTO materiales (codigo, caducidad, estado, descripcion) VALUES (?, ?, ?, ?)", filas)
+    return app.app.test_client()
+
+
+def _recorrer(cliente, consulta, limite=25):
+    codigos, cursor = [], ""
+    while cursor is not None:
+        r = cliente.get(f"/api/materiales?{consulta}&cursor={cursor}&limit={limite}")
+        assert r.status_code == 200
+        pagina = r.get_json()
+        codigos += [m["codigo"] for m in pagina["items"]]
+        cursor = pagina["next_cursor"]
+    return codigos
+
+
+def test_cursor_por_relevancia_recorre_todas_las_filas(cliente):
+    todas = [m["codigo"] for m in cliente.get("/api/materiales?q=guante&orden=relevancia&limit=5000").get_json()]
+    assert len(todas) > 100
+    assert _recorrer(cliente, "q=guante&orden=relevancia") == todas
+    # Primero las que empiezan por el texto buscado
+    primera = cliente.get("/api/materiales?q=guante&orden=relevancia&cursor=&limit=10").get_json()["items"]
+    assert all(m["descripcion"].upper().startswith("GUANTE") for m in primera)
+
+
+def test_cursor_de_otra_ordenacion(cliente):
+    cursor = cliente.get("/api/materiales?q=guante&orden=relevancia&cursor=&limit=10").get_json()["next_cursor"]
+    assert cliente.get(f"/api/materiales?q=guante&cursor={cursor}&limit=10").status_code == 400
+    cursor = cliente.get("/api/materiales?q=guante&cursor=&limit=10").get_json()["next_cursor"]
+    assert cliente.get(f"/api/materiales?q=guante&orden=relevancia&cursor={cursor}&limit=10").status_code == 400
@@ -0,0 +1,99 @@
+"""
+El estado que calcula SQL (columnas materializadas, migraciones 7 y 11) debe coincidir con
+estado_base() de app.py, y el listado debe salir en el orden de clave_orden_material().
+"""
+import itertools
+from datetime import date, timedelta
+
+from shared.migraciones import migrar_materiales
+
+ESTADOS_GUARDADOS = [None, "", "precintado", "disponible", "gastado", "Retirado", "escaneado"]
+OPERARIOS = [None, "", "  ", "\t", "123456"]
+
+
+def _caducidades(aviso_dias):
+    hoy = date.today()
+    relativas = [-400, -1, 0, 1, aviso_dias, aviso_dias + 1, 365]
+    return ([None, "", "abc", "2025-13-45", "2025-02-30", "2025-00-10", "2025-04-31", "0000-01-01",
+             "31/12/2099", "20991231", "2099-12-31 10:00"]
+            + [(hoy + timedelta(days=d)).isoformat() for d in relativas])
+
+
+def _sembrar(app):
+    filas = []
+    combinaciones = itertools.product(_caducidades(app.AVISO_DIAS), ESTADOS_GUARDADOS, OPERARIOS)
+    for n, (cad, estado, op) in enumerate(combinaciones):
+        filas.append((f"{n:07d}", cad, estado, op))
+    with app.get_db_materiales() as conn:
+        conn.executemany("INSERT INTO materiales (codigo, caducidad, estado, operario_numero) VALUES (?, ?, ?, ?)",
+                         filas)
+    app.asegurar_estados_al_dia()
+    return filas
+
+
+def _filas_bd(app):
+    with app.get_db_materiales() as conn:
+        return conn.execute("""SELECT codigo, caducidad, estado, operario_numero, estado_calc, estado_orden,
+                                      vence_prox, caducado FROM materiales ORDER BY codigo""").fetchall()
+
+
+def test_estado_calc_coincide_con_estado_base(app):
+    _sembrar(app)
+    hoy = date.today()
+    limite = hoy + timedelta(days=app.AVISO_DIAS)
+    for r in _filas_bd(app):
+        esperado = app.estado_base(r["caducidad"], r["operario_numero"], r["estado"])
+        assert r["estado_calc"] == esperado, dict(r)
+        assert r["estado_orden"] == app.sort_key_estado(esperado), dict(r)
+        cad = app.parse_date(r["caducidad"])
+        assert r["caducado"] == int(bool(cad and cad < hoy)), dict(r)
+        assert r["vence_prox"] == int(bool(cad and hoy <= cad <= limite)), dict(r)
+
+
+def test_contadores_coinciden_con_estado_base(app):
+    filas = _sembrar(app)
+    esperados = {}
+    for _, cad, estado, op in filas:
+        e = app.estado_base(cad, op, estado)
+        esperados[e] = esperados.get(e, 0) + 1
+    with app.get_db_materiales() as conn:
+        contadores = {r["clave"]: r["n"] for r in conn.execute("SELECT clave, n FROM materiales_contadores")}
+    for clave in app.ORDEN_ESTADOS:
+        if clave != "precintado":   # cuenta los precintados sin operario, no un estado base
+            assert contadores[clave] == esperados.get(clave, 0), clave
+
+
+def test_orden_del_listado_y_cursor(app):
+    filas = _sembrar(app)
+    esperado = sorted((app.sort_key_estado(app.estado_base(cad, op, estado)), cad or "", codigo)
+                      for codigo, cad, estado, op in filas)
+    esperado = [codigo for _, _, codigo in esperado]
+
+    pagina = app.list_materiales_paged(None, "", 0, len(filas) + 1)
+    assert [m.codigo for m in pagina] == esperado
+
+    recorrido, after = [], None
+    while True:
+        pagina = app.list_materiales_paged(None, "", 0, 37, after=after)
+        if not pagina:
+            break
+        recorrido += [m.codigo for m in pagina]
+        after = app.clave_orden_material(pagina[-1])
+    assert recorrido == esperado
+
+
+def test_migracion_corrige_fechas_imposibles(app):
+    _sembrar(app)
+    # Bases migradas antes de la versión 11: fechas imposibles con estado de fecha
+    with app.get_db_materiales() as conn:
+        conn.execute("""UPDATE materiales SET estado_calc = 'disponible', estado_orden = 3
+                        WHERE caducidad = '2025-13-45' AND estado_calc = 'error fecha'""")
+        conn.execute("PRAGMA user_version = 10")
+    with app.get_db_materiales() as conn:
+        migrar_materiales(conn)
+        assert conn.execute("PRAGMA user_version").fetchone()[0] >= 11
+    for r in _filas_bd(app):
+        assert r["estado_calc"] == app.estado_base(r["caducidad"], r["operario_numero"], r["estado"]), dict(r)
+    with app.get_db_materiales() as conn:
+        n = conn.execute("SELECT n FROM materiales_contadores WHERE clave = 'error fecha'").fetchone()[0]
+        assert n == conn.execute("SELECT COUNT(*) FROM materiales WHERE estado_calc = 'error fecha'").fetchone()[0]
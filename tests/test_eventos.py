@@ -0,0 +1,40 @@
+"""
+Registro de cambios del canal de eventos (materiales_cambios): se poda aunque no haya
+ninguna pantalla conectada, y quien reconecta tras la poda recibe 'recargar'.
+"""
+from shared.migraciones import CAMBIOS_CONSERVADOS, migrar_materiales
+
+
+def _registrar_cambios(app, n):
+    with app.get_db_materiales() as conn:
+        conn.executemany("INSERT INTO materiales (codigo, caducidad, estado) VALUES (?, '2099-01-01', 'precintado')",
+                         [(f"{i:07d}",) for i in range(n)])
+        conn.execute("UPDATE materiales SET descripcion = 'Cambiada'")
+
+
+def test_registro_acotado_sin_suscriptores(app):
+    assert not app._suscriptores
+    _registrar_cambios(app, 5 * CAMBIOS_CONSERVADOS + 123)
+    with app.get_db_materiales() as conn:
+        n, primero, ultimo = conn.execute("SELECT COUNT(*), MIN(seq), MAX(seq) FROM materiales_cambios").fetchone()
+    assert ultimo > 5 * CAMBIOS_CONSERVADOS
+    assert CAMBIOS_CONSERVADOS <= n < 2 * CAMBIOS_CONSERVADOS
+    assert ultimo - primero + 1 == n
+    # Un cliente que se quedó antes de lo podado recarga; uno reciente recibe sus cambios
+    eventos, _ = app._cambios_materiales(0)
+    assert eventos is None
+    eventos, seq = app._cambios_materiales(ultimo - 3)
+    assert len(eventos) == 3 and seq == ultimo
+
+
+def test_migracion_poda_registro_existente(app):
+    with app.get_db_materiales() as conn:
+        conn.execute("DROP TRIGGER materiales_cambios_poda")
+    _registrar_cambios(app, 3 * CAMBIOS_CONSERVADOS)
+    with app.get_db_materiales() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM materiales_cambios").fetchone()[0] > 3 * CAMBIOS_CONSERVADOS
+        conn.execute("PRAGMA user_version = 11")
+    with app.get_db_materiales() as conn:
+        migrar_materiales(conn)
+        assert conn.execute("SELECT COUNT(*) FROM materiales_cambios").fetchone()[0] == CAMBIOS_CONSERVADOS
+        assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'materiales_cambios_poda'").fetchone()
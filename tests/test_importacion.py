@@ -0,0 +1,108 @@
+"""
+Importación de materiales por tabla de preparación (IMPORTACION_VALIDACIONES + INSERT ...
+ON CONFLICT): el informe cuadra con lo que queda en la base.
+"""
+
+
+def _fila(n, codigo, caducidad="", ean="", descripcion="", estado="", operario=""):
+    return (n, codigo, caducidad, ean, descripcion, estado, operario)
+
+
+def _materiales(app):
+    with app.get_db_materiales() as conn:
+        return {r["codigo"]: dict(r) for r in conn.execute(
+            "SELECT codigo, caducidad, estado, operario_numero, ean, descripcion FROM materiales")}
+
+
+def _errores(res):
+    return {e["fila"]: e["error"] for e in res.errores}
+
+
+def _cuadra(app, res, antes):
+    """Los nuevos del informe son los que hay de más en la base."""
+    assert len(_materiales(app)) == antes + res.insertados
+
+
+def test_fechas_invalidas(app):
+    res = app.importar_filas_materiales([
+        _fila(2, "1000001", "31/12/2099", descripcion="Guantes"),
+        _fila(3, "1000002", "2099-02-30", descripcion="Guantes"),
+        _fila(4, "1000003", "30/02/2099", descripcion="Guantes"),
+        _fila(5, "1000004", "mañana", descripcion="Guantes"),
+        _fila(6, "1000005", "", descripcion="Guantes"),
+    ])
+    assert (res.insertados, res.actualizados) == (1, 0)
+    errores = _errores(res)
+    assert sorted(errores) == [3, 4, 5, 6]
+    assert errores[3] == "Fecha de caducidad inválida: 2099-02-30."
+    assert errores[6] == "Caducidad obligatoria para un material nuevo."
+    _cuadra(app, res, 0)
+    assert _materiales(app)["1000001"]["caducidad"] == "2099-12-31"
+
+
+def test_conflictos_ean_descripcion(app):
+    with app.get_db_materiales() as conn:
+        conn.execute("""INSERT INTO materiales (codigo, caducidad, estado, ean, descripcion)
+                        VALUES ('1000001', '2099-01-01', 'precintado', '8400000000001', 'Guantes')""")
+        conn.execute("INSERT INTO ean_descriptions (ean, descripcion) VALUES ('8400000000003', 'Cofias')")
+    res = app.importar_filas_materiales([
+        _fila(2, "1000002", "2099-01-01", "8400000000001", "Mascarillas"),   # choca con la base
+        _fila(3, "1000003", "2099-01-01", "8400000000002", "Batas"),
+        _fila(4, "1000004", "2099-01-01", "8400000000002", "Gorros"),        # choca con la fila 3
+        _fila(5, "1000005", "2099-01-01", "8400000000003"),                  # toma la del catálogo
+        _fila(6, "1000006", "2099-01-01", "84000000000", "Cofias"),          # EAN corto
+    ])
+    assert (res.insertados, res.actualizados) == (2, 0)
+    errores = _errores(res)
+    assert sorted(errores) == [2, 4, 6]
+    assert errores[2].startswith("EAN 8400000000001 ya existe con descripción 'Guantes'")
+    assert errores[4] == "EAN 8400000000002 con otra descripción en la fila 3."
+    assert errores[6].startswith("EAN inválido")
+    _cuadra(app, res, 1)
+    m = _materiales(app)
+    assert m["1000003"]["descripcion"] == "Batas" and m["1000005"]["descripcion"] == "Cofias"
+    with app.get_db_materiales() as conn:
+        assert conn.execute("SELECT descripcion FROM ean_descriptions WHERE ean = '8400000000002'").fetchone()[0] == "Batas"
+
+
+def test_codigo_repetido_en_el_archivo(app):
+    res = app.importar_filas_materiales([
+        _fila(2, "1000001", "2099-01-01", descripcion="Guantes"),
+        _fila(3, "1000002", "2099-01-01", descripcion="Batas"),
+        _fila(4, "1000001", "2099-06-01", descripcion="Gorros"),
+        _fila(5, "1000001", "", descripcion=""),
+    ])
+    assert (res.insertados, res.actualizados) == (2, 0)
+    errores = _errores(res)
+    assert errores == {4: "Código repetido en el archivo (fila 2).", 5: "Código repetido en el archivo (fila 2)."}
+    _cuadra(app, res, 0)
+    m = _materiales(app)["1000001"]
+    assert (m["caducidad"], m["descripcion"]) == ("2099-01-01", "Guantes")
+
+
+def test_actualiza_existentes_e_inserta_nuevos(app):
+    with app.get_db_operarios() as conn:
+        conn.execute("INSERT INTO operarios (numero, nombre, rol, activo) VALUES ('100', 'Ana', 'operario', 1)")
+    app.operarios_db.invalidar_cache()
+    with app.get_db_materiales() as conn:
+        conn.executemany("""INSERT INTO materiales (codigo, caducidad, estado, ean, descripcion)
+                            VALUES (?, '2099-01-01', 'precintado', NULL, 'Guantes')""", [("1000001",), ("1000002",)])
+    res = app.importar_filas_materiales([
+        _fila(2, "1000001", estado="Gastado"),                       # celdas vacías: se conservan
+        _fila(3, "1000002", "01/03/2099", operario="100"),
+        _fila(4, "1000003", "2099-05-01", descripcion="Batas"),
+        _fila(5, "1000004", "2099-05-01", descripcion="Gorros", operario="100 - Ana"),
+        _fila(6, "1000005", "2099-05-01", descripcion="Cofias", operario="999"),
+        _fila(7, "1000001", estado="perdido"),
+    ])
+    assert (res.insertados, res.actualizados) == (2, 2)
+    errores = _errores(res)
+    assert errores == {6: "Operario inexistente: 999.", 7: "Código repetido en el archivo (fila 2)."}
+    _cuadra(app, res, 2)
+    m = _materiales(app)
+    assert m["1000001"] == {"codigo": "1000001", "caducidad": "2099-01-01", "estado": "gastado",
+                            "operario_numero": None, "ean": None, "descripcion": "Guantes"}
+    assert (m["1000002"]["caducidad"], m["1000002"]["estado"], m["1000002"]["operario_numero"]) == \
+        ("2099-03-01", "precintado", "100 - Ana")
+    assert m["1000003"]["estado"] == "precintado"
+    assert (m["1000004"]["estado"], m["1000004"]["operario_numero"]) == ("disponible", "100 - Ana")
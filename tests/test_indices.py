@@ -0,0 +1,125 @@
+"""
+Las consultas calientes (listado y sus filtros, páginas por cursor, búsqueda, contadores y
+estadísticas por operario) deben resolverse con los índices de las migraciones 5-8 y no
+recorrer la tabla materiales. Se captura el SQL que ejecuta app.py y se mira su
+EXPLAIN QUERY PLAN.
+"""
+import re
+import random
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import pytest
+
+# "SCAN m" / "SCAN materiales" sin índice: recorrido completo de la tabla
+RECORRIDO = re.compile(r"\bSCAN (m|materiales)\b(?! USING)")
+
+
+@pytest.fixture
+def app_sembrada(app):
+    rnd = random.Random(1)
+    hoy = date.today()
+    with app.get_db_operarios() as conn:
+        conn.executemany("INSERT OR REPLACE INTO operarios (numero, nombre, rol, activo) VALUES (?, ?, 'operario', 1)",
+                         [(f"{100000 + i}", f"Operario {i}") for i in range(20)])
+    filas = []
+    for i in range(3000):
+        cad = (hoy + timedelta(days=rnd.randint(-30, 365))).isoformat()
+        op = f"{100000 + rnd.randrange(20)}" if rnd.random() < 0.3 else None
+        estado = rnd.choice(["precintado", "disponible", "disponible", "gastado"])
+        filas.append((f"{i:07d}", cad, estado, op, f"84{rnd.randrange(10**11):011d}", f"Material {i % 500}"))
+    with app.get_db_materiales() as conn:
+        conn.executemany("""INSERT INTO materiales (codigo, caducidad, estado, operario_numero, ean, descripcion)
+                            VALUES (?, ?, ?, ?, ?, ?)""", filas)
+        conn.execute("ANALYZE")
+    app.asegurar_estados_al_dia()
+    return app
+
+
+@pytest.fixture
+def planes(app_sembrada, monkeypatch):
+    """Llamar a planes(funcion, *args) devuelve el plan de cada SELECT sobre materiales que ejecuta."""
+    app = app_sembrada
+    original = app.get_db_materiales
+
+    @contextmanager
+    def con_traza(sentencias):
+        with original() as conn:
+            conn.set_trace_callback(sentencias.append)
+            try:
+                yield conn
+            finally:
+                conn.set_trace_callback(None)
+
+    def capturar(funcion, *args, **kwargs):
+        sentencias = []
+        monkeypatch.setattr(app, "get_db_materiales", lambda: con_traza(sentencias))
+        try:
+            funcion(*args, **kwargs)
+        finally:
+            monkeypatch.setattr(app, "get_db_materiales", original)
+        resultado = {}
+        with original() as conn:
+            for sql in sentencias:
+                if re.match(r"\s*SELECT\b", sql, re.I) and re.search(r"\bmateriales(_operario)?\b", sql):
+                    filas = conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+                    resultado[sql] = "\n".join(r["detail"] for r in filas)
+        assert resultado, "no se ha capturado ninguna consulta sobre materiales"
+        return resultado
+    return capturar
+
+
+def _comprobar(planes_por_sql, *fragmentos, orden_por_indice=False):
+    """Ninguna consulta recorre materiales sin índice y los planes contienen los fragmentos.
+    Con orden_por_indice el listado sale en el orden del índice (sin ordenar aparte)."""
+    for sql, plan in planes_por_sql.items():
+        assert not RECORRIDO.search(plan), f"{sql}\n{plan}"
+        if orden_por_indice:
+            assert "TEMP B-TREE" not in plan, f"{sql}\n{plan}"
+    todos = "\n".join(planes_por_sql.values())
+    for fragmento in fragmentos:
+        assert fragmento in todos, todos
+
+
+@pytest.mark.parametrize("estado, fragmento", [
+    # Sin filtro se recorre el índice del orden del listado hasta el LIMIT
+    ("todos", "SCAN m USING INDEX idx_materiales_estado_orden"),
+    ("en uso", "SEARCH m USING INDEX idx_materiales_estado_orden (estado_orden=?)"),
+    ("disponible", "SEARCH m USING INDEX idx_materiales_estado_orden (estado_orden=?)"),
+    ("gastado", "SEARCH m USING INDEX idx_materiales_estado_orden (estado_orden=?)"),
+    ("error fecha", "SEARCH m USING INDEX idx_materiales_estado_orden (estado_orden=?)"),
+    # Índices parciales: solo tienen las filas del filtro
+    ("vence prox", "SCAN m USING INDEX idx_materiales_vence_prox"),
+    ("caducado", "SCAN m USING INDEX idx_materiales_caducado"),
+    ("precintado", "SCAN m USING INDEX idx_materiales_precintado"),
+])
+def test_listado_por_estado(planes, app_sembrada, estado, fragmento):
+    _comprobar(planes(app_sembrada.list_materiales_paged, estado, "", 0, 50), fragmento, orden_por_indice=True)
+
+
+def test_listado_por_cursor(planes, app_sembrada):
+    app = app_sembrada
+    primera = app.list_materiales_paged(None, "", 0, 50)
+    after = app.clave_orden_material(primera[-1])
+    _comprobar(planes(app.list_materiales_paged, None, "", 0, 50, after=after),
+               "SEARCH m USING INDEX idx_materiales_estado_orden (estado_orden>?)", orden_por_indice=True)
+
+
+def test_busqueda(planes, app_sembrada):
+    if not app_sembrada.FTS_DISPONIBLE:
+        pytest.skip("SQLite sin FTS5 trigram")
+    fts = "SCAN materiales_fts VIRTUAL TABLE INDEX"
+    _comprobar(planes(app_sembrada.list_materiales_paged, None, "Material 12", 0, 50),
+               fts, "SEARCH m USING INTEGER PRIMARY KEY")
+    _comprobar(planes(app_sembrada.list_materiales_paged, None, "", 0, 50, "100003"), fts)
+
+
+def test_contadores(planes, app_sembrada):
+    _comprobar(planes(app_sembrada._calcular_contadores),
+               "SCAN m USING INDEX idx_materiales_caducado",
+               "SEARCH m USING INDEX idx_materiales_caducidad (caducidad=?)")
+
+
+def test_estadisticas_operario(planes, app_sembrada):
+    _comprobar(planes(app_sembrada.get_estadisticas_operario, "100003"),
+               "SEARCH materiales USING COVERING INDEX idx_materiales_operario (operario_numero=?)")
@@ -0,0 +1,22 @@
+"""
+Descarga del resultado de un trabajo en segundo plano (/api/admin/trabajos/<id>/resultado).
+"""
+
+
+def test_resultado_borrado_404(app, tmp_path, monkeypatch):
+    ruta = tmp_path / "export.csv"
+    ruta.write_text("codigo\n1000001\n")
+    descargados = []
+    monkeypatch.setattr(app.gestor_trabajos, "resultado", lambda trabajo_id: (str(ruta), "export 1.csv", "text/csv"))
+    monkeypatch.setattr(app.gestor_trabajos, "descargado", descargados.append)
+    client = app.app.test_client()
+    client.set_cookie("role", "admin")
+    r = client.get("/api/admin/trabajos/t1/resultado")
+    assert r.status_code == 200
+    assert r.headers["Content-Disposition"] == 'attachment; filename="export 1.csv"'
+    assert r.data == b"codigo\n1000001\n"
+    assert descargados == ["t1"]
+    # La limpieza borra el archivo entre resultado() y la apertura
+    ruta.unlink()
+    r = client.get("/api/admin/trabajos/t1/resultado")
+    assert r.status_code == 404 and "error" in r.get_json()